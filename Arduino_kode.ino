@@ -3,8 +3,32 @@
 // Pin-nummeret defineres til SS (Slave Select) til Arduino pin 10
 const int ssPin = 10;
 
-// Samplingstiden i millisekunder tilføjes (man vil kunne ændre værdien efter behov)
-const int samplingTime = 10;
+// Samplingsfrekvensen i Hz (skal matche samplerate i Python-koden). Der samples på et timerinterrupt,
+// så raten er præcis og ikke afhænger af hvor lang tid SPI og seriel afsendelse tager
+const uint16_t SAMPLE_RATE = 250;
+
+// Samples lægges i en lille ringbuffer af interruptet og sendes fra loop()
+const uint8_t BUFFER_STOERRELSE = 32;          // Skal være en potens af 2
+volatile int16_t sampleBuffer[BUFFER_STOERRELSE];
+volatile uint32_t sampleTaeller = 0;           // Antal samples taget siden opstart (også dem der ikke nåede at blive sendt)
+uint32_t sendtTaeller = 0;                     // Tælleren for næste sample der skal sendes
+
+// Protokol: 0 = tekst ("tæller,værdi" pr. linje), 1 = binære frames (skal matche protokol i Python-koden)
+#define BINAER_PROTOKOL 0
+
+// Begge protokoller sendes med 115200 baud (ca. 11500 bytes/s). En tekstlinje er op til 19 bytes
+// ("4294967295,-32768\r\n"), altså ca. 4750 bytes/s ved 250 Hz. Med 38400 baud (3840 bytes/s) var
+// forbindelsen for langsom så snart tælleren fik 7 cifre (efter ca. 67 min), og ringbufferen løb
+// over uden at nogen opdagede det. Tekst kan højst bære ca. 600 Hz, binære frames ca. 4000 Hz
+const long baudRate = 115200;
+
+// Binær frame: 0xA5 0x5A | sekvens (uint16) | antal (uint8) | antal x int16 samples | fletcher-16 (uint16)
+// Alle tal sendes little-endian. Se ekg_protokol.py
+const uint8_t FRAME_SAMPLES = 10;
+const uint8_t FRAME_LAENGDE = 7 + 2 * FRAME_SAMPLES;
+int16_t frameSamples[FRAME_SAMPLES];
+uint8_t frameIndex = 0;
+uint16_t frameSekvens = 0;
 
 // SPI-indstillingerne
 SPISettings settings(8000000, MSBFIRST, SPI_MODE0);
@@ -17,22 +41,93 @@ int getEKGADC() {
   return result;                             // resultatet af AD-konverteringen
 }
 
+// Pakker de opsamlede samples i en frame og sender den samlet
+void sendFrame() {
+  uint8_t frame[FRAME_LAENGDE];
+  frame[0] = 0xA5;                           // Sync bytes
+  frame[1] = 0x5A;
+  frame[2] = frameSekvens & 0xFF;            // Sekvensnummer, så tabte frames kan opdages
+  frame[3] = frameSekvens >> 8;
+  frame[4] = FRAME_SAMPLES;
+  for (uint8_t i = 0; i < FRAME_SAMPLES; i++) {
+    frame[5 + 2 * i] = frameSamples[i] & 0xFF;
+    frame[6 + 2 * i] = (frameSamples[i] >> 8) & 0xFF;
+  }
+
+  // Fletcher-16 over sekvens, antal og samples
+  uint16_t sum1 = 0, sum2 = 0;
+  for (uint8_t i = 2; i < FRAME_LAENGDE - 2; i++) {
+    sum1 = (sum1 + frame[i]) % 255;
+    sum2 = (sum2 + sum1) % 255;
+  }
+  frame[FRAME_LAENGDE - 2] = sum1;
+  frame[FRAME_LAENGDE - 1] = sum2;
+
+  Serial.write(frame, FRAME_LAENGDE);
+}
+
+// Timer1 interrupt: tager én sample med præcis 1 / SAMPLE_RATE sekunders mellemrum
+ISR(TIMER1_COMPA_vect) {
+  sampleBuffer[sampleTaeller & (BUFFER_STOERRELSE - 1)] = getEKGADC();
+  sampleTaeller++;
+}
+
+// Sætter Timer1 i CTC-tilstand med prescaler 64 (16 MHz / 64 = 250 kHz)
+void startSampleTimer() {
+  noInterrupts();
+  TCCR1A = 0;
+  TCCR1B = 0;
+  TCNT1 = 0;
+  OCR1A = (F_CPU / 64) / SAMPLE_RATE - 1;
+  TCCR1B |= (1 << WGM12) | (1 << CS11) | (1 << CS10);
+  TIMSK1 |= (1 << OCIE1A);
+  interrupts();
+}
+
 void setup() {
   SPI.begin();                               //  SPI-porten startes
   SPI.beginTransaction(settings);            //  SPI-overførsel med de angivne indstillinger startes
   pinMode(ssPin, OUTPUT);                    //  SS-pin’en sættes som output
   digitalWrite(ssPin, HIGH);                 //  SS-pin’en sættes høj som standard
-  Serial.begin(38400);                       //  Den serielle kommunikation med en baudrate på 38400 vælges
+  Serial.begin(baudRate);                    //  Den serielle kommunikation startes (115200 for begge protokoller)
+  startSampleTimer();                        //  Sampling startes på timerinterruptet
 }
 
 void loop() {
-  //  AD-konvertering udføres  resultatet vil vises
-  int adcValue = getEKGADC();
+  //  Henter hvor langt interruptet er nået (32 bit læses uden afbrydelse)
+  noInterrupts();
+  uint32_t taget = sampleTaeller;
+  interrupts();
 
+  //  Er loop() kommet for langt bagud er de ældste samples overskrevet og springes over.
+  //  Tælleren (eller frame-sekvensen) fortæller PC'en at der mangler samples
+  if (taget - sendtTaeller > BUFFER_STOERRELSE) {
+    sendtTaeller = taget - BUFFER_STOERRELSE;
+#if BINAER_PROTOKOL
+    //  En frame skal starte ved en tæller delelig med FRAME_SAMPLES, så den halve frame kasseres
+    sendtTaeller += (FRAME_SAMPLES - sendtTaeller % FRAME_SAMPLES) % FRAME_SAMPLES;
+    frameIndex = 0;
+#endif
+  }
 
-  //  Resultat sendes via den serielle forbindelse
-  Serial.println(adcValue);
+  while (sendtTaeller != taget) {
+    int16_t adcValue = sampleBuffer[sendtTaeller & (BUFFER_STOERRELSE - 1)];
 
-  // Samplingstiden
-  delay(samplingTime);
+    //  Resultat sendes via den serielle forbindelse
+#if BINAER_PROTOKOL
+    if (frameIndex == 0) {
+      frameSekvens = sendtTaeller / FRAME_SAMPLES;   //  Sekvensen giver PC'en tælleren for framens første sample
+    }
+    frameSamples[frameIndex++] = adcValue;
+    if (frameIndex == FRAME_SAMPLES) {
+      sendFrame();
+      frameIndex = 0;
+    }
+#else
+    Serial.print(sendtTaeller);                //  "tæller,værdi" så PC'en kan genskabe sampletiderne
+    Serial.print(',');
+    Serial.println(adcValue);
+#endif
+    sendtTaeller++;
+  }
 }
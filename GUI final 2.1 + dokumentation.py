@@ -1,113 +1,59 @@
 import tkinter as tk
 from tkinter import Frame, ttk, messagebox
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import sqlite3
-import threading
-import io
-import serial
-from collections import deque
-from scipy.signal import find_peaks
-from scipy.ndimage import uniform_filter1d
+import time
 import numpy as np
 from datetime import datetime
 
-from six import integer_types
-
-COMport = "/dev/cu.usbmodem141301" #COM Port vælges
-baud = 38400 #Baud rate skal matche arduino koden
-
-conn = sqlite3.connect("EKGDATABASE.db", check_same_thread=False) #Forbindelse til databasefil
-cursor = conn.cursor()
-
-#Der oprettes 3 tabeller til data hvis de ikke findes
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS Brugerdata (
-    Id INTEGER PRIMARY KEY AUTOINCREMENT,
-    Navn TEXT,
-    Efternavn TEXT,
-    Alder INTEGER,
-    KØN TEXT
-)""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS Pulsmålinger (
-    Id INTEGER PRIMARY KEY AUTOINCREMENT,
-    PatientID INTEGER,
-    Puls INTEGER,
-    FOREIGN KEY (PatientID) REFERENCES Brugerdata(Id)
-)""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS Ekgdata (
-    Id INTEGER PRIMARY KEY AUTOINCREMENT,
-    PatientID INTEGER,
-    Tidspunkt TEXT,
-    Data REAL,
-    Puls INTEGER,
-    FOREIGN KEY (PatientID) REFERENCES Brugerdata(Id)
-)""")
-conn.commit()
+#Tunge moduler (matplotlib, SciPy, pyserial) importeres først når de skal bruges, så vinduet vises hurtigt.
+#Kør "python ekg_starttid.py" for at se hvad der importeres ved start
+from ekg_analysepool import AnalysePool
+from ekg_ingest import RingBuffer
+from ekg_lagring import iso_til_ns_array
+from ekg_database import Database
+from ekg_hrv import RullendeHRV, hrv_linje, hrv_tekst
+from ekg_plot import EkgPlot, OversigtPlot
+from ekg_katalog import PatientKatalog
+from ekg_metrik import MetrikEksport, metrik
+from ekg_opsamling import Opsamling, find_porte
+from ekg_tabel import EkgSider
+from ekg_signal import StreamingQRS, beregn_puls
+
+COMport = "/dev/cu.usbmodem141301" #COM Port vælges (eller f.eks. "sim://?puls=80" for en simuleret enhed, se ekg_simulator.py)
+protokol = "tekst" #Seriel protokol: "tekst" (én værdi pr. linje) eller "binær" (frames, se ekg_protokol.py)
+baud = None #Baud rate. None vælger ud fra protokollen (115200); 38400 til ældre firmware der kun sender værdien
+samplerate = 250 #Samplingsfrekvens sat i arduino koden (SAMPLE_RATE). Den effektive rate estimeres ud fra enhedens tæller
+database = "EKGDATABASE.db" #Databasefil
+plot_fps = 30 #Maks antal billeder pr. sekund i EKG diagrammet (uafhængigt af datahastigheden)
+lagring = "rækker" #Lagringsform: "rækker" (en række pr. måling i Ekgdata) eller "blokke" (int16 blokke i EkgBlokke)
+dæmon = None #F.eks. "127.0.0.1:50505": målingerne kører i ekg_daemon.py og GUI'en viser dem kun (skrivebeskyttet)
+rå_dage = None #F.eks. 30: rå samples fra ældre sessioner arkiveres komprimeret i baggrunden (se ekg_retention.py)
+metrik_fil = None #F.eks. "metrik.jsonl": latens pr. stadie og tællere skrives til filen (se ekg_metrik.py)
+metrik_overlay = False #True viser ende-til-ende latens og de langsomste stadier på PageOne
+
+#Databaselag, patientliste og analysepool oprettes i start(). Modulet kan derfor importeres uden at
+#åbne databasen eller starte noget, hvilket arbejderprocesserne (spawn) og testene gør
+db = None
+katalog = None
+analysepool = None
 
 #Benyttes til threading mm.
 run = True
 
-class Datahandler():
-    # Initialiserer Datahandler med patient ID og stop-event. Buffer benyttes til
-    def __init__(self, patient_id, stop_event):
-        self.patient_id = patient_id #patienten der måles på's ID
-        self.stop_event = stop_event #Threading stopper funktion
-        self.buffer = deque(maxlen=300) #Dobbeltkø der holder på seneste 300 værdier (Benyttes til pulsberegning)
+# Opretter en Datahandler til Opsamling. ekg_daemon (og pyserial) importeres først ved første måling
+def lav_datahandler(patient_id, stop_event, ringbuffer, writer=None, helbred=None):
+    from ekg_daemon import Datahandler
+    return Datahandler(patient_id, stop_event, ringbuffer, writer=writer, helbred=helbred, db=db,
+                       protokol=protokol, samplerate=samplerate, lagring=lagring, baud=baud)
 
-    # Læser seriel data fra Arduino og indsætter i databasen.
-    def serialdata(self, com):
-        try:
-            conn_local = sqlite3.connect("EKGDATABASE.db") #Lokal forbindelse til Databasen
-            cursor_local = conn_local.cursor()
-            ser = serial.Serial(com, baud, timeout=0.001) #Åbner serial port
-            sio = io.TextIOWrapper(io.BufferedReader(ser))
+#Styrer alle igangværende målinger (én Datahandler pr. port) og den fælles skriver til databasen.
+#Kører målingerne i dæmonen, læses de i stedet derfra. Oprettes i start()
+opsamling = None
 
-            while not self.stop_event.is_set(): #Kører en løkke indtil stop_event køres
-                try:
-                    data = sio.readline().strip() #Fjerne whitespaces fra serialdata
-                    if not data:
-                        continue
-
-                    value = float(data)  #Gør værdien til en float og gemmer i buffer til beregning
-                    self.buffer.append(value)
-
-                    # pulsberegner benyttes, men først når 100 målinger laves
-                    puls = self.beregn_puls() if len(self.buffer) >= 100 else None
-
-                    #Variabel med nuværende tid sættes
-                    now = datetime.now().isoformat(timespec='microseconds')
-
-                    #De nu fundne værdier sættes ind i databasen
-                    cursor_local.execute("""
-                        INSERT INTO Ekgdata (PatientID, Data, Tidspunkt, Puls)
-                        VALUES (?, ?, ?, ?)
-                    """, (self.patient_id, value, now, puls))
-                    conn_local.commit()
-                except Exception as e:
-                    print("Fejl ved læsning/indsættelse:", e)
-
-        except Exception as e:
-            print("Serialfejl:", e)
-
-    # Beregner pulsen ud fra peak-detektion i den interne buffer.
-    def beregn_puls(self):
-        peaks, _ = find_peaks(self.buffer, height=1000, distance=40, prominence=200) #finder signaltoppe vha scipy
-        if len(peaks) < 2: #Mindst to peaks skal haves for at regne distance mellem dem
-            return None
-        rr_intervaller = np.diff(peaks) #Afstanden mellem peaks findes (R til R peak)
-        if len(rr_intervaller) == 0:
-            return None
-
-        #Gennemsnitsintervallet mellem peaks divideres med samplingfrekvensen for at få varighed i sekunder
-        rr_mean = np.mean(rr_intervaller)
-        fs = 250
-        sek_per_peak = rr_mean / fs
-        return int(60 / sek_per_peak) if sek_per_peak > 0 else None # Konverterer sek/beat til BPM
+#Skriver latens og tællere til metrik_fil. Startes i start()
+metrik_eksport = None
+
+#Baggrundsarkivering af gamle sessioner. Startes i start()
+komprimering = None
 
 
 class App(tk.Tk):
@@ -135,18 +81,26 @@ class App(tk.Tk):
         #Benyttes til at gemme pulshistorik og valgt patient
         self.pulse_history = []
         self.selected_patient_id = None
+        self.aktiv_side = None #Siden der vises (sider med egen opdateringsløkke tegner kun når de vises)
 
-        #For hver variabel opretter og placerer undersider
-        for F in (StartPage, PageOne, PageTwo, Login):
-            frame = F(parent=container, controller=self)
-            self.frames[F] = frame
-            frame.place(relwidth=1, relheight=1)
+        #Undersiderne oprettes først når de vises første gang (se get_frame)
+        self.container = container
 
         self.show_frame(StartPage) #Viser StartPage som første side når programmet åbnes
 
+    # Returnerer siden og opretter den hvis den ikke er vist før
+    def get_frame(self, page_class):
+        frame = self.frames.get(page_class)
+        if frame is None:
+            frame = page_class(parent=self.container, controller=self)
+            self.frames[page_class] = frame
+            frame.place(relwidth=1, relheight=1)
+        return frame
+
     # Skifter den viste side i GUI'en til den angivne frame.
     def show_frame(self, page_class):
-        frame = self.frames[page_class]
+        frame = self.get_frame(page_class)
+        self.aktiv_side = page_class
         frame.tkraise() #Placerer den øverst i GUI'en
 
 class StartPage(tk.Frame):
@@ -161,14 +115,24 @@ class StartPage(tk.Frame):
         #Første knap. Funktion: Patientlisen opdateres og der skiftes til PageOne
         tk.Button(self, text="EKG diagram og puls", bg="lightblue",
                   borderwidth=0, highlightthickness=0, padx=10, pady=4,
-                  command=lambda: [controller.frames[PageOne].load_patients(), controller.show_frame(PageOne)]).pack(
+                  command=lambda: [controller.get_frame(PageOne).load_patients(), controller.show_frame(PageOne)]).pack(
             pady=(80, 10))
 
+        #Knap til oversigt over alle igangværende målinger
+        tk.Button(self, text="Live oversigt", bg="lightblue",
+                  borderwidth=0, highlightthickness=0, padx=10, pady=4,
+                  command=lambda: controller.show_frame(PageLive)).pack(pady=(0, 10))
+
         #Anden knap skifter til PageTwo
         tk.Button(self, text="Data over målinger", bg="lightblue",
                   borderwidth=0, highlightthickness=0, padx=10, pady=4,
                   command=lambda: controller.show_frame(PageTwo)).pack()
 
+        #Knap til zoombar historik over hele målingen
+        tk.Button(self, text="Historik", bg="lightblue",
+                  borderwidth=0, highlightthickness=0, padx=10, pady=4,
+                  command=lambda: [controller.get_frame(PageHistorik).hele_målingen(), controller.show_frame(PageHistorik)]).pack(pady=(10, 0))
+
         #Tredje knap skifter til Login
         tk.Button(self, text="Patienter", bg="lightblue",
                   borderwidth=0, highlightthickness=0, padx=10, pady=4,
@@ -180,10 +144,17 @@ class PageOne(tk.Frame):
         super().__init__(parent, bg="lightblue") #Arver fra tk.Frame
         self.controller = controller
 
-        # buffere til ekgdata og tid. (Benyttes til pulsberegning)
-        self.ekg_buffer = deque(maxlen=5000)
-        self.tid_buffer = deque(maxlen=5000)
-        self.smooth_pulse = None  # glattet puls variabel
+        # Forudallokeret buffer til ekgdata og tid i epoch-ns. (Benyttes til pulsberegning)
+        self.puls_buffer = RingBuffer(5000)
+        #HRV over 1 min, 5 min og hele målingen til visning. Detektoren giver den hvert slag den ser.
+        #Det der gemmes regner Datahandler selv ud fra alle slag (ekg_daemon.py)
+        self.hrv = RullendeHRV()
+
+        # Live data fra igangværende måling læses fra ringbufferen i stedet for databasen
+        self.ringbuffer = None #Ringbufferen for den viste patients måling (fra opsamling)
+        self.sekvens = 0 #Sekvensnummer for seneste behandlede sample
+        self.sidste_puls_gem = 0.0 #Tidspunkt for seneste opdatering af puls i databasen
+        self.detektor = None #QRS-detektor der fødes med nye samples fra ringbufferen
 
         tk.Label(self, text="EKG diagram og puls", bg="lightblue", #Titel
                  font=("Helvetica", 18, "bold")).place(relx=0.02, rely=0.02, anchor="nw")
@@ -193,16 +164,18 @@ class PageOne(tk.Frame):
         tk.Label(self, text="Puls", font=("Helvetica", 18), bg="lightblue").place(relx=0.85, rely=0.22) #puls tekst
         self.puls_label.place(relx=0.85, rely=0.3) #Viser aktuel puls. Er bundet til update_data funktionen
 
-        #Dropdown med patientvalg (ID og Navn) Ved valg kaldes patient_selected
+        #Dropdown med patientvalg (ID og Navn) Ved valg kaldes patient_selected.
+        #Skrives der i feltet vises kun patienter hvis navn starter med teksten
         self.patient_var = tk.StringVar()
         # Label til dropdown
         tk.Label(self, text="Vælg patient:", bg="lightblue", font=("Helvetica", 16)).place(relx=0.56, rely=0.053)
 
         # Dropdown-menu
-        self.patient_dropdown = ttk.Combobox(self, textvariable=self.patient_var, state="readonly", width=25)
+        self.patient_dropdown = ttk.Combobox(self, textvariable=self.patient_var, width=25)
         self.patient_dropdown.place(relx=0.7, rely=0.05)
 
         self.patient_dropdown.bind("<<ComboboxSelected>>", self.patient_selected)
+        self.patient_dropdown.bind("<KeyRelease>", self.søg_patient)
         self.load_patients()
 
         #Rammer til grafområde
@@ -213,11 +186,24 @@ class PageOne(tk.Frame):
         plot_frame.pack()
         plot_frame.pack_propagate(False)
 
-        #Opretter matplotlib figur i TKinter
-        self.fig = Figure(figsize=(6, 4.5), dpi=100, facecolor='lightblue')
-        self.ax = self.fig.add_subplot(111)
-        self.canvas = FigureCanvasTkAgg(self.fig, master=plot_frame)
-        self.canvas.get_tk_widget().pack(expand=True, fill="both")
+        #Opretter matplotlib figur i TKinter. Akser og kurve oprettes én gang og kurven opdateres med blitting
+        self.plot = EkgPlot(plot_frame, antal=150, max_fps=plot_fps)
+
+        #Viser målt antal billeder pr. sekund
+        self.fps_label = tk.Label(self, text="", font=("Helvetica", 10), fg="gray", bg="lightblue")
+        self.fps_label.place(relx=0.85, rely=0.4)
+
+        #HRV tabel under grafen (opdateres én gang i sekundet under en måling)
+        self.hrv_label = tk.Label(self, text="", font=("Courier", 9), bg="lightblue", justify="left")
+        self.hrv_label.place(relx=0.05, rely=0.76)
+        self.sidste_hrv = 0.0
+
+        #Latens fra sample til skærm og pr. stadie (kun med metrik_overlay)
+        self.metrik_label = None
+        self.sidste_metrik = 0.0
+        if metrik_overlay:
+            self.metrik_label = tk.Label(self, text="", font=("Courier", 9), fg="gray", bg="lightblue", justify="left")
+            self.metrik_label.place(relx=0.83, rely=0.45)
 
         #Knap tilbage til StartPage
         tk.Button(self, text="Tilbage", borderwidth=0, highlightthickness=0,
@@ -226,47 +212,52 @@ class PageOne(tk.Frame):
         #Starter realtidsopdatering
         self.update_data()
 
-        # Trådrelateret
-        self.data_thread = None
-        self.stop_event = None
+        # Port som målingen startes på. Flere patienter kan måles samtidig på hver sin port
+        self.port_var = tk.StringVar(value=COMport)
+        self.port_dropdown = ttk.Combobox(self, textvariable=self.port_var, values=find_porte(COMport), width=14)
+        self.port_dropdown.place(relx=0.83, rely=0.105)
 
         # Start-knap
         tk.Button(self, text="Start måling", borderwidth=0, highlightthickness=0, padx=10, pady=4, command=self.start_measurement).place(relx=0.7, rely=0.1)
         # Stop-knap
         tk.Button(self, text="Stop måling", borderwidth=0, highlightthickness=0, padx=10, pady=4, command=self.stop_measurement).place(relx=0.7, rely=0.15)
 
-        # Her gemmer vi alle visninger af smooth puls
-        self.smooth_pulses = []
-
     # Indlæser patienter fra databasen til dropdown-menuen.
     def load_patients(self):
-        cursor.execute("SELECT Id, Navn FROM Brugerdata") #Henter ID og navn
-        self.patients = cursor.fetchall()
-        names = [f"{navn} (ID: {pid})" for pid, navn in self.patients] #For hvert navn omdannes det til pæn string
-        self.patient_dropdown['values'] = names #Insættes i dropdown
-        if names: #Ved navne vælges første patient, og patient_selected kaldes så korrekt ID sættes som variabel
+        self.vis_patienter(katalog.alle()) #Henter ID og navn fra den fælles liste
+        if self.patients: #Ved navne vælges første patient, og patient_selected kaldes så korrekt ID sættes som variabel
             self.patient_dropdown.current(0)
             self.patient_selected()
 
-    # Stopper målingen og gemmer gennemsnitspulsen i databasen.
+    # Sætter patienterne i dropdown-menuen. self.patients har samme rækkefølge som menuen
+    def vis_patienter(self, patienter):
+        self.patients = [(p.id, p.navn) for p in patienter]
+        self.patient_dropdown['values'] = [f"{navn} (ID: {pid})" for pid, navn in self.patients] #For hvert navn omdannes det til pæn string
+
+    # Viser kun patienter hvis navn starter med den skrevne tekst
+    def søg_patient(self, event=None):
+        if event is not None and event.keysym in ("Up", "Down", "Return", "Escape"):
+            return
+        self.vis_patienter(katalog.søg(self.patient_var.get(), maks=200))
+
+    # Stopper målingen. Datahandler gemmer gennemsnitspulsen og HRV for hele målingen i databasen
     def stop_measurement(self):
-        if self.data_thread and self.data_thread.is_alive(): #Tjekker om tråd køres (Der er aktiv måling)
-            print("Måling stoppes manuelt") #Sender stop besked til tråd og variable ryddes op
-            self.stop_event.set()
-            self.data_thread.join()
-            self.data_thread = None
-            self.stop_event = None
-
-            # Gemmer gennemsnit af smooth_pulse i Pulsmålinger
-            if self.smooth_pulses:
-                avg_pulse = int(round(np.mean(self.smooth_pulses))) #Gennemsnitspulsen regnes fra liste
-                cursor.execute("INSERT INTO Pulsmålinger (PatientID, Puls) VALUES (?, ?)", #Indsættes i DB
-                               (self.controller.selected_patient_id, avg_pulse))
-                conn.commit()
+        if dæmon:
+            messagebox.showinfo("Dæmon", "Målingerne styres af ekg_daemon.py. GUI'en viser dem kun.")
+            return
+        enheder = opsamling.stop_patient(self.controller.selected_patient_id) #Stopper målinger på den viste patient
+        if enheder:
+            print("Måling stoppes manuelt")
+            self.ringbuffer = None
+
+            # Viser gennemsnitspulsen (ud fra alle RR-intervaller i målingen) og HRV som Datahandler har gemt
+            hrv = enheder[0].helbred.hrv
+            if hrv and hrv["puls_gns"]:
+                avg_pulse = int(round(hrv["puls_gns"]))
 
                 #Beskedbokse
-                print(f"Gemte gennemsnitlig puls: {avg_pulse}")
-                messagebox.showinfo("Måling stoppet", f"Målingen er stoppet.\nGennemsnitlig puls: {avg_pulse} BPM")
+                print(f"Gemte gennemsnitlig puls: {avg_pulse} ({hrv_linje(hrv)})")
+                messagebox.showinfo("Måling stoppet", f"Målingen er stoppet.\nGennemsnitlig puls: {avg_pulse} BPM\n{hrv_linje(hrv)}")
             else:
                 messagebox.showinfo("Måling stoppet", "Målingen er stoppet, men der blev ikke registreret nogen puls.")
         else:
@@ -274,8 +265,9 @@ class PageOne(tk.Frame):
 
     # Starter en ny tråd til indsamling af EKG-data.
     def start_measurement(self):
-        self.smooth_pulses = []  # Nulstil tidligere målinger
-
+        if dæmon:
+            messagebox.showinfo("Dæmon", "Målingerne styres af ekg_daemon.py. GUI'en viser dem kun.")
+            return
         #Tjekker om patient er valgt
         index = self.patient_dropdown.current()
         if index < 0:
@@ -286,20 +278,16 @@ class PageOne(tk.Frame):
         patient_id, _ = self.patients[index]
         self.controller.selected_patient_id = patient_id
 
-        # Stop evt. gammel tråd
-        if self.data_thread and self.data_thread.is_alive():
-            print("Stopper tidligere måling")
-            self.stop_event.set()
-            self.data_thread.join()
-
-        # Start ny tråd
-        print(f"Starter ny måling for patient {patient_id}")
-        self.stop_event = threading.Event()
-        self.data_thread = threading.Thread(
-            target=lambda: Datahandler(patient_id, self.stop_event).serialdata(COMport),
-            daemon=True
-        )
-        self.data_thread.start()
+        # Starter måling på den valgte port. En evt. tidligere måling på samme port stoppes,
+        # målinger på andre porte kører videre
+        port = self.port_var.get() or COMport
+        enhed = opsamling.start(port, patient_id)
+
+        # Ny ringbuffer til live data
+        self.ringbuffer = enhed.ringbuffer
+        self.sekvens = 0
+        self.hrv = RullendeHRV() #Nulstil visningen af tidligere målinger
+        self.detektor = StreamingQRS(fs=samplerate, hrv=self.hrv)
 
     # Registrerer valgt patient fra dropdown-menuen.
     def patient_selected(self, event=None):
@@ -308,41 +296,15 @@ class PageOne(tk.Frame):
             patient_id, _ = self.patients[index]
             self.controller.selected_patient_id = patient_id
 
-    # Beregner puls baseret på EKG-data og tidsstempler.
+    # Beregner puls baseret på EKG-data og tidsstempler (selve beregningen ligger i ekg_signal.py)
     def beregn_puls(self, data, tider):
-        if len(data) < 10: #Venter på minimum 10 målinger for at undgå fejlmålinger
-            return None
-        try:
-            sekunder = np.array([(t - tider[0]).total_seconds() for t in tider]) #numpy array med tid i sek ifht 1. mål
-            signal = np.array(data) #Array med EKG værdier
-
-            # Lavpasfilter
-            signal = uniform_filter1d(signal, size=5)
-
-            # Finder peaks
-            peaks, _ = find_peaks(signal, height=1000, distance=200, prominence=300)
-            if len(peaks) < 2: # Der skal bruges minimum 2 peaks for at kunne regne puls
-                return None
-
-            # RR-interval (sekunder)
-            rr_intervaller = np.diff(sekunder[peaks]) #Beregner tid i sek mellem peaks
-            rr_intervaller = rr_intervaller[(rr_intervaller > 0.3) & (rr_intervaller < 3.5)]  # Mellem 30–210 BPM
-
-            #Der skal haves gyldige intervaller
-            if len(rr_intervaller) == 0:
-                return None
-
-            rr_mean = np.mean(rr_intervaller[-5:]) #Gennemsnit fra sidste 5 intervaller
-            return 60 / rr_mean if rr_mean > 0 else None #konverterer til BPM fra sek/Beat
-        #Går noget galt returneres fejlmedling
-        except Exception as e:
-            print("Pulsfejl:", e)
-            return None
+        return beregn_puls(data, tider)
 
     # Opdaterer graf og puls i realtid med nyeste målinger.
     def update_data(self):
         if not run: #Tjekker om programmet kører
             return
+        t_opdatering = metrik.start()
 
         #Er der ikke valgt en patient så prøv igen om 1 sekund
         patient_id = self.controller.selected_patient_id
@@ -350,77 +312,196 @@ class PageOne(tk.Frame):
             self.after(1000, self.update_data)
             return
 
-        #Henter seneste 150 EKG værdier og tilhørende puls
-        cursor.execute("SELECT Data, Puls FROM Ekgdata WHERE PatientID = ? ORDER BY Id DESC LIMIT 150", (patient_id,))
-        results = cursor.fetchall()
+        #Kører der en måling på patienten læses direkte fra dens ringbuffer
+        enhed = opsamling.for_patient(patient_id)
+        live = enhed is not None
+        if live and enhed.ringbuffer is not self.ringbuffer: #Skift til en anden patients måling
+            self.ringbuffer = enhed.ringbuffer
+            self.sekvens = 0
+            self.hrv = RullendeHRV()
+            self.detektor = StreamingQRS(fs=samplerate, hrv=self.hrv)
+        if live:
+            #Henter kun samples der er kommet siden sidste opdatering
+            sekvens, nye_værdier, nye_tider = self.ringbuffer.læs_siden(self.sekvens)
+            if sekvens == self.sekvens: #Ingen nye samples, så intet at tegne eller beregne
+                self.after(3, self.update_data)
+                return
+            self.sekvens = sekvens
+
+            data_points = self.ringbuffer.seneste(150)[0] #Seneste 150 EKG værdier
+            latest_pulse = self.ringbuffer.puls #Bruges til visning før ny beregning
+
+            #Datahandler har målt en anden samplerate end forventet, så detektoren følger med
+            fs = self.ringbuffer.fs
+            if fs and abs(fs - self.detektor.fs) > 0.02 * self.detektor.fs:
+                self.detektor = StreamingQRS(fs=fs, hrv=self.hrv) #HRV-vinduerne fortsætter
+
+            #Kun de nye samples sendes gennem QRS-detektoren (RR beregnes ud fra tidsstemplerne)
+            t0 = metrik.start()
+            self.detektor.tilføj_mange(nye_værdier.tolist(), nye_tider.tolist())
+            dynamisk_puls = self.detektor.puls()
+            metrik.slut("qrs", t0)
+        else:
+            #Ingen aktiv måling: seneste gemte data hentes fra databasen
+            t0 = metrik.start()
+            if lagring == "blokke":
+                værdier, tider_ns, pulser = db.seneste_samples(patient_id, 150)
+                results = list(zip(værdier[::-1].tolist(), pulser[::-1].tolist()))
+            else:
+                results = db.seneste_ekg(patient_id, 150)
+
+            #Fås ingen resultater prøves igen om 1 sekund
+            if not results:
+                self.after(1000, self.update_data)
+                return
 
-        #Fås der resultater
-        if results:
             data_points = [x[0] for x in results][::-1] #Indeholder amplituder i rækkefølge
             latest_pulse = results[0][1] #Bruges til visning før ny beregning
 
-            #Rydder grafen og tegner ny kurve
-            self.ax.clear()
-            self.ax.set_facecolor('white')
-            self.ax.plot(range(len(data_points)), data_points, color='black')
-
-            # Gitter og aksemærkninger
-            self.ax.grid(True, which='both', linestyle='--', linewidth=0.5, color='gray', alpha=0.7)  # <-- ny
-            self.ax.set_xlabel("Tid (målepunkt #)")  # <-- ny
-            self.ax.set_ylabel("Amplitude (AD værdi)")  # <-- ny
-            step = max(1, len(data_points) // 10)  # <-- ny
-            self.ax.set_xticks(range(0, len(data_points), step))  # <-- ny
-            self.ax.set_xticklabels([str(i) for i in range(0, len(data_points), step)], rotation=45)  # <-- ny
-
-            self.ax.set_title("EKG diagram")
-            self.ax.set_ylim(-100, 4500)
-            self.ax.set_xlim(0, len(data_points) - 1)
-            self.ax.tick_params(axis='both', labelsize=8)
-            self.canvas.draw()
-
-            #Henter seneste 100 målinger inkl tid
-            cursor.execute("SELECT Tidspunkt, Data FROM Ekgdata WHERE PatientID = ? ORDER BY Id DESC LIMIT 100", (patient_id,))
-            rows = cursor.fetchall()[::-1]
-
-            #Viser seneste kendte beregning
-            self.puls_label.config(text=str(latest_pulse))
-
-            #Tilføjer nye målinger til buffers
-            for tid, val in rows:
-                try:
-                    self.ekg_buffer.append(float(val))
-                    self.tid_buffer.append(datetime.fromisoformat(tid))
-                except:
-                    continue
-
-            #Kalder beregn puls med nyeste datapunkter
-            dynamisk_puls = self.beregn_puls(list(self.ekg_buffer), list(self.tid_buffer))
-
-            #Udglatter ændringer i puls (exponentielt glidende avg)
-            if dynamisk_puls:
-                if self.smooth_pulse is None:
-                    self.smooth_pulse = dynamisk_puls
-                else:
-                    self.smooth_pulse = 0.3 * dynamisk_puls + 0.7 * self.smooth_pulse  # glat overgang
-
-                #Viser puls i GUI
-                self.puls_label.config(text=f"{int(self.smooth_pulse)} BPM")
-                self.smooth_pulses.append(self.smooth_pulse)
-
-                # Opdater seneste puls i databasen
-                cursor.execute("""
-                        UPDATE Ekgdata
-                        SET Puls = ?
-                        WHERE PatientID = ? AND Id = (
-                            SELECT Id FROM Ekgdata WHERE PatientID = ? ORDER BY Id DESC LIMIT 1
-                        )
-                    """, (int(self.smooth_pulse), patient_id, patient_id))
-                conn.commit()
-            #Fås ingen værdier sættes puls til "--"
+            #Henter seneste 100 målinger inkl tid (tidspunkter omregnes samlet til epoch-ns)
+            if lagring == "blokke":
+                nye_værdier, nye_tider = værdier[-100:], tider_ns[-100:]
             else:
-                self.puls_label.config(text="--")
-        #Kører igen om 3ms (realtid)
-        self.after(3,self.update_data)
+                rows = db.seneste_ekg_tid(patient_id, 100)[::-1]
+                try:
+                    nye_tider = iso_til_ns_array([tid for tid, _ in rows])
+                    nye_værdier = np.array([val for _, val in rows], dtype=np.float64)
+                except (TypeError, ValueError):
+                    nye_tider = nye_værdier = np.empty(0)
+            metrik.slut("db_forespørgsel", t0)
+
+        #Opdaterer kurven (tegnes højst plot_fps gange i sekundet)
+        if self.plot.opdater(data_points):
+            self.fps_label.config(text=f"{self.plot.fps:.0f} fps")
+            #Tk tegner skærmen når den er ledig, så ende-til-ende latensen registreres lige efter
+            ankomst = getattr(self.ringbuffer, "ankomst_ns", None) if live else None
+            if metrik.aktiv and ankomst:
+                self.after_idle(lambda: metrik.registrer("ende_til_ende", time.monotonic_ns() - ankomst))
+
+        #Viser seneste kendte beregning
+        self.puls_label.config(text=str(latest_pulse))
+
+        if not live:
+            #Tilføjer kun målinger der er nyere end dem der allerede ligger i bufferen
+            _, sidste_tid = self.puls_buffer.seneste(1)
+            if len(sidste_tid):
+                ny = nye_tider > sidste_tid[0]
+                nye_værdier, nye_tider = nye_værdier[ny], nye_tider[ny]
+            self.puls_buffer.skriv_mange(nye_værdier, nye_tider)
+
+            #Nyeste datapunkter sendes til analyse i arbejderprocessen. Resultatet hentes når det er klar,
+            #og er arbejderen bagud springes denne analyse over
+            if len(nye_værdier):
+                analysepool.send(patient_id, *self.puls_buffer.seneste(5000))
+            resultat = analysepool.resultat(patient_id)
+            dynamisk_puls = resultat["puls"] if resultat else None
+
+        #Pulsen er allerede et gennemsnit af de seneste RR-intervaller, så den vises som den er
+        if dynamisk_puls:
+            #Viser puls i GUI
+            self.puls_label.config(text=f"{int(dynamisk_puls)} BPM")
+
+            # Opdater seneste puls i databasen (højst én gang i sekundet, databasen er kun til lagring)
+            if time.monotonic() - self.sidste_puls_gem >= 1.0:
+                self.sidste_puls_gem = time.monotonic()
+                db.opdater_seneste_puls(patient_id, int(dynamisk_puls), blokke=lagring == "blokke")
+        #Fås ingen værdier sættes puls til "--"
+        else:
+            self.puls_label.config(text="--")
+
+        #HRV vinduerne vises én gang i sekundet. Slag ældre end vinduerne fjernes også når der ikke kommer nye
+        if live and time.monotonic() - self.sidste_hrv >= 1.0:
+            self.sidste_hrv = time.monotonic()
+            if len(nye_tider):
+                self.hrv.udløb(int(nye_tider[-1]))
+            self.hrv_label.config(text=hrv_tekst(self.hrv.resultater()))
+
+        metrik.slut("update_data", t_opdatering)
+        if self.metrik_label is not None and time.monotonic() - self.sidste_metrik >= 1.0:
+            self.sidste_metrik = time.monotonic()
+            self.vis_metrik()
+
+        #Kører igen om 3ms (realtid) ved live måling, ellers om 1 sekund
+        self.after(3 if live else 1000, self.update_data)
+
+    # Viser ende-til-ende latens og p95 for hvert stadie i overlayet (opdateres én gang i sekundet)
+    def vis_metrik(self):
+        billede = metrik.øjebliksbillede()
+        linjer = []
+        e2e = billede["stadier"].get("ende_til_ende")
+        if e2e:
+            linjer.append(f"sample->skærm {e2e['seneste_ms']:.0f} ms (p95 {e2e['p95_ms']:.0f})")
+        for navn, s in sorted(billede["stadier"].items(), key=lambda s: -s[1]["p95_ms"]):
+            if navn != "ende_til_ende":
+                linjer.append(f"{navn[:14]:<14} {s['p95_ms']:6.1f} ms")
+        fejl = sum(billede["tællere"].get(n, 0) for n in ("parse_fejl", "checksum_fejl", "db_fejl"))
+        linjer.append(f"fejl {fejl}  tabte frames {billede['tællere'].get('tabte_frames', 0)}  "
+                      f"tabte samples {billede['tællere'].get('tabte_samples', 0)}")
+        self.metrik_label.config(text="\n".join(linjer))
+
+class PageLive(tk.Frame):
+    # Viser op til fire igangværende målinger på én gang. Én fælles opdateringsløkke læser alle ringbuffere
+    def __init__(self, parent, controller):
+        super().__init__(parent, bg="lightblue") #Arver fra tk.Frame
+        self.controller = controller
+
+        tk.Label(self, text="Live oversigt", bg="lightblue", #Titel
+                 font=("Helvetica", 18, "bold")).place(relx=0.02, rely=0.02, anchor="nw")
+
+        #Fire pladser i et 2x2 gitter, hver med en kurve og en linje med puls og sundhedstal
+        self.pladser = []
+        for i in range(4):
+            ramme = Frame(self, width=430, height=230, bg="lightblue")
+            ramme.place(relx=0.02 + 0.49 * (i % 2), rely=0.08 + 0.44 * (i // 2))
+            ramme.pack_propagate(False)
+            info = tk.Label(ramme, text="Ingen måling", font=("Helvetica", 10), bg="lightblue", anchor="w")
+            info.pack(fill="x")
+            plot = EkgPlot(ramme, antal=500, max_fps=plot_fps, figsize=(4.3, 2.1), titel="")
+            self.pladser.append({"plot": plot, "info": info, "ringbuffer": None, "sekvens": 0})
+
+        #Knap tilbage til StartPage
+        tk.Button(self, text="Tilbage", borderwidth=0, highlightthickness=0,
+                  padx=10, pady=4, command=lambda: controller.show_frame(StartPage)).place(relx=1.0, rely=1.0, anchor="se", x=-10, y=-10)
+
+        self.opdater()
+
+    # Opdaterer alle pladser ud fra de igangværende målinger
+    def opdater(self):
+        if not run: #Tjekker om programmet kører
+            return
+        if self.controller.aktiv_side is not PageLive: #Siden vises ikke, så intet tegnes
+            self.after(500, self.opdater)
+            return
+
+        enheder = opsamling.aktive()[:len(self.pladser)]
+        for plads, enhed in zip(self.pladser, enheder + [None] * (len(self.pladser) - len(enheder))):
+            if enhed is None:
+                if plads["ringbuffer"] is not None:
+                    plads["ringbuffer"] = None
+                    plads["plot"].opdater([], tving=True)
+                    plads["info"].config(text="Ingen måling")
+                continue
+
+            #Ny måling på pladsen
+            if plads["ringbuffer"] is not enhed.ringbuffer:
+                plads["ringbuffer"] = enhed.ringbuffer
+                plads["sekvens"] = 0
+
+            #Kurven tegnes kun når der er kommet nye samples
+            sekvens = enhed.ringbuffer.sekvens
+            if sekvens != plads["sekvens"]:
+                plads["sekvens"] = sekvens
+                plads["plot"].opdater(enhed.ringbuffer.seneste(plads["plot"].antal)[0])
+
+            stat = enhed.helbred.statistik()
+            puls = enhed.ringbuffer.puls
+            plads["info"].config(text=f"Patient {enhed.patient_id} på {enhed.port}  "
+                                      f"puls {puls if puls else '--'}  {stat['samples_pr_s']:.0f} samples/s  "
+                                      f"fejl {stat['parse_fejl']}  tabte frames {stat['tabte_frames']}  "
+                                      f"genforbindelser {stat['genforbindelser']}  ({stat['status']})")
+
+        self.after(1000 // plot_fps, self.opdater)
+
 
 class PageTwo(tk.Frame):
     # Initialiserer en side i GUI med de nødvendige widgets. Arver fraq tk.Frame
@@ -432,12 +513,35 @@ class PageTwo(tk.Frame):
         self.patient_label.pack(pady=(15,5), padx=20, anchor='e') #Titel
 
         #Tabel formatering.
-        self.tree = ttk.Treeview(self, columns=("Tidspunkt", "EKG Data"), show="headings")
+        tabel_frame = tk.Frame(self, bg="lightblue")
+        tabel_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=10)
+        self.tree = ttk.Treeview(tabel_frame, columns=("Tidspunkt", "Puls", "EKG Data"), show="headings")
         self.tree.heading("Tidspunkt", text="Tidspunkt")
+        self.tree.heading("Puls", text="Puls")
         self.tree.heading("EKG Data", text="EKG Data")
         self.tree.column("Tidspunkt", width=50)
+        self.tree.column("Puls", width=30, anchor="center")
         self.tree.column("EKG Data", width=50, anchor="center")
-        self.tree.pack(fill=tk.BOTH, expand=True, padx=20, pady=10)
+
+        #Scrollbar. Når der rulles tæt på bunden hentes næste side
+        self.scrollbar = ttk.Scrollbar(tabel_frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.rullet)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        #Sidevis indlæsning af målinger (sættes ved opdatering)
+        self.sider = None
+        self.henter = False #Sikrer at der kun hentes én side ad gangen
+
+        #Hop til tidspunkt
+        hop_frame = tk.Frame(self, bg="lightblue")
+        hop_frame.pack()
+        tk.Label(hop_frame, text="Gå til tidspunkt:", bg="lightblue").pack(side=tk.LEFT)
+        self.tid_entry = tk.Entry(hop_frame, width=20)
+        self.tid_entry.insert(0, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        self.tid_entry.pack(side=tk.LEFT, padx=5)
+        tk.Button(hop_frame, text="Gå til", borderwidth=0, highlightthickness=0, padx=10, pady=4,
+                  command=self.hop_til_tid).pack(side=tk.LEFT)
 
         #Opdater knap
         refresh_btn = tk.Button(self, text="Opdater", borderwidth=0, highlightthickness=0, padx=10, pady=4, command=self.refresh_data)
@@ -448,36 +552,24 @@ class PageTwo(tk.Frame):
 
         self.refresh_data()
 
-    # Opdaterer tabellen med de nyeste målinger for valgt patient.
+    # Opdaterer tabellen med de nyeste målinger for valgt patient. Kun første side hentes
     def refresh_data(self):
-        for item in self.tree.get_children(): #For hver del i self.tree fra constructer slettes de.
-            self.tree.delete(item)
+        self.tree.delete(*self.tree.get_children()) #Alle rækker slettes i ét kald
 
         #Findes patient_id vil den vælge værdierne fra databasen og returnerer hvis ingen patient er valgt
         patient_id = self.controller.selected_patient_id
 
-        #Stripper navn og puls i programmet fra databasen så det står uden parenteser mm. rundt om
-        cursor.execute("""
-                               SELECT Navn 
-                               FROM Brugerdata
-                               WHERE Id = ?
-                               """, (patient_id,))
-
-        navn = str(cursor.fetchall())
-        stripnavn = navn.strip("'()[],'")
-
-        cursor.execute("""
-                                       SELECT Puls
-                                       FROM Pulsmålinger
-                                       WHERE PatientID = ?
-                                       ORDER BY ID DESC
-                                       LIMIT 1
-                                       """, (patient_id,))
-
-        puls = str(cursor.fetchall())
-        strippuls = puls.strip("'()[],'")
+        #Henter navn og gennemsnitspuls fra patientens seneste session (gamle målinger har kun Pulsmålinger)
+        stripnavn = katalog.navn(patient_id) or ""
+        sessioner = db.sessioner(patient_id, 1)
+        if sessioner and sessioner[0]["PulsGns"]:
+            strippuls = int(round(sessioner[0]["PulsGns"]))
+        else:
+            pulser = db.seneste_pulsmålinger(patient_id, 1)
+            strippuls = pulser[0] if pulser else ""
 
         if not patient_id:
+            self.sider = None
             self.patient_label.config(text="Målinger (ingen patient valgt)")
             return
 
@@ -486,19 +578,129 @@ class PageTwo(tk.Frame):
                  font=("Helvetica", 18, "bold")).place(relx=0.02, rely=0.02, anchor="nw")
         self.patient_label.config(text=f" \t Patient: {stripnavn} \t ID:  {patient_id} \t Seneste gns puls: {strippuls}") #titel på side
 
-        #Op til 6000  værdier i tabellen (svarende til 10 EKG-komplekser med alle takker)
-        cursor.execute("""
-                       SELECT strftime('%Y-%m-%d %H:%M:%S', Tidspunkt), Puls, Data
-                       FROM Ekgdata
-                       WHERE PatientID = ?
-                       ORDER BY Tidspunkt DESC
-                       LIMIT 6000
-                       """, (patient_id,))
-
-        #For hver værdi hentet til cursor indsættes det i tree
-        for row in cursor.fetchall():
+        #Nyeste side hentes. Ældre målinger hentes først når der rulles ned
+        self.sider = EkgSider(db, patient_id, blokke=lagring == "blokke", side_størrelse=200)
+        self.indsæt(self.sider.første_side())
+
+    # Indsætter en side rækker nederst i tabellen
+    def indsæt(self, rækker):
+        for row in rækker:
             self.tree.insert("", tk.END, values=row)
 
+    # Kaldes af Treeview når der rulles. Er bunden næsten synlig hentes næste side
+    def rullet(self, første, sidste):
+        self.scrollbar.set(første, sidste)
+        if self.sider and not self.sider.slut and not self.henter and float(sidste) > 0.9:
+            self.henter = True
+            self.after_idle(self.hent_næste_side)
+
+    # Henter næste (ældre) side og tilføjer den til tabellen
+    def hent_næste_side(self):
+        try:
+            if self.sider:
+                self.indsæt(self.sider.næste_side())
+        finally:
+            self.henter = False
+
+    # Viser målinger fra det indtastede tidspunkt og bagud
+    def hop_til_tid(self):
+        if not self.sider:
+            return
+        try:
+            tidspunkt = datetime.fromisoformat(self.tid_entry.get().strip())
+        except ValueError:
+            messagebox.showwarning("Ugyldigt tidspunkt", "Skriv tidspunktet som ÅÅÅÅ-MM-DD TT:MM:SS")
+            return
+        self.tree.delete(*self.tree.get_children())
+        rækker = self.sider.hop_til(tidspunkt)
+        if not rækker:
+            messagebox.showinfo("Ingen målinger", "Der er ingen målinger på eller før tidspunktet.")
+            return
+        self.indsæt(rækker)
+        self.tree.yview_moveto(0)
+
+
+class PageHistorik(tk.Frame):
+    # Zoombar oversigt over hele målingen for valgt patient. Der hentes højst to min/max spande pr. pixel
+    # fra pyramiden (EkgPyramide), så et døgn tegnes lige så hurtigt som ti sekunder
+    def __init__(self, parent, controller):
+        super().__init__(parent, bg="lightblue")
+        self.controller = controller
+
+        tk.Label(self, text="Historik", bg="lightblue", #Titel
+                 font=("Helvetica", 18, "bold")).place(relx=0.02, rely=0.02, anchor="nw")
+        self.info = tk.Label(self, text="", font=("Helvetica", 11), bg="lightblue")
+        self.info.pack(pady=(15, 5), padx=20, anchor='e')
+
+        #Diagram over det viste tidsrum
+        ramme = Frame(self, width=860, height=420, bg="lightblue")
+        ramme.pack(padx=20)
+        ramme.pack_propagate(False)
+        self.plot = OversigtPlot(ramme, figsize=(8.6, 4.2))
+        self.plot.canvas.mpl_connect("scroll_event", self.scroll)
+
+        #Knapper til zoom og panorering
+        knapper = tk.Frame(self, bg="lightblue")
+        knapper.pack(pady=10)
+        for tekst, kommando in (("<", lambda: self.panorer(-0.5)), ("Zoom ind", lambda: self.zoom(0.5)),
+                                ("Zoom ud", lambda: self.zoom(2.0)), (">", lambda: self.panorer(0.5)),
+                                ("Hele målingen", self.hele_målingen)):
+            tk.Button(knapper, text=tekst, borderwidth=0, highlightthickness=0, padx=10, pady=4,
+                      command=kommando).pack(side=tk.LEFT, padx=3)
+
+        #Knap tilbage til StartPage
+        tk.Button(self, text="Tilbage", borderwidth=0, highlightthickness=0,
+                  padx=10, pady=4, command=lambda: controller.show_frame(StartPage)).place(relx=1.0, rely=1.0, anchor="se", x=-10, y=-10)
+
+        self.omfang = None #(start, slut) i epoch-ns for hele målingen
+        self.fra_ns = self.til_ns = 0 #Det viste tidsrum
+
+    # Viser hele målingen for valgt patient
+    def hele_målingen(self):
+        patient_id = self.controller.selected_patient_id
+        self.omfang = db.måling_omfang(patient_id) if patient_id else None
+        if not self.omfang:
+            self.plot.tegn([], [], [])
+            self.info.config(text="Ingen målinger (vælg en patient under EKG diagram og puls)")
+            return
+        self.fra_ns, self.til_ns = self.omfang
+        self.tegn()
+
+    # Zoomer omkring midten af det viste tidsrum (faktor < 1 zoomer ind)
+    def zoom(self, faktor, midte=None):
+        if not self.omfang:
+            return
+        midte = (self.fra_ns + self.til_ns) / 2 if midte is None else midte
+        halv = max((self.til_ns - self.fra_ns) * faktor / 2, 1e9) #Mindst to sekunder vises
+        self.fra_ns, self.til_ns = int(midte - halv), int(midte + halv)
+        self.tegn()
+
+    # Flytter det viste tidsrum en brøkdel af dets længde
+    def panorer(self, brøk):
+        if not self.omfang:
+            return
+        skift = int((self.til_ns - self.fra_ns) * brøk)
+        self.fra_ns += skift
+        self.til_ns += skift
+        self.tegn()
+
+    # Musehjulet zoomer omkring tidspunktet under musen
+    def scroll(self, event):
+        if event.xdata is None:
+            return
+        self.zoom(0.5 if event.button == "up" else 2.0, midte=self.fra_ns + event.xdata * 1e9)
+
+    # Henter spande til tidsrummet i diagrammets bredde og tegner dem
+    def tegn(self):
+        patient_id = self.controller.selected_patient_id
+        tider, mins, maxs, niveau = db.oversigt(patient_id, self.fra_ns, self.til_ns, self.plot.bredde(),
+                                                fs=samplerate, blokke=lagring == "blokke")
+        self.plot.tegn((tider - self.fra_ns) / 1e9, mins, maxs, xlim=(0, (self.til_ns - self.fra_ns) / 1e9))
+        start = datetime.fromtimestamp(self.fra_ns / 1e9).strftime('%Y-%m-%d %H:%M:%S')
+        niveautekst = "rå samples" if niveau == 1 else f"1:{niveau}"
+        self.info.config(text=f"Patient ID: {patient_id}   Fra {start}   "
+                              f"{(self.til_ns - self.fra_ns) / 1e9:.0f} s   Niveau: {niveautekst}")
+
 
 class Login(tk.Frame):
     def __init__(self, parent, controller=None):
@@ -595,6 +797,14 @@ class Login(tk.Frame):
         self.back_button.pack(side="left", padx=5)
         self.back_button.pack_forget()
 
+        #Søgefelt. Listen viser patienter hvis navn starter med teksten
+        søg_frame = tk.Frame(self, bg="lightblue")
+        søg_frame.pack()
+        tk.Label(søg_frame, text="Søg:", bg="lightblue").pack(side="left")
+        self.søg_entry = tk.Entry(søg_frame, bg="white", highlightthickness=0, bd=0, width=30)
+        self.søg_entry.pack(side="left", padx=5)
+        self.søg_entry.bind("<KeyRelease>", lambda event: self.view_patients())
+
         # Laver en box/liste til at se se allerede-oprettede patienter
         list_frame = tk.Frame(self, bg="lightblue")
         list_frame.pack(pady=20)
@@ -646,12 +856,12 @@ class Login(tk.Frame):
             return
 
 
-        cursor.execute("INSERT INTO Brugerdata (Navn, Efternavn, Alder, KØN) VALUES (?, ?, ?, ?)", (name, surname, age, gender))
-        conn.commit()
+        db.ny_patient(name, surname, age, gender)
+        katalog.ugyldiggør() #Den nye patient kommer med ved næste opslag
 
         messagebox.showinfo("Succes", f"Patient {name} oprettet.")
-        if self.controller:
-            self.controller.frames[PageOne].load_patients()
+        if self.controller and PageOne in self.controller.frames: #Er PageOne ikke oprettet endnu, henter den selv listen
+            self.controller.get_frame(PageOne).load_patients()
         self.entry_name.delete(0, tk.END)
         self.entry_surname.delete(0, tk.END)
         self.entry_age.delete(0, tk.END)
@@ -660,10 +870,9 @@ class Login(tk.Frame):
     # Viser alle patienter i en box/liste.
     def view_patients(self):
         self.patient_listbox.delete(0, tk.END)
-        cursor.execute("SELECT Navn, Efternavn, Alder, KØN FROM Brugerdata")
-
-        for navn, surname, alder, køn in cursor.fetchall():
-            self.patient_listbox.insert(tk.END, f"{navn} {surname} - {alder} år - {køn}")
+        self.patient_data = katalog.søg(self.søg_entry.get()) #Samme rækkefølge som listen, så indeks giver patienten
+        for p in self.patient_data:
+            self.patient_listbox.insert(tk.END, f"{p.navn} {p.efternavn} - {p.alder} år - {p.køn}")
         self.back_button.pack_forget()  # skjul tilbage-knappen
 
     # Viser pulsmålinger for valgt patient i box/liste til højre
@@ -673,49 +882,105 @@ class Login(tk.Frame):
             return
 
         index = selection[0]
-        cursor.execute("SELECT Id, Navn FROM Brugerdata")
-        patients = cursor.fetchall()
-        if index >= len(patients):
+        if index >= len(self.patient_data):
             return
 
-        patient_id, navn = patients[index]
-
-        cursor.execute("""
-            SELECT Puls
-            FROM Pulsmålinger
-            WHERE PatientID = ?
-            ORDER BY Id DESC
-            LIMIT 5
-            """, (patient_id,))
-        målinger = cursor.fetchall()
+        patient_id, navn = self.patient_data[index][:2]
 
         self.measurement_listbox.delete(0, tk.END)
+
+        #Sessionerne har deres opsummering gemt, så listen er ét indekseret opslag
+        sessioner = db.sessioner(patient_id, 5)
+        if sessioner:
+            self.measurement_listbox.insert(tk.END, f"Seneste målinger for {navn} (ID {patient_id}):")
+            for i, s in enumerate(sessioner, 1):
+                self.measurement_listbox.insert(tk.END, f"{i}. {session_tekst(s)}")
+            return
+
+        målinger = db.seneste_pulsmålinger(patient_id, 5)
         if målinger:
             self.measurement_listbox.insert(tk.END, f"Seneste pulsmålinger for {navn} (ID {patient_id}):")
-            for i, (puls,) in enumerate(målinger, 1):
+            for i, puls in enumerate(målinger, 1):
                 self.measurement_listbox.insert(tk.END, f"{i}. {puls} BPM")
         else:
             self.measurement_listbox.insert(tk.END, f"Ingen pulsmålinger fundet for {navn}.")
 
 
-# Sørger for sikker nedlukning af GUI og tråde.
-def on_closing():
+# Kort tekst om en session til listerne: starttid, varighed, puls og antal slag
+def session_tekst(s):
+    start = datetime.fromtimestamp(s["StartNs"] / 1e9).strftime('%Y-%m-%d %H:%M') if s["StartNs"] else "?"
+    varighed = f"{(s['SlutNs'] - s['StartNs']) / 6e10:.1f} min" if s["StartNs"] and s["SlutNs"] else s["Status"]
+    if s["PulsGns"] is None:
+        return f"{start}  {varighed}  ingen puls"
+    puls = f"{s['PulsGns']:.0f} BPM"
+    if s["PulsMin"] is not None:
+        puls += f" ({s['PulsMin']:.0f}-{s['PulsMaks']:.0f})"
+    slag = f"  {s['Slag']} slag" if s["Slag"] is not None else ""
+    return f"{start}  {varighed}  {puls}{slag}"
+
+
+# Åbner databasen og opretter de fælles objekter. Kaldes kun fra __main__
+def start():
+    global db, katalog, analysepool, opsamling, komprimering, metrik_eksport
+    #Databaselag med én forbindelse pr. tråd (WAL). Tabeller og indekser oprettes eller migreres ved start
+    db = Database(database)
+
+    #Fælles liste over patienter til alle sider. Hentes igen når en patient oprettes
+    katalog = PatientKatalog(db)
+
+    #Pulsanalysen med SciPy (når der ikke måles live) køres i en arbejderproces, så GUI-tråden ikke venter.
+    #Arbejderen startes først når den skal bruges
+    analysepool = AnalysePool(arbejdere=1, kapacitet=5000, maks_ventende=2)
+
+    #Målingerne styres her eller læses fra dæmonen
+    if dæmon:
+        from ekg_daemon import DaemonKlient
+        vært, _, feed_port = dæmon.rpartition(":")
+        opsamling = DaemonKlient(vært, int(feed_port)).forbind()
+    else:
+        opsamling = Opsamling(database, lav_datahandler)
+
+    #Målinger af latens og tællere. Slået fra koster de næsten intet
+    if metrik_fil:
+        metrik_eksport = MetrikEksport(metrik_fil).start()
+    if metrik_overlay:
+        metrik.slå_til()
+
+    #Retention kører hvor målingerne skrives: i dæmonen (--rå-dage) eller her
+    if rå_dage is not None and not dæmon:
+        from ekg_retention import Komprimering
+        komprimering = Komprimering(database, rå_dage).start()
+
+
+# Stopper målinger og baggrundstråde og lukker databasen
+def luk():
     global run
     run = False
-    #Tjekker om tråd kører, og lukker den hvis den gør
+    #Stopper alle målinger og skriver det sidste til databasen
     try:
-        frame = app.frames[PageOne]
-        if frame.data_thread and frame.data_thread.is_alive():
-            frame.stop_event.set()
-            frame.data_thread.join()
-    except:
-        pass
-
-    conn.close() #Lukker SQL forbindelse
+        if opsamling is not None:
+            opsamling.stop_alle()
+    except Exception as e:
+        print("Fejl ved stop af målinger:", e)
+
+    if komprimering is not None:
+        komprimering.stop() #Stopper efter den igangværende transaktion
+    if metrik_eksport is not None:
+        metrik_eksport.stop() #Skriver den sidste linje
+    if analysepool is not None:
+        analysepool.luk() #Stopper arbejderprocessen
+    if db is not None:
+        db.luk() #Lukker SQL forbindelserne
+
+
+# Sørger for sikker nedlukning af GUI og tråde.
+def on_closing():
+    luk()
     app.destroy() #Lukker GUI vindue
 
 # Starter hovedprogrammet og konfigurerer lukke-event.
 if __name__ == "__main__":
+    start() #Under spawn kører arbejderne filen som __mp_main__, så intet her startes igen
     app = App() #Opretter instans af GUI
     setattr(app, "selected_patient_id", None) #attribut der holder styr på valgte patient
     app.protocol("WM_DELETE_WINDOW", on_closing) #Binder lukkeknappen til "on_closing"
@@ -0,0 +1,63 @@
+import unittest
+import time
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import ekg_analysepool
+import ekg_signal
+
+
+def vent_på_resultat(pool, nøgle, sekvens=0, frist=30.0):
+    slut = time.monotonic() + frist
+    while time.monotonic() < slut:
+        resultat = pool.resultat(nøgle)
+        if resultat is not None and resultat["sekvens"] > sekvens:
+            return resultat
+        time.sleep(0.01)
+    return None
+
+
+class TestAnalysePool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = ekg_analysepool.AnalysePool(arbejdere=1, kapacitet=5000, maks_ventende=2).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.luk()
+
+    def setUp(self):
+        # Venter til analyser fra tidligere tests er færdige
+        slut = time.monotonic() + 30
+        while self.pool.statistik()["ventende"] and time.monotonic() < slut:
+            time.sleep(0.01)
+
+    def test_puls_og_rr_fra_arbejder(self):
+        signal, _ = ekg_signal.syntetisk_ekg(fs=250, sekunder=20, puls=75)
+        tider = np.arange(len(signal), dtype=np.int64) * 4_000_000
+        self.assertTrue(self.pool.send("a", signal, tider))
+        resultat = vent_på_resultat(self.pool, "a")
+        self.assertIsNotNone(resultat)
+        forventet = ekg_signal.puls_fra_ns(signal[-5000:], tider[-5000:])
+        self.assertAlmostEqual(resultat["puls"], forventet)
+        self.assertTrue(all(0.7 < rr < 0.9 for rr in resultat["rr"]))
+
+    def test_for_lidt_data(self):
+        self.pool.send("b", [1.0, 2.0], [0, 1])
+        self.assertIsNone(vent_på_resultat(self.pool, "b")["puls"])
+
+    def test_kasserer_når_arbejderne_er_bagud(self):
+        signal, _ = ekg_signal.syntetisk_ekg(fs=250, sekunder=20, puls=60)
+        tider = np.arange(len(signal), dtype=np.int64) * 4_000_000
+        før = self.pool.statistik()["tabte"]
+        sendt = [self.pool.send("c", signal, tider) for _ in range(10)]
+        self.assertFalse(all(sendt))
+        self.assertGreater(self.pool.statistik()["tabte"], før)
+        self.assertIsNotNone(vent_på_resultat(self.pool, "c"))
+
+
+if __name__ == '__main__':
+    unittest.main()
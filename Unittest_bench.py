@@ -0,0 +1,63 @@
+import unittest
+import tempfile
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import ekg_bench
+from ekg_database import åbn_forbindelse, opret_schema
+
+
+class TestSammenligning(unittest.TestCase):
+    def test_retning(self):
+        self.assertEqual(ekg_bench.retning("tekst_samples_pr_s"), 1)
+        self.assertEqual(ekg_bench.retning("blit_ms"), -1)
+        self.assertEqual(ekg_bench.retning("find_peaks_us_pr_kald"), -1)
+        self.assertEqual(ekg_bench.retning("streaming_puls"), 0)
+
+    def test_regressioner(self):
+        før = {"resultater": {"plot": {"blit_ms": 1.0, "fuld_ms": 40.0}, "parse": {"tekst_samples_pr_s": 1000.0}}}
+        nu = {"resultater": {"plot": {"blit_ms": 1.2, "fuld_ms": 60.0}, "parse": {"tekst_samples_pr_s": 700.0},
+                             "puls": {"streaming_puls": 10.0}}}
+        fundne = ekg_bench.regressioner(nu, før, tolerance=0.25)
+        self.assertEqual([(d, n) for d, n, _, _, _ in fundne], [("plot", "fuld_ms"), ("parse", "tekst_samples_pr_s")])
+        self.assertEqual(ekg_bench.regressioner(nu, før, tolerance=0.5), [])
+
+    def test_støj_ignoreres(self):
+        før = {"resultater": {"forespørgsler": {"x_ms": 0.1}}}
+        nu = {"resultater": {"forespørgsler": {"x_ms": 0.3}}}
+        self.assertEqual(ekg_bench.regressioner(nu, før), [])
+        nu["resultater"]["forespørgsler"]["x_ms"] = 0.5
+        self.assertEqual(len(ekg_bench.regressioner(nu, før)), 1)
+
+
+class TestDele(unittest.TestCase):
+    def setUp(self):
+        self.mappe = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.mappe.cleanup()
+
+    def test_fyld_ekgdata(self):
+        sti = os.path.join(self.mappe.name, "fyld.db")
+        conn = åbn_forbindelse(sti)
+        opret_schema(conn)
+        ekg_bench.fyld_ekgdata(conn, 12000, patienter=3, måling=5000, stykke=4000)
+        ekg_bench.fyld_ekgdata(conn, 15000, patienter=3, måling=5000, stykke=4000) #Fortsætter hvor den slap
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM Ekgdata").fetchone()[0], 15000)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM Sessions").fetchone()[0], 3)
+        self.assertEqual(conn.execute("SELECT PatientID, SessionID, Tidspunkt FROM Ekgdata WHERE Id = 5001").fetchone(),
+                         (2, 2, "2024-01-01T00:00:20.000000"))
+        conn.close()
+
+    def test_kør_små_dele(self):
+        resultat = ekg_bench.kør(("parse", "forespørgsler", "puls"), rækker=(2000,), mappe=self.mappe.name)
+        målinger = resultat["resultater"]
+        self.assertGreater(målinger["parse"]["binær_samples_pr_s"], 0)
+        self.assertIn("update_data_seneste_ekg_2000_ms", målinger["forespørgsler"])
+        self.assertAlmostEqual(målinger["puls"]["streaming_puls"], 72, delta=3)
+        self.assertEqual(ekg_bench.regressioner(resultat, resultat), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
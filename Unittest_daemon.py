@@ -0,0 +1,120 @@
+import unittest
+import socket
+import tempfile
+import threading
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from ekg_daemon import DaemonKlient, EkgDaemon, baud_rate, åbn_port
+from ekg_protokol import BAUD_BINÆR, BAUD_TEKST, BAUD_ÆLDRE
+from ekg_database import Database
+
+
+class TcpEnhed():
+    # Lille TCP server der opfører sig som en Arduino med tekstprotokollen ("tæller,værdi" linjer).
+    # Dæmonen åbner den med serial_for_url("socket://...")
+    def __init__(self, antal=500):
+        self.sok = socket.socket()
+        self.sok.bind(("127.0.0.1", 0))
+        self.sok.listen(1)
+        self.url = "socket://127.0.0.1:%d" % self.sok.getsockname()[1]
+        self.antal = antal
+        threading.Thread(target=self._send, daemon=True).start()
+
+    def _send(self):
+        forbindelse, _ = self.sok.accept()
+        with forbindelse:
+            time.sleep(0.2) #pyserial tømmer inputbufferen når porten åbnes
+            for i in range(self.antal):
+                forbindelse.sendall(f"{i},{500 + i % 100}\n".encode())
+                if i % 50 == 49:
+                    time.sleep(0.01)
+            time.sleep(5)
+
+    def luk(self):
+        self.sok.close()
+
+
+# Venter op til sekunder på at betingelse bliver sand
+def vent_på(betingelse, sekunder=10.0):
+    slut = time.monotonic() + sekunder
+    while time.monotonic() < slut:
+        if betingelse():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class TestEkgDaemon(unittest.TestCase):
+    def setUp(self):
+        self.mappe = tempfile.TemporaryDirectory()
+        self.db_sti = os.path.join(self.mappe.name, "test.db")
+        self.enhed = TcpEnhed()
+        self.dæmon = EkgDaemon(self.db_sti, [(self.enhed.url, 7)], port=0).start()
+        self.klient = DaemonKlient(*self.dæmon.adresse, interval=0.02).forbind()
+
+    def tearDown(self):
+        self.klient.stop_alle()
+        if not self.dæmon.stoppet.is_set():
+            self.dæmon.stop()
+        self.enhed.luk()
+        self.mappe.cleanup()
+
+    def test_klient_får_live_samples(self):
+        self.assertTrue(vent_på(lambda: self.klient.for_patient(7) is not None
+                                and self.klient.for_patient(7).ringbuffer.sekvens >= 500))
+        enhed = self.klient.for_patient(7)
+        værdier, tider = enhed.ringbuffer.seneste(500)
+        self.assertEqual(værdier.tolist(), [500 + i % 100 for i in range(500)])
+        self.assertTrue((tider[1:] >= tider[:-1]).all())
+        self.assertEqual(enhed.helbred.statistik()["samples"], 500)
+        self.assertIsNone(self.klient.for_patient(8))
+
+    def test_målingen_gemmes_og_sessionen_afsluttes(self):
+        self.assertTrue(vent_på(lambda: self.dæmon.svar({"kommando": "status"})["enheder"][0]["samples"] >= 500))
+        self.dæmon.stop()
+        db = Database(self.db_sti)
+        try:
+            self.assertEqual(db.hent_en("SELECT COUNT(*) FROM Ekgdata WHERE PatientID = 7")[0], 500)
+            session = db.sessioner(7, 1)[0]
+            self.assertEqual((session["Status"], session["Antal"], session["Port"]), ("afsluttet", 500, self.enhed.url))
+            self.assertEqual(db.hent_en("SELECT COUNT(DISTINCT SessionID) FROM Ekgdata")[0], 1)
+        finally:
+            db.luk()
+
+    def test_metrik_og_ankomsttid(self):
+        self.assertTrue(vent_på(lambda: self.klient.for_patient(7) is not None
+                                and self.klient.for_patient(7).ringbuffer.ankomst_ns is not None))
+        self.assertLessEqual(self.klient.for_patient(7).ringbuffer.ankomst_ns, time.monotonic_ns())
+        billede = self.dæmon.svar({"kommando": "metrik"})
+        self.assertIn("stadier", billede)
+        self.assertIn("tællere", billede)
+
+    def test_feedet_er_skrivebeskyttet(self):
+        self.assertIn("fejl", self.dæmon.svar({"kommando": "start", "port": "COM9"}))
+        self.assertEqual(self.dæmon.svar({"kommando": "data", "port": "COM9"}), {"fejl": "ukendt port"})
+
+
+class TestBaudRate(unittest.TestCase):
+    def test_standard_og_ældre_firmware(self):
+        self.assertEqual(baud_rate("tekst"), BAUD_TEKST)
+        self.assertEqual(baud_rate("binær"), BAUD_BINÆR)
+        self.assertEqual(baud_rate("tekst", BAUD_ÆLDRE), 38400)
+
+    def test_porten_åbnes_med_valgt_baud(self):
+        port = åbn_port("loop://", "tekst", baud=BAUD_ÆLDRE)
+        try:
+            self.assertEqual(port.baudrate, 38400)
+        finally:
+            port.close()
+        port = åbn_port("loop://", "tekst")
+        try:
+            self.assertEqual(port.baudrate, BAUD_TEKST)
+        finally:
+            port.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import sqlite3
+import tempfile
+import threading
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import ekg_database
+
+
+class TestSchema(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_ny_database_får_nyeste_version(self):
+        self.assertEqual(ekg_database.opret_schema(self.conn), ekg_database.SCHEMA_VERSION)
+        # Anden kørsel ændrer intet
+        self.assertEqual(ekg_database.opret_schema(self.conn), ekg_database.SCHEMA_VERSION)
+
+    def test_gammel_database_migreres_uden_datatab(self):
+        # Database som den gamle version af programmet oprettede den (user_version = 0)
+        ekg_database._grundtabeller(self.conn.cursor())
+        self.conn.execute("INSERT INTO Brugerdata (Navn) VALUES ('Anna')")
+        self.conn.execute("INSERT INTO Ekgdata (PatientID, Tidspunkt, Data) VALUES (1, '2024-01-01T00:00:00', 512)")
+        self.conn.commit()
+
+        ekg_database.opret_schema(self.conn)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM Ekgdata").fetchone()[0], 1)
+        indekser = [r[0] for r in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        self.assertIn("idx_ekgdata_patient_id", indekser)
+        self.assertIn("idx_ekgdata_patient_tid", indekser)
+
+    def test_ingen_forespørgsler_uden_indeks(self):
+        ekg_database.opret_schema(self.conn)
+        problemer = [(navn, problem) for navn, _, _, problem in ekg_database.explain(self.conn) if problem]
+        self.assertEqual(problemer, [])
+
+    def test_explain_finder_manglende_indeks(self):
+        ekg_database._grundtabeller(self.conn.cursor())
+        ekg_database.opret_pyramide_tabel(self.conn.cursor())
+        ekg_database.opret_blok_tabel(self.conn.cursor())
+        ekg_database._sessioner(self.conn.cursor())
+        ekg_database.opret_arkiv_tabel(self.conn.cursor())
+        ekg_database.opret_analyse_kolonne(self.conn.cursor())
+        ekg_database._hrv_kolonner(self.conn.cursor())
+        ekg_database.opret_meta_tabel(self.conn.cursor())
+        problemer = {navn for navn, _, _, problem in ekg_database.explain(self.conn) if problem}
+        self.assertIn("seneste_ekg", problemer)
+        self.assertIn("ekg_tabel", problemer)
+
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.mappe = tempfile.TemporaryDirectory()
+        self.db = ekg_database.Database(os.path.join(self.mappe.name, "test.db"))
+
+    def tearDown(self):
+        self.db.luk()
+        self.mappe.cleanup()
+
+    def test_wal_er_slået_til(self):
+        self.assertEqual(self.db.hent_en("PRAGMA journal_mode")[0], "wal")
+
+    def test_en_forbindelse_pr_tråd(self):
+        forbindelser = []
+
+        def tråd():
+            forbindelser.append(self.db.forbindelse())
+            forbindelser.append(self.db.forbindelse())
+
+        t = threading.Thread(target=tråd)
+        t.start()
+        t.join()
+        self.assertIs(forbindelser[0], forbindelser[1])  # Samme tråd genbruger forbindelsen
+        self.assertIsNot(forbindelser[0], self.db.forbindelse())
+
+    def test_hjælpefunktioner(self):
+        patient_id = self.db.ny_patient("Anna", "Hansen", 40, "Kvinde")
+        self.assertEqual(self.db.patienter(), [(patient_id, "Anna")])
+        self.assertEqual(self.db.patient_navn(patient_id), "Anna")
+        self.assertIsNone(self.db.patient_navn(patient_id + 1))
+
+        self.db.ny_pulsmåling(patient_id, 60)
+        self.db.ny_pulsmåling(patient_id, 70)
+        self.assertEqual(self.db.seneste_pulsmålinger(patient_id, 5), [70, 60])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+import tempfile
+import threading
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import ekg_eksport
+from ekg_database import Database
+from ekg_ingest import IngestWriter
+from ekg_lagring import BlokWriter, ns_til_iso_array
+
+START_NS = 1_700_000_000_000_000_000
+
+
+class TestEksport(unittest.TestCase):
+    def setUp(self):
+        self.mappe = tempfile.TemporaryDirectory()
+        self.sti = os.path.join(self.mappe.name, "test.db")
+        self.db = Database(self.sti)
+        self.ud = os.path.join(self.mappe.name, "ud")
+
+    def tearDown(self):
+        self.db.luk()
+        self.mappe.cleanup()
+
+    # Skriver samples som rækker i Ekgdata for en session (None = rækker fra før sessionerne)
+    def skriv_rækker(self, patient_id, session_id, værdier, start_ns=START_NS):
+        tider = start_ns + np.arange(len(værdier)) * 4_000_000
+        with self.db.forbindelse() as conn:
+            conn.executemany("INSERT INTO Ekgdata (PatientID, Data, Tidspunkt, Puls, SessionID) VALUES (?, ?, ?, NULL, ?)",
+                             zip([patient_id] * len(værdier), værdier, ns_til_iso_array(tider).tolist(),
+                                 [session_id] * len(værdier)))
+        return tider
+
+    def test_rækker_i_bidder(self):
+        session_id = self.db.ny_session(1)
+        tider = self.skriv_rækker(1, session_id, list(range(1000)))
+        self.skriv_rækker(1, None, [7, 8, 9], START_NS - 10 ** 9) #Gammel måling uden session
+        self.skriv_rækker(2, session_id + 1, [1, 2]) #Anden patient
+        info = ekg_eksport.eksporter_patient(self.sti, 1, self.ud, stykke=64)
+        self.assertEqual([(s["session"], s["antal"]) for s in info], [(0, 3), (session_id, 1000)])
+        self.assertAlmostEqual(info[1]["samplerate"], 250, places=3)
+
+        samples, tider_fil = ekg_eksport.åbn_session(os.path.join(self.ud, "patient_1"), session_id)
+        self.assertIsInstance(samples, np.memmap)
+        self.assertEqual(samples.dtype, np.int16)
+        self.assertEqual(samples.tolist(), list(range(1000)))
+        self.assertTrue(np.all(np.abs(tider_fil - tider) < 1000)) #Ekgdata gemmer mikrosekunder
+        self.assertEqual(ekg_eksport.åbn_session(os.path.join(self.ud, "patient_1"), 0)[0].tolist(), [7, 8, 9])
+
+    def test_blokke(self):
+        session_id = self.db.ny_session(3)
+        writer = IngestWriter(self.sti).start()
+        blok = BlokWriter(writer, 3, session_id, 250)
+        for i in range(600):
+            blok.tilføj(i, START_NS + i * 4_000_000)
+        blok.flush()
+        writer.stop()
+        info = ekg_eksport.eksporter_patient(self.sti, 3, self.ud, stykke=250)
+        self.assertEqual([(s["session"], s["antal"], s["kilde"]) for s in info], [(session_id, 600, "blokke")])
+        samples, tider = ekg_eksport.åbn_session(os.path.join(self.ud, "patient_3"), session_id)
+        self.assertEqual(samples.tolist(), list(range(600)))
+        self.assertEqual(int(tider[1] - tider[0]), 4_000_000)
+
+    def test_import_som_rækker_og_blokke(self):
+        session_id = self.db.ny_session(1)
+        self.skriv_rækker(1, session_id, [int(v) for v in 500 + 100 * np.sin(np.arange(3000) / 20)])
+        ekg_eksport.eksporter_patient(self.sti, 1, self.ud)
+        patient_mappe = os.path.join(self.ud, "patient_1")
+        original, original_tider = ekg_eksport.åbn_session(patient_mappe, session_id)
+
+        nye = {}
+        for lagring, patient_id in (("rækker", 8), ("blokke", 9)):
+            (ny,) = nye[lagring] = ekg_eksport.importer_patient(self.sti, patient_mappe, patient_id, lagring, stykke=1000)
+            session = self.db.session(ny)
+            self.assertEqual((session["PatientID"], session["Antal"], session["Status"]), (patient_id, 3000, "afsluttet"))
+            self.assertEqual(self.db.session_samples(ny).tolist(), original.tolist())
+            self.assertIsNotNone(self.db.måling_omfang(patient_id)) #Historikken har fået pyramiden
+        ekg_eksport.eksporter_patient(self.sti, 8, self.ud)
+        _, kopi_tider = ekg_eksport.åbn_session(os.path.join(self.ud, "patient_8"), nye["rækker"][0])
+        self.assertTrue(np.all(np.abs(kopi_tider - original_tider) < 1000))
+
+    def test_import_uden_tider(self):
+        sti = os.path.join(self.mappe.name, "signal.npy")
+        np.save(sti, np.arange(100, dtype=np.int16))
+        ny = ekg_eksport.importer(self.sti, 4, sti, samplerate=100)
+        self.assertEqual(self.db.session(ny)["Antal"], 100)
+        self.assertAlmostEqual(self.db.session(ny)["SlutNs"] - self.db.session(ny)["StartNs"], 99 * 10 ** 7, delta=1000)
+
+    def test_eksport_mens_der_skrives(self):
+        session_id = self.db.ny_session(1)
+        self.skriv_rækker(1, session_id, list(range(5000)))
+        stop = threading.Event()
+
+        # Datahandler skriver videre på sessionen mens der eksporteres
+        def skriv():
+            db = Database(self.sti)
+            while not stop.is_set():
+                with db.forbindelse() as conn:
+                    conn.executemany("INSERT INTO Ekgdata (PatientID, Data, Tidspunkt, SessionID) VALUES (1, 1, ?, ?)",
+                                     [("2024-01-01T00:00:00.000000", session_id)] * 100)
+            db.luk()
+        tråd = threading.Thread(target=skriv)
+        tråd.start()
+        try:
+            info = ekg_eksport.eksporter_patient(self.sti, 1, self.ud, stykke=100)
+        finally:
+            stop.set()
+            tråd.join()
+        samples, _ = ekg_eksport.åbn_session(os.path.join(self.ud, "patient_1"), session_id)
+        self.assertEqual(len(samples), info[0]["antal"]) #Antal og indhold er fra samme øjebliksbillede
+        self.assertEqual(samples[:5000].tolist(), list(range(5000)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,25 +1,96 @@
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
+from types import SimpleNamespace
 from datetime import datetime, timedelta
+import importlib.util
 import sys
 import os
 
 # Tilføj sti til GUI-filen så den kan importeres :P
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
-import GUI_final_2_0 as gui  # Sørg for at navnet matcher din fil
+from ekg_signal import beregn_puls
+
+# GUI filen har mellemrum i navnet, så den indlæses med importlib. Den starter intet før start() kaldes
+GUI_FIL = os.path.join(os.path.abspath(os.path.dirname(__file__)), "GUI final 2.1 + dokumentation.py")
+try:
+    spec = importlib.util.spec_from_file_location("gui", GUI_FIL)
+    gui = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gui)
+except ImportError: #tkinter er ikke installeret
+    gui = None
+
+
+# Seks brede peaks med 1 sekunds mellemrum ved 250 Hz
+def peak_signal(baseline=0):
+    base_time = datetime.now()
+    data = []
+    tider = []
+    for i in range(6):
+        for _ in range(250):
+            data.append(baseline)
+            tider.append(base_time + timedelta(milliseconds=4 * len(tider)))
+        for val in [1000, 2000, 3000, 2000, 1000]:
+            data.append(val)
+            tider.append(base_time + timedelta(milliseconds=4 * len(tider)))
+    return data, tider
+
+
+class TestBeregnPuls(unittest.TestCase):
+    def test_beregn_puls_invalid_rr(self):
+        data = [1200, 0, 0, 0, 1200, 0, 0, 0]
+        tider = [datetime.now() + timedelta(seconds=i * 10) for i in range(len(data))]
+        self.assertIsNone(beregn_puls(data, tider))
+
+    def test_beregn_puls_mindre_end_10(self):
+        data = [1000, 1020]
+        tider = [datetime.now(), datetime.now() + timedelta(milliseconds=10)]
+        self.assertIsNone(beregn_puls(data, tider))
+
+    def test_beregn_puls_valide_peak_intervaller(self):
+        data, tider = peak_signal()
+        for _ in range(50): # Efter sidste peak
+            data.append(0)
+            tider.append(tider[-1] + timedelta(milliseconds=4))
+        result = beregn_puls(data, tider)
+        self.assertIsInstance(result, float)
+        self.assertTrue(30 < result < 200)
+
+    def test_beregn_puls_tom_data(self):
+        self.assertIsNone(beregn_puls([], []))
 
+    def test_beregn_puls_none(self):
+        self.assertIsNone(beregn_puls(None, None))
+        self.assertIsNone(beregn_puls([1000] * 20, None))
+
+    def test_beregn_puls_forskellig_længde(self):
+        data, tider = peak_signal()
+        self.assertIsNone(beregn_puls(data, tider[:-10]))
+
+    def test_beregn_puls_for_faa_peaks(self):
+        data = [0]*10 + [1200] + [0]*10  # Kun ét peak
+        tider = [datetime.now() + timedelta(milliseconds=40 * i) for i in range(len(data))]
+        self.assertIsNone(beregn_puls(data, tider))
+
+    def test_pulsberegning_med_valid_peaks(self):
+        data, tider = peak_signal(baseline=200)
+        result = beregn_puls(data, tider)
+        self.assertIsInstance(result, float)
+        self.assertTrue(30 < result < 200)
+
+
+@unittest.skipIf(gui is None, "tkinter er ikke installeret")
 class TestGUI(unittest.TestCase):
     def setUp(self):
         # Mock controller og patientvalg
         self.mock_controller = MagicMock()
         self.mock_controller.selected_patient_id = 1
 
-        # Initialiser PageOne med mocks
-        self.page = gui.PageOne(parent=None, controller=self.mock_controller)
+        # PageOne uden vindue (kræver ingen skærm). Kun metoderne afprøves
+        self.page = gui.PageOne.__new__(gui.PageOne)
+        self.page.controller = self.mock_controller
         self.page.patient_dropdown = MagicMock()
         self.page.patient_dropdown.current.return_value = 0
         self.page.patients = [(1, "Test Person")]
-        self.page.controller.selected_patient_id = 1
 
     def test_patient_selected_index_negativ(self):
         self.page.patient_dropdown.current.return_value = -1
@@ -27,56 +98,15 @@ class TestGUI(unittest.TestCase):
         self.assertEqual(self.page.controller.selected_patient_id, 1)
 
     def test_load_patients_dropdown_values(self):
-        # Mock fetchall før kald
-        gui.cursor = MagicMock()
-        gui.cursor.fetchall.return_value = [(1, "Test Person"), (2, "Anna Hansen")]
-
-        self.page.patient_dropdown = MagicMock()
-        self.page.patient_dropdown.current.return_value = 0
-        self.page.load_patients()
+        # Mock patientlisten før kald
+        katalog = MagicMock()
+        katalog.alle.return_value = [SimpleNamespace(id=1, navn="Test Person"), SimpleNamespace(id=2, navn="Anna Hansen")]
+        with patch.object(gui, "katalog", katalog):
+            self.page.load_patients()
 
         expected = ["Test Person (ID: 1)", "Anna Hansen (ID: 2)"]
         self.page.patient_dropdown.__setitem__.assert_called_with('values', expected)
-
-    def test_beregn_puls_invalid_rr(self):
-        data = [1200, 0, 0, 0, 1200, 0, 0, 0]
-        tider = [datetime.now() + timedelta(seconds=i * 10) for i in range(len(data))]
-        result = self.page.beregn_puls(data, tider)
-        self.assertIsNone(result)
-
-    def test_beregn_puls_mindre_end_10(self):
-        data = [1000, 1020]
-        tider = [datetime.now(), datetime.now() + timedelta(milliseconds=10)]
-        result = self.page.beregn_puls(data, tider)
-        self.assertIsNone(result)
-
-    def test_beregn_puls_valide_peak_intervaller(self):
-        base_time = datetime.now()
-        data = []
-        tider = []
-
-        for i in range(6):
-            # Baseline før peak
-            for _ in range(250):
-                data.append(0)
-                tider.append(base_time + timedelta(milliseconds=4 * len(tider)))
-
-            # Bredt og højt peak
-            peak_values = [1000, 2000, 3000, 2000, 1000]
-            for val in peak_values:
-                data.append(val)
-                tider.append(base_time + timedelta(milliseconds=4 * len(tider)))
-
-            # Efter peak
-            for _ in range(50):
-                data.append(0)
-                tider.append(base_time + timedelta(milliseconds=4 * len(tider)))
-
-        result = self.page.beregn_puls(data, tider)
-        print("Valide peak test:", result)
-        self.assertIsNotNone(result)
-        self.assertIsInstance(result, float)
-        self.assertTrue(30 < result < 200)
+        self.assertEqual(self.page.controller.selected_patient_id, 1)
 
     def test_update_data_uden_patient(self):
         self.page.controller.selected_patient_id = None
@@ -84,37 +114,15 @@ class TestGUI(unittest.TestCase):
         self.page.update_data()
         self.page.after.assert_called_once()
 
-    def test_beregn_puls_tom_data(self):
-        result = self.page.beregn_puls([], [])
-        self.assertIsNone(result)
-
-    def test_beregn_puls_for_faa_peaks(self):
-        data = [0]*10 + [1200] + [0]*10  # Kun ét peak
-        tider = [datetime.now() + timedelta(milliseconds=40 * i) for i in range(len(data))]
-        result = self.page.beregn_puls(data, tider,)
-        self.assertIsNone(result)
-
-    def test_pulsberegning_med_valid_peaks(self):
-        data = []
-        tider = []
-        now = datetime.now()
-        interval = 250
-
-        for i in range(6):
-            data += [200] * interval
-            tider += [now + timedelta(milliseconds=4 * len(tider)) for _ in range(interval)]
-
-            # Lav et bredt peak, så det overlever lavpasfilter
-            peak_values = [1000, 2000, 3000, 2000, 1000]
-            data += peak_values
-            tider += [now + timedelta(milliseconds=4 * len(tider)) for _ in peak_values]
-
-        result = self.page.beregn_puls(data, tider)
-        print("Resultat af pulsberegning:", result)
-        self.assertIsNotNone(result)
-        self.assertIsInstance(result, float)
-        self.assertTrue(30 < result < 200)
+    def test_beregn_puls_adapter(self):
+        data, tider = peak_signal()
+        self.assertEqual(self.page.beregn_puls(data, tider), beregn_puls(data, tider))
+        self.assertTrue(30 < self.page.beregn_puls(data, tider) < 200)
 
+    def test_beregn_puls_adapter_uden_data(self):
+        self.assertIsNone(self.page.beregn_puls(None, None))
+        self.assertIsNone(self.page.beregn_puls([], []))
+        self.assertIsNone(self.page.beregn_puls([1000, 1020], [datetime.now(), datetime.now()]))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+import unittest
+import tempfile
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from ekg_database import Database
+from ekg_hrv import HRVVindue, RullendeHRV, hrv_linje, hrv_tekst
+from ekg_signal import StreamingQRS, syntetisk_ekg
+
+
+# HRV regnet direkte med numpy for gyldige intervaller (rr i sekunder, NaN er ugyldige)
+def facit(rr):
+    gyldige = rr[~np.isnan(rr)]
+    forskelle = np.diff(rr)
+    forskelle = forskelle[~np.isnan(forskelle)]
+    return {"antal": len(gyldige), "sdnn_ms": gyldige.std(ddof=1) * 1000,
+            "rmssd_ms": np.sqrt(np.mean(forskelle ** 2)) * 1000, "pnn50": 100 * np.mean(np.abs(forskelle) > 0.05),
+            "puls_gns": 60 / gyldige.mean(), "puls_min": 60 / gyldige.max(), "puls_maks": 60 / gyldige.min()}
+
+
+class TestHRV(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.rr = 0.8 + 0.06 * rng.standard_normal(3000)
+        self.rr[rng.random(3000) < 0.02] = np.nan #Ugyldige intervaller (ekstraslag, støj)
+        self.tider = (np.cumsum(np.nan_to_num(self.rr, nan=0.4)) * 1e9).astype(np.int64)
+        self.hrv = RullendeHRV()
+        for tid, rr in zip(self.tider.tolist(), self.rr.tolist()):
+            self.hrv.slag_fundet(tid, None if np.isnan(rr) else rr)
+
+    def sammenlign(self, resultat, forventet):
+        for nøgle, værdi in forventet.items():
+            self.assertAlmostEqual(resultat[nøgle], værdi, places=6, msg=nøgle)
+
+    def sammenlign_løst(self, resultat, forventet):
+        self.assertAlmostEqual(resultat["puls_gns"], forventet["puls_gns"], delta=1)
+        self.assertAlmostEqual(resultat["sdnn_ms"], forventet["sdnn_ms"], delta=5)
+        self.assertAlmostEqual(resultat["rmssd_ms"], forventet["rmssd_ms"], delta=8)
+
+    def test_hele_sessionen(self):
+        self.sammenlign(self.hrv.resultat("session"), facit(self.rr))
+        self.assertEqual(self.hrv.slag, 3000)
+
+    def test_glidende_vinduer(self):
+        for navn, sekunder in (("1 min", 60), ("5 min", 300)):
+            i = self.tider >= self.tider[-1] - sekunder * 10 ** 9
+            #Forskellen for det første slag i vinduet hører til intervallet før, så den regnes med
+            forventet = facit(self.rr[i])
+            forskelle = np.diff(self.rr[np.flatnonzero(i)[0] - 1:])
+            forskelle = forskelle[~np.isnan(forskelle)]
+            forventet["rmssd_ms"] = np.sqrt(np.mean(forskelle ** 2)) * 1000
+            forventet["pnn50"] = 100 * np.mean(np.abs(forskelle) > 0.05)
+            self.sammenlign(self.hrv.resultat(navn), forventet)
+
+    def test_slag_falder_ud(self):
+        vindue = HRVVindue(60)
+        vindue.tilføj(0, 0.5)
+        vindue.tilføj(10 ** 9, 1.5, 1.0)
+        self.assertEqual((vindue.resultat()["puls_min"], vindue.resultat()["puls_maks"]), (40, 120))
+        vindue.udløb(61 * 10 ** 9 - 1)
+        self.assertEqual((vindue.resultat()["antal"], vindue.resultat()["puls_maks"]), (1, 40))
+        vindue.udløb(62 * 10 ** 9)
+        self.assertEqual(vindue.resultat()["antal"], 0)
+        self.assertIsNone(vindue.resultat()["sdnn_ms"])
+
+    def test_tekst(self):
+        self.assertIn("RMSSD", hrv_tekst(self.hrv.resultater()))
+        self.assertEqual(hrv_tekst(RullendeHRV().resultater()).count("--"), 18)
+        self.assertIn("SDNN", hrv_linje(self.hrv.resultat()))
+
+    def test_fødes_af_detektoren(self):
+        signal, r_tider = syntetisk_ekg(fs=250, sekunder=120, puls=60, variation=0.05)
+        hrv = RullendeHRV()
+        StreamingQRS(fs=250, hrv=hrv).tilføj_mange(signal.tolist(), (np.arange(len(signal)) * 4_000_000).tolist())
+        self.sammenlign_løst(hrv.resultat(), facit(np.diff(r_tider)))
+
+
+class TestGemHRV(unittest.TestCase):
+    def test_pulsmåling_med_hrv(self):
+        with tempfile.TemporaryDirectory() as mappe:
+            db = Database(os.path.join(mappe, "test.db"))
+            try:
+                hrv = {"sdnn_ms": 42.0, "rmssd_ms": 30.5, "pnn50": 12.0, "puls_min": 55.0, "puls_maks": 90.0}
+                db.ny_pulsmåling(1, 70, 3, hrv)
+                db.ny_pulsmåling(1, 71)
+                self.assertEqual(db.hent_alle("SELECT Puls, SessionID, SDNN, RMSSD, PNN50, PulsMin, PulsMaks "
+                                              "FROM Pulsmålinger ORDER BY Id"),
+                                 [(70, 3, 42.0, 30.5, 12.0, 55.0, 90.0), (71, None, None, None, None, None, None)])
+            finally:
+                db.luk()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import unittest
+import sqlite3
+import tempfile
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import ekg_ingest
+
+
+class TestIngestWriter(unittest.TestCase):
+    def setUp(self):
+        # Midlertidig database med samme Ekgdata tabel som programmet
+        self.mappe = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.mappe.name, "test.db")
+        conn = sqlite3.connect(self.db)
+        conn.execute("""
+        CREATE TABLE Ekgdata (
+            Id INTEGER PRIMARY KEY AUTOINCREMENT,
+            PatientID INTEGER,
+            Tidspunkt TEXT,
+            Data REAL,
+            Puls INTEGER
+        )""")
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.mappe.cleanup()
+
+    def antal_rækker(self):
+        conn = sqlite3.connect(self.db)
+        antal = conn.execute("SELECT COUNT(*) FROM Ekgdata").fetchone()[0]
+        conn.close()
+        return antal
+
+    def test_flush_efter_antal(self):
+        writer = ekg_ingest.IngestWriter(self.db, flush_antal=10, flush_ms=60000).start()
+        for i in range(25):
+            writer.tilføj((1, float(i), "2024-01-01T00:00:00", None))
+        time.sleep(0.2)
+        self.assertEqual(self.antal_rækker(), 20)  # To fulde batches, resten venter
+        writer.stop()
+        self.assertEqual(self.antal_rækker(), 25)
+
+    def test_flush_efter_tid(self):
+        writer = ekg_ingest.IngestWriter(self.db, flush_antal=1000, flush_ms=20).start()
+        writer.tilføj((1, 1.0, "2024-01-01T00:00:00", None))
+        time.sleep(0.3)
+        self.assertEqual(self.antal_rækker(), 1)
+        writer.stop()
+
+    def test_flush_ved_stop(self):
+        writer = ekg_ingest.IngestWriter(self.db, flush_antal=1000, flush_ms=60000).start()
+        for i in range(5):
+            writer.tilføj((1, float(i), "2024-01-01T00:00:00", None))
+        writer.stop()
+        self.assertEqual(self.antal_rækker(), 5)
+
+    def test_statistik(self):
+        writer = ekg_ingest.IngestWriter(self.db, flush_antal=50).start()
+        for i in range(100):
+            writer.tilføj((1, float(i), "2024-01-01T00:00:00", None))
+        writer.stop()
+        stat = writer.statistik()
+        self.assertEqual(stat["rækker"], 100)
+        self.assertGreaterEqual(stat["flushes"], 2)
+        self.assertEqual(stat["kødybde"], 0)
+        self.assertGreater(stat["rækker_pr_s"], 0)
+
+    def test_begrænset_kø_taber_ved_fuld_kø(self):
+        writer = ekg_ingest.IngestWriter(self.db, maks_kø=3, kø_timeout=0.01) #Ikke startet, så køen tømmes ikke
+        for i in range(5):
+            writer.tilføj((1, float(i), "2024-01-01T00:00:00", None))
+        self.assertEqual(writer.statistik()["tabte"], 2)
+        writer.start()
+        writer.stop()
+        self.assertEqual(self.antal_rækker(), 3)
+
+    def test_fuld_kø_blokerer_ikke(self):
+        writer = ekg_ingest.IngestWriter(self.db, maks_kø=2, kø_timeout=5.0) #Ikke startet, så køen tømmes ikke
+        start = time.monotonic()
+        writer.tilføj((1, 0.0, "2024-01-01T00:00:00", None))
+        writer.tilføj((1, 0.0, "2024-01-01T00:00:00", None), samples=250)
+        for _ in range(100):
+            writer.tilføj((1, 0.0, "2024-01-01T00:00:00", None), samples=250)
+        self.assertLess(time.monotonic() - start, 0.5) #Læsetråden venter ikke på databasen
+        stat = writer.statistik()
+        self.assertEqual((stat["tabte"], stat["tabte_samples"], stat["ventende_samples"]), (100, 25000, 251))
+        writer.start()
+        writer.stop()
+        self.assertEqual(writer.statistik()["ventende_samples"], 0)
+
+    def test_stop_hænger_ikke_når_skrivetråden_er_død(self):
+        #Databasen kan ikke åbnes, så skrivetråden dør med det samme
+        writer = ekg_ingest.IngestWriter(os.path.join(self.mappe.name, "findes", "ikke.db"), maks_kø=2, stop_timeout=2.0)
+        writer.start()
+        writer._tråd.join(2.0)
+        writer.tilføj((1, 0.0, "2024-01-01T00:00:00", None), samples=250)
+        writer.tilføj((1, 0.0, "2024-01-01T00:00:00", None), samples=250)
+        start = time.monotonic()
+        writer.stop()
+        self.assertLess(time.monotonic() - start, 1.0)
+        stat = writer.statistik()
+        self.assertEqual((stat["tabte"], stat["tabte_samples"], stat["ventende_samples"]), (2, 500, 0))
+
+    def test_fejlet_flush_tælles_som_tabt(self):
+        writer = ekg_ingest.IngestWriter(self.db).start()
+        writer.tilføj((1, 2), sql="INSERT INTO Findesikke VALUES (?, ?)", samples=250)
+        writer.tilføj((1, 0.0, "2024-01-01T00:00:00", None))
+        writer.stop()
+        stat = writer.statistik()
+        self.assertEqual((stat["tabte"], stat["tabte_samples"], stat["ventende_samples"]), (2, 251, 0))
+        self.assertEqual(stat["fejl"], ekg_ingest.FLUSH_FORSØG)
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_læs_siden_giver_kun_nye_samples(self):
+        buf = ekg_ingest.RingBuffer(10)
+        for i in range(4):
+            buf.skriv(float(i), i)
+        sekvens, værdier, tider = buf.læs_siden(0)
+        self.assertEqual(sekvens, 4)
+        self.assertEqual(værdier.tolist(), [0.0, 1.0, 2.0, 3.0])
+
+        buf.skriv(4.0, 4, puls=70)
+        sekvens, værdier, tider = buf.læs_siden(sekvens)
+        self.assertEqual(sekvens, 5)
+        self.assertEqual(værdier.tolist(), [4.0])
+        self.assertEqual(tider.tolist(), [4])
+        self.assertEqual(buf.puls, 70)
+
+        self.assertEqual(len(buf.læs_siden(sekvens)[1]), 0)
+
+    def test_overløb(self):
+        buf = ekg_ingest.RingBuffer(5)
+        for i in range(12):
+            buf.skriv(float(i), i)
+        # Læseren er bagud, så kun de sidste 5 samples kan leveres
+        sekvens, værdier, _ = buf.læs_siden(0)
+        self.assertEqual(sekvens, 12)
+        self.assertEqual(værdier.tolist(), [7.0, 8.0, 9.0, 10.0, 11.0])
+        self.assertEqual(buf.seneste(3)[0].tolist(), [9.0, 10.0, 11.0])
+
+    def test_skriv_mange_hen_over_enden(self):
+        buf = ekg_ingest.RingBuffer(5)
+        buf.skriv_mange([0.0, 1.0, 2.0], [0, 1, 2])
+        buf.skriv_mange([3.0, 4.0, 5.0, 6.0], [3, 4, 5, 6])
+        værdier, tider = buf.seneste(5)
+        self.assertEqual(værdier.tolist(), [2.0, 3.0, 4.0, 5.0, 6.0])
+        self.assertEqual(tider.tolist(), [2, 3, 4, 5, 6])
+        self.assertEqual(buf.sekvens, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
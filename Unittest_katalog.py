@@ -0,0 +1,46 @@
+import unittest
+import tempfile
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from ekg_database import Database
+from ekg_katalog import PatientKatalog
+
+
+class TestPatientKatalog(unittest.TestCase):
+    def setUp(self):
+        self.mappe = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.mappe.name, "test.db"))
+        for navn, efternavn in (("Anna", "Hansen"), ("Bo", "Andersen"), ("anders", "Berg"), ("Carl", "Bo")):
+            self.db.ny_patient(navn, efternavn, 40, "Andet")
+        self.katalog = PatientKatalog(self.db)
+
+    def tearDown(self):
+        self.db.luk()
+        self.mappe.cleanup()
+
+    def test_sorteret_efter_id_og_hentes_én_gang(self):
+        self.assertEqual([p.id for p in self.katalog.alle()], [1, 2, 3, 4])
+        self.assertEqual(self.katalog.navn(2), "Bo")
+        self.assertIsNone(self.katalog.hent(99))
+        self.assertEqual(self.katalog.indlæsninger, 1)
+
+    def test_ugyldiggør(self):
+        self.katalog.alle()
+        self.db.ny_patient("Dorte", "Dam", 30, "Kvinde")
+        self.assertEqual(len(self.katalog.alle()), 4) #Cachen er ikke ugyldiggjort endnu
+        self.katalog.ugyldiggør()
+        self.assertEqual(self.katalog.navn(5), "Dorte")
+        self.assertEqual(self.katalog.indlæsninger, 2)
+
+    def test_præfikssøgning(self):
+        self.assertEqual([p.id for p in self.katalog.søg("an")], [1, 2, 3]) #Anna, Andersen og anders
+        self.assertEqual([p.id for p in self.katalog.søg("BO")], [2, 4]) #Fornavn Bo og efternavn Bo
+        self.assertEqual([p.id for p in self.katalog.søg("anna h")], [1])
+        self.assertEqual(self.katalog.søg("x"), [])
+        self.assertEqual(len(self.katalog.søg("", maks=2)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
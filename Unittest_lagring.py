@@ -0,0 +1,186 @@
+import unittest
+import sqlite3
+import time
+from datetime import datetime, timedelta
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import ekg_lagring
+
+
+class ListeWriter():
+    # Simpel writer der udfører rækkerne direkte mod en forbindelse
+    def __init__(self, conn):
+        self.conn = conn
+
+    def tilføj(self, række, sql, samples=1):
+        self.conn.execute(sql, række)
+
+
+class TestBlokLagring(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("""
+        CREATE TABLE Ekgdata (
+            Id INTEGER PRIMARY KEY AUTOINCREMENT,
+            PatientID INTEGER,
+            Tidspunkt TEXT,
+            Data REAL,
+            Puls INTEGER
+        )""")
+        ekg_lagring.opret_blok_tabel(self.conn.cursor())
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_pak_og_udpak(self):
+        værdier = [0, 512, 4095, -5, 40000]
+        data = ekg_lagring.pak_samples(værdier)
+        self.assertEqual(len(data), 2 * len(værdier))
+        self.assertEqual(ekg_lagring.udpak_samples(data).tolist(), [0, 512, 4095, -5, 32767])
+
+    def test_sample_tider(self):
+        tider = ekg_lagring.sample_tider(1_000_000_000, 250, 3)
+        self.assertEqual(tider.tolist(), [1_000_000_000, 1_004_000_000, 1_008_000_000])
+
+    def test_blokwriter_og_hent_seneste(self):
+        blok = ekg_lagring.BlokWriter(ListeWriter(self.conn), 1, 1, samplerate=100)
+        for i in range(250):
+            blok.tilføj(i, 10_000_000 * i, puls=60)
+        blok.flush()
+
+        antal = self.conn.execute("SELECT COUNT(*) FROM EkgBlokke").fetchone()[0]
+        self.assertEqual(antal, 3)  # 100 + 100 + 50 samples
+
+        værdier, tider, pulser = ekg_lagring.hent_seneste(self.conn.cursor(), 1, 120)
+        self.assertEqual(værdier.tolist(), list(range(130, 250)))
+        self.assertEqual(tider[0], 1_300_000_000)
+        self.assertEqual(pulser[-1], 60)
+
+    def test_hent_interval(self):
+        blok = ekg_lagring.BlokWriter(ListeWriter(self.conn), 1, 1, samplerate=100)
+        for i in range(300):
+            blok.tilføj(i, 10_000_000 * i)
+        blok.flush()
+        værdier, tider, _ = ekg_lagring.hent_interval(self.conn.cursor(), 1, 950_000_000, 1_050_000_000)
+        self.assertEqual(værdier.tolist(), list(range(95, 106)))
+
+    def test_hent_interval_afgrænset_i_indeks(self):
+        #To målinger med et hul imellem
+        blok = ekg_lagring.BlokWriter(ListeWriter(self.conn), 1, 1, samplerate=100)
+        for i in range(200):
+            blok.tilføj(i, 10_000_000 * i)
+        for i in range(200, 300):
+            blok.tilføj(i, 10_000_000 * i + 5 * 10 ** 9)
+        blok.flush()
+        cursor = self.conn.cursor()
+        værdier, _, _ = ekg_lagring.hent_interval(cursor, 1, -10 ** 9, 50_000_000)
+        self.assertEqual(værdier.tolist(), list(range(6)))
+        værdier, _, _ = ekg_lagring.hent_interval(cursor, 1, 3 * 10 ** 9, 7_020_000_000)
+        self.assertEqual(værdier.tolist(), [200, 201, 202])
+
+        #Indekset skal afgrænses i begge ender, ellers vokser opslaget med historikken
+        self.conn.execute("CREATE INDEX idx_start ON EkgBlokke (PatientID, StartNs)")
+        plan = [r[3] for r in self.conn.execute("EXPLAIN QUERY PLAN " + ekg_lagring.SQL_BLOK_INTERVAL, (1,) * 6)]
+        self.assertIn("StartNs>? AND StartNs<?", plan[0])
+
+    def test_iso_til_ns_array(self):
+        tidspunkter = ["2024-03-01T10:00:00.000000", "2024-03-01T10:00:00.004000", "2024-03-01T10:00:01.500000"]
+        forventet = [ekg_lagring.iso_til_ns(t) for t in tidspunkter]
+        self.assertEqual(ekg_lagring.iso_til_ns_array(tidspunkter).tolist(), forventet)
+
+    def test_tidspunkter_hen_over_sommertid(self):
+        tz = os.environ.get("TZ")
+        os.environ["TZ"] = "Europe/Copenhagen"
+        time.tzset()
+        try:
+            #Sommertid starter 31. marts 2024 kl. 01:00 UTC og slutter 27. oktober kl. 01:00 UTC
+            for skift in (1711846800, 1729990800):
+                tider = (skift - 1800 + np.arange(3600, dtype=np.int64)) * 10 ** 9 + 250_123_000
+                iso = ekg_lagring.ns_til_iso_array(tider)
+                forventet = [(datetime.fromtimestamp(t // 10 ** 9) + timedelta(microseconds=t % 10 ** 9 // 1000))
+                             .isoformat(timespec="microseconds") for t in tider.tolist()]
+                self.assertEqual(np.count_nonzero(iso != np.array(forventet)), 0, skift)
+                if skift == 1711846800: #Om efteråret findes timen 02-03 to gange og kan ikke læses entydigt tilbage
+                    self.assertEqual(np.count_nonzero(ekg_lagring.iso_til_ns_array(iso) != tider), 0)
+                    self.assertEqual(np.count_nonzero(ekg_lagring.iso_til_ns_array(iso[::-1]) != tider[::-1]), 0)
+            #Tider der ikke krydser et skift får samme forskydning som den enkelte omregning
+            self.assertEqual(ekg_lagring.iso_til_ns_array(["2024-07-01T12:00:00.000000"]).tolist(),
+                             [ekg_lagring.iso_til_ns("2024-07-01T12:00:00.000000")])
+        finally:
+            if tz is None:
+                del os.environ["TZ"]
+            else:
+                os.environ["TZ"] = tz
+            time.tzset()
+
+    def test_migrer_ekgdata(self):
+        start = datetime(2024, 1, 1, 12, 0, 0)
+        rækker = []
+        for i in range(300):
+            rækker.append((1, (start + timedelta(milliseconds=4 * i)).isoformat(), float(i), None))
+        # Ny måling en time senere
+        for i in range(10):
+            rækker.append((1, (start + timedelta(hours=1, milliseconds=4 * i)).isoformat(), 7.0, 72))
+        self.conn.executemany("INSERT INTO Ekgdata (PatientID, Tidspunkt, Data, Puls) VALUES (?, ?, ?, ?)", rækker)
+
+        blokke = ekg_lagring.migrer_ekgdata(self.conn)
+        self.assertEqual(blokke, 3)  # 250 + 50 i første session, 10 i anden
+
+        sessioner = self.conn.execute("SELECT COUNT(DISTINCT SessionID) FROM EkgBlokke").fetchone()[0]
+        self.assertEqual(sessioner, 2)
+        antal = self.conn.execute("SELECT Antal FROM Sessions ORDER BY Id").fetchall()
+        self.assertEqual(antal, [(300,), (10,)])
+        fs = self.conn.execute("SELECT Samplerate FROM EkgBlokke ORDER BY Id LIMIT 1").fetchone()[0]
+        self.assertAlmostEqual(fs, 250, places=3)
+
+        værdier, _, pulser = ekg_lagring.hent_seneste(self.conn.cursor(), 1, 310)
+        self.assertTrue(np.array_equal(værdier[:300], np.arange(300)))
+        self.assertEqual(pulser[-1], 72)
+
+        #En ny kørsel migrerer ikke de samme rækker igen
+        self.assertEqual(ekg_lagring.migrer_ekgdata(self.conn), 0)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM EkgBlokke").fetchone()[0], 3)
+
+    # Indsætter en måling på antal samples med 4 ms mellem dem
+    def indsæt_måling(self, patient_id, start, antal):
+        self.conn.executemany("INSERT INTO Ekgdata (PatientID, Tidspunkt, Data, Puls) VALUES (?, ?, ?, ?)",
+                              [(patient_id, (start + timedelta(milliseconds=4 * i)).isoformat(), float(i % 100), None)
+                               for i in range(antal)])
+        self.conn.commit()
+
+    def test_migrering_fortsætter_efter_afbrydelse(self):
+        start = datetime(2024, 1, 1, 12, 0, 0)
+        self.indsæt_måling(1, start, 600)
+        self.assertEqual(ekg_lagring.migrer_ekgdata(self.conn), 3)
+        #Databasen sættes tilbage til som hvis migreringen var afbrudt efter første blok
+        self.conn.execute("DELETE FROM EkgBlokke WHERE Id > 1")
+        self.conn.execute("DELETE FROM Sessions")
+        self.conn.execute("INSERT INTO Sessions (Id, PatientID, Status) VALUES (1, 1, 'aktiv')")
+        self.conn.execute("UPDATE Meta SET Værdi = 250 WHERE Nøgle = 'migrer_ekgdata:1:id'")
+        self.conn.execute("UPDATE Meta SET Værdi = 1 WHERE Nøgle = 'migrer_ekgdata:1:session'")
+        self.conn.commit()
+
+        self.indsæt_måling(1, start + timedelta(hours=1), 100) #Ny måling efter migreringen
+        self.assertEqual(ekg_lagring.migrer_ekgdata(self.conn), 3)
+        sessioner = self.conn.execute("SELECT Id, Antal FROM Sessions ORDER BY Id").fetchall()
+        self.assertEqual(sessioner, [(1, 600), (2, 100)]) #Den afbrudte session er fortsat, ikke startet forfra
+        self.assertEqual(self.conn.execute("SELECT SUM(Antal) FROM EkgBlokke").fetchone()[0], 700)
+
+    def test_slet_kun_migrerede(self):
+        start = datetime(2024, 1, 1, 12, 0, 0)
+        self.indsæt_måling(1, start, 300)
+        self.indsæt_måling(2, start, 300)
+        self.conn.execute("INSERT INTO Ekgdata (PatientID, Tidspunkt, Data) VALUES (1, 'ugyldig', 0)")
+        self.conn.commit()
+        ekg_lagring.migrer_ekgdata(self.conn, slet_gamle=True)
+        #Kun rækken med det ugyldige tidspunkt er ikke migreret og står tilbage
+        self.assertEqual(self.conn.execute("SELECT Tidspunkt FROM Ekgdata").fetchall(), [("ugyldig",)])
+        self.assertEqual(self.conn.execute("SELECT SUM(Antal) FROM EkgBlokke").fetchone()[0], 600)
+
+
+if __name__ == '__main__':
+    unittest.main()
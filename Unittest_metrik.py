@@ -0,0 +1,132 @@
+import unittest
+import tempfile
+import threading
+import time
+import json
+import io
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from ekg_daemon import Datahandler
+from ekg_database import Database
+from ekg_ingest import IngestWriter, RingBuffer
+from ekg_metrik import Metrik, MetrikEksport, metrik, rapport
+from ekg_protokol import TekstLæser
+
+
+class TestMetrik(unittest.TestCase):
+    def test_slået_fra_registrerer_intet(self):
+        m = Metrik()
+        self.assertEqual(m.start(), 0)
+        m.slut("a", m.start())
+        m.registrer("a", 10 ** 6)
+        m.tæl("b")
+        with m.span("c"):
+            pass
+        self.assertEqual(m.øjebliksbillede()["stadier"], {})
+        self.assertEqual(m.øjebliksbillede()["tællere"], {})
+
+    def test_slået_fra_koster_næsten_intet(self):
+        m = Metrik()
+        antal = 200000
+        start = time.perf_counter()
+        for _ in range(antal):
+            m.slut("a", m.start())
+            m.tæl("b")
+        #Typisk omkring 0,2 µs pr. gennemløb. Grænsen er løs, så testen ikke afhænger af maskinen
+        self.assertLess((time.perf_counter() - start) / antal, 5e-6)
+
+    def test_histogram_og_percentiler(self):
+        m = Metrik().slå_til()
+        for _ in range(90):
+            m.registrer("db", 1_000_000) #1 ms
+        for _ in range(10):
+            m.registrer("db", 50_000_000) #50 ms
+        s = m.stadie("db")
+        self.assertEqual(s["antal"], 100)
+        self.assertAlmostEqual(s["gns_ms"], 5.9)
+        self.assertEqual(s["maks_ms"], 50.0)
+        self.assertEqual(s["seneste_ms"], 50.0)
+        self.assertLessEqual(s["p50_ms"], 1.1) #Øvre grænse for spanden med 1 ms
+        self.assertGreater(s["p99_ms"], 30.0)
+        self.assertEqual(sum(s["spande"]), 100)
+
+    def test_span_og_tællere(self):
+        m = Metrik().slå_til()
+        with m.span("vent"):
+            time.sleep(0.01)
+        m.tæl("samples", 10)
+        m.tæl("samples", 5)
+        billede = m.øjebliksbillede()
+        self.assertGreaterEqual(billede["stadier"]["vent"]["maks_ms"], 9.0)
+        self.assertEqual(billede["tællere"], {"samples": 15})
+        self.assertIn("vent", rapport(billede))
+        m.nulstil()
+        self.assertEqual(m.øjebliksbillede()["tællere"], {})
+
+    def test_eksport_til_fil(self):
+        m = Metrik()
+        with tempfile.TemporaryDirectory() as mappe:
+            fil = os.path.join(mappe, "metrik.jsonl")
+            eksport = MetrikEksport(fil, interval=0.05, kilde=m).start()
+            self.assertTrue(m.aktiv)
+            m.tæl("frames")
+            time.sleep(0.2)
+            eksport.stop()
+            with open(fil, encoding="utf-8") as f:
+                linjer = [json.loads(linje) for linje in f]
+            self.assertGreaterEqual(len(linjer), 2)
+            self.assertEqual(linjer[-1]["tællere"], {"frames": 1})
+
+
+class TestInstrumentering(unittest.TestCase):
+    def setUp(self):
+        metrik.nulstil()
+        metrik.slå_til()
+
+    def tearDown(self):
+        metrik.slå_til(False)
+        metrik.nulstil()
+
+    def test_parsefejl_tælles(self):
+        læser = TekstLæser(io.BytesIO(b"1,512\nxx\n2,513\n"))
+        for _ in range(3):
+            læser.læs()
+        self.assertEqual(metrik.øjebliksbillede()["tællere"]["parse_fejl"], 1)
+
+    def test_skriver(self):
+        with tempfile.TemporaryDirectory() as mappe:
+            sti = os.path.join(mappe, "test.db")
+            Database(sti).luk()
+            writer = IngestWriter(sti).start()
+            for i in range(300):
+                writer.tilføj((1, float(i), "2024-01-01T00:00:00.000000", None))
+            writer.stop()
+        billede = metrik.øjebliksbillede()
+        self.assertEqual(billede["tællere"]["rækker_skrevet"], 300)
+        self.assertGreaterEqual(billede["stadier"]["db_commit"]["antal"], 1)
+
+    def test_datahandler(self):
+        with tempfile.TemporaryDirectory() as mappe:
+            db = Database(os.path.join(mappe, "test.db"))
+            stop = threading.Event()
+            ringbuffer = RingBuffer(5000)
+            handler = Datahandler(1, stop, ringbuffer, db=db, protokol="binær")
+            tråd = threading.Thread(target=handler.serialdata, args=("sim://?hastighed=0",))
+            tråd.start()
+            time.sleep(1.0)
+            stop.set()
+            tråd.join()
+            db.luk()
+        billede = metrik.øjebliksbillede()
+        self.assertGreater(billede["tællere"]["samples_læst"], 0)
+        #Pyramiden og sessionens opsummering skrives også af skriveren
+        self.assertGreaterEqual(billede["tællere"]["rækker_skrevet"], billede["tællere"]["samples_læst"])
+        for stadie in ("serial_læs", "behandling", "db_commit"):
+            self.assertGreater(billede["stadier"][stadie]["antal"], 0)
+        self.assertIsNotNone(ringbuffer.ankomst_ns)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import sqlite3
+import tempfile
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import ekg_opsamling
+from ekg_database import opret_schema
+
+
+class FalskLæser():
+    # Læser der kun har statistik
+    def __init__(self, **tal):
+        self.tal = tal
+
+    def statistik(self):
+        return dict(self.tal)
+
+
+class FalskDatahandler():
+    # Skriver en fast værdi pr. millisekund indtil den stoppes, som en rigtig Datahandler ville
+    def __init__(self, patient_id, stop_event, ringbuffer, writer=None, helbred=None):
+        self.patient_id = patient_id
+        self.stop_event = stop_event
+        self.ringbuffer = ringbuffer
+        self.writer = writer
+        self.helbred = helbred
+
+    def serialdata(self, com):
+        self.helbred.status = "forbundet"
+        i = 0
+        while not self.stop_event.is_set():
+            tid_ns = time.time_ns()
+            self.ringbuffer.skriv(float(self.patient_id), tid_ns, 60)
+            self.writer.tilføj((self.patient_id, float(i), "2024-01-01T00:00:00", 60))
+            self.helbred.tæl(1)
+            i += 1
+            time.sleep(0.001)
+
+
+class TestOpsamling(unittest.TestCase):
+    def setUp(self):
+        self.mappe = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.mappe.name, "test.db")
+        conn = sqlite3.connect(self.db)
+        opret_schema(conn)
+        conn.close()
+
+    def tearDown(self):
+        self.mappe.cleanup()
+
+    def test_flere_enheder_samtidig(self):
+        opsamling = ekg_opsamling.Opsamling(self.db, FalskDatahandler, maks_kø=1000)
+        opsamling.start("port1", 1)
+        opsamling.start("port2", 2)
+        time.sleep(0.2)
+        self.assertEqual(len(opsamling.aktive()), 2)
+        self.assertEqual(opsamling.for_patient(2).port, "port2")
+        self.assertEqual(opsamling.for_patient(1).ringbuffer.seneste(1)[0].tolist(), [1.0])
+
+        stat = opsamling.statistik()
+        self.assertEqual(sorted(e["port"] for e in stat["enheder"]), ["port1", "port2"])
+        writer = opsamling.writer
+        opsamling.stop_alle()
+        self.assertEqual(opsamling.aktive(), [])
+        self.assertEqual(writer.statistik()["tabte"], 0)
+
+        conn = sqlite3.connect(self.db)
+        patienter = conn.execute("SELECT PatientID, COUNT(*) FROM Ekgdata GROUP BY PatientID").fetchall()
+        conn.close()
+        self.assertEqual([pid for pid, _ in patienter], [1, 2])
+        self.assertTrue(all(antal > 10 for _, antal in patienter))
+
+    def test_ny_måling_på_samme_port_stopper_den_gamle(self):
+        opsamling = ekg_opsamling.Opsamling(self.db, FalskDatahandler)
+        gammel = opsamling.start("port1", 1)
+        opsamling.start("port1", 2)
+        self.assertTrue(gammel.stop_event.is_set())
+        self.assertEqual(gammel.helbred.status, "stoppet")
+        self.assertEqual([e.patient_id for e in opsamling.aktive()], [2])
+        opsamling.stop_alle()
+
+
+class TestHelbred(unittest.TestCase):
+    def test_fejl_summeres_over_genforbindelser(self):
+        helbred = ekg_opsamling.Helbred("port1", 1)
+        helbred.sæt_læser(FalskLæser(parse_fejl=2))
+        helbred.sæt_læser(FalskLæser(checksum_fejl=1, tabte_frames=4))
+        stat = helbred.statistik()
+        self.assertEqual(stat["parse_fejl"], 3)
+        self.assertEqual(stat["tabte_frames"], 4)
+
+    def test_samples_pr_s(self):
+        helbred = ekg_opsamling.Helbred()
+        helbred._vindue_start -= 1.0
+        helbred.tæl(250)
+        self.assertAlmostEqual(helbred.statistik()["samples_pr_s"], 250, delta=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import ekg_plot
+
+
+class TestEkgPlot(unittest.TestCase):
+    def test_linje_oprettes_kun_en_gang(self):
+        plot = ekg_plot.EkgPlot(antal=150, max_fps=0)
+        linje = plot.linje
+        for i in range(5):
+            plot.opdater(np.arange(200) + i)
+        self.assertIs(plot.linje, linje)
+        self.assertEqual(len(plot.ax.lines), 1)
+        self.assertEqual(plot.ydata[-1], 199 + 4)
+
+    def test_kort_data_fyldes_med_nan(self):
+        plot = ekg_plot.EkgPlot(antal=10, max_fps=0)
+        plot.opdater([1, 2, 3])
+        self.assertEqual(plot.ydata[:3].tolist(), [1.0, 2.0, 3.0])
+        self.assertTrue(np.isnan(plot.ydata[3:]).all())
+
+    def test_fps_loft(self):
+        plot = ekg_plot.EkgPlot(max_fps=1)
+        self.assertTrue(plot.opdater([1, 2, 3]))
+        self.assertFalse(plot.opdater([1, 2, 3]))  # For tæt på forrige billede
+        self.assertTrue(plot.opdater([1, 2, 3], tving=True))
+
+    def test_uden_blitting(self):
+        plot = ekg_plot.EkgPlot(max_fps=0, blit=False)
+        self.assertTrue(plot.opdater([100, 200]))
+        self.assertIsNone(plot.baggrund)
+
+
+
+class TestOversigtPlot(unittest.TestCase):
+    def test_huller_brydes_med_nan(self):
+        #To sessioner med spande hvert sekund og en time imellem
+        x = np.concatenate((np.arange(10.0), 3600 + np.arange(5.0)))
+        mins, maxs = np.zeros(15), np.ones(15)
+        bx, bmins, bmaxs = ekg_plot.bryd_ved_huller(x, mins, maxs)
+        self.assertEqual(bx[9:12].tolist(), [9.0, 10.0, 3600.0])
+        self.assertTrue(np.isnan(bmins[10]) and np.isnan(bmaxs[10]))
+        self.assertEqual(np.count_nonzero(np.isnan(bmins)), 1)
+        self.assertEqual(bx[-1], 3605.0) #Den sidste spand får sin bredde
+        #Kendes bredden bruges den i stedet for det typiske mellemrum
+        self.assertEqual(np.count_nonzero(np.isnan(ekg_plot.bryd_ved_huller(x, mins, maxs, spand=4000)[1])), 0)
+
+    def test_båndet_tegnes_ikke_over_hullet(self):
+        plot = ekg_plot.OversigtPlot()
+        x = np.concatenate((np.arange(10.0), 3600 + np.arange(5.0)))
+        plot.tegn(x, np.zeros(15), np.ones(15), xlim=(0, 3605))
+        #fill_between laver et område for hver sammenhængende del
+        self.assertEqual(len(plot.bånd.get_paths()), 2)
+        plot.tegn(x, x, x)
+        xdata = plot.linje.get_xdata()
+        self.assertEqual(len(xdata), 16) #Rå samples: kun NaN ved hullet, ingen ekstra punkt til sidst
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+import io
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import ekg_protokol
+
+
+class FalskPort():
+    # Simpel erstatning for serial.Serial der afleverer de givne bytes i bidder
+    def __init__(self, data, bid=64):
+        self.data = bytearray(data)
+        self.bid = bid
+
+    @property
+    def in_waiting(self):
+        return min(len(self.data), self.bid)
+
+    def read(self, n):
+        del_ = bytes(self.data[:n])
+        del self.data[:n]
+        return del_
+
+
+def læs_alt(læser):
+    # Læser indtil porten er tom og returnerer alle værdier og sekvensnumre
+    værdier, tællere = [], []
+    while læser.ser.data:
+        v, _, t = læser.læs()
+        værdier.extend(v.tolist())
+        tællere.extend(t.tolist())
+    return værdier, tællere
+
+
+class TestBinærProtokol(unittest.TestCase):
+    def test_frame_længde(self):
+        frame = ekg_protokol.pak_frame(0, range(10))
+        self.assertEqual(len(frame), ekg_protokol.frame_type().itemsize)
+        self.assertEqual(len(frame), 27)
+
+    def test_fletcher16_som_løkke(self):
+        data = bytes(range(40))
+        sum1 = sum2 = 0
+        for b in data:
+            sum1 = (sum1 + b) % 255
+            sum2 = (sum2 + sum1) % 255
+        self.assertEqual(int(ekg_protokol.fletcher16(np.frombuffer(data, dtype=np.uint8))[0]), (sum2 << 8) | sum1)
+
+    def test_afkoder_frames_over_flere_læsninger(self):
+        data = b"".join(ekg_protokol.pak_frame(i, np.arange(10) + 10 * i - 50) for i in range(20))
+        læser = ekg_protokol.BinærLæser(FalskPort(data, bid=13))
+        værdier, tællere = læs_alt(læser)
+        self.assertEqual(værdier, list(range(-50, 150)))
+        self.assertEqual(tællere, list(range(200)))
+        self.assertEqual(læser.tabte_frames, 0)
+
+    def test_tæller_tabte_frames_og_sekvens_der_løber_rundt(self):
+        numre = [65533, 65534, 65535, 0, 3, 4]
+        data = b"".join(ekg_protokol.pak_frame(n, [n % 100] * 10) for n in numre)
+        læser = ekg_protokol.BinærLæser(FalskPort(data, bid=1000))
+        læs_alt(læser)
+        self.assertEqual(læser.frames, 6)
+        self.assertEqual(læser.tabte_frames, 2)
+
+    def test_resynkroniserer_efter_støj_og_checksumfejl(self):
+        god = [ekg_protokol.pak_frame(i, [i] * 10) for i in range(4)]
+        ødelagt = bytearray(god[1])
+        ødelagt[10] ^= 0x0F
+        data = b"\x00\x13\xa5" + god[0] + bytes(ødelagt) + b"\x5a\xa5" + god[2] + god[3]
+        læser = ekg_protokol.BinærLæser(FalskPort(data, bid=1000))
+        værdier, tællere = læs_alt(læser)
+        self.assertEqual(tællere, list(range(0, 10)) + list(range(20, 40)))
+        self.assertEqual(værdier, [0] * 10 + [2] * 10 + [3] * 10)
+        self.assertEqual(læser.checksum_fejl, 1)
+        self.assertEqual(læser.tabte_frames, 1)
+
+    def test_tider_følger_samplerate(self):
+        data = ekg_protokol.pak_frame(0, range(10))
+        læser = ekg_protokol.BinærLæser(FalskPort(data, bid=1000), fs=250)
+        _, tider, _ = læser.læs()
+        self.assertTrue(np.all(np.diff(tider) == 4_000_000))
+
+
+class OpdeltPort():
+    # Port der afleverer bidderne som de er givet. b"" svarer til en read der fik timeout
+    def __init__(self, bidder):
+        self.bidder = list(bidder)
+        self.in_waiting = 0
+
+    def read(self, n):
+        return self.bidder.pop(0) if self.bidder else b""
+
+
+class TestTekstProtokol(unittest.TestCase):
+    def test_tæller_og_værdi_samt_gammelt_format(self):
+        port = io.BytesIO(b"7,512\n8,530\n2048\nabc\n")
+        læser = ekg_protokol.TekstLæser(port)
+        resultater = [læser.læs() for _ in range(4)]
+        self.assertEqual([r[0].tolist() for r in resultater], [[512.0], [530.0], [2048.0], []])
+        self.assertEqual([r[2].tolist() for r in resultater], [[7], [8], [], []])
+        self.assertGreater(resultater[1][1][0], resultater[0][1][0])
+        self.assertEqual(læser.parse_fejl, 1)
+
+    def test_linjer_delt_over_flere_læsninger(self):
+        #Linjerne kommer i stykker med timeouts imellem, og en gammel linje og en ny kommer i samme bid
+        port = OpdeltPort([b"12345,1", b"", b"023\r", b"\n12346,-", b"", b"5", b"00\r\n12347,7\r\n"])
+        læser = ekg_protokol.TekstLæser(port)
+        værdier, tællere = [], []
+        for _ in range(10):
+            v, _, t = læser.læs()
+            værdier += v.tolist()
+            tællere += t.tolist()
+        self.assertEqual(værdier, [1023.0, -500.0, 7.0])
+        self.assertEqual(tællere, [12345, 12346, 12347])
+        self.assertEqual((læser.parse_fejl, læser.ur.nulstillinger), (0, 0))
+
+
+class TestSampleUr(unittest.TestCase):
+    def test_estimerer_effektiv_samplerate(self):
+        # Enheden sampler reelt med 100 Hz selvom den nominelle rate er 250 Hz, og PC'en får data med jitter
+        rng = np.random.default_rng(1)
+        ur = ekg_protokol.SampleUr(fs=250)
+        start = 1_700_000_000_000_000_000
+        for frame in range(200):
+            tællere = frame * 10 + np.arange(10)
+            modtaget = start + int((tællere[-1] + 1) * 1e7 + rng.uniform(0, 5e6))
+            tider = ur.tider(tællere, modtaget)
+        self.assertAlmostEqual(ur.fs, 100, delta=0.5)
+        self.assertTrue(np.allclose(np.diff(tider), 1e9 / ur.fs, atol=1))
+        self.assertLess(abs(tider[-1] - (start + 1999 * 1e7)), 20e6) #Overførselstiden indgår som fast forsinkelse
+
+    def test_nominel_rate_indtil_der_er_målt_længe_nok(self):
+        ur = ekg_protokol.SampleUr(fs=250)
+        ur.tider([0, 1, 2], 0)
+        ur.tider([3, 4, 5], 12_000_000)
+        self.assertEqual(ur.fs, 250)
+
+    def test_tæller_der_løber_rundt_og_genstart(self):
+        ur = ekg_protokol.SampleUr(fs=250, modulo=16)
+        self.assertEqual(ur.udpak([14, 15, 0, 1]).tolist(), [0, 1, 2, 3])
+        self.assertEqual(ur.udpak([3]).tolist(), [5])
+        self.assertEqual(ur.nulstillinger, 0)
+        ur.udpak([0]) #Enheden er genstartet
+        self.assertEqual(ur.nulstillinger, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+import tempfile
+from datetime import datetime
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from ekg_database import Database
+from ekg_pyramide import (CHUNK, INSERT_PYRAMIDE, SQL_PYRAMIDE_INTERVAL, PyramideBygger, byg_eksisterende, hent_niveau,
+                          reducer, vælg_niveau)
+
+
+class ListeWriter():
+    # Writer der blot gemmer rækkerne
+    def __init__(self):
+        self.rækker = []
+
+    def tilføj(self, række, sql, samples=1):
+        self.rækker.append((sql, række))
+
+
+class TestPyramideBygger(unittest.TestCase):
+    def test_løbende_svarer_til_samlet_reduktion(self):
+        rng = np.random.default_rng(1)
+        værdier = rng.integers(0, 4000, 123457).astype(np.float64)
+        tider = np.arange(len(værdier), dtype=np.int64) * 4_000_000
+        writer = ListeWriter()
+        bygger = PyramideBygger(writer, 7)
+        # Ujævne bidder som fra serielporten
+        start = 0
+        for n in rng.integers(1, 400, 10000):
+            bygger.tilføj_mange(værdier[start:start + n], tider[start:start + n])
+            start += n
+            if start >= len(værdier):
+                break
+        bygger.tilføj_mange(værdier[start:], tider[start:])
+        bygger.flush()
+
+        for niveau in (10, 100, 1000, 10000):
+            rækker = [r for sql, r in writer.rækker if sql == INSERT_PYRAMIDE and r[1] == niveau]
+            self.assertTrue(all(r[0] == 7 for r in rækker))
+            self.assertTrue(all(r[4] <= CHUNK for r in rækker))
+            mins = np.concatenate([np.frombuffer(r[6], dtype=np.int16) for r in rækker])
+            maxs = np.concatenate([np.frombuffer(r[7], dtype=np.int16) for r in rækker])
+            starttider = np.concatenate([np.frombuffer(r[5], dtype=np.int64) for r in rækker])
+            antal = -(-len(værdier) // niveau)
+            forventet_min = [værdier[i:i + niveau].min() for i in range(0, len(værdier), niveau)]
+            forventet_max = [værdier[i:i + niveau].max() for i in range(0, len(værdier), niveau)]
+            self.assertEqual(len(mins), antal)
+            np.testing.assert_array_equal(mins, forventet_min)
+            np.testing.assert_array_equal(maxs, forventet_max)
+            np.testing.assert_array_equal(starttider, tider[::niveau])
+
+    def test_intet_skrives_uden_samples(self):
+        writer = ListeWriter()
+        PyramideBygger(writer, 1).flush()
+        self.assertEqual(writer.rækker, [])
+
+
+class TestOpslag(unittest.TestCase):
+    def test_vælg_niveau(self):
+        self.assertEqual(vælg_niveau(1000, 800), 1)
+        self.assertEqual(vælg_niveau(16000, 800), 10)
+        self.assertEqual(vælg_niveau(250 * 3600, 800), 100)
+        self.assertEqual(vælg_niveau(250 * 86400, 800), 10000)
+
+    def test_reducer(self):
+        tider = np.arange(1001, dtype=np.int64)
+        værdier = np.arange(1001, dtype=np.int16)
+        t, mins, maxs = reducer(tider, værdier, værdier, 100)
+        self.assertLessEqual(len(t), 100)
+        self.assertEqual(mins.min(), 0)
+        self.assertEqual(maxs.max(), 1000)
+        self.assertEqual(reducer(tider[:50], værdier[:50], værdier[:50], 100)[0].tolist(), list(range(50)))
+
+
+class TestDatabaseOversigt(unittest.TestCase):
+    def setUp(self):
+        self.mappe = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.mappe.name, "test.db"))
+        self.start_ns = 1_700_000_000 * 10 ** 9
+        # To timer ved 250 Hz
+        self.værdier = (np.arange(250 * 7200) % 1000).astype(np.float64)
+        self.tider = self.start_ns + np.arange(len(self.værdier), dtype=np.int64) * 4_000_000
+        conn = self.db.forbindelse()
+        writer = ListeWriter()
+        bygger = PyramideBygger(writer, 1)
+        bygger.tilføj_mange(self.værdier, self.tider)
+        bygger.flush()
+        with conn:
+            conn.executemany(INSERT_PYRAMIDE, [r for _, r in writer.rækker])
+
+    def tearDown(self):
+        self.db.luk()
+        self.mappe.cleanup()
+
+    def test_omfang(self):
+        self.assertEqual(self.db.måling_omfang(1), (self.start_ns, int(self.tider[-1])))
+        self.assertIsNone(self.db.måling_omfang(2))
+
+    def test_oversigt_højst_to_spande_pr_pixel(self):
+        fra, til = self.db.måling_omfang(1)
+        tider, mins, maxs, niveau = self.db.oversigt(1, fra, til, 800)
+        self.assertEqual(niveau, 1000)
+        self.assertLessEqual(len(tider), 1600)
+        self.assertEqual(mins.min(), 0)
+        self.assertEqual(maxs.max(), 999)
+
+        # Et udsnit midt i målingen
+        fra = self.start_ns + 3600 * 10 ** 9
+        tider, mins, maxs, niveau = self.db.oversigt(1, fra, fra + 1800 * 10 ** 9, 800)
+        self.assertEqual(niveau, 100)
+        self.assertTrue((tider >= fra).all() and (tider <= fra + 1800 * 10 ** 9).all())
+
+    def test_hent_niveau_afgrænset_i_indeks(self):
+        conn = self.db.forbindelse()
+        #Et udsnit der starter midt i en række giver de samme spande som den fulde række skåret til
+        fra = self.start_ns + 3600 * 10 ** 9 + 123_000_000
+        tider, mins, _ = hent_niveau(conn.cursor(), 1, 10, fra, fra + 60 * 10 ** 9)
+        alle, alle_mins, _ = hent_niveau(conn.cursor(), 1, 10, 0, 2 ** 62)
+        maske = (alle >= fra) & (alle <= fra + 60 * 10 ** 9)
+        self.assertEqual(tider.tolist(), alle[maske].tolist())
+        self.assertEqual(mins.tolist(), alle_mins[maske].tolist())
+
+        #Indekset skal afgrænses i begge ender, ellers vokser opslaget med historikken
+        plan = [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + SQL_PYRAMIDE_INTERVAL, (1,) * 8)]
+        self.assertIn("StartNs>? AND StartNs<?", plan[0])
+
+    def test_korte_tidsrum_hentes_rå(self):
+        conn = self.db.forbindelse()
+        with conn:
+            conn.execute("INSERT INTO Ekgdata (PatientID, Data, Tidspunkt, Puls) VALUES (1, 5, '2024-01-01T12:00:00.000000', 60)")
+        fra = int(datetime(2024, 1, 1, 11, 59, 59).timestamp() * 1e9)
+        tider, mins, maxs, niveau = self.db.oversigt(1, fra, fra + 2 * 10 ** 9, 800)
+        self.assertEqual(niveau, 1)
+        self.assertEqual(mins.tolist(), [5.0])
+
+    def test_byg_eksisterende(self):
+        conn = self.db.forbindelse()
+        with conn:
+            conn.execute("INSERT INTO Ekgdata (PatientID, Data, Tidspunkt, Puls) VALUES (2, 5, '2024-01-01T12:00:00.000000', 60)")
+        self.assertEqual(byg_eksisterende(conn), 4) #Én række pr. niveau for patient 2; patient 1 findes allerede
+        tider, mins, maxs = hent_niveau(conn.cursor(), 2, 10, 0, 2 ** 62)
+        self.assertEqual(mins.tolist(), [5])
+        self.assertEqual(byg_eksisterende(conn), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+import tempfile
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from ekg_database import Database, åbn_forbindelse
+from ekg_ingest import IngestWriter
+from ekg_lagring import BlokWriter, ns_til_iso_array
+from ekg_reanalyse import VERSION, analyser_session, reanalyser
+from ekg_retention import arkiver_session
+from ekg_signal import syntetisk_ekg
+
+START_NS = 1_700_000_000_000_000_000
+
+
+class TestReanalyse(unittest.TestCase):
+    def setUp(self):
+        self.mappe = tempfile.TemporaryDirectory()
+        self.sti = os.path.join(self.mappe.name, "test.db")
+        self.db = Database(self.sti)
+        self.conn = åbn_forbindelse(self.sti)
+
+    def tearDown(self):
+        self.conn.close()
+        self.db.luk()
+        self.mappe.cleanup()
+
+    # Gemmer et syntetisk EKG som en afsluttet session i rækker. Enheden sampler reelt med fs, og pulsen i
+    # rækkerne er forkert (som med den hardkodede 250 Hz). Med anden_session skrives en anden samtidig
+    # måling ind imellem, så rækkernes Id ikke er sammenhængende
+    def session_i_rækker(self, patient_id, fs, puls, sekunder=60, anden_session=None):
+        signal, _ = syntetisk_ekg(fs=fs, sekunder=sekunder, puls=puls, variation=0.02)
+        session_id = self.db.ny_session(patient_id)
+        tider = START_NS + np.rint(np.arange(len(signal)) * 1e9 / fs).astype(np.int64)
+        iso = ns_til_iso_array(tider).tolist()
+        with self.conn:
+            for i, (værdi, tid) in enumerate(zip(signal.tolist(), iso)):
+                self.conn.execute("INSERT INTO Ekgdata (PatientID, Data, Tidspunkt, Puls, SessionID) VALUES (?, ?, ?, ?, ?)",
+                                  (patient_id, værdi, tid, 999, session_id))
+                if anden_session and i % 10 == 0:
+                    self.conn.execute("INSERT INTO Ekgdata (PatientID, Data, Tidspunkt, Puls, SessionID) VALUES (?, ?, ?, ?, ?)",
+                                      (patient_id + 1, 0, tid, 999, anden_session))
+            self.conn.execute("UPDATE Sessions SET StartNs = ?, SlutNs = ?, Samplerate = 250, Antal = ?, "
+                              "Status = 'afsluttet' WHERE Id = ?", (int(tider[0]), int(tider[-1]), len(signal), session_id))
+        return session_id
+
+    def hent(self, sql, parametre=()):
+        return self.conn.execute(sql, parametre).fetchall()
+
+    def test_rækker_får_ny_puls_og_opsummering(self):
+        aktiv = self.db.ny_session(2)
+        session_id = self.session_i_rækker(1, fs=200, puls=72, anden_session=aktiv)
+        statistik = reanalyser(self.sti, arbejdere=2, fremskridt=None)
+        self.assertEqual((statistik["sessioner"], statistik["fejl"]), (1, 0))
+        self.assertEqual(statistik["samples"], 12000)
+
+        session = self.db.session(session_id)
+        self.assertAlmostEqual(session["Samplerate"], 200, delta=0.5)
+        self.assertAlmostEqual(session["PulsGns"], 72, delta=2)
+        self.assertAlmostEqual(session["RRGns"], 60 / 72, delta=0.03)
+        self.assertAlmostEqual(session["Slag"], 72, delta=2)
+        self.assertEqual(session["Status"], "afsluttet")
+        self.assertEqual(self.hent("SELECT Analyse FROM Sessions WHERE Id = ?", (session_id,))[0][0], VERSION)
+
+        puls = [p for (p,) in self.hent("SELECT Puls FROM Ekgdata WHERE SessionID = ? ORDER BY Id", (session_id,))]
+        self.assertIsNone(puls[0]) #Før det første RR-interval
+        self.assertNotIn(999, puls)
+        self.assertTrue(all(70 <= p <= 74 for p in puls[1000:]))
+        #Den aktive sessions rækker ligger imellem og røres ikke
+        self.assertEqual(self.hent("SELECT DISTINCT Puls FROM Ekgdata WHERE SessionID = ?", (aktiv,)), [(999,)])
+
+    def test_blokke_og_arkiv(self):
+        signal, _ = syntetisk_ekg(fs=250, sekunder=60, puls=90)
+        blok_session = self.db.ny_session(3)
+        writer = IngestWriter(self.sti).start()
+        blok = BlokWriter(writer, 3, blok_session, 250)
+        for i, værdi in enumerate(signal.tolist()):
+            blok.tilføj(værdi, START_NS + i * 4_000_000, puls=0)
+        blok.flush()
+        writer.stop()
+        with self.conn:
+            self.conn.execute("UPDATE Sessions SET Status = 'afsluttet' WHERE Id = ?", (blok_session,))
+        arkiv_session = self.session_i_rækker(4, fs=250, puls=50)
+        arkiver_session(self.conn, 4, arkiv_session, pause=0)
+        with self.conn:
+            self.conn.execute("UPDATE Sessions SET Status = 'arkiveret' WHERE Id = ?", (arkiv_session,))
+
+        self.assertEqual(reanalyser(self.sti, arbejdere=2, fremskridt=None)["sessioner"], 2)
+        blok_puls = [p for (p,) in self.hent("SELECT Puls FROM EkgBlokke WHERE SessionID = ? ORDER BY Id", (blok_session,))]
+        self.assertEqual(len(blok_puls), 60)
+        self.assertIsNone(blok_puls[0])
+        self.assertTrue(all(88 <= p <= 92 for p in blok_puls[5:]))
+        arkiv = self.db.session(arkiv_session)
+        self.assertAlmostEqual(arkiv["PulsGns"], 50, delta=2)
+        self.assertEqual(arkiv["Status"], "arkiveret")
+
+    def test_fortsætter_og_ny_version(self):
+        første = self.session_i_rækker(1, fs=250, puls=60, sekunder=20)
+        anden = self.session_i_rækker(2, fs=250, puls=60, sekunder=20)
+        #Som et afbrudt job: kun den første session nåede at blive skrevet færdig
+        self.assertEqual(reanalyser(self.sti, arbejdere=1, patient_id=1, fremskridt=None)["sessioner"], 1)
+        self.assertEqual(reanalyser(self.sti, arbejdere=1, fremskridt=None)["sessioner"], 1)
+        self.assertEqual(reanalyser(self.sti, arbejdere=1, fremskridt=None)["sessioner"], 0)
+        self.assertEqual(reanalyser(self.sti, arbejdere=1, version="ny", fremskridt=None)["sessioner"], 2)
+        self.assertEqual(self.hent("SELECT Analyse FROM Sessions WHERE Id IN (?, ?)", (første, anden)), [("ny",), ("ny",)])
+
+    def test_bidstørrelse_ændrer_ikke_resultatet(self):
+        session_id = self.session_i_rækker(1, fs=250, puls=75, sekunder=90)
+        hele = analyser_session(self.sti, 1, session_id)
+        små = analyser_session(self.sti, 1, session_id, stykke=3000)
+        self.assertEqual(små["opsummering"], hele["opsummering"])
+        self.assertEqual(små["puls"], hele["puls"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+import unittest
+import tempfile
+import threading
+import sqlite3
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import ekg_eksport
+from ekg_database import Database, åbn_forbindelse
+from ekg_ingest import IngestWriter
+from ekg_lagring import BlokWriter, ns_til_iso_array, pak_arkiv, udpak_arkiv
+from ekg_pyramide import PyramideBygger, _SamletWriter
+from ekg_retention import Komprimering, arkiver_session, frigiv_plads, komprimer, omstil, saml_uden_session
+
+DAG_NS = 86400 * 10 ** 9
+NU_NS = 1_700_000_000_000_000_000
+
+
+class StopEfterFørste(threading.Event):
+    # Stop der sættes ved første pause, som når Komprimering stoppes midt i et job
+    def wait(self, timeout=None):
+        self.set()
+        return True
+
+
+class TestArkivFormat(unittest.TestCase):
+    def test_tabsfrit_med_overløb(self):
+        værdier = np.array([0, 32767, -32768, 32767, -5, 12], dtype=np.int16)
+        tider = NU_NS + np.array([0, 4_000_000, 8_000_000, 12_001_000, 16_000_000, 19_999_000])
+        udpakket, tider_ud = udpak_arkiv(*pak_arkiv(værdier, tider))
+        self.assertEqual(udpakket.tolist(), værdier.tolist())
+        self.assertEqual(tider_ud.tolist(), tider.tolist())
+
+    def test_mindre_end_rå_samples(self):
+        værdier = (500 + 300 * np.sin(np.arange(5000) / 20)).astype(np.int16)
+        data, tider = pak_arkiv(værdier, NU_NS + np.arange(5000) * 4_000_000)
+        self.assertLess(len(data) + len(tider), værdier.nbytes / 2)
+
+
+class TestRetention(unittest.TestCase):
+    def setUp(self):
+        self.mappe = tempfile.TemporaryDirectory()
+        self.sti = os.path.join(self.mappe.name, "test.db")
+        self.db = Database(self.sti)
+        self.conn = åbn_forbindelse(self.sti)
+
+    def tearDown(self):
+        self.conn.close()
+        self.db.luk()
+        self.mappe.cleanup()
+
+    # Opretter en afsluttet session med samples som rækker i Ekgdata, der sluttede for dage siden
+    def gammel_session(self, patient_id, værdier, dage):
+        session_id = self.db.ny_session(patient_id)
+        tider = NU_NS - int(dage * DAG_NS) + np.arange(len(værdier)) * 4_000_000
+        with self.conn:
+            self.conn.executemany("INSERT INTO Ekgdata (PatientID, Data, Tidspunkt, SessionID) VALUES (?, ?, ?, ?)",
+                                  zip([patient_id] * len(værdier), værdier, ns_til_iso_array(tider).tolist(),
+                                      [session_id] * len(værdier)))
+            self.conn.execute("UPDATE Sessions SET StartNs = ?, SlutNs = ?, Status = 'afsluttet' WHERE Id = ?",
+                              (int(tider[0]), int(tider[-1]), session_id))
+        return session_id
+
+    def antal(self, sql, parametre=()):
+        return self.conn.execute(sql, parametre).fetchone()[0]
+
+    def test_gamle_sessioner_arkiveres(self):
+        værdier = [(i * 7) % 1000 for i in range(12000)]
+        gammel = self.gammel_session(1, værdier, dage=40)
+        ny = self.gammel_session(1, [1, 2, 3], dage=2)
+        statistik = komprimer(self.conn, rå_dage=30, pause=0, nu_ns=NU_NS)
+        self.assertEqual((statistik["sessioner"], statistik["samples"], statistik["pyramider"]), (1, 12000, 1))
+
+        self.assertEqual(self.antal("SELECT COUNT(*) FROM Ekgdata WHERE SessionID = ?", (gammel,)), 0)
+        self.assertEqual(self.antal("SELECT COUNT(*) FROM Ekgdata WHERE SessionID = ?", (ny,)), 3)
+        self.assertEqual(self.antal("SELECT COUNT(*) FROM EkgArkiv WHERE SessionID = ?", (gammel,)), 3)
+        self.assertEqual(self.db.session(gammel)["Status"], "arkiveret")
+        self.assertEqual(self.db.session_samples(gammel).tolist(), værdier)
+        #Historikken har stadig en oversigt over den arkiverede session
+        self.assertGreater(self.antal("SELECT COUNT(*) FROM EkgPyramide WHERE PatientID = 1"), 0)
+        #Eksport læser arkivet som en almindelig session
+        info = ekg_eksport.eksporter_patient(self.sti, 1, os.path.join(self.mappe.name, "ud"))
+        self.assertEqual([(s["session"], s["antal"], s["kilde"]) for s in info],
+                         [(gammel, 12000, "arkiv"), (ny, 3, "rækker")])
+        #Anden kørsel har intet at lave
+        self.assertEqual(komprimer(self.conn, rå_dage=30, pause=0, nu_ns=NU_NS)["sessioner"], 0)
+
+    # Skriver pyramiden for de første antal samples i en session, som en måling der blev afbrudt undervejs
+    def delvis_pyramide(self, patient_id, session_id, antal):
+        værdier = self.db.session_samples(session_id)[:antal]
+        start = self.db.session(session_id)["StartNs"]
+        writer = _SamletWriter(self.conn)
+        bygger = PyramideBygger(writer, patient_id)
+        bygger.tilføj_mange(værdier, start + np.arange(antal) * 4_000_000)
+        bygger.flush()
+        writer.skriv()
+
+    def test_delvis_pyramide_bygges_om(self):
+        værdier = [(i * 7) % 1000 for i in range(12000)]
+        delvis = self.gammel_session(1, værdier, dage=40)
+        self.delvis_pyramide(1, delvis, 5000)
+        hel = self.gammel_session(2, værdier, dage=40)
+        self.delvis_pyramide(2, hel, 12000)
+        statistik = komprimer(self.conn, rå_dage=30, pause=0, nu_ns=NU_NS)
+        self.assertEqual((statistik["sessioner"], statistik["pyramider"]), (2, 1))
+        #Den delvise pyramide er erstattet, ikke suppleret, så hver sample ligger i præcis én spand
+        for patient_id in (1, 2):
+            self.assertEqual(self.antal("SELECT SUM(Antal) FROM EkgPyramide WHERE PatientID = ? AND Niveau = 10",
+                                        (patient_id,)), 1200)
+            self.assertEqual(self.antal("SELECT SUM(Antal) FROM EkgPyramide WHERE PatientID = ? AND Niveau = 1000",
+                                        (patient_id,)), 12)
+
+    # Skriver rækker uden session (som fra før Sessions fandtes) med start dage siden
+    def rækker_uden_session(self, patient_id, antal, dage):
+        tider = NU_NS - int(dage * DAG_NS) + np.arange(antal) * 4_000_000
+        with self.conn:
+            self.conn.executemany("INSERT INTO Ekgdata (PatientID, Data, Tidspunkt) VALUES (?, ?, ?)",
+                                  zip([patient_id] * antal, range(antal), ns_til_iso_array(tider).tolist()))
+
+    def test_rækker_uden_session_arkiveres(self):
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO Brugerdata (Id) VALUES (1)")
+        self.rækker_uden_session(1, 3000, dage=50)
+        self.rækker_uden_session(1, 2000, dage=40) #Ny måling efter en lang pause
+        self.rækker_uden_session(1, 500, dage=1) #Endnu ikke gammel nok
+        statistik = komprimer(self.conn, rå_dage=30, pause=0, nu_ns=NU_NS)
+        self.assertEqual((statistik["samlet"], statistik["sessioner"], statistik["samples"]), (2, 2, 5000))
+        self.assertEqual(self.antal("SELECT COUNT(*) FROM Ekgdata WHERE SessionID IS NULL"), 500)
+        sessioner = self.conn.execute("SELECT Id, Antal, Samplerate, Status FROM Sessions ORDER BY Id").fetchall()
+        self.assertEqual([(antal, status) for _, antal, _, status in sessioner], [(3000, "arkiveret"), (2000, "arkiveret")])
+        self.assertAlmostEqual(sessioner[0][2], 250, delta=0.01)
+        self.assertEqual(self.db.session_samples(sessioner[1][0]).tolist(), list(range(2000)))
+        #Anden kørsel har intet at lave
+        self.assertEqual(komprimer(self.conn, rå_dage=30, pause=0, nu_ns=NU_NS)["samlet"], 0)
+
+    def test_afbrudt_samling_fortsætter(self):
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO Brugerdata (Id) VALUES (1)")
+        self.rækker_uden_session(1, 3000, dage=40)
+        stop = StopEfterFørste() #Stopper efter første bid
+        grænse = NU_NS - 30 * DAG_NS
+        self.assertEqual(saml_uden_session(self.conn, grænse, stykke=1000, pause=0, stop=stop), 0)
+        self.assertEqual(self.antal("SELECT COUNT(*) FROM Ekgdata WHERE SessionID IS NULL"), 2000)
+        self.assertEqual(saml_uden_session(self.conn, grænse, stykke=1000, pause=0), 1)
+        self.assertEqual(self.conn.execute("SELECT Antal, Status FROM Sessions").fetchall(), [(3000, "afsluttet")])
+        self.assertEqual(self.antal("SELECT COUNT(DISTINCT SessionID) FROM Ekgdata"), 1)
+
+    def test_blokke_arkiveres(self):
+        session_id = self.db.ny_session(2)
+        writer = IngestWriter(self.sti).start()
+        blok = BlokWriter(writer, 2, session_id, 250)
+        for i in range(1300):
+            blok.tilføj(i % 200, NU_NS - 40 * DAG_NS + i * 4_000_000)
+        blok.flush()
+        writer.stop()
+        with self.conn:
+            self.conn.execute("UPDATE Sessions SET SlutNs = ?, Status = 'afsluttet' WHERE Id = ?",
+                              (NU_NS - 40 * DAG_NS + 1300 * 4_000_000, session_id))
+        self.assertEqual(komprimer(self.conn, rå_dage=30, pause=0, nu_ns=NU_NS)["samples"], 1300)
+        self.assertEqual(self.antal("SELECT COUNT(*) FROM EkgBlokke"), 0)
+        self.assertEqual(self.db.session_samples(session_id).tolist(), [i % 200 for i in range(1300)])
+
+    def test_afbrudt_kørsel_fortsætter(self):
+        værdier = list(range(3000))
+        session_id = self.gammel_session(1, værdier, dage=40)
+        stop = threading.Event()
+        stop.set() #Stopper efter første bid
+        self.assertIsNone(arkiver_session(self.conn, 1, session_id, stykke=1000, pause=0, stop=stop))
+        self.assertEqual(self.antal("SELECT COUNT(*) FROM Ekgdata"), 2000)
+        self.assertEqual(self.db.session(session_id)["Status"], "afsluttet")
+        self.assertEqual(komprimer(self.conn, rå_dage=30, stykke=1000, pause=0, nu_ns=NU_NS)["samples"], 2000)
+        self.assertEqual(self.db.session_samples(session_id).tolist(), værdier)
+
+    def test_plads_frigives(self):
+        self.gammel_session(1, list(range(50000)), dage=40)
+        sider_før = self.antal("PRAGMA page_count")
+        statistik = komprimer(self.conn, rå_dage=30, pause=0, nu_ns=NU_NS)
+        self.assertGreater(statistik["sider_frigivet"], 0)
+        self.assertEqual(self.antal("PRAGMA freelist_count"), 0)
+        self.assertLess(self.antal("PRAGMA page_count"), sider_før / 2)
+
+    def test_baggrundstråd(self):
+        self.gammel_session(1, list(range(2000)), dage=40)
+        komprimering = Komprimering(self.sti, rå_dage=30, pause=0).start()
+        for _ in range(100):
+            if komprimering.kørsler:
+                break
+            threading.Event().wait(0.05)
+        komprimering.stop()
+        self.assertEqual(komprimering.seneste["sessioner"], 1)
+        self.assertEqual(komprimering.fejl, 0)
+
+
+class TestOmstil(unittest.TestCase):
+    def test_gammel_database_uden_auto_vacuum(self):
+        with tempfile.TemporaryDirectory() as mappe:
+            sti = os.path.join(mappe, "gammel.db")
+            conn = sqlite3.connect(sti)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("CREATE TABLE T (X)")
+            conn.close()
+            conn = åbn_forbindelse(sti)
+            self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 0)
+            self.assertEqual(frigiv_plads(conn), 0) #Uden auto_vacuum genbruges frie sider blot
+            conn.close()
+            self.assertTrue(omstil(sti))
+
+
+if __name__ == '__main__':
+    unittest.main()
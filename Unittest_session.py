@@ -0,0 +1,106 @@
+import unittest
+import sqlite3
+import tempfile
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import ekg_database
+import ekg_lagring
+from ekg_database import Database
+from ekg_session import SessionStatistik
+from ekg_signal import StreamingQRS, syntetisk_ekg
+
+
+class TestSessionStatistik(unittest.TestCase):
+    def test_summer_svarer_til_numpy(self):
+        rr = np.array([0.8, 0.82, 0.79, 1.0, 0.75, 0.9])
+        statistik = SessionStatistik(1, 250)
+        statistik.tilføj(np.array([1000, 2000, 3000]))
+        statistik.tilføj(np.array([4000]))
+        statistik.slag_fundet(None) #Første slag har intet RR-interval
+        for r in rr:
+            statistik.slag_fundet(r)
+        o = statistik.opsummering()
+        self.assertEqual((o["StartNs"], o["SlutNs"], o["Antal"], o["Slag"]), (1000, 4000, 4, 7))
+        self.assertAlmostEqual(o["RRGns"], rr.mean())
+        self.assertAlmostEqual(o["RRStd"], rr.std(ddof=1))
+        self.assertAlmostEqual(o["PulsGns"], (60 / rr).mean())
+        self.assertAlmostEqual(o["PulsMin"], 60)
+        self.assertAlmostEqual(o["PulsMaks"], 80)
+
+    def test_slag_fra_detektor(self):
+        signal, r_tider = syntetisk_ekg(fs=250, sekunder=20, puls=75)
+        detektor = StreamingQRS(fs=250)
+        statistik = SessionStatistik(1, 250)
+        for v in signal:
+            if detektor.tilføj(v) is not None:
+                statistik.slag_fundet(detektor.nyt_rr)
+        o = statistik.opsummering()
+        self.assertEqual(o["Slag"], detektor.antal_slag)
+        self.assertAlmostEqual(o["PulsGns"], 75, delta=3)
+
+
+class TestSessionerIDatabasen(unittest.TestCase):
+    def setUp(self):
+        self.mappe = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.mappe.name, "test.db"))
+
+    def tearDown(self):
+        self.db.luk()
+        self.mappe.cleanup()
+
+    def test_start_og_afslut(self):
+        første = self.db.ny_session(1, "COM3", samplerate=250)
+        anden = self.db.ny_session(1, "COM3", samplerate=250)
+        self.assertNotEqual(første, anden)
+        self.assertEqual(self.db.session(anden)["Status"], "aktiv")
+
+        statistik = SessionStatistik(anden, 249.5)
+        statistik.tilføj(np.array([10 ** 9, 61 * 10 ** 9]))
+        statistik.slag_fundet(None)
+        statistik.slag_fundet(1.0)
+        self.db.afslut_session(statistik)
+
+        sessioner = self.db.sessioner(1, 5)
+        self.assertEqual([s["Id"] for s in sessioner], [anden, første])
+        s = sessioner[0]
+        self.assertEqual((s["Port"], s["Status"], s["Antal"], s["Slag"]), ("COM3", "afsluttet", 2, 2))
+        self.assertEqual(s["Samplerate"], 249.5)
+        self.assertAlmostEqual(s["PulsGns"], 60)
+        self.assertEqual(self.db.sessioner(2, 5), [])
+
+    def test_pulsmåling_med_session(self):
+        session_id = self.db.ny_session(1)
+        self.db.ny_pulsmåling(1, 72, session_id)
+        self.assertEqual(self.db.hent_en("SELECT SessionID FROM Pulsmålinger")[0], session_id)
+
+
+class TestMigrering(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_blokke_får_sessioner(self):
+        # Database fra før sessionerne (version 4) med blokke fra to målinger
+        ekg_database._grundtabeller(self.conn.cursor())
+        ekg_lagring.opret_blok_tabel(self.conn.cursor())
+        for session_id, puls in ((1, 60), (1, 70), (2, 80)):
+            self.conn.execute(ekg_lagring.INSERT_BLOK, (3, session_id, session_id * 10 ** 9, session_id * 10 ** 9 + 10 ** 9,
+                                                        250.0, 250, puls, ekg_lagring.pak_samples([0] * 250)))
+        self.conn.execute("PRAGMA user_version = 4")
+        self.conn.commit()
+
+        ekg_database.opret_schema(self.conn)
+        rækker = self.conn.execute("SELECT Id, PatientID, Antal, PulsMin, PulsMaks, Status FROM Sessions ORDER BY Id").fetchall()
+        self.assertEqual(rækker, [(1, 3, 500, 60, 70, "afsluttet"), (2, 3, 250, 80, 80, "afsluttet")])
+        kolonner = [r[1] for r in self.conn.execute("PRAGMA table_info(Ekgdata)")]
+        self.assertIn("SessionID", kolonner)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+from datetime import datetime, timedelta
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import ekg_signal
+
+
+class TestLøbendeSum(unittest.TestCase):
+    def test_sum_over_vindue(self):
+        løbende = ekg_signal.LøbendeSum(3)
+        for værdi in [1, 2, 3, 4, 5]:
+            løbende.tilføj(værdi)
+        self.assertEqual(løbende.sum, 12)
+        self.assertEqual(løbende.gennemsnit(), 4)
+
+
+class TestStreamingQRS(unittest.TestCase):
+    def test_finder_slag_i_syntetisk_ekg(self):
+        for fs, puls in [(250, 72), (1000, 110), (100, 50)]:
+            signal, r_tider = ekg_signal.syntetisk_ekg(fs=fs, sekunder=20, puls=puls)
+            detektor = ekg_signal.StreamingQRS(fs=fs)
+            tak = np.array(detektor.tilføj_mange(signal)) / fs
+
+            # Hvert fundet slag skal ligge tæt på et rigtigt R-tak
+            afstand = np.abs(tak[:, None] - r_tider[None, :]).min(axis=1)
+            self.assertTrue((afstand < 0.05).all(), (fs, puls))
+            self.assertGreaterEqual(len(tak), len(r_tider[r_tider > 2.5]))
+            self.assertAlmostEqual(detektor.puls(), puls, delta=2)
+
+    def test_ingen_puls_uden_slag(self):
+        detektor = ekg_signal.StreamingQRS(fs=250)
+        detektor.tilføj_mange([500.0] * 1000)
+        self.assertIsNone(detektor.puls())
+        self.assertEqual(detektor.antal_slag, 0)
+
+    def test_rr_ud_fra_tidsstempler(self):
+        # Samples kommer reelt med 100 Hz selvom detektoren er sat til 250 Hz
+        signal, _ = ekg_signal.syntetisk_ekg(fs=100, sekunder=20, puls=60)
+        tider = (np.arange(len(signal)) * 10_000_000).tolist()
+        detektor = ekg_signal.StreamingQRS(fs=250)
+        detektor.tilføj_mange(signal, tider)
+        self.assertAlmostEqual(detektor.puls(), 60, delta=2)
+
+    def test_puls_fra_buffer(self):
+        signal, _ = ekg_signal.syntetisk_ekg(fs=250, sekunder=10, puls=60)
+        sekunder = np.arange(len(signal)) / 250
+        self.assertAlmostEqual(ekg_signal.puls_fra_buffer(signal, sekunder), 60, delta=1)
+
+
+class TestBidQRS(unittest.TestCase):
+    # Kører detektoren over signalet i bidder af stykke samples
+    def find(self, signal, fs, stykke):
+        detektor = ekg_signal.BidQRS(fs=fs)
+        tak = [detektor.tilføj(signal[i:i + stykke]) for i in range(0, len(signal), stykke)]
+        tak.append(detektor.tilføj(np.empty(0), slut=True))
+        return np.concatenate(tak)
+
+    def test_finder_slag_i_syntetisk_ekg(self):
+        for fs, puls, variation in [(250, 72, 0.0), (500, 45, 0.1), (250, 150, 0.05)]:
+            signal, r_tider = ekg_signal.syntetisk_ekg(fs=fs, sekunder=120, puls=puls, variation=variation)
+            tak = self.find(signal, fs, 10 ** 6) / fs
+            afstand = np.abs(tak[:, None] - r_tider[None, :]).min(axis=1)
+            self.assertTrue((afstand < 0.03).all(), (fs, puls))
+            self.assertGreaterEqual(len(tak), len(r_tider) - 1)
+
+    def test_uafhængig_af_bidderne(self):
+        signal, _ = ekg_signal.syntetisk_ekg(fs=250, sekunder=120, puls=80, variation=0.05, ekstraslag=0.1)
+        hele = self.find(signal, 250, len(signal))
+        for stykke in (2000, 3001, 7777):
+            self.assertEqual(self.find(signal, 250, stykke).tolist(), hele.tolist(), stykke)
+
+    def test_ingen_slag_i_fladt_signal(self):
+        self.assertEqual(len(self.find(np.full(5000, 500.0), 250, 1000)), 0)
+
+    def test_rr_og_puls(self):
+        r_tider = np.array([0, 1000, 2000, 2100, 3000, 4000]) * 1_000_000
+        rr, puls = ekg_signal.rr_og_puls(r_tider)
+        self.assertTrue(np.isnan(rr[0]) and np.isnan(rr[3]) and np.isnan(puls[0]))
+        self.assertEqual(rr[[1, 2, 4, 5]].tolist(), [1.0, 1.0, 0.9, 1.0])
+        #Det ugyldige interval (100 ms) ændrer ikke pulsen
+        self.assertEqual(puls[3], puls[2])
+        self.assertAlmostEqual(puls[5], 60 / np.mean([1.0, 1.0, 0.9, 1.0]))
+
+
+class TestTidsstempler(unittest.TestCase):
+    def test_datetimes_til_ns(self):
+        start = datetime(2024, 1, 1, 12, 0, 0)
+        tider = [start + timedelta(milliseconds=4 * i) for i in range(3)]
+        ns = ekg_signal.datetimes_til_ns(tider)
+        self.assertEqual(ns.dtype, np.int64)
+        self.assertEqual(np.diff(ns).tolist(), [4_000_000, 4_000_000])
+
+    def test_puls_fra_ns_svarer_til_datetime_vejen(self):
+        signal, _ = ekg_signal.syntetisk_ekg(fs=250, sekunder=10, puls=80)
+        start = datetime(2024, 1, 1, 12, 0, 0)
+        tider = [start + timedelta(milliseconds=4 * i) for i in range(len(signal))]
+        sekunder = np.array([(t - tider[0]).total_seconds() for t in tider])
+        forventet = ekg_signal.puls_fra_buffer(signal, sekunder)
+        self.assertAlmostEqual(ekg_signal.puls_fra_ns(signal, ekg_signal.datetimes_til_ns(tider)), forventet)
+
+    def test_puls_fra_ns_for_lidt_data(self):
+        self.assertIsNone(ekg_signal.puls_fra_ns([1.0, 2.0], [0, 1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
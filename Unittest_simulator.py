@@ -0,0 +1,148 @@
+import unittest
+import tempfile
+import threading
+import time
+import sys
+import os
+
+import numpy as np
+import serial
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from ekg_daemon import Datahandler, åbn_port
+from ekg_database import Database
+from ekg_protokol import BinærLæser, TekstLæser, pak_frame
+from ekg_simulator import SimServer, SimuleretPort, pak_frames, syntetisk_kilde, åbn_simulator
+from ekg_signal import StreamingQRS, syntetisk_ekg
+
+
+# Læser fra læseren indtil der er mindst antal samples (højst sekunder)
+def læs_samples(læser, antal, sekunder=5.0):
+    værdier, tællere = [], []
+    slut = time.monotonic() + sekunder
+    while sum(len(v) for v in værdier) < antal and time.monotonic() < slut:
+        v, _, t = læser.læs()
+        værdier.append(v)
+        tællere.append(t)
+    return np.concatenate(værdier), np.concatenate(tællere)
+
+
+class TestSimuleretPort(unittest.TestCase):
+    def test_frames_som_pak_frame(self):
+        værdier = np.arange(30) - 15
+        forventet = b"".join(pak_frame(s, værdier[i * 10:(i + 1) * 10]) for i, s in enumerate((7, 8, 65535)))
+        self.assertEqual(pak_frames(np.array([7, 8, 65535]), værdier), forventet)
+
+    def test_tekst_afspiller_signalet_i_ring(self):
+        port = SimuleretPort(np.arange(100), fs=250, hastighed=0)
+        værdier, tællere = læs_samples(TekstLæser(port), 250)
+        self.assertEqual(tællere[:250].tolist(), list(range(250)))
+        self.assertEqual(værdier[:250].tolist(), [i % 100 for i in range(250)])
+        port.close()
+
+    def test_binær_med_udfald(self):
+        port = SimuleretPort(np.arange(1000), fs=100, protokol="binær", hastighed=0, udfald=(1.0, 0.2))
+        læser = BinærLæser(port, 100)
+        værdier, tællere = læs_samples(læser, 400)
+        #Hvert sekund tabes de sidste 0,2 s (20 samples = 2 frames), og tælleren løber videre
+        self.assertTrue(np.all(tællere % 100 < 80))
+        self.assertEqual(værdier.tolist(), (tællere % 1000).tolist())
+        self.assertGreater(læser.statistik()["tabte_frames"], 0)
+        self.assertEqual(læser.statistik()["checksum_fejl"], 0)
+        port.close()
+
+    def test_tempo_og_byger(self):
+        port = SimuleretPort(np.zeros(10), fs=1000, byger=(0.2, 0.1), timeout=0)
+        time.sleep(0.12) #Midt i den første byge: kun de første 100 ms er sendt
+        self.assertEqual(port.read(100000).count(b"\n"), 100)
+        time.sleep(0.1) #Bygen er slut, og det tilbageholdte sendes samlet
+        self.assertGreaterEqual(port.read(100000).count(b"\n"), 100)
+        port.close()
+
+    def test_afbrydelse(self):
+        port = SimuleretPort(np.zeros(10), afbryd_efter=0.0)
+        with self.assertRaises(serial.SerialException):
+            port.read(10)
+
+    def test_syntetisk_kilde_uden_spring_ved_samlingen(self):
+        signal = syntetisk_kilde(fs=250, puls=60, sekunder=20)
+        detektor = StreamingQRS(fs=250)
+        rr = []
+        for v in np.tile(signal, 3):
+            if detektor.tilføj(v) is not None and detektor.nyt_rr:
+                rr.append(detektor.nyt_rr)
+        self.assertGreater(len(rr), 40)
+        self.assertTrue(all(0.95 < x < 1.05 for x in rr))
+
+    def test_ekstraslag(self):
+        _, r_tider = syntetisk_ekg(fs=250, sekunder=60, puls=60, ekstraslag=0.2, seed=1)
+        rr = np.diff(r_tider)
+        self.assertTrue(np.any(rr < 0.7)) #For tidlige slag
+        self.assertTrue(np.any(rr > 1.3)) #Kompenserende pauser
+        _, normale = syntetisk_ekg(fs=250, sekunder=60, puls=60, seed=1)
+        self.assertTrue(np.allclose(np.diff(normale), 1.0))
+
+
+class TestAdresser(unittest.TestCase):
+    def test_felter(self):
+        port = åbn_simulator("sim://?puls=90&fs=500&protokol=binær&udfald=10,0.5&hastighed=0", protokol="tekst")
+        self.assertEqual((port.fs, port.protokol, port.udfald, port.hastighed), (500, "binær", (10, 0.5), 0))
+        port.close()
+        with self.assertRaises(ValueError):
+            åbn_simulator("sim://?pulse=90")
+        with self.assertRaises(ValueError):
+            åbn_simulator("sim://?udfald=1,2")
+
+    def test_afspil_session_fra_databasen(self):
+        with tempfile.TemporaryDirectory() as mappe:
+            sti = os.path.join(mappe, "test.db")
+            db = Database(sti)
+            session_id = db.ny_session(3)
+            with db.forbindelse() as conn:
+                conn.executemany("INSERT INTO Ekgdata (PatientID, Data, Tidspunkt, SessionID) VALUES (3, ?, '', ?)",
+                                 [(v, session_id) for v in (5, 6, 7)])
+            db.luk()
+            port = åbn_port(f"sim://?db={sti}&session={session_id}&hastighed=0")
+            værdier, _ = læs_samples(TekstLæser(port), 6)
+            self.assertEqual(værdier[:6].tolist(), [5, 6, 7, 5, 6, 7])
+            port.close()
+
+
+class TestMedDatahandler(unittest.TestCase):
+    def test_måling_fra_simulator(self):
+        with tempfile.TemporaryDirectory() as mappe:
+            db = Database(os.path.join(mappe, "test.db"))
+            stop = threading.Event()
+            handler = Datahandler(1, stop, db=db, protokol="binær")
+            tråd = threading.Thread(target=handler.serialdata, args=("sim://?puls=75",))
+            tråd.start()
+            time.sleep(6.0)
+            stop.set()
+            tråd.join()
+            session = db.session(handler.session_id)
+            self.assertGreater(session["Antal"], 1400)
+            self.assertAlmostEqual(session["PulsGns"], 75, delta=5)
+            #Pulsen og HRV for hele målingen gemmes af Datahandler når sessionen lukkes
+            puls, sdnn, rmssd = db.hent_en("SELECT Puls, SDNN, RMSSD FROM Pulsmålinger WHERE SessionID = ?",
+                                           (handler.session_id,))
+            self.assertAlmostEqual(puls, 75, delta=5)
+            self.assertIsNotNone(sdnn)
+            self.assertIsNotNone(rmssd)
+            self.assertEqual(handler.helbred.hrv["sdnn_ms"], sdnn)
+            db.luk()
+
+    def test_tcp_server(self):
+        server = SimServer("sim://?hastighed=0", protokol="binær")
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            port = serial.serial_for_url("socket://127.0.0.1:%d" % server.server_address[1], timeout=0.05)
+            værdier, tællere = læs_samples(BinærLæser(port), 1000)
+            self.assertEqual(tællere[:1000].tolist(), list(range(1000)))
+            port.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
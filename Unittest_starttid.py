@@ -0,0 +1,41 @@
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from ekg_starttid import fortolk_importtime, mål_starttid, rapport, tjek
+
+EKSEMPEL = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:      2000 |       5000 | numpy
+import time:       800 |       3000 |   numpy.core
+import time:       300 |        300 | ekg_tabel
+"""
+
+
+class TestStarttid(unittest.TestCase):
+    def test_fortolk_importtime(self):
+        målinger = fortolk_importtime(EKSEMPEL + "anden linje\n")
+        self.assertEqual(målinger, [("_io", 120, 120, 1), ("numpy", 2000, 5000, 0),
+                                    ("numpy.core", 800, 3000, 1), ("ekg_tabel", 300, 300, 0)])
+        self.assertEqual(rapport(12.0, målinger, top=1).splitlines(), ["Import af GUI: 12 ms", "       5.0 ms  numpy"])
+
+    def test_tjek(self):
+        målinger = fortolk_importtime(EKSEMPEL)
+        self.assertEqual(tjek(100, målinger, budget_ms=200), [])
+        self.assertEqual(len(tjek(300, målinger, budget_ms=200)), 1)
+        self.assertEqual(tjek(100, målinger, budget_ms=200, forbudte=("numpy",)), ["numpy importeres ved start"])
+
+    def test_gui_importerer_ikke_tunge_moduler(self):
+        try:
+            import tkinter #noqa: F401
+        except ImportError:
+            self.skipTest("tkinter er ikke installeret")
+        samlet_ms, målinger = mål_starttid()
+        self.assertIsNotNone(samlet_ms)
+        #Kun de forbudte moduler tjekkes her, da tiden afhænger af maskinen
+        self.assertEqual(tjek(samlet_ms, målinger, budget_ms=float("inf")), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import tempfile
+from datetime import datetime, timedelta
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import ekg_lagring
+from ekg_database import Database
+from ekg_tabel import EkgSider
+
+
+class ListeWriter():
+    # Simpel writer der udfører rækkerne direkte mod en forbindelse
+    def __init__(self, conn):
+        self.conn = conn
+
+    def tilføj(self, række, sql, samples=1):
+        self.conn.execute(sql, række)
+
+
+class TestEkgSider(unittest.TestCase):
+    def setUp(self):
+        self.mappe = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.mappe.name, "test.db"))
+        self.start = datetime(2024, 1, 1, 12, 0, 0)
+        conn = self.db.forbindelse()
+        with conn:
+            # To patienter flettet sammen, så siderne skal holde sig til én patient
+            for i in range(1000):
+                for pid in (1, 2):
+                    tid = (self.start + timedelta(milliseconds=4 * i)).isoformat(timespec='microseconds')
+                    conn.execute("INSERT INTO Ekgdata (PatientID, Data, Tidspunkt, Puls) VALUES (?, ?, ?, ?)",
+                                 (pid, float(i), tid, 60))
+
+    def tearDown(self):
+        self.db.luk()
+        self.mappe.cleanup()
+
+    def test_sider_nyeste_først_uden_huller(self):
+        sider = EkgSider(self.db, 1, side_størrelse=300)
+        data = []
+        rækker = sider.første_side()
+        while rækker:
+            data += [række[2] for række in rækker]
+            rækker = sider.næste_side()
+        self.assertTrue(sider.slut)
+        self.assertEqual(data, [float(i) for i in range(999, -1, -1)])
+
+    def test_hop_til_tidspunkt(self):
+        sider = EkgSider(self.db, 1, side_størrelse=10)
+        rækker = sider.hop_til(self.start + timedelta(milliseconds=4 * 500 + 1))
+        self.assertEqual([række[2] for række in rækker], [float(i) for i in range(500, 490, -1)])
+        self.assertEqual(sider.næste_side()[0][2], 490.0)
+        self.assertEqual(sider.hop_til(self.start - timedelta(seconds=1)), [])
+
+    def test_blokke(self):
+        conn = self.db.forbindelse()
+        start_ns = int(self.start.timestamp() * 1e9)
+        with conn:
+            blok = ekg_lagring.BlokWriter(ListeWriter(conn), 3, 1, samplerate=100)
+            for i in range(350):
+                blok.tilføj(i, start_ns + 10_000_000 * i, puls=70)
+            blok.flush()
+
+        sider = EkgSider(self.db, 3, blokke=True, side_størrelse=150)
+        første = sider.første_side()
+        self.assertEqual([række[2] for række in første], list(range(349, 199, -1)))  # Hele blokke (50 + 100)
+        self.assertEqual(første[0][1], 70)
+
+        rækker = sider.hop_til(datetime.fromtimestamp((start_ns + 10_000_000 * 120) / 1e9))
+        self.assertEqual([række[2] for række in rækker], list(range(120, -1, -1)))
+        self.assertEqual(sider.næste_side(), [])
+        self.assertTrue(sider.slut)
+
+
+if __name__ == '__main__':
+    unittest.main()
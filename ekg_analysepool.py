@@ -0,0 +1,142 @@
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ekg_metrik import metrik
+from ekg_signal import rr_fra_buffer
+
+
+# Arbejderprocessens del: læser samples fra shared memory og finder RR-intervaller og puls.
+# Arrays der peger ind i den delte hukommelse skal være væk inden den lukkes
+def _analyser(navn, antal, kapacitet):
+    shm = shared_memory.SharedMemory(name=navn)
+    try:
+        værdier = np.ndarray((kapacitet,), dtype=np.float64, buffer=shm.buf)[:antal]
+        tider = np.ndarray((kapacitet,), dtype=np.int64, buffer=shm.buf, offset=8 * kapacitet)[:antal]
+        sekunder = (tider - tider[0]) / 1e9 #Tid i sek ifht 1. måling
+        rr = rr_fra_buffer(værdier, sekunder) if antal >= 10 else np.empty(0)
+        del værdier, tider
+    finally:
+        shm.close()
+    puls = 60 / np.mean(rr[-5:]) if len(rr) else None #Gennemsnit fra sidste 5 intervaller
+    return {"puls": puls, "rr": rr.tolist()}
+
+
+class AnalysePool():
+    # Kører pulsanalysen (SciPy) i separate processer, så hverken GUI'en eller målingen venter på den.
+    # Samples kopieres ind i en af maks_ventende shared memory pladser, og kun pladsens navn sendes med.
+    # Er alle pladser optaget kasseres analysen (backpressure), og den næste forsøges i stedet
+    def __init__(self, arbejdere=1, kapacitet=5000, maks_ventende=2, kontekst="spawn"):
+        self.arbejdere = arbejdere
+        self.kapacitet = kapacitet #Maks antal samples pr. analyse
+        self.maks_ventende = maks_ventende #Antal analyser der må være undervejs på én gang
+        self.kontekst = kontekst #spawn undgår fork af en proces med tråde (Tkinter, Datahandler)
+        self._executor = None
+        self._pladser = [] #Shared memory pladser
+        self._ledige = [] #Indeks for ledige pladser
+        self._lås = threading.Lock()
+        self._sekvens = 0
+        self._resultater = {} #nøgle -> seneste resultat
+
+        #Statistik
+        self.sendt = 0
+        self.tabte = 0
+        self.færdige = 0
+        self.fejl = 0
+        self.latens_ms = 0.0 #Tid fra send til resultat for seneste analyse
+
+    # Starter arbejderprocesserne og opretter de delte hukommelsespladser
+    def start(self):
+        if self._executor is not None:
+            return self
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        self._executor = ProcessPoolExecutor(max_workers=self.arbejdere,
+                                             mp_context=multiprocessing.get_context(self.kontekst))
+        for i in range(self.maks_ventende):
+            shm = shared_memory.SharedMemory(create=True, size=16 * self.kapacitet)
+            værdier = np.ndarray((self.kapacitet,), dtype=np.float64, buffer=shm.buf)
+            tider = np.ndarray((self.kapacitet,), dtype=np.int64, buffer=shm.buf, offset=8 * self.kapacitet)
+            self._pladser.append((shm, værdier, tider))
+            self._ledige.append(i)
+        return self
+
+    # Sender de seneste samples til analyse. Returnerer False hvis analysen blev kasseret
+    def send(self, nøgle, værdier, tider_ns):
+        if self._executor is None:
+            self.start()
+        værdier = np.asarray(værdier, dtype=np.float64)[-self.kapacitet:]
+        tider_ns = np.asarray(tider_ns, dtype=np.int64)[-self.kapacitet:]
+        antal = len(værdier)
+
+        with self._lås:
+            if not self._ledige: #Arbejderne er bagud, så denne analyse springes over
+                self.tabte += 1
+                metrik.tæl("analyser_sprunget_over")
+                return False
+            plads = self._ledige.pop()
+            self._sekvens += 1
+            sekvens = self._sekvens
+            self.sendt += 1
+
+        shm, delte_værdier, delte_tider = self._pladser[plads]
+        delte_værdier[:antal] = værdier
+        delte_tider[:antal] = tider_ns
+        start = time.perf_counter()
+        try:
+            fremtid = self._executor.submit(_analyser, shm.name, antal, self.kapacitet)
+        except RuntimeError as e: #Poolen er lukket
+            print("Analysefejl:", e)
+            with self._lås:
+                self._ledige.append(plads)
+            return False
+        fremtid.add_done_callback(lambda f: self._færdig(f, plads, nøgle, sekvens, start))
+        return True
+
+    # Kaldes når en analyse er færdig. Pladsen frigives og kun nyere resultater gemmes
+    def _færdig(self, fremtid, plads, nøgle, sekvens, start):
+        with self._lås:
+            self._ledige.append(plads)
+            if fremtid.cancelled():
+                return
+            try:
+                resultat = fremtid.result()
+            except Exception as e:
+                self.fejl += 1
+                print("Analysefejl:", e)
+                return
+            self.færdige += 1
+            self.latens_ms = (time.perf_counter() - start) * 1000
+            metrik.registrer("analyse", self.latens_ms * 1e6) #find_peaks i arbejderen inkl. ventetid
+            gammel = self._resultater.get(nøgle)
+            if gammel is None or gammel["sekvens"] < sekvens:
+                resultat["sekvens"] = sekvens
+                self._resultater[nøgle] = resultat
+
+    # Returnerer seneste resultat for nøglen ({"puls", "rr", "sekvens"}) eller None
+    def resultat(self, nøgle):
+        with self._lås:
+            return self._resultater.get(nøgle)
+
+    # Statistik over sendte, kasserede og færdige analyser
+    def statistik(self):
+        with self._lås:
+            return {"sendt": self.sendt, "tabte": self.tabte, "færdige": self.færdige, "fejl": self.fejl,
+                    "ventende": self.maks_ventende - len(self._ledige) if self._executor else 0,
+                    "latens_ms": self.latens_ms}
+
+    # Stopper arbejderne og frigiver den delte hukommelse
+    def luk(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+        #numpy arrays der peger ind i hukommelsen skal slippes før den kan lukkes
+        delte = [shm for shm, _, _ in self._pladser]
+        self._pladser = []
+        self._ledige = []
+        for shm in delte:
+            shm.close()
+            shm.unlink()
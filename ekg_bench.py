@@ -0,0 +1,372 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from ekg_signal import StreamingQRS, puls_find_peaks, puls_fra_buffer, syntetisk_ekg
+
+
+# Henter en optaget måling fra databasen (rækker i Ekgdata eller blokke i EkgBlokke)
+def hent_optagelse(db_sti, patient_id, antal=None):
+    conn = sqlite3.connect(db_sti)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT Data FROM Ekgdata WHERE PatientID = ? ORDER BY Id", (patient_id,))
+        signal = np.array([r[0] for r in cursor.fetchall()], dtype=np.float64)
+        if not len(signal):
+            from ekg_lagring import udpak_samples
+            cursor.execute("SELECT Data FROM EkgBlokke WHERE PatientID = ? ORDER BY Id", (patient_id,))
+            blokke = [udpak_samples(r[0]) for r in cursor.fetchall()]
+            signal = np.concatenate(blokke).astype(np.float64) if blokke else signal
+    finally:
+        conn.close()
+    return signal[:antal] if antal else signal
+
+
+# Datahandler's oprindelige vej: find_peaks over en deque på 300 efter hver sample (når der er 100)
+def bench_datahandler_find_peaks(signal, fs):
+    buffer = deque(maxlen=300)
+    puls = None
+    start = time.perf_counter()
+    for værdi in signal:
+        buffer.append(værdi)
+        if len(buffer) >= 100:
+            puls = puls_find_peaks(buffer, fs)
+    varighed = time.perf_counter() - start
+    return {"us_pr_sample": varighed / len(signal) * 1e6, "puls": puls}
+
+
+# PageOne's oprindelige vej: lavpas og find_peaks over bufferen på op til 5000 samples pr. GUI opdatering
+def bench_pageone_find_peaks(signal, fs, samples_pr_opdatering=1, maks_opdateringer=2000):
+    sekunder = np.arange(len(signal)) / fs
+    puls = None
+    opdateringer = 0
+    start = time.perf_counter()
+    for slut in range(samples_pr_opdatering, len(signal) + 1, samples_pr_opdatering):
+        a = max(0, slut - 5000)
+        puls = puls_fra_buffer(signal[a:slut], sekunder[a:slut])
+        opdateringer += 1
+        if opdateringer >= maks_opdateringer: #Begrænser køretiden, resultatet er pr. opdatering
+            break
+    varighed = time.perf_counter() - start
+    return {"us_pr_sample": varighed / (opdateringer * samples_pr_opdatering) * 1e6,
+            "ms_pr_opdatering": varighed / opdateringer * 1000, "puls": puls}
+
+
+# Den streamende detektor: én sample ad gangen
+def bench_streaming(signal, fs):
+    detektor = StreamingQRS(fs=fs)
+    start = time.perf_counter()
+    tak = detektor.tilføj_mange(signal.tolist())
+    varighed = time.perf_counter() - start
+    return {"us_pr_sample": varighed / len(signal) * 1e6, "puls": detektor.puls(), "slag": len(tak)}
+
+
+# Kører alle tre pulsberegninger på samme signal og udskriver resultatet
+def bench_qrs(signal, fs, navn):
+    print(f"{navn}: {len(signal)} samples ved {fs} Hz")
+    resultater = {
+        "datahandler_find_peaks": bench_datahandler_find_peaks(signal, fs),
+        "pageone_find_peaks": bench_pageone_find_peaks(signal, fs),
+        "streaming_qrs": bench_streaming(signal, fs),
+    }
+    for vej, res in resultater.items():
+        puls = f"{res['puls']:.1f}" if res["puls"] else "--"
+        print(f"  {vej:24s} {res['us_pr_sample']:9.2f} us/sample   puls {puls}")
+    return resultater
+
+
+# Median og 95% fraktil i ms for et kald (efter ét opvarmningskald)
+def tidtag(funktion, gentagelser=50):
+    funktion()
+    tider = []
+    for _ in range(gentagelser):
+        start = time.perf_counter()
+        funktion()
+        tider.append((time.perf_counter() - start) * 1000)
+    return float(np.median(tider)), float(np.percentile(tider, 95))
+
+
+# Serialdata's læsning: afkodning af tekst- og binærprotokollen fra simulatoren så hurtigt som muligt
+def bench_parse(samples=50000, fs=250):
+    from ekg_protokol import BinærLæser, TekstLæser
+    from ekg_simulator import SimuleretPort, syntetisk_kilde
+
+    signal = syntetisk_kilde(fs=fs)
+    resultater = {}
+    for protokol, læser_type in (("tekst", TekstLæser), ("binær", BinærLæser)):
+        port = SimuleretPort(signal, fs, protokol, hastighed=0, timeout=0)
+        læser = læser_type(port, fs)
+        læst = 0
+        start = time.perf_counter()
+        while læst < samples:
+            læst += len(læser.læs()[0])
+        varighed = time.perf_counter() - start
+        port.close()
+        resultater[f"{protokol}_samples_pr_s"] = læst / varighed
+    return resultater
+
+
+# Indsættelse i Ekgdata gennem IngestWriter (samme SQL og batching som Datahandler) og blokvis i EkgBlokke
+def bench_insert(db_sti, rækker=50000):
+    from ekg_database import INSERT_EKGDATA_SESSION, Database
+    from ekg_ingest import IngestWriter
+    from ekg_lagring import BlokWriter
+
+    Database(db_sti).luk() #Opretter tabellerne
+    tidspunkt = "2024-01-01T00:00:00.000000"
+    writer = IngestWriter(db_sti).start()
+    start = time.perf_counter()
+    for i in range(rækker):
+        writer.tilføj((1, float(i % 1000), tidspunkt, 70, 1), sql=INSERT_EKGDATA_SESSION)
+    writer.stop()
+    række_tid = time.perf_counter() - start
+
+    writer = IngestWriter(db_sti).start()
+    blok = BlokWriter(writer, 2, 2, 250)
+    start = time.perf_counter()
+    for i in range(rækker):
+        blok.tilføj(float(i % 1000), 1_700_000_000_000_000_000 + i * 4_000_000, 70)
+    blok.flush()
+    writer.stop()
+    blok_tid = time.perf_counter() - start
+    return {"ekgdata_rækker_pr_s": rækker / række_tid, "blokke_samples_pr_s": rækker / blok_tid,
+            "flush_ms_gns": writer.statistik()["flush_ms_gns"]}
+
+
+# Fylder Ekgdata op til antal rækker fordelt på patienter i målinger af 5000 rækker. Tidspunkterne er
+# ISO tekster som Datahandler skriver dem
+def fyld_ekgdata(conn, antal, patienter=10, måling=5000, stykke=100000):
+    fra = conn.execute("SELECT COUNT(*) FROM Ekgdata").fetchone()[0]
+    start = np.datetime64("2024-01-01T00:00:00", "us")
+    for a in range(fra, antal, stykke):
+        i = np.arange(a, min(antal, a + stykke))
+        patient = (i // måling) % patienter + 1
+        tider = np.datetime_as_string(start + i * 4000, unit="us")
+        værdier = 500 + (i * 37) % 2000
+        with conn:
+            conn.executemany("INSERT INTO Ekgdata (PatientID, Data, Tidspunkt, Puls, SessionID) VALUES (?, ?, ?, 70, ?)",
+                             zip(patient.tolist(), værdier.tolist(), tider.tolist(), (i // måling + 1).tolist()))
+            sessioner = np.unique(i // måling)
+            conn.executemany("INSERT OR IGNORE INTO Sessions (Id, PatientID, Port, StartNs, Samplerate, Status) "
+                             "VALUES (?, ?, 'bench', 0, 250, 'afsluttet')",
+                             zip((sessioner + 1).tolist(), (sessioner % patienter + 1).tolist()))
+    return antal
+
+
+# Forespørgslerne fra PageOne.update_data (uden live måling) og PageTwo.refresh_data ved flere tabelstørrelser
+def bench_forespørgsler(db_sti, størrelser=(10_000, 1_000_000, 10_000_000), gentagelser=50):
+    from ekg_database import Database, åbn_forbindelse
+    from ekg_tabel import EkgSider
+
+    db = Database(db_sti)
+    conn = åbn_forbindelse(db_sti)
+    resultater = {}
+    try:
+        for antal in sorted(størrelser):
+            fyld_ekgdata(conn, antal)
+            forespørgsler = {
+                "update_data_seneste_ekg": lambda: db.seneste_ekg(1, 150),
+                "update_data_seneste_ekg_tid": lambda: db.seneste_ekg_tid(1, 100),
+                "update_data_opdater_puls": lambda: db.opdater_seneste_puls(1, 72),
+                "refresh_data_sessioner": lambda: (db.sessioner(1, 1), db.seneste_pulsmålinger(1, 1)),
+                "refresh_data_første_side": lambda: EkgSider(db, 1, side_størrelse=200).første_side(),
+            }
+            for navn, funktion in forespørgsler.items():
+                median, p95 = tidtag(funktion, gentagelser)
+                resultater[f"{navn}_{antal}_ms"] = median
+                resultater[f"{navn}_{antal}_p95_ms"] = p95
+    finally:
+        conn.close()
+        db.luk()
+    return resultater
+
+
+# Pulsberegningens pris pr. kald for begge implementationer (find_peaks over bufferen og den streamende)
+def bench_puls(fs=250, sekunder=60, puls=72):
+    signal, _ = syntetisk_ekg(fs=fs, sekunder=sekunder, puls=puls)
+    find_peaks = bench_datahandler_find_peaks(signal[:int(20 * fs)], fs) #Den gamle vej er langsom
+    streaming = bench_streaming(signal, fs)
+    return {"find_peaks_us_pr_kald": find_peaks["us_pr_sample"], "streaming_us_pr_kald": streaming["us_pr_sample"],
+            "streaming_puls": streaming["puls"]}
+
+
+# Tid pr. billede for PageOne's kurve med og uden blitting (tegnet i hukommelsen). Fuld tegning er
+# langsom, så den får en fjerdedel af billederne
+def bench_plot(billeder=200):
+    from ekg_plot import EkgPlot
+
+    resultater = {}
+    data = 500 + 100 * np.sin(np.arange(400) / 10)
+    for blit in (True, False):
+        plot = EkgPlot(antal=150, max_fps=0, blit=blit)
+        tider = []
+        for i in range(billeder if blit else billeder // 4):
+            plot.opdater(data[i % 250:i % 250 + 150], tving=True)
+            tider.append(plot.billede_ms)
+        resultater["blit_ms" if blit else "fuld_ms"] = float(np.median(tider))
+    return resultater
+
+
+# Hele kæden på én gang: Datahandler læser fra simulatoren og skriver til databasen, mens hovedtråden
+# tegner kurven og finder pulsen fra ringbufferen som PageOne gør. Simulatoren sender så hurtigt som
+# Datahandler kan læse (hastighed 0), så samples_pr_s er kædens største gennemløb
+def bench_samlet(db_sti, sekunder=5.0, fs=1000, protokol="binær"):
+    from ekg_daemon import Datahandler
+    from ekg_database import Database
+    from ekg_ingest import RingBuffer
+    from ekg_plot import EkgPlot
+
+    db = Database(db_sti)
+    stop = threading.Event()
+    ringbuffer = RingBuffer(5000)
+    handler = Datahandler(1, stop, ringbuffer, db=db, protokol=protokol, samplerate=fs)
+    tråd = threading.Thread(target=handler.serialdata, args=(f"sim://?fs={fs}&hastighed=0",))
+    plot = EkgPlot(antal=150, max_fps=0)
+    detektor = StreamingQRS(fs=fs)
+    sekvens = 0
+    billeder = []
+    tråd.start()
+    start = time.perf_counter()
+    try:
+        while time.perf_counter() - start < sekunder:
+            ny_sekvens, værdier, tider = ringbuffer.læs_siden(sekvens)
+            if ny_sekvens == sekvens:
+                time.sleep(0.003)
+                continue
+            sekvens = ny_sekvens
+            billede_start = time.perf_counter()
+            detektor.tilføj_mange(værdier.tolist(), tider.tolist())
+            plot.opdater(ringbuffer.seneste(150)[0], tving=True)
+            billeder.append((time.perf_counter() - billede_start) * 1000)
+    finally:
+        varighed = time.perf_counter() - start
+        stop.set()
+        tråd.join() #Venter til skriveren har tømt sin kø
+    gemt = db.hent_en("SELECT COUNT(*) FROM Ekgdata")[0]
+    db.luk()
+    return {"samples_pr_s": sekvens / varighed, "gemt_pr_s": gemt / (time.perf_counter() - start),
+            "billede_ms": float(np.median(billeder)) if billeder else None,
+            "billede_p95_ms": float(np.percentile(billeder, 95)) if billeder else None,
+            "billeder_pr_s": len(billeder) / varighed}
+
+
+#Rækkefølgen delene køres i
+DELE = ("parse", "insert", "forespørgsler", "puls", "plot", "samlet")
+
+
+# Kører de valgte dele og returnerer resultaterne med oplysninger om maskinen og versionen
+def kør(dele=DELE, rækker=(10_000, 1_000_000, 10_000_000), sekunder=5.0, mappe=None):
+    with tempfile.TemporaryDirectory(dir=mappe) as tmp:
+        funktioner = {
+            "parse": lambda: bench_parse(),
+            "insert": lambda: bench_insert(os.path.join(tmp, "insert.db")),
+            "forespørgsler": lambda: bench_forespørgsler(os.path.join(tmp, "forespørgsler.db"), rækker),
+            "puls": lambda: bench_puls(),
+            "plot": lambda: bench_plot(),
+            "samlet": lambda: bench_samlet(os.path.join(tmp, "samlet.db"), sekunder),
+        }
+        resultater = {}
+        for del_ in dele:
+            start = time.perf_counter()
+            resultater[del_] = funktioner[del_]()
+            print(f"{del_} ({time.perf_counter() - start:.1f} s)")
+            for nøgle, værdi in resultater[del_].items():
+                print(f"  {nøgle:42s} {værdi:12.3f}" if isinstance(værdi, float) else f"  {nøgle:42s} {værdi}")
+    return {"version": git_version(), "python": platform.python_version(), "numpy": np.__version__,
+            "maskine": platform.platform(), "tidspunkt": time.strftime("%Y-%m-%dT%H:%M:%S"), "resultater": resultater}
+
+
+# Commit som målingen er lavet på (eller None uden git)
+def git_version():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# Om en større værdi er bedre (rater), en mindre er bedre (tider) eller om tallet kun er til information
+def retning(nøgle):
+    if nøgle.endswith("_pr_s"):
+        return 1
+    if nøgle.endswith("_ms") or "_us_" in nøgle:
+        return -1
+    return 0
+
+
+# Sammenligner med en tidligere kørsel. Returnerer (del, nøgle, før, nu, ændring) for hver måling der er
+# blevet mere end tolerance (relativt) dårligere. En tid skal desuden være steget mere end støj_ms, da
+# forespørgsler på brøkdele af et millisekund svinger meget fra kørsel til kørsel
+def regressioner(nu, før, tolerance=0.25, støj_ms=0.25):
+    fundne = []
+    for del_, målinger in nu["resultater"].items():
+        for nøgle, værdi in målinger.items():
+            gammel = før.get("resultater", {}).get(del_, {}).get(nøgle)
+            r = retning(nøgle)
+            if not r or værdi is None or not gammel:
+                continue
+            if r < 0 and nøgle.endswith("_ms") and værdi - gammel < støj_ms:
+                continue
+            ændring = (værdi - gammel) / gammel
+            if -r * ændring > tolerance:
+                fundne.append((del_, nøgle, gammel, værdi, ændring))
+    return fundne
+
+
+if __name__ == "__main__":
+    #Kør f.eks. "python ekg_bench.py --json ny.json --baseline gammel.json" for hele pakken. Afslutter med kode 1
+    #hvis en måling er blevet mere end --tolerance dårligere end i baseline. "python ekg_bench.py qrs" sammenligner
+    #de tre pulsberegninger som før
+    parser = argparse.ArgumentParser(description="Benchmarks for EKG programmet")
+    parser.add_argument("dele", metavar="del", nargs="*",
+                        help=f"hvilke benchmarks der køres: {', '.join(DELE)} eller qrs (standard: alle undtagen qrs)")
+    parser.add_argument("--json", help="gem resultaterne i denne fil")
+    parser.add_argument("--baseline", help="sammenlign med resultater fra en tidligere kørsel")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="tilladt forværring (0.25 = 25%%)")
+    parser.add_argument("--rækker", default="10000,1000000,10000000", help="tabelstørrelser for forespørgsler")
+    parser.add_argument("--mappe", help="mappe til de midlertidige databaser (10M rækker fylder ca. 600 MB)")
+    parser.add_argument("--samlet-sekunder", type=float, default=5.0, help="varighed af den samlede test")
+    parser.add_argument("--fs", type=int, default=250, help="samplingsfrekvens (qrs)")
+    parser.add_argument("--sekunder", type=float, default=60, help="længde af syntetisk signal (qrs)")
+    parser.add_argument("--puls", type=float, default=72, help="puls i syntetisk signal (qrs)")
+    parser.add_argument("--db", help="database med optagede målinger (qrs)")
+    parser.add_argument("--patient", type=int, help="patient ID for optaget måling (qrs)")
+    args = parser.parse_args()
+    args.dele = args.dele or list(DELE)
+    for del_ in set(args.dele) - set(DELE + ("qrs",)):
+        parser.error(f"ukendt del: {del_}")
+
+    if "qrs" in args.dele:
+        syntetisk, _ = syntetisk_ekg(fs=args.fs, sekunder=args.sekunder, puls=args.puls)
+        bench_qrs(syntetisk, args.fs, f"Syntetisk EKG ({args.puls:.0f} BPM)")
+        if args.db and args.patient is not None:
+            optagelse = hent_optagelse(args.db, args.patient, int(args.fs * args.sekunder))
+            if len(optagelse):
+                bench_qrs(optagelse, args.fs, f"Optagelse for patient {args.patient}")
+            else:
+                print(f"Ingen målinger fundet for patient {args.patient}")
+        args.dele.remove("qrs")
+        if not args.dele:
+            sys.exit(0)
+
+    resultat = kør(args.dele, tuple(int(x) for x in args.rækker.split(",")), args.samlet_sekunder, args.mappe)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fil:
+            json.dump(resultat, fil, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fil:
+            fundne = regressioner(resultat, json.load(fil), args.tolerance)
+        for del_, nøgle, før, nu, ændring in fundne:
+            print(f"REGRESSION {del_}.{nøgle}: {før:.3f} -> {nu:.3f} ({ændring:+.0%})")
+        if fundne:
+            sys.exit(1)
@@ -0,0 +1,459 @@
+import argparse
+import functools
+import json
+import signal
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime
+
+import serial
+
+from ekg_database import Database, INSERT_EKGDATA_SESSION, SQL_NY_PULSMÅLING, pulsmåling_række
+from ekg_ingest import IngestWriter, RingBuffer
+from ekg_lagring import BlokWriter
+from ekg_metrik import MetrikEksport, metrik
+from ekg_opsamling import Helbred, Opsamling
+from ekg_protokol import BinærLæser, TekstLæser, BAUD_BINÆR, BAUD_TEKST, BAUD_ÆLDRE
+from ekg_pyramide import PyramideBygger
+from ekg_retention import Komprimering
+from ekg_hrv import RullendeHRV
+from ekg_session import SQL_AFSLUT_SESSION, SessionStatistik
+from ekg_signal import StreamingQRS
+
+#Standardindstillinger for dæmonen (kan ændres på kommandolinjen)
+DATABASE = "EKGDATABASE.db" #Databasefil
+PROTOKOL = "tekst" #Seriel protokol: "tekst" (én værdi pr. linje) eller "binær" (frames, se ekg_protokol.py)
+SAMPLERATE = 250 #Samplingsfrekvens sat i arduino koden (SAMPLE_RATE). Den effektive rate estimeres ud fra enhedens tæller
+LAGRING = "rækker" #Lagringsform: "rækker" (en række pr. måling i Ekgdata) eller "blokke" (int16 blokke i EkgBlokke)
+FEED_VÆRT = "127.0.0.1" #Feedet lytter kun lokalt
+FEED_PORT = 50505 #TCP port som GUI'en kobler sig på
+RÅ_DAGE = None #Dage rå samples beholdes før sessionen arkiveres (se ekg_retention.py). None = altid
+METRIK = None #F.eks. "metrik.jsonl": latens pr. stadie og tællere skrives til filen (se ekg_metrik.py)
+BAUD = None #Baud rate. None vælger ud fra protokollen; 38400 (BAUD_ÆLDRE) til ældre firmware med kun "værdi" pr. linje
+
+
+# Baud rate til protokollen (skal matche arduino koden). En valgt baud rate går forud
+def baud_rate(protokol, baud=None):
+    if baud:
+        return baud
+    return BAUD_BINÆR if protokol == "binær" else BAUD_TEKST
+
+
+# Åbner en port. Adresser der starter med sim:// åbner en simuleret enhed (se ekg_simulator.py), alt andet
+# åbnes med serial_for_url, der også kan åbne f.eks. loop:// og socket:// (test og netværk)
+def åbn_port(com, protokol=PROTOKOL, timeout=0.001, baud=BAUD):
+    if com.startswith("sim://"):
+        from ekg_simulator import åbn_simulator
+        return åbn_simulator(com, protokol, timeout)
+    return serial.serial_for_url(com, baud_rate(protokol, baud), timeout=timeout)
+
+
+class Datahandler():
+    # Initialiserer Datahandler med patient ID og stop-event. Buffer benyttes til live data i GUI'en.
+    # writer er en fælles IngestWriter (fra Opsamling); uden writer oprettes en egen.
+    # db er databaselaget (Database). De øvrige indstillinger svarer til dem øverst i filen
+    def __init__(self, patient_id, stop_event, ringbuffer=None, writer=None, helbred=None, db=None,
+                 protokol=PROTOKOL, samplerate=SAMPLERATE, lagring=LAGRING, baud=BAUD):
+        self.patient_id = patient_id #patienten der måles på's ID
+        self.db = db or Database(DATABASE)
+        self.protokol = protokol
+        self.baud = baud
+        self.lagring = lagring
+        self.stop_event = stop_event #Threading stopper funktion
+        self.ringbuffer = ringbuffer #Delt buffer som GUI'en læser live data fra
+        self.writer = writer #Fælles skriver til databasen
+        self.helbred = helbred or Helbred(patient_id=patient_id) #Samples/s, fejl og genforbindelser
+        self.fs = samplerate #Samplingsfrekvens, justeres til enhedens effektive rate (Benyttes til pulsberegning og blokke)
+        #HRV over hele målingen. Fødes af detektoren med hvert slag, så ingen slag mistes selvom GUI'en halter
+        #bagefter eller skifter patient, og gemmes i Pulsmålinger når sessionen lukkes (også under dæmonen)
+        self.hrv = RullendeHRV()
+        self.detektor = StreamingQRS(fs=self.fs, hrv=self.hrv) #Finder R-takker én sample ad gangen (Benyttes til pulsberegning)
+        self.session_id = None #Id i Sessions for målingen (oprettes når serialdata starter)
+
+    # Læser seriel data fra Arduino og indsætter i databasen. Mistes forbindelsen åbnes porten igen
+    def serialdata(self, com):
+        db = self.db
+        writer = self.writer or IngestWriter(db.sti).start() #Samler målinger og skriver dem i samlede transaktioner
+        #Målingen får en session. Opsummeringen (puls, RR, antal slag) samles løbende og skrives ved stop
+        session = SessionStatistik(db.ny_session(self.patient_id, com, samplerate=self.fs), self.fs)
+        db.luk_tråd() #Trådens forbindelse benyttes ikke mere (skrivning sker via writer)
+        self.session_id = self.helbred.session_id = session.session_id
+        blok = None
+        if self.lagring == "blokke": #Ved blokvis lagring samles målingerne i blokke af et sekund
+            blok = BlokWriter(writer, self.patient_id, session.session_id, self.fs)
+        pyramide = PyramideBygger(writer, self.patient_id) #Min/max oversigt til historikken bygges mens der måles
+        forbundet_før = False
+        try:
+            while not self.stop_event.is_set(): #Kører en løkke indtil stop_event køres
+                try:
+                    ser = åbn_port(com, self.protokol, baud=self.baud) #Åbner serial port (eller simulatoren)
+                except (serial.SerialException, ValueError) as e:
+                    print("Serialfejl:", e)
+                    self.helbred.status = "afbrudt"
+                    self.stop_event.wait(1.0) #Prøver igen om et sekund
+                    continue
+
+                if forbundet_før:
+                    self.helbred.genforbindelser += 1
+                forbundet_før = True
+                self.helbred.status = "forbundet"
+                læser = BinærLæser(ser, self.fs) if self.protokol == "binær" else TekstLæser(ser, self.fs)
+                self.helbred.sæt_læser(læser)
+                try:
+                    self.læs_port(læser, writer, blok, pyramide, session)
+                except serial.SerialException as e:
+                    print("Serialfejl:", e) #F.eks. kabel trukket ud. Porten åbnes igen i næste omgang
+                    self.helbred.status = "afbrudt"
+                finally:
+                    ser.close()
+        finally:
+            if blok:
+                blok.flush() #Den sidste ufuldstændige blok gemmes også
+            pyramide.flush()
+            session.samplerate = self.fs
+            #Skrives efter målingens sidste rækker. Opsummeringen må ikke tabes, så den venter på plads i køen
+            writer.tilføj(session.række(), sql=SQL_AFSLUT_SESSION, samples=0, vent=True)
+            self.gem_hrv(writer)
+            if self.writer is None:
+                writer.stop() #Skriver resten af køen når stop_event sættes
+                stat = writer.statistik()
+                print(f"Ingest: {stat['rækker']} rækker, {stat['rækker_pr_s']:.0f} rækker/s, "
+                      f"flush gns {stat['flush_ms_gns']:.1f} ms, max {stat['flush_ms_max']:.1f} ms")
+            print("Serial:", self.helbred.statistik()) #Bl.a. parsefejl og tabte frames
+
+    # Læser fra en åben port indtil stop_event sættes. Fejl på selve porten sendes videre
+    def læs_port(self, læser, writer, blok, pyramide=None, session=None):
+        while not self.stop_event.is_set():
+            try:
+                t0 = metrik.start()
+                værdier, tider, _ = læser.læs() #Tekst giver højst én værdi, binær en eller flere hele frames
+                if not len(værdier):
+                    continue
+                ankomst = time.monotonic_ns()
+                metrik.slut("serial_læs", t0)
+                metrik.tæl("samples_læst", len(værdier))
+                t0 = metrik.start()
+                self.helbred.tæl(len(værdier))
+                self.opdater_fs(læser.ur.fs, blok)
+                if pyramide:
+                    pyramide.tilføj_mange(værdier, tider) #Én gang pr. læsning, ikke pr. sample
+                if session:
+                    session.tilføj(tider)
+                for value, tid_ns in zip(værdier.tolist(), tider.tolist()):
+                    #Hver sample og dens tid fra enheden sendes til QRS-detektoren. Fundne slag tælles i sessionen
+                    if self.detektor.tilføj(value, tid_ns) is not None and session:
+                        session.slag_fundet(self.detektor.nyt_rr)
+
+                    # pulsberegner benyttes, giver None indtil der er fundet gyldige RR-intervaller
+                    puls = self.beregn_puls()
+
+                    #Værdien sendes direkte til GUI'en gennem ringbufferen
+                    if self.ringbuffer is not None:
+                        self.ringbuffer.skriv(value, tid_ns, puls)
+
+                    #De nu fundne værdier lægges i skriverens kø og skrives samlet til databasen
+                    if blok:
+                        blok.tilføj(value, tid_ns, puls)
+                    else:
+                        now = datetime.fromtimestamp(tid_ns / 1e9).isoformat(timespec='microseconds')
+                        writer.tilføj((self.patient_id, value, now, puls, self.session_id), sql=INSERT_EKGDATA_SESSION)
+                if self.ringbuffer is not None:
+                    self.ringbuffer.ankomst_ns = ankomst
+                metrik.slut("behandling", t0) #QRS, ringbuffer og skriverens kø for læsningen
+            except serial.SerialException:
+                raise
+            except Exception as e:
+                print("Fejl ved læsning/indsættelse:", e)
+
+    # Skifter til enhedens effektive samplerate når den afviger fra den der regnes med.
+    # Detektorens filtervinduer afhænger af fs, så den startes forfra ved større afvigelser
+    def opdater_fs(self, fs, blok=None):
+        if abs(fs - self.fs) <= 0.02 * self.fs:
+            return
+        print(f"Effektiv samplerate {fs:.1f} Hz (regnede med {self.fs:.1f} Hz)")
+        self.fs = fs
+        self.detektor = StreamingQRS(fs=fs, hrv=self.hrv) #HRV-vinduerne fortsætter
+        if blok:
+            blok.samplerate = fs #Blokkenes sampletider rekonstrueres ud fra sampleraten
+        if self.ringbuffer is not None:
+            self.ringbuffer.fs = fs
+
+    # Gemmer gennemsnitspulsen og HRV for hele målingen i Pulsmålinger (hvis der blev fundet gyldige slag).
+    # Resultatet lægges også på helbred, så GUI'en kan vise det når målingen er stoppet
+    def gem_hrv(self, writer):
+        hrv = self.helbred.hrv = self.hrv.resultat("session")
+        if hrv["puls_gns"]:
+            writer.tilføj(pulsmåling_række(self.patient_id, int(round(hrv["puls_gns"])), self.session_id, hrv),
+                          sql=SQL_NY_PULSMÅLING, samples=0, vent=True)
+
+    # Beregner pulsen ud fra detektorens løbende RR-estimat.
+    def beregn_puls(self):
+        puls = self.detektor.puls()
+        return int(puls) if puls else None # Konverteret til hele BPM
+
+
+
+class _FeedHandler(socketserver.StreamRequestHandler):
+    # Én forbindelse fra en klient. Hver linje er en JSON forespørgsel, og svaret er én JSON linje
+    def handle(self):
+        for linje in self.rfile:
+            try:
+                svar = self.server.dæmon.svar(json.loads(linje))
+            except (ValueError, KeyError, TypeError) as e:
+                svar = {"fejl": str(e)}
+            try:
+                self.wfile.write((json.dumps(svar) + "\n").encode())
+            except OSError: #Klienten er gået
+                return
+
+
+class _FeedServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, adresse, dæmon):
+        super().__init__(adresse, _FeedHandler)
+        self.dæmon = dæmon
+
+
+class EkgDaemon():
+    # Kører målinger og pulsanalyse uden GUI. Hver enhed (port, patient_id) får sin egen Datahandler
+    # gennem Opsamling, og alle skriver til databasen. Et lokalt TCP feed giver GUI'en (DaemonKlient)
+    # skrivebeskyttet adgang til status og live samples, så GUI'en kan startes og lukkes uafhængigt
+    def __init__(self, db_sti=DATABASE, enheder=(), protokol=PROTOKOL, samplerate=SAMPLERATE, lagring=LAGRING,
+                 vært=FEED_VÆRT, port=FEED_PORT, rå_dage=RÅ_DAGE, metrik_fil=METRIK, baud=BAUD):
+        self.db = Database(db_sti) #Schema oprettes/migreres her, én gang
+        lav = functools.partial(Datahandler, db=self.db, protokol=protokol, samplerate=samplerate, lagring=lagring,
+                                baud=baud)
+        self.opsamling = Opsamling(db_sti, lav)
+        self.enheder = list(enheder) #(port, patient_id) der måles på
+        self.adresse = (vært, port)
+        self.server = None
+        self._server_tråd = None
+        self.stoppet = threading.Event()
+        #Gamle sessioner arkiveres i baggrunden i små transaktioner, mens der måles
+        self.komprimering = Komprimering(db_sti, rå_dage) if rå_dage is not None else None
+        self.metrik_eksport = MetrikEksport(metrik_fil) if metrik_fil else None
+
+    # Starter feedet og målingerne på alle enheder
+    def start(self):
+        self.server = _FeedServer(self.adresse, self)
+        self.adresse = self.server.server_address #Port 0 giver en ledig port
+        self._server_tråd = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._server_tråd.start()
+        for port, patient_id in self.enheder:
+            self.opsamling.start(port, patient_id)
+        if self.komprimering is not None:
+            self.komprimering.start()
+        if self.metrik_eksport is not None:
+            self.metrik_eksport.start()
+        print(f"EKG dæmon kører: {len(self.enheder)} enheder, feed på {self.adresse[0]}:{self.adresse[1]}")
+        return self
+
+    # Besvarer en forespørgsel fra feedet. Der findes kun læsende kommandoer
+    def svar(self, forespørgsel):
+        kommando = forespørgsel["kommando"]
+        if kommando == "status":
+            enheder = []
+            for enhed in self.opsamling.aktive():
+                stat = enhed.helbred.statistik()
+                stat.update(sekvens=enhed.ringbuffer.sekvens, puls=enhed.ringbuffer.puls, fs=enhed.ringbuffer.fs)
+                enheder.append(stat)
+            return {"enheder": enheder, "writer": self.opsamling.statistik()["writer"]}
+        if kommando == "data":
+            enhed = next((e for e in self.opsamling.aktive() if e.port == forespørgsel["port"]), None)
+            if enhed is None:
+                return {"fejl": "ukendt port"}
+            sekvens, værdier, tider = enhed.ringbuffer.læs_siden(int(forespørgsel.get("sekvens", 0)))
+            return {"sekvens": sekvens, "værdier": værdier.tolist(), "tider": tider.tolist(),
+                    "puls": enhed.ringbuffer.puls, "fs": enhed.ringbuffer.fs, "ankomst_ns": enhed.ringbuffer.ankomst_ns}
+        if kommando == "metrik": #Latens pr. stadie og tællere (tomme hvis målingerne er slået fra)
+            return metrik.øjebliksbillede()
+        return {"fejl": f"ukendt kommando {kommando}"}
+
+    # Stopper feedet og alle målinger. Resten af skriverens kø skrives til databasen
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.komprimering is not None:
+            self.komprimering.stop()
+        self.opsamling.stop_alle()
+        if self.metrik_eksport is not None:
+            self.metrik_eksport.stop() #Sidste linje skrives efter målingerne er stoppet
+        self.db.luk()
+        self.stoppet.set()
+
+    # Kører indtil Ctrl+C eller SIGTERM og udskriver status hvert interval sekund
+    def kør(self, interval=10.0):
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        self.start()
+        try:
+            while not stop.wait(interval):
+                for stat in self.svar({"kommando": "status"})["enheder"]:
+                    print(f"{stat['port']}: patient {stat['patient_id']}  {stat['samples_pr_s']:.0f} samples/s  "
+                          f"puls {stat['puls']}  {stat['status']}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+class _FjernHelbred():
+    # Sundhedstal for en måling i dæmonen, som de blev læst sidst
+    def __init__(self, stat):
+        self.stat = stat
+
+    def statistik(self):
+        return self.stat
+
+
+class FjernEnhed():
+    # Spejl af en måling i dæmonen med de samme felter som Enhed (port, patient_id, ringbuffer, helbred).
+    # Ringbufferen fyldes af DaemonKlient med de samples der kommer over feedet
+    def __init__(self, stat, kapacitet=5000):
+        self.port = stat["port"]
+        self.patient_id = stat["patient_id"]
+        self.ringbuffer = RingBuffer(kapacitet)
+        self.helbred = _FjernHelbred(stat)
+        self.fjern_sekvens = 0 #Sekvens i dæmonens ringbuffer som er hentet
+
+
+class DaemonKlient():
+    # Skrivebeskyttet klient til EkgDaemon's feed. Har samme læsende metoder som Opsamling (aktive,
+    # for_patient, statistik), så GUI'en kan vise målinger der kører i dæmonen. En tråd henter nye
+    # samples hvert interval sekund. Målinger kan ikke startes eller stoppes herfra
+    def __init__(self, vært=FEED_VÆRT, port=FEED_PORT, interval=0.05, kapacitet=5000):
+        self.adresse = (vært, port)
+        self.interval = interval
+        self.kapacitet = kapacitet
+        self.enheder = {} #port -> FjernEnhed
+        self.writer_stat = None
+        self.forbundet = False
+        self._lås = threading.Lock()
+        self._stop = threading.Event()
+        self._tråd = None
+        self._sok = None
+        self._fil = None
+
+    # Starter tråden der henter data fra dæmonen
+    def forbind(self):
+        if self._tråd is None:
+            self._tråd = threading.Thread(target=self._kør, daemon=True)
+            self._tråd.start()
+        return self
+
+    # Sender en forespørgsel og returnerer svaret. Forbindelsen åbnes ved behov
+    def _spørg(self, forespørgsel):
+        if self._fil is None:
+            self._sok = socket.create_connection(self.adresse, timeout=2.0)
+            self._fil = self._sok.makefile("rwb")
+        self._fil.write((json.dumps(forespørgsel) + "\n").encode())
+        self._fil.flush()
+        linje = self._fil.readline()
+        if not linje:
+            raise ConnectionError("Dæmonen lukkede forbindelsen")
+        return json.loads(linje)
+
+    # Lukker forbindelsen (den åbnes igen ved næste forespørgsel)
+    def _afbryd(self):
+        for ting in (self._fil, self._sok):
+            try:
+                if ting is not None:
+                    ting.close()
+            except OSError:
+                pass
+        self._fil = self._sok = None
+        self.forbundet = False
+
+    # Henter status og nye samples for alle målinger én gang
+    def opdater(self):
+        status = self._spørg({"kommando": "status"})
+        self.forbundet = True
+        nye = {}
+        for stat in status["enheder"]:
+            enhed = self.enheder.get(stat["port"])
+            #Ny måling på porten (anden patient, eller dæmonens buffer er startet forfra)
+            if enhed is None or enhed.patient_id != stat["patient_id"] or stat["sekvens"] < enhed.fjern_sekvens:
+                enhed = FjernEnhed(stat, self.kapacitet)
+            enhed.helbred.stat = stat
+            svar = self._spørg({"kommando": "data", "port": enhed.port, "sekvens": enhed.fjern_sekvens})
+            if "fejl" not in svar:
+                enhed.ringbuffer.skriv_mange(svar["værdier"], svar["tider"])
+                enhed.ringbuffer.puls = svar["puls"]
+                enhed.ringbuffer.fs = svar["fs"]
+                #monotonic_ns er fælles for processerne på maskinen, så GUI'en kan måle fra dæmonens læsning
+                enhed.ringbuffer.ankomst_ns = svar.get("ankomst_ns")
+                enhed.fjern_sekvens = svar["sekvens"]
+            nye[enhed.port] = enhed
+        with self._lås:
+            self.enheder = nye
+            self.writer_stat = status.get("writer")
+
+    # Trådens løkke. Mistes forbindelsen prøves igen efter et sekund
+    def _kør(self):
+        while not self._stop.is_set():
+            try:
+                self.opdater()
+                self._stop.wait(self.interval)
+            except (OSError, ValueError, KeyError) as e:
+                if self.forbundet:
+                    print("Dæmonfejl:", e)
+                self._afbryd()
+                self._stop.wait(1.0)
+        self._afbryd()
+
+    # Målingerne dæmonen kører lige nu
+    def aktive(self):
+        with self._lås:
+            return list(self.enheder.values())
+
+    # Første måling på patienten (eller None)
+    def for_patient(self, patient_id):
+        for enhed in self.aktive():
+            if enhed.patient_id == patient_id:
+                return enhed
+        return None
+
+    # Sundhedstal i samme form som Opsamling.statistik
+    def statistik(self):
+        return {"enheder": [enhed.helbred.statistik() for enhed in self.aktive()], "writer": self.writer_stat}
+
+    # Stopper kun klienten. Målingerne fortsætter i dæmonen
+    def stop_alle(self):
+        self._stop.set()
+        if self._tråd is not None:
+            self._tråd.join()
+            self._tråd = None
+
+
+# Læser enheder skrevet som port=patient_id
+def _enhed(tekst):
+    port, _, patient_id = tekst.rpartition("=")
+    if not port:
+        raise argparse.ArgumentTypeError("Enheder skrives som PORT=PATIENT_ID")
+    return port, int(patient_id)
+
+
+if __name__ == "__main__":
+    #Kør f.eks. "python ekg_daemon.py --enhed COM3=1 --enhed COM4=2" for at måle uden GUI.
+    #GUI'en kobler sig på ved at sætte dæmon = "127.0.0.1:50505" øverst i GUI filen
+    parser = argparse.ArgumentParser(description="EKG opsamling og pulsanalyse uden GUI")
+    parser.add_argument("--enhed", type=_enhed, action="append", default=[], help="PORT=PATIENT_ID (kan gentages)")
+    parser.add_argument("--db", default=DATABASE)
+    parser.add_argument("--protokol", choices=("tekst", "binær"), default=PROTOKOL)
+    parser.add_argument("--samplerate", type=float, default=SAMPLERATE)
+    parser.add_argument("--lagring", choices=("rækker", "blokke"), default=LAGRING)
+    parser.add_argument("--feed-port", type=int, default=FEED_PORT)
+    parser.add_argument("--rå-dage", type=float, default=RÅ_DAGE, help="arkiver sessioner ældre end så mange dage")
+    parser.add_argument("--metrik", default=METRIK, help="fil som latens og tællere skrives til (JSON linjer)")
+    parser.add_argument("--baud", type=int, default=BAUD,
+                        help=f"baud rate (standard efter protokollen; {BAUD_ÆLDRE} til ældre firmware)")
+    argumenter = parser.parse_args()
+    EkgDaemon(argumenter.db, argumenter.enhed, argumenter.protokol, argumenter.samplerate, argumenter.lagring,
+              port=argumenter.feed_port, rå_dage=argumenter.rå_dage, metrik_fil=argumenter.metrik,
+              baud=argumenter.baud).kør()
@@ -0,0 +1,559 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from ekg_lagring import (INSERT_BLOK, SQL_SENESTE_BLOKKE, SQL_BLOK_INTERVAL, SQL_BLOK_SIDE, SQL_BLOK_ID_VED_TID,
+                         SQL_SESSION_BLOKKE, SQL_EKSPORT_BLOK_SESSIONER, SQL_EKSPORT_BLOKKE, SQL_SLET_BLOKKE,
+                         INSERT_ARKIV, SQL_SESSION_ARKIV, SQL_EKSPORT_ARKIV_SESSIONER, SQL_EKSPORT_ARKIV,
+                         SQL_REANALYSE_BLOKKE, SQL_REANALYSE_BLOK_PULS,
+                         opret_blok_tabel, opret_arkiv_tabel, udpak_samples, hent_seneste, hent_side, hent_interval,
+                         hent_arkiv, iso_til_ns_array, opret_meta_tabel, SQL_HENT_META, SQL_SÆT_META,
+                         SQL_MIGRER_PATIENTER, SQL_MIGRER_EKGDATA, SQL_MIGRER_TIDSPUNKT, SQL_SLET_MIGREREDE)
+from ekg_pyramide import (INSERT_PYRAMIDE, SQL_PYRAMIDE_INTERVAL, SQL_PYRAMIDE_OMFANG, SQL_PYRAMIDE_DÆKNING,
+                          SQL_SLET_PYRAMIDE, NIVEAUER,
+                          opret_pyramide_tabel, vælg_niveau, hent_niveau, reducer)
+from ekg_session import (INSERT_SESSION, SQL_AFSLUT_SESSION, SQL_SESSIONER, SQL_SESSION, SQL_OPSUMMER_BLOKKE,
+                         SQL_GAMLE_SESSIONER, SQL_ARKIVER_SESSION, SQL_SAML_SESSION, SQL_SAMLES_SESSION,
+                         SQL_SAMLET_SESSION, SQL_REANALYSE_SESSIONER, SQL_REANALYSE_SESSION,
+                         SQL_ANALYSE_VERSION, opret_session_tabel, opret_analyse_kolonne, opsummer_blokke, session_dict)
+
+#Indstillinger for hver forbindelse. WAL gør at GUI'ens læsninger og ingest-trådens skrivninger ikke blokerer
+#hinanden. synchronous=NORMAL er sikkert sammen med WAL og sparer en fsync pr. commit.
+#auto_vacuum skal sættes før WAL for at virke på en ny database. Den lader retention (ekg_retention.py)
+#give slettede sider tilbage til filsystemet lidt ad gangen. Eksisterende databaser omstilles én gang
+#med "python ekg_retention.py omstil"
+PRAGMAS = (
+    "PRAGMA auto_vacuum = INCREMENTAL",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000", #16 MB side-cache pr. forbindelse
+    "PRAGMA mmap_size = 268435456", #256 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+)
+
+#SQL til indsættelse af en enkelt EKG måling (benyttes med executemany)
+INSERT_EKGDATA = """
+    INSERT INTO Ekgdata (PatientID, Data, Tidspunkt, Puls)
+    VALUES (?, ?, ?, ?)
+"""
+#Samme med sessionen rækken hører til (benyttes af Datahandler)
+INSERT_EKGDATA_SESSION = """
+    INSERT INTO Ekgdata (PatientID, Data, Tidspunkt, Puls, SessionID)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+#Forespørgsler programmet benytter. Samlet ét sted så deres query plan kan kontrolleres (se explain)
+SQL_PATIENTER = "SELECT Id, Navn FROM Brugerdata"
+SQL_PATIENTER_DETALJER = "SELECT Navn, Efternavn, Alder, KØN FROM Brugerdata"
+SQL_PATIENT_KATALOG = "SELECT Id, Navn, Efternavn, Alder, KØN FROM Brugerdata ORDER BY Id"
+SQL_PATIENT_NAVN = "SELECT Navn FROM Brugerdata WHERE Id = ?"
+SQL_NY_PATIENT = "INSERT INTO Brugerdata (Navn, Efternavn, Alder, KØN) VALUES (?, ?, ?, ?)"
+SQL_NY_PULSMÅLING = """
+    INSERT INTO Pulsmålinger (PatientID, Puls, SessionID, SDNN, RMSSD, PNN50, PulsMin, PulsMaks)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_SENESTE_PULSMÅLINGER = "SELECT Puls FROM Pulsmålinger WHERE PatientID = ? ORDER BY Id DESC LIMIT ?"
+SQL_SENESTE_EKG = "SELECT Data, Puls FROM Ekgdata WHERE PatientID = ? ORDER BY Id DESC LIMIT ?"
+SQL_SENESTE_EKG_TID = "SELECT Tidspunkt, Data FROM Ekgdata WHERE PatientID = ? ORDER BY Id DESC LIMIT ?"
+SQL_EKG_TABEL = """
+    SELECT strftime('%Y-%m-%d %H:%M:%S', Tidspunkt), Puls, Data
+    FROM Ekgdata
+    WHERE PatientID = ?
+    ORDER BY Tidspunkt DESC
+    LIMIT ?
+"""
+#Keyset pagination til PageTwo: en side rækker ældre end et givent Id, og rækken ved et tidspunkt.
+#(PatientID, Id) dækkes af indekset på PatientID, da SQLite gemmer rowid sidst i hvert indeks
+SQL_EKG_SIDE = """
+    SELECT Id, strftime('%Y-%m-%d %H:%M:%S', Tidspunkt), Puls, Data
+    FROM Ekgdata
+    WHERE PatientID = ? AND Id < ?
+    ORDER BY Id DESC
+    LIMIT ?
+"""
+SQL_EKG_ID_VED_TID = """
+    SELECT Id
+    FROM Ekgdata
+    WHERE PatientID = ? AND Tidspunkt <= ?
+    ORDER BY Tidspunkt DESC
+    LIMIT 1
+"""
+SQL_EKG_INTERVAL = """
+    SELECT Tidspunkt, Data
+    FROM Ekgdata
+    WHERE PatientID = ? AND Tidspunkt BETWEEN ? AND ?
+    ORDER BY Tidspunkt
+"""
+#Alle rækker fra én session. PatientID med, så indekset på (PatientID, SessionID) kan benyttes
+SQL_SESSION_EKG = """
+    SELECT Data
+    FROM Ekgdata
+    WHERE PatientID = ? AND SessionID = ?
+    ORDER BY Id
+"""
+#Eksport: sessioner med antal rækker for en patient (rækker fra før sessionerne har SessionID NULL),
+#og rækkerne fra én session i bidder med keyset pagination
+SQL_EKSPORT_SESSIONER = """
+    SELECT SessionID, COUNT(*)
+    FROM Ekgdata
+    WHERE PatientID = ?
+    GROUP BY SessionID
+"""
+SQL_EKSPORT_EKG = """
+    SELECT Id, Data, Tidspunkt
+    FROM Ekgdata
+    WHERE PatientID = ? AND SessionID IS ? AND Id > ?
+    ORDER BY Id
+    LIMIT ?
+"""
+#Retention: rækkerne fra én session slettes i bidder, når de er flyttet til EkgArkiv
+SQL_SLET_EKGDATA = "DELETE FROM Ekgdata WHERE PatientID = ? AND SessionID = ? AND Id <= ?"
+#Retention: rækker uden session (fra før Sessions fandtes) for en patient i bidder, og tildeling af en
+#session til et stykke af dem angivet med Id
+#Patienterne gennemløbes, ikke Ekgdata, så det ikke koster en læsning af hele tabellen hver gang
+SQL_UDEN_SESSION_PATIENTER = """
+    SELECT Id
+    FROM Brugerdata
+    WHERE EXISTS (SELECT 1 FROM Ekgdata WHERE PatientID = Brugerdata.Id AND SessionID IS NULL)
+    ORDER BY Id
+"""
+SQL_UDEN_SESSION = """
+    SELECT Id, Tidspunkt
+    FROM Ekgdata
+    WHERE PatientID = ? AND SessionID IS NULL AND Id > ?
+    ORDER BY Id
+    LIMIT ?
+"""
+SQL_TILDEL_SESSION = "UPDATE Ekgdata SET SessionID = ? WHERE PatientID = ? AND SessionID IS NULL AND Id BETWEEN ? AND ?"
+#Retention: alle samples fra én session, uanset om de ligger som rækker, blokke eller allerede er arkiveret
+SQL_SESSION_SAMPLES_ANTAL = """
+    SELECT (SELECT COUNT(*) FROM Ekgdata WHERE PatientID = ? AND SessionID = ?)
+         + (SELECT COALESCE(SUM(Antal), 0) FROM EkgBlokke WHERE SessionID = ?)
+         + (SELECT COALESCE(SUM(Antal), 0) FROM EkgArkiv WHERE SessionID = ?)
+"""
+#Reanalyse: ny puls for et stykke af en session. Stykket angives med Id, så rowid bruges direkte.
+#Rækker fra andre samtidige målinger kan ligge imellem, derfor også SessionID
+SQL_REANALYSE_EKG_PULS = "UPDATE Ekgdata SET Puls = ? WHERE Id BETWEEN ? AND ? AND SessionID = ?"
+SQL_OPDATER_SENESTE_PULS = """
+    UPDATE Ekgdata
+    SET Puls = ?
+    WHERE PatientID = ? AND Id = (
+        SELECT Id FROM Ekgdata WHERE PatientID = ? ORDER BY Id DESC LIMIT 1
+    )
+"""
+SQL_OPDATER_SENESTE_BLOK_PULS = """
+    UPDATE EkgBlokke
+    SET Puls = ?
+    WHERE Id = (SELECT Id FROM EkgBlokke WHERE PatientID = ? ORDER BY Id DESC LIMIT 1)
+"""
+
+#Navn, SQL og om en fuld gennemløbning af tabellen er forventet (f.eks. listen over alle patienter)
+FORESPØRGSLER = [
+    ("patienter", SQL_PATIENTER, True),
+    ("patienter_detaljer", SQL_PATIENTER_DETALJER, True),
+    ("patient_katalog", SQL_PATIENT_KATALOG, True),
+    ("patient_navn", SQL_PATIENT_NAVN, False),
+    ("ny_patient", SQL_NY_PATIENT, False),
+    ("ny_pulsmåling", SQL_NY_PULSMÅLING, False),
+    ("seneste_pulsmålinger", SQL_SENESTE_PULSMÅLINGER, False),
+    ("seneste_ekg", SQL_SENESTE_EKG, False),
+    ("seneste_ekg_tid", SQL_SENESTE_EKG_TID, False),
+    ("ekg_tabel", SQL_EKG_TABEL, False),
+    ("ekg_side", SQL_EKG_SIDE, False),
+    ("ekg_id_ved_tid", SQL_EKG_ID_VED_TID, False),
+    ("opdater_seneste_puls", SQL_OPDATER_SENESTE_PULS, False),
+    ("opdater_seneste_blok_puls", SQL_OPDATER_SENESTE_BLOK_PULS, False),
+    ("indsæt_ekgdata", INSERT_EKGDATA, False),
+    ("indsæt_blok", INSERT_BLOK, False),
+    ("seneste_blokke", SQL_SENESTE_BLOKKE, False),
+    ("blok_interval", SQL_BLOK_INTERVAL, False),
+    ("blok_side", SQL_BLOK_SIDE, False),
+    ("blok_id_ved_tid", SQL_BLOK_ID_VED_TID, False),
+    ("indsæt_ekgdata_session", INSERT_EKGDATA_SESSION, False),
+    ("ny_session", INSERT_SESSION, False),
+    ("afslut_session", SQL_AFSLUT_SESSION, False),
+    ("sessioner", SQL_SESSIONER, False),
+    ("session", SQL_SESSION, False),
+    ("opsummer_blokke", SQL_OPSUMMER_BLOKKE, False),
+    ("ekg_interval", SQL_EKG_INTERVAL, False),
+    ("indsæt_pyramide", INSERT_PYRAMIDE, False),
+    ("pyramide_interval", SQL_PYRAMIDE_INTERVAL, False),
+    ("pyramide_omfang", SQL_PYRAMIDE_OMFANG, False),
+    ("session_ekg", SQL_SESSION_EKG, False),
+    ("session_blokke", SQL_SESSION_BLOKKE, False),
+    ("eksport_sessioner", SQL_EKSPORT_SESSIONER, False),
+    ("eksport_ekg", SQL_EKSPORT_EKG, False),
+    ("eksport_blok_sessioner", SQL_EKSPORT_BLOK_SESSIONER, False),
+    ("eksport_blokke", SQL_EKSPORT_BLOKKE, False),
+    ("gamle_sessioner", SQL_GAMLE_SESSIONER, True),
+    ("arkiver_session", SQL_ARKIVER_SESSION, False),
+    ("pyramide_dækning", SQL_PYRAMIDE_DÆKNING, False),
+    ("slet_pyramide", SQL_SLET_PYRAMIDE, False),
+    ("session_samples_antal", SQL_SESSION_SAMPLES_ANTAL, False),
+    ("uden_session_patienter", SQL_UDEN_SESSION_PATIENTER, True),
+    ("uden_session", SQL_UDEN_SESSION, False),
+    ("tildel_session", SQL_TILDEL_SESSION, False),
+    ("saml_session", SQL_SAML_SESSION, False),
+    ("samles_session", SQL_SAMLES_SESSION, False),
+    ("samlet_session", SQL_SAMLET_SESSION, False),
+    ("slet_ekgdata", SQL_SLET_EKGDATA, False),
+    ("slet_blokke", SQL_SLET_BLOKKE, False),
+    ("indsæt_arkiv", INSERT_ARKIV, False),
+    ("session_arkiv", SQL_SESSION_ARKIV, False),
+    ("eksport_arkiv_sessioner", SQL_EKSPORT_ARKIV_SESSIONER, False),
+    ("eksport_arkiv", SQL_EKSPORT_ARKIV, False),
+    ("reanalyse_sessioner", SQL_REANALYSE_SESSIONER, True),
+    ("reanalyse_session", SQL_REANALYSE_SESSION, False),
+    ("analyse_version", SQL_ANALYSE_VERSION, False),
+    ("reanalyse_ekg_puls", SQL_REANALYSE_EKG_PULS, False),
+    ("reanalyse_blokke", SQL_REANALYSE_BLOKKE, False),
+    ("reanalyse_blok_puls", SQL_REANALYSE_BLOK_PULS, False),
+    ("hent_meta", SQL_HENT_META, False),
+    ("sæt_meta", SQL_SÆT_META, False),
+    ("migrer_patienter", SQL_MIGRER_PATIENTER, True),
+    ("migrer_ekgdata", SQL_MIGRER_EKGDATA, False),
+    ("migrer_tidspunkt", SQL_MIGRER_TIDSPUNKT, False),
+    ("slet_migrerede", SQL_SLET_MIGREREDE, False),
+]
+
+
+# Version 1: de tre oprindelige tabeller
+def _grundtabeller(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS Brugerdata (
+        Id INTEGER PRIMARY KEY AUTOINCREMENT,
+        Navn TEXT,
+        Efternavn TEXT,
+        Alder INTEGER,
+        KØN TEXT
+    )""")
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS Pulsmålinger (
+        Id INTEGER PRIMARY KEY AUTOINCREMENT,
+        PatientID INTEGER,
+        Puls INTEGER,
+        FOREIGN KEY (PatientID) REFERENCES Brugerdata(Id)
+    )""")
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS Ekgdata (
+        Id INTEGER PRIMARY KEY AUTOINCREMENT,
+        PatientID INTEGER,
+        Tidspunkt TEXT,
+        Data REAL,
+        Puls INTEGER,
+        FOREIGN KEY (PatientID) REFERENCES Brugerdata(Id)
+    )""")
+
+
+# Version 3: sammensatte indekser til de forespørgsler der køres mange gange i sekundet
+def _indekser(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ekgdata_patient_id ON Ekgdata (PatientID, Id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ekgdata_patient_tid ON Ekgdata (PatientID, Tidspunkt)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pulsmaalinger_patient_id ON Pulsmålinger (PatientID, Id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ekgblokke_patient_id ON EkgBlokke (PatientID, Id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ekgblokke_patient_start ON EkgBlokke (PatientID, StartNs)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ekgblokke_session ON EkgBlokke (SessionID)")
+
+
+# Version 5: en række pr. måling i Sessions. Ekgdata og Pulsmålinger får en SessionID, og sessioner der
+# allerede findes som blokke i EkgBlokke får deres opsummering
+def _sessioner(cursor):
+    opret_session_tabel(cursor)
+    for tabel in ("Ekgdata", "Pulsmålinger"):
+        kolonner = [række[1] for række in cursor.execute(f"PRAGMA table_info({tabel})")]
+        if "SessionID" not in kolonner:
+            cursor.execute(f"ALTER TABLE {tabel} ADD COLUMN SessionID INTEGER REFERENCES Sessions(Id)")
+    cursor.execute("SELECT DISTINCT SessionID FROM EkgBlokke WHERE SessionID IS NOT NULL")
+    for (session_id,) in cursor.fetchall():
+        opsummer_blokke(cursor, session_id)
+
+
+# Version 6: rækkerne i Ekgdata kan findes pr. session (afspilning og eksport af hele sessioner)
+def _session_indeks(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ekgdata_patient_session ON Ekgdata (PatientID, SessionID)")
+
+
+# Version 9: HRV for hele målingen gemmes sammen med gennemsnitspulsen (SDNN og RMSSD i ms, pNN50 i procent)
+def _hrv_kolonner(cursor):
+    kolonner = [række[1] for række in cursor.execute("PRAGMA table_info(Pulsmålinger)")]
+    for kolonne in ("SDNN", "RMSSD", "PNN50", "PulsMin", "PulsMaks"):
+        if kolonne not in kolonner:
+            cursor.execute(f"ALTER TABLE Pulsmålinger ADD COLUMN {kolonne} REAL")
+
+
+#Migreringer i rækkefølge. Databasens version gemmes i PRAGMA user_version.
+#Eksisterende databaser uden version har allerede tabellerne, derfor bruges IF NOT EXISTS overalt
+MIGRERINGER = [
+    (1, "Grundtabeller", _grundtabeller),
+    (2, "Blokvis lagring (EkgBlokke)", opret_blok_tabel),
+    (3, "Indekser på PatientID", _indekser),
+    (4, "Min/max pyramide (EkgPyramide)", opret_pyramide_tabel),
+    (5, "Sessioner med opsummering (Sessions)", _sessioner),
+    (6, "Indeks på sessioner i Ekgdata", _session_indeks),
+    (7, "Arkiv til gamle sessioner (EkgArkiv)", opret_arkiv_tabel),
+    (8, "Analyseversion pr. session (Sessions.Analyse)", opret_analyse_kolonne),
+    (9, "HRV i Pulsmålinger", _hrv_kolonner),
+    (10, "Metadata (Meta)", opret_meta_tabel),
+]
+SCHEMA_VERSION = MIGRERINGER[-1][0]
+
+
+# Returnerer databasens schema version
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Kører de migreringer databasen mangler. Hver migrering køres i sin egen transaktion
+def opret_schema(conn):
+    version = schema_version(conn)
+    for ny_version, beskrivelse, migrering in MIGRERINGER:
+        if ny_version <= version:
+            continue
+        with conn:
+            migrering(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {int(ny_version)}")
+        print(f"Database migreret til version {ny_version}: {beskrivelse}")
+    return schema_version(conn)
+
+
+# Åbner en forbindelse med programmets indstillinger. Forespørgsler med samme SQL tekst genbruger
+# den forberedte (prepared) statement fra forbindelsens cache
+def åbn_forbindelse(sti):
+    conn = sqlite3.connect(sti, timeout=10, cached_statements=256)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# Parametrene til SQL_NY_PULSMÅLING. hrv er resultatet for hele målingen fra ekg_hrv (HRVVindue.resultat).
+# Datahandler lægger rækken i IngestWriter'ens kø når sessionen lukkes
+def pulsmåling_række(patient_id, puls, session_id=None, hrv=None):
+    hrv = hrv or {}
+    return (patient_id, puls, session_id, hrv.get("sdnn_ms"), hrv.get("rmssd_ms"), hrv.get("pnn50"),
+            hrv.get("puls_min"), hrv.get("puls_maks"))
+
+
+class Database():
+    # Initialiserer databaselaget. Hver tråd får sin egen forbindelse fra puljen første gang den
+    # beder om en, så GUI-tråden og ingest-trådene aldrig deler forbindelse eller cursor
+    def __init__(self, sti):
+        self.sti = sti
+        self._lokal = threading.local()
+        self._lås = threading.Lock()
+        self._forbindelser = {} #Tråd-id -> forbindelse, så alle kan lukkes ved nedlukning
+        opret_schema(self.forbindelse()) #Schema oprettes/migreres én gang
+
+    # Returnerer den kaldende tråds forbindelse (oprettes hvis den ikke findes)
+    def forbindelse(self):
+        conn = getattr(self._lokal, "conn", None)
+        if conn is None:
+            conn = åbn_forbindelse(self.sti)
+            self._lokal.conn = conn
+            with self._lås:
+                self._forbindelser[threading.get_ident()] = conn
+        return conn
+
+    # Lukker den kaldende tråds forbindelse (kaldes når en ingest-tråd stopper)
+    def luk_tråd(self):
+        conn = getattr(self._lokal, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._lokal.conn = None
+            with self._lås:
+                self._forbindelser.pop(threading.get_ident(), None)
+
+    # Lukker alle forbindelser i puljen
+    def luk(self):
+        with self._lås:
+            forbindelser = list(self._forbindelser.values())
+            self._forbindelser.clear()
+        for conn in forbindelser:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError: #Forbindelser fra andre tråde kan ikke altid lukkes herfra
+                pass
+        self._lokal.conn = None
+
+    # Udfører en SELECT og returnerer alle rækker
+    def hent_alle(self, sql, parametre=()):
+        return self.forbindelse().execute(sql, parametre).fetchall()
+
+    # Udfører en SELECT og returnerer første række (eller None)
+    def hent_en(self, sql, parametre=()):
+        return self.forbindelse().execute(sql, parametre).fetchone()
+
+    # Udfører en ændring i sin egen transaktion og returnerer rækkens id
+    def udfør(self, sql, parametre=()):
+        conn = self.forbindelse()
+        with conn:
+            return conn.execute(sql, parametre).lastrowid
+
+    # Login og PageOne: alle patienter som (Id, Navn)
+    def patienter(self):
+        return self.hent_alle(SQL_PATIENTER)
+
+    # Login: alle patienter som (Navn, Efternavn, Alder, Køn)
+    def patienter_detaljer(self):
+        return self.hent_alle(SQL_PATIENTER_DETALJER)
+
+    # PatientKatalog: alle patienter som (Id, Navn, Efternavn, Alder, Køn) sorteret efter Id
+    def patient_katalog(self):
+        return self.hent_alle(SQL_PATIENT_KATALOG)
+
+    # PageTwo: navnet på en patient eller None
+    def patient_navn(self, patient_id):
+        række = self.hent_en(SQL_PATIENT_NAVN, (patient_id,))
+        return række[0] if række else None
+
+    # Login: opretter en patient og returnerer det nye id
+    def ny_patient(self, navn, efternavn, alder, køn):
+        return self.udfør(SQL_NY_PATIENT, (navn, efternavn, alder, køn))
+
+    # Gemmer en gennemsnitspuls for en afsluttet måling direkte (Datahandler gemmer sine målinger gennem
+    # IngestWriter med pulsmåling_række)
+    def ny_pulsmåling(self, patient_id, puls, session_id=None, hrv=None):
+        return self.udfør(SQL_NY_PULSMÅLING, pulsmåling_række(patient_id, puls, session_id, hrv))
+
+    # Datahandler: opretter en session når en måling starter og returnerer dens Id
+    def ny_session(self, patient_id, port=None, start_ns=None, samplerate=None):
+        return self.udfør(INSERT_SESSION, (patient_id, port, start_ns, samplerate))
+
+    # Skriver opsummeringen fra en SessionStatistik når målingen stopper
+    def afslut_session(self, statistik):
+        self.udfør(SQL_AFSLUT_SESSION, statistik.række())
+
+    # Login og PageTwo: de seneste sessioner som dicts (nyeste først)
+    def sessioner(self, patient_id, antal):
+        return [session_dict(række) for række in self.hent_alle(SQL_SESSIONER, (patient_id, antal))]
+
+    # En session som dict (eller None)
+    def session(self, session_id):
+        return session_dict(self.hent_en(SQL_SESSION, (session_id,)))
+
+    # Alle samples fra en session som float array (fra Ekgdata, fra EkgBlokke ved blokvis lagring eller
+    # fra EkgArkiv når sessionen er arkiveret)
+    def session_samples(self, session_id):
+        session = self.session(session_id)
+        if session is None:
+            return np.empty(0, dtype=np.float64)
+        rækker = self.hent_alle(SQL_SESSION_EKG, (session["PatientID"], session_id))
+        if rækker:
+            return np.array([r[0] for r in rækker], dtype=np.float64)
+        blokke = [udpak_samples(r[0]) for r in self.hent_alle(SQL_SESSION_BLOKKE, (session_id,))]
+        if blokke:
+            return np.concatenate(blokke).astype(np.float64)
+        return hent_arkiv(self.forbindelse().cursor(), session_id)[0].astype(np.float64)
+
+    # PageTwo og Login: de seneste pulsmålinger (nyeste først)
+    def seneste_pulsmålinger(self, patient_id, antal):
+        return [puls for (puls,) in self.hent_alle(SQL_SENESTE_PULSMÅLINGER, (patient_id, antal))]
+
+    # PageOne: de seneste (Data, Puls) rækker (nyeste først)
+    def seneste_ekg(self, patient_id, antal):
+        return self.hent_alle(SQL_SENESTE_EKG, (patient_id, antal))
+
+    # PageOne: de seneste (Tidspunkt, Data) rækker (nyeste først)
+    def seneste_ekg_tid(self, patient_id, antal):
+        return self.hent_alle(SQL_SENESTE_EKG_TID, (patient_id, antal))
+
+    # PageTwo: (tidspunkt, puls, data) rækker til tabellen (nyeste først)
+    def ekg_tabel(self, patient_id, antal):
+        return self.hent_alle(SQL_EKG_TABEL, (patient_id, antal))
+
+    # PageTwo: en side med (Id, tidspunkt, puls, data) rækker ældre end før_id (nyeste først)
+    def ekg_side(self, patient_id, før_id, antal):
+        return self.hent_alle(SQL_EKG_SIDE, (patient_id, før_id, antal))
+
+    # PageTwo: Id for seneste række på eller før et ISO tidspunkt (eller None)
+    def ekg_id_ved_tid(self, patient_id, tidspunkt):
+        række = self.hent_en(SQL_EKG_ID_VED_TID, (patient_id, tidspunkt))
+        return række[0] if række else None
+
+    # PageTwo: mindst antal samples fra blokke ældre end før_id (værdier, tider, puls, ældste blok Id)
+    def blok_side(self, patient_id, før_id, antal):
+        return hent_side(self.forbindelse().cursor(), patient_id, før_id, antal)
+
+    # PageTwo: Id for blokken der starter på eller før et tidspunkt i epoch-ns (eller None)
+    def blok_id_ved_tid(self, patient_id, tid_ns):
+        række = self.hent_en(SQL_BLOK_ID_VED_TID, (patient_id, tid_ns))
+        return række[0] if række else None
+
+    # PageOne og PageTwo: de seneste samples fra blokkene (værdier, tider i epoch-ns, puls)
+    def seneste_samples(self, patient_id, antal):
+        return hent_seneste(self.forbindelse().cursor(), patient_id, antal)
+
+    # Historik: første og sidste tidspunkt (epoch-ns) i pyramiden for patienten, eller None
+    def måling_omfang(self, patient_id):
+        start, slut = self.hent_en(SQL_PYRAMIDE_OMFANG, (patient_id, NIVEAUER[0]))
+        return (start, slut) if start is not None else None
+
+    # Historik: (tider, min, max, niveau) for et tidsrum tegnet i bredde pixels. Niveauet vælges så der
+    # er mindst to spande pr. pixel, og der returneres højst 2 * bredde spande uanset tidsrummets længde.
+    # Korte tidsrum (niveau 1) hentes som rå samples, hvor min og max er samme værdi
+    def oversigt(self, patient_id, fra_ns, til_ns, bredde, fs=250, blokke=False):
+        niveau = vælg_niveau((til_ns - fra_ns) / 1e9 * fs, bredde)
+        if niveau > 1:
+            tider, mins, maxs = hent_niveau(self.forbindelse().cursor(), patient_id, niveau, fra_ns, til_ns)
+            tider, mins, maxs = reducer(tider, mins, maxs, 2 * bredde)
+            return tider, mins, maxs, niveau
+        if blokke:
+            værdier, tider, _ = hent_interval(self.forbindelse().cursor(), patient_id, fra_ns, til_ns)
+        else:
+            fra = datetime.fromtimestamp(fra_ns / 1e9).isoformat(timespec='microseconds')
+            til = datetime.fromtimestamp(til_ns / 1e9).isoformat(timespec='microseconds')
+            rækker = self.hent_alle(SQL_EKG_INTERVAL, (patient_id, fra, til))
+            tider = iso_til_ns_array([tid for tid, _ in rækker])
+            værdier = np.array([data for _, data in rækker], dtype=np.float64)
+        return tider, værdier, værdier, 1
+
+    # PageOne: sætter pulsen på den nyeste række (eller blok) for patienten
+    def opdater_seneste_puls(self, patient_id, puls, blokke=False):
+        if blokke:
+            self.udfør(SQL_OPDATER_SENESTE_BLOK_PULS, (puls, patient_id))
+        else:
+            self.udfør(SQL_OPDATER_SENESTE_PULS, (puls, patient_id, patient_id))
+
+
+# Returnerer (navn, sql, plan linjer, problem) for hver forespørgsel. Et problem er en fuld
+# gennemløbning (SCAN uden indeks) eller en midlertidig sortering der ikke er forventet
+def explain(conn):
+    resultater = []
+    for navn, sql, scan_tilladt in FORESPØRGSLER:
+        parametre = tuple(1 for _ in range(sql.count("?")))
+        plan = [række[3] for række in conn.execute("EXPLAIN QUERY PLAN " + sql, parametre)]
+        problem = None
+        for linje in plan:
+            #SCAN CONSTANT ROW er en SELECT uden tabel (f.eks. kun med underforespørgsler) og læser intet
+            fuld_scan = linje.startswith("SCAN") and "USING" not in linje and linje != "SCAN CONSTANT ROW"
+            if (fuld_scan and not scan_tilladt) or "USE TEMP B-TREE" in linje:
+                problem = linje
+        resultater.append((navn, sql, plan, problem))
+    return resultater
+
+
+if __name__ == "__main__":
+    import sys
+
+    #Kør "python ekg_database.py explain [database]" for at se query plans for alle forespørgsler
+    #eller "python ekg_database.py migrer [database]" for at opdatere en eksisterende database
+    if len(sys.argv) < 2 or sys.argv[1] not in ("explain", "migrer"):
+        print("Brug: python ekg_database.py explain|migrer [EKGDATABASE.db]")
+        sys.exit(1)
+    forbindelse = åbn_forbindelse(sys.argv[2] if len(sys.argv) > 2 else "EKGDATABASE.db")
+    print("Schema version:", opret_schema(forbindelse))
+
+    if sys.argv[1] == "explain":
+        fejl = 0
+        for navn, sql, plan, problem in explain(forbindelse):
+            print(f"\n{navn}{'   <-- ' + problem if problem else ''}")
+            for linje in plan:
+                print("   ", linje)
+            fejl += problem is not None
+        print(f"\n{fejl} forespørgsler uden passende indeks")
+        forbindelse.close()
+        sys.exit(1 if fejl else 0)
+    forbindelse.close()
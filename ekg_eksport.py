@@ -0,0 +1,209 @@
+import json
+import os
+import time
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from ekg_database import INSERT_EKGDATA_SESSION, SQL_EKSPORT_EKG, SQL_EKSPORT_SESSIONER, Database, åbn_forbindelse
+from ekg_lagring import (ARKIV_STYKKE, BLOK_SEKUNDER, INSERT_BLOK, SAMPLE_TYPE, SQL_EKSPORT_ARKIV,
+                         SQL_EKSPORT_ARKIV_SESSIONER, SQL_EKSPORT_BLOK_SESSIONER, SQL_EKSPORT_BLOKKE, iso_til_ns_array,
+                         ns_til_iso_array, pak_samples, sample_tider, udpak_arkiv, udpak_samples)
+from ekg_pyramide import PyramideBygger, _SamletWriter
+from ekg_session import SQL_AFSLUT_SESSION, SessionStatistik, ny_session
+
+#Antal rækker der læses eller skrives ad gangen. Hukommelsesforbruget afhænger kun af denne, ikke af målingens længde
+STYKKE = 65536
+
+#Hver session gemmes som to .npy filer i patientens mappe plus en fælles info.json:
+#  patient_<id>/session_<sid>_samples.npy   int16 ADC værdier
+#  patient_<id>/session_<sid>_tider.npy     int64 epoch-ns
+#Rækker fra før sessionerne (SessionID NULL) får session 0
+
+
+# Filnavnene for en session i en patients mappe
+def session_filer(mappe, session_id):
+    navn = f"session_{session_id or 0}"
+    return os.path.join(mappe, f"{navn}_samples.npy"), os.path.join(mappe, f"{navn}_tider.npy")
+
+
+# Patientens sessioner med antal samples: [(session_id, antal, "rækker", "blokke" eller "arkiv")]
+def sessioner(conn, patient_id):
+    fundne = [(s, n, "rækker") for s, n in conn.execute(SQL_EKSPORT_SESSIONER, (patient_id,))]
+    fundne += [(s, n, "blokke") for s, n in conn.execute(SQL_EKSPORT_BLOK_SESSIONER, (patient_id,))]
+    fundne += [(s, n, "arkiv") for s, n in conn.execute(SQL_EKSPORT_ARKIV_SESSIONER, (patient_id,))]
+    return sorted(fundne, key=lambda s: (s[0] or 0, s[2]))
+
+
+# Bidder af (int16 samples, int64 tider) fra én session, læst med keyset pagination på Id.
+# Med med_id kommer Id for den sidste række i bidden først (retention sletter op til den)
+def bidder(conn, patient_id, session_id, kilde="rækker", stykke=STYKKE, med_id=False):
+    sidste_id = 0
+    while True:
+        if kilde == "blokke":
+            blokke = conn.execute(SQL_EKSPORT_BLOKKE, (patient_id, session_id, sidste_id,
+                                                       max(1, stykke // 250))).fetchall()
+            if not blokke:
+                return
+            sidste_id = blokke[-1][0]
+            bid = (np.concatenate([udpak_samples(data) for _, _, _, _, data in blokke]),
+                   np.concatenate([sample_tider(start, fs, antal) for _, start, fs, antal, _ in blokke]))
+        elif kilde == "arkiv":
+            rækker = conn.execute(SQL_EKSPORT_ARKIV, (session_id, sidste_id, max(1, stykke // ARKIV_STYKKE))).fetchall()
+            if not rækker:
+                return
+            sidste_id = rækker[-1][0]
+            udpakket = [udpak_arkiv(data, tider) for _, data, tider in rækker]
+            bid = np.concatenate([v for v, _ in udpakket]), np.concatenate([t for _, t in udpakket])
+        else:
+            rækker = conn.execute(SQL_EKSPORT_EKG, (patient_id, session_id, sidste_id, stykke)).fetchall()
+            if not rækker:
+                return
+            sidste_id = rækker[-1][0]
+            værdier = np.array([data for _, data, _ in rækker], dtype=np.float64)
+            bid = (np.clip(np.rint(værdier), -32768, 32767).astype(SAMPLE_TYPE),
+                   iso_til_ns_array([tid for _, _, tid in rækker]))
+        yield (sidste_id,) + bid if med_id else bid
+
+
+# Skriver én session direkte til to .npy filer på disken (open_memmap), én bid ad gangen
+def eksporter_session(conn, patient_id, session_id, antal, mappe, kilde="rækker", stykke=STYKKE):
+    samples_sti, tider_sti = session_filer(mappe, session_id)
+    samples = open_memmap(samples_sti, mode="w+", dtype=SAMPLE_TYPE, shape=(antal,))
+    tider = open_memmap(tider_sti, mode="w+", dtype=np.int64, shape=(antal,))
+    i = 0
+    start_ns = slut_ns = None
+    for værdier, tider_ns in bidder(conn, patient_id, session_id, kilde, stykke):
+        n = len(værdier)
+        samples[i:i + n] = værdier
+        tider[i:i + n] = tider_ns
+        i += n
+        start_ns = int(tider_ns[0]) if start_ns is None else start_ns
+        slut_ns = int(tider_ns[-1])
+    samples.flush()
+    tider.flush()
+    del samples, tider #Lukker filerne
+    fs = (antal - 1) * 1e9 / (slut_ns - start_ns) if antal > 1 and slut_ns > start_ns else None
+    return {"session": session_id or 0, "antal": antal, "kilde": kilde, "samplerate": fs,
+            "start_ns": start_ns, "slut_ns": slut_ns,
+            "samples": os.path.basename(samples_sti), "tider": os.path.basename(tider_sti)}
+
+
+# Eksporterer alle patientens sessioner til mappe/patient_<id>. Alt læses i én læsetransaktion, så
+# antallet og rækkerne passer sammen, selvom Datahandler skriver imens (WAL)
+def eksporter_patient(db_sti, patient_id, mappe, stykke=STYKKE):
+    Database(db_sti).luk() #Sikrer at schemaet er migreret
+    patient_mappe = os.path.join(mappe, f"patient_{patient_id}")
+    os.makedirs(patient_mappe, exist_ok=True)
+    conn = åbn_forbindelse(db_sti)
+    try:
+        conn.execute("BEGIN")
+        info = [eksporter_session(conn, patient_id, session_id, antal, patient_mappe, kilde, stykke)
+                for session_id, antal, kilde in sessioner(conn, patient_id)]
+        conn.rollback()
+    finally:
+        conn.close()
+    with open(os.path.join(patient_mappe, "info.json"), "w", encoding="utf-8") as fil:
+        json.dump({"patient": patient_id, "sessioner": info}, fil, indent=2, ensure_ascii=False)
+    return info
+
+
+# Åbner en eksporteret session som (samples, tider) uden at læse filerne ind i hukommelsen
+def åbn_session(patient_mappe, session_id):
+    samples_sti, tider_sti = session_filer(patient_mappe, session_id)
+    return np.load(samples_sti, mmap_mode="r"), np.load(tider_sti, mmap_mode="r")
+
+
+# Rækker til EkgBlokke for en bid samples delt i blokke af blok samples
+def _blokke(patient_id, session_id, værdier, tider_ns, samplerate, blok):
+    for b in range(0, len(værdier), blok):
+        antal = len(værdier[b:b + blok])
+        start_ns = int(tider_ns[b])
+        yield (patient_id, session_id, start_ns, start_ns + int(round(antal * 1e9 / samplerate)), samplerate,
+               antal, None, pak_samples(værdier[b:b + blok]))
+
+
+# Importerer samples (og tider i epoch-ns) som en ny session for patienten og returnerer dens Id.
+# Filerne åbnes memory-mapped og skrives i bidder, hver bid i sin egen transaktion, så Datahandler
+# og GUI'en ikke venter på hele importen. Uden tider regnes de ud fra samplerate med start nu
+def importer(db_sti, patient_id, samples_sti, tider_sti=None, samplerate=250, lagring="rækker", stykke=STYKKE):
+    samples = np.load(samples_sti, mmap_mode="r")
+    if tider_sti is not None:
+        tider = np.load(tider_sti, mmap_mode="r")
+        if len(tider) != len(samples):
+            raise ValueError(f"{samples_sti} og {tider_sti} har ikke lige mange værdier")
+        if len(tider) > 1 and tider[-1] > tider[0]:
+            samplerate = (len(tider) - 1) * 1e9 / (int(tider[-1]) - int(tider[0]))
+    else:
+        tider = time.time_ns() + np.rint(np.arange(len(samples)) * (1e9 / samplerate)).astype(np.int64)
+
+    Database(db_sti).luk()
+    conn = åbn_forbindelse(db_sti)
+    try:
+        with conn:
+            session_id = ny_session(conn.cursor(), patient_id, "import", int(tider[0]) if len(tider) else None,
+                                    samplerate)
+        statistik = SessionStatistik(session_id, samplerate)
+        pyramide_writer = _SamletWriter(conn)
+        pyramide = PyramideBygger(pyramide_writer, patient_id) #Importen kan ses i historikken
+        blok = max(1, int(round(samplerate * BLOK_SEKUNDER)))
+        if lagring == "blokke":
+            stykke = max(blok, stykke // blok * blok) #Bidderne deles i hele blokke
+
+        for a in range(0, len(samples), stykke):
+            værdier = np.asarray(samples[a:a + stykke])
+            tider_ns = np.asarray(tider[a:a + stykke], dtype=np.int64)
+            with conn:
+                if lagring == "blokke":
+                    conn.executemany(INSERT_BLOK, _blokke(patient_id, session_id, værdier, tider_ns, samplerate, blok))
+                else:
+                    conn.executemany(INSERT_EKGDATA_SESSION, zip([patient_id] * len(værdier), værdier.tolist(),
+                                                                 ns_til_iso_array(tider_ns).tolist(),
+                                                                 [None] * len(værdier), [session_id] * len(værdier)))
+            pyramide.tilføj_mange(værdier, tider_ns)
+            pyramide_writer.skriv()
+            statistik.tilføj(tider_ns)
+
+        pyramide.flush()
+        pyramide_writer.skriv()
+        with conn:
+            conn.execute(SQL_AFSLUT_SESSION, statistik.række())
+    finally:
+        conn.close()
+    return session_id
+
+
+# Importerer alle sessioner fra en eksporteret patientmappe til en (evt. anden) patient
+def importer_patient(db_sti, patient_mappe, patient_id=None, lagring="rækker", stykke=STYKKE):
+    with open(os.path.join(patient_mappe, "info.json"), encoding="utf-8") as fil:
+        info = json.load(fil)
+    patient_id = info["patient"] if patient_id is None else patient_id
+    return [importer(db_sti, patient_id, os.path.join(patient_mappe, s["samples"]),
+                     os.path.join(patient_mappe, s["tider"]), lagring=lagring, stykke=stykke)
+            for s in info["sessioner"] if s["antal"]]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    #Kør f.eks. "python ekg_eksport.py eksport --patient 1 2 3 --mappe eksport" og læs i Python med
+    #np.load("eksport/patient_1/session_4_samples.npy", mmap_mode="r").
+    #"python ekg_eksport.py import eksport/patient_1 --patient 7" indlæser dem igen
+    parser = argparse.ArgumentParser(description="Eksport og import af EKG målinger som .npy filer")
+    parser.add_argument("handling", choices=("eksport", "import"))
+    parser.add_argument("mappe", nargs="?", default="eksport", help="eksportmappe eller patientmappe ved import")
+    parser.add_argument("--db", default="EKGDATABASE.db")
+    parser.add_argument("--patient", type=int, nargs="*", default=[], help="patient ID'er (import: ny patient)")
+    parser.add_argument("--lagring", choices=("rækker", "blokke"), default="rækker", help="lagringsform ved import")
+    argumenter = parser.parse_args()
+
+    start = time.perf_counter()
+    if argumenter.handling == "eksport":
+        for patient_id in argumenter.patient:
+            info = eksporter_patient(argumenter.db, patient_id, argumenter.mappe)
+            print(f"Patient {patient_id}: {len(info)} sessioner, {sum(s['antal'] for s in info)} samples")
+    else:
+        patient_id = argumenter.patient[0] if argumenter.patient else None
+        nye = importer_patient(argumenter.db, argumenter.mappe, patient_id, argumenter.lagring)
+        print(f"Importeret som sessioner {nye}")
+    print(f"{time.perf_counter() - start:.1f} s")
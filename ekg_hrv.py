@@ -0,0 +1,151 @@
+import math
+from collections import deque
+
+#Vinduerne der vises og gemmes: navn og længde i sekunder (None: hele sessionen)
+VINDUER = (("1 min", 60), ("5 min", 300), ("session", None))
+
+#Forskel mellem to på hinanden følgende RR-intervaller der tælles med i pNN50 (sekunder)
+NN50 = 0.05
+
+
+class HRVVindue():
+    # HRV for RR-intervallerne i et glidende tidsvindue. Summerne opdateres når et slag kommer ind og når
+    # det falder ud af vinduet, og min/max findes med monotone køer, så hvert slag koster O(1) (amortiseret).
+    # Uden sekunder er vinduet hele sessionen, og intet falder ud
+    def __init__(self, sekunder=None):
+        self.sekunder = sekunder
+        self._slag = deque() #(tid_ns, rr, forskel) for gyldige intervaller i vinduet
+        self._min = deque() #Stigende RR (korteste forrest), giver højeste puls
+        self._maks = deque() #Faldende RR (længste forrest), giver laveste puls
+        self.rr_min = None #Kun til hele sessionen, hvor køerne ikke behøves
+        self.rr_maks = None
+        self._nulstil_summer()
+        self._siden_genberegning = 0
+
+    # Sætter de løbende summer til nul
+    def _nulstil_summer(self):
+        self.antal = 0
+        self.rr_sum = 0.0
+        self.rr_kvadratsum = 0.0
+        self.forskel_antal = 0 #Antal par af på hinanden følgende gyldige intervaller
+        self.forskel_kvadratsum = 0.0
+        self.nn50 = 0
+
+    # Tilføjer et gyldigt RR-interval (sekunder) der sluttede ved tid_ns. forskel er forskellen til det
+    # forrige interval hvis begge var gyldige, ellers None
+    def tilføj(self, tid_ns, rr, forskel=None):
+        self._læg_til(rr, forskel, 1)
+        if self.sekunder is None:
+            self.rr_min = rr if self.rr_min is None else min(self.rr_min, rr)
+            self.rr_maks = rr if self.rr_maks is None else max(self.rr_maks, rr)
+            return
+        self._slag.append((tid_ns, rr, forskel))
+        while self._min and self._min[-1][1] >= rr:
+            self._min.pop()
+        self._min.append((tid_ns, rr))
+        while self._maks and self._maks[-1][1] <= rr:
+            self._maks.pop()
+        self._maks.append((tid_ns, rr))
+        self.udløb(tid_ns)
+
+    # Lægger et interval til summerne (fortegn 1) eller trækker det fra (fortegn -1)
+    def _læg_til(self, rr, forskel, fortegn):
+        self.antal += fortegn
+        self.rr_sum += fortegn * rr
+        self.rr_kvadratsum += fortegn * rr * rr
+        if forskel is not None:
+            self.forskel_antal += fortegn
+            self.forskel_kvadratsum += fortegn * forskel * forskel
+            self.nn50 += fortegn * (abs(forskel) > NN50)
+
+    # Fjerner slag der er ældre end vinduet set fra nu_ns
+    def udløb(self, nu_ns):
+        if self.sekunder is None:
+            return
+        grænse = nu_ns - int(self.sekunder * 1e9)
+        while self._slag and self._slag[0][0] < grænse:
+            _, rr, forskel = self._slag.popleft()
+            self._læg_til(rr, forskel, -1)
+            self._siden_genberegning += 1
+        while self._min and self._min[0][0] < grænse:
+            self._min.popleft()
+        while self._maks and self._maks[0][0] < grænse:
+            self._maks.popleft()
+        #Summerne genberegnes en gang for hvert vindue der er skiftet ud, så afrundingsfejl ikke hober sig op
+        if self._siden_genberegning > max(64, len(self._slag)):
+            self._nulstil_summer()
+            for _, rr, forskel in self._slag:
+                self._læg_til(rr, forskel, 1)
+            self._siden_genberegning = 0
+
+    # Resultatet som dict: antal intervaller, SDNN og RMSSD i ms, pNN50 i procent og puls (gns, min, maks)
+    def resultat(self):
+        n = self.antal
+        if self.sekunder is None:
+            rr_min, rr_maks = self.rr_min, self.rr_maks
+        else:
+            rr_min = self._min[0][1] if self._min else None
+            rr_maks = self._maks[0][1] if self._maks else None
+        rr_gns = self.rr_sum / n if n else None
+        sdnn = math.sqrt(max(0.0, (self.rr_kvadratsum - n * rr_gns * rr_gns) / (n - 1))) * 1000 if n > 1 else None
+        m = self.forskel_antal
+        return {"antal": n, "sdnn_ms": sdnn,
+                "rmssd_ms": math.sqrt(max(0.0, self.forskel_kvadratsum) / m) * 1000 if m else None,
+                "pnn50": 100 * self.nn50 / m if m else None,
+                "puls_gns": 60 / rr_gns if rr_gns else None,
+                "puls_min": 60 / rr_maks if rr_maks else None,
+                "puls_maks": 60 / rr_min if rr_min else None}
+
+
+class RullendeHRV():
+    # HRV over flere vinduer på én gang (1 min, 5 min og hele sessionen). Fødes med ét kald pr. slag fra
+    # QRS-detektoren (StreamingQRS(hrv=...)), så intet skal regnes om ud fra bufferne
+    def __init__(self, vinduer=VINDUER):
+        self.vinduer = {navn: HRVVindue(sekunder) for navn, sekunder in vinduer}
+        self.slag = 0
+        self._forrige_rr = None #Forrige interval hvis det var gyldigt
+
+    # Registrerer et slag ved tid_ns. rr er intervallet til forrige slag i sekunder hvis det var gyldigt
+    def slag_fundet(self, tid_ns, rr=None):
+        self.slag += 1
+        if not rr:
+            self._forrige_rr = None
+            self.udløb(tid_ns)
+            return
+        forskel = rr - self._forrige_rr if self._forrige_rr is not None else None
+        self._forrige_rr = rr
+        for vindue in self.vinduer.values():
+            vindue.tilføj(tid_ns, rr, forskel)
+
+    # Fjerner slag der er ældre end vinduerne set fra nu_ns (f.eks. når signalet er tabt og der ikke kommer slag)
+    def udløb(self, nu_ns):
+        for vindue in self.vinduer.values():
+            vindue.udløb(nu_ns)
+
+    # Resultatet for hvert vindue: {navn: dict fra HRVVindue.resultat}
+    def resultater(self):
+        return {navn: vindue.resultat() for navn, vindue in self.vinduer.items()}
+
+    # Resultatet for ét vindue
+    def resultat(self, navn="session"):
+        return self.vinduer[navn].resultat()
+
+
+# Et tal til visning, eller "--" når det ikke kan beregnes endnu
+def _tal(værdi):
+    return f"{værdi:.0f}" if værdi is not None else "--"
+
+
+# Tabel med vinduerne som kolonner til visning (PageOne)
+def hrv_tekst(resultater):
+    linjer = [f"{'':<9}" + "".join(f"{navn:>8}" for navn in resultater)]
+    for nøgle, navn in (("puls_gns", "Puls"), ("puls_min", "Puls min"), ("puls_maks", "Puls max"),
+                        ("sdnn_ms", "SDNN ms"), ("rmssd_ms", "RMSSD ms"), ("pnn50", "pNN50 %")):
+        linjer.append(f"{navn:<9}" + "".join(f"{_tal(r[nøgle]):>8}" for r in resultater.values()))
+    return "\n".join(linjer)
+
+
+# HRV for ét vindue på én linje (beskeden når en måling stoppes)
+def hrv_linje(resultat):
+    return (f"SDNN {_tal(resultat['sdnn_ms'])} ms, RMSSD {_tal(resultat['rmssd_ms'])} ms, "
+            f"pNN50 {_tal(resultat['pnn50'])} %, puls {_tal(resultat['puls_min'])}-{_tal(resultat['puls_maks'])} BPM")
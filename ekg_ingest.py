@@ -0,0 +1,301 @@
+import queue
+import threading
+import time
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+
+from ekg_database import INSERT_EKGDATA, åbn_forbindelse
+from ekg_metrik import metrik
+
+#Markør der lægges i køen når skriveren skal stoppe
+_STOP = object()
+
+#Antal forsøg på at skrive en batch. Transaktionen rulles tilbage ved fejl, så et nyt forsøg skriver intet dobbelt
+FLUSH_FORSØG = 2
+
+
+class IngestWriter():
+    # Initialiserer skriveren. Målinger samles i hukommelsen og skrives samlet i én transaktion,
+    # enten når flush_antal målinger er samlet eller når flush_ms millisekunder er gået.
+    # maks_kø begrænser køen (0 = ubegrænset). Er køen fuld kasseres rækken med det samme og tælles som
+    # tabt, så den læsende tråd aldrig venter på databasen (ellers løber enhedens buffer over i stedet).
+    # Kun rækker der lægges i køen med vent=True (f.eks. sessionens opsummering) venter op til kø_timeout sekunder
+    # stop_timeout er hvor længe stop() højst venter på at skrivetråden bliver færdig
+    def __init__(self, db_sti, flush_antal=250, flush_ms=200, maks_kø=0, kø_timeout=1.0, stop_timeout=10.0):
+        self.db_sti = db_sti #Stien til databasefilen
+        self.flush_antal = flush_antal #Maks antal rækker pr. transaktion
+        self.flush_ms = flush_ms #Maks tid en måling må ligge i hukommelsen
+        self.kø_timeout = kø_timeout
+        self.stop_timeout = stop_timeout
+        self.kø = queue.Queue(maxsize=maks_kø) #Kø mellem de læsende tråde og skrivetråden
+        self._tråd = None
+        self._stop = threading.Event() #Sat af stop(). Skrivetråden stopper når køen er tom
+
+        #Statistik over skrivningen
+        self._lås = threading.Lock()
+        self._start_tid = None
+        self.rækker_skrevet = 0
+        self.flushes = 0
+        self.fejl = 0
+        self.tabte = 0 #Rækker der er kasseret (fuld kø, fejl ved skrivning eller skrivetråden stoppet)
+        self.tabte_samples = 0 #Samples i de kasserede rækker
+        self.ventende_samples = 0 #Samples i køen og i den batch der skrives (modtrykket målt i samples)
+        self.flush_ms_total = 0.0
+        self.flush_ms_max = 0.0
+        self.flush_ms_seneste = 0.0
+
+    # Lægger en række i køen. sql angiver hvilken tabel rækken skal skrives til, og samples hvor mange
+    # samples rækken indeholder (en blok har mange, en opsummering ingen). Blokerer ikke medmindre vent er sat
+    def tilføj(self, række, sql=INSERT_EKGDATA, samples=1, vent=False):
+        try:
+            if vent:
+                self.kø.put((sql, række, samples), timeout=self.kø_timeout)
+            else:
+                self.kø.put_nowait((sql, række, samples))
+        except queue.Full:
+            self._tab(1, samples)
+            return
+        with self._lås:
+            self.ventende_samples += samples
+
+    # Tæller kasserede rækker og deres samples
+    def _tab(self, rækker, samples, ventende=0):
+        metrik.tæl("tabte_samples", samples)
+        with self._lås:
+            self.tabte += rækker
+            self.tabte_samples += samples
+            self.ventende_samples -= ventende
+
+    # Starter skrivetråden
+    def start(self):
+        self._start_tid = time.monotonic()
+        self._stop.clear()
+        self._tråd = threading.Thread(target=self.kør, daemon=True)
+        self._tråd.start()
+        return self
+
+    # Stopper skrivetråden. Alt hvad der ligger i køen skrives inden tråden lukkes. Er køen fuld, eller er
+    # skrivetråden død eller hængt, ventes der højst stop_timeout sekunder. Rækker der ikke nåede at blive
+    # skrevet tælles som tabte
+    def stop(self):
+        tråd, self._tråd = self._tråd, None
+        if tråd is None:
+            return
+        self._stop.set()
+        try:
+            self.kø.put_nowait(_STOP) #Vækker skrivetråden med det samme. Ellers opdager den _stop ved næste timeout
+        except queue.Full:
+            pass
+        tråd.join(self.stop_timeout)
+        if tråd.is_alive():
+            print(f"Skrivetråden stoppede ikke inden for {self.stop_timeout} s")
+            return
+        rækker = samples = 0
+        while True:
+            try:
+                element = self.kø.get_nowait()
+            except queue.Empty:
+                break
+            if element is not _STOP:
+                rækker += 1
+                samples += element[2]
+        if rækker:
+            print(f"{rækker} rækker blev ikke skrevet til databasen")
+            self._tab(rækker, samples, ventende=samples)
+
+    # Skrivetrådens løkke. Henter rækker fra køen og flusher efter antal eller tid
+    def kør(self):
+        conn = åbn_forbindelse(self.db_sti) #Skrivetråden har sin egen forbindelse (WAL)
+        batch = []
+        frist = time.monotonic() + self.flush_ms / 1000
+        try:
+            while True:
+                try:
+                    element = self.kø.get(timeout=max(0.0, frist - time.monotonic()))
+                except queue.Empty:
+                    element = None
+
+                if element is _STOP or (element is None and self._stop.is_set()):
+                    break
+                if element is not None:
+                    batch.append(element)
+                    #Tømmer køen uden at vente så der ikke betales timeout pr. række
+                    while len(batch) < self.flush_antal:
+                        try:
+                            element = self.kø.get_nowait()
+                        except queue.Empty:
+                            break
+                        if element is _STOP:
+                            self._flush(conn, batch)
+                            return
+                        batch.append(element)
+
+                #Flusher når der er nok rækker eller fristen er nået
+                if len(batch) >= self.flush_antal or time.monotonic() >= frist:
+                    self._flush(conn, batch)
+                    batch = []
+                    frist = time.monotonic() + self.flush_ms / 1000
+
+            self._flush(conn, batch) #Sidste rest skrives ved stop
+        finally:
+            conn.close()
+
+    # Skriver en samling rækker i én transaktion med executemany
+    def _flush(self, conn, batch):
+        if not batch:
+            return
+        start = time.perf_counter()
+        samples = sum(antal for _, _, antal in batch)
+        for forsøg in range(1, FLUSH_FORSØG + 1):
+            try:
+                with conn: #Commit ved succes, rollback ved fejl
+                    for sql, rækker in groupby(batch, key=itemgetter(0)):
+                        conn.executemany(sql, [række for _, række, _ in rækker])
+                break
+            except Exception as e:
+                print(f"Fejl ved skrivning til database (forsøg {forsøg} af {FLUSH_FORSØG}):", e)
+                metrik.tæl("db_fejl")
+                with self._lås:
+                    self.fejl += 1
+        else:
+            print(f"{len(batch)} rækker med {samples} samples blev ikke skrevet")
+            self._tab(len(batch), samples, ventende=samples)
+            return
+        varighed = (time.perf_counter() - start) * 1000
+        metrik.registrer("db_commit", varighed * 1e6)
+        metrik.tæl("rækker_skrevet", len(batch))
+
+        with self._lås:
+            self.ventende_samples -= samples
+            self.rækker_skrevet += len(batch)
+            self.flushes += 1
+            self.flush_ms_total += varighed
+            self.flush_ms_seneste = varighed
+            self.flush_ms_max = max(self.flush_ms_max, varighed)
+
+    # Returnerer statistik: rækker pr. sekund, flush-latens og kødybde
+    def statistik(self):
+        with self._lås:
+            forløbet = time.monotonic() - self._start_tid if self._start_tid else 0.0
+            return {
+                "rækker": self.rækker_skrevet,
+                "rækker_pr_s": self.rækker_skrevet / forløbet if forløbet > 0 else 0.0,
+                "flushes": self.flushes,
+                "fejl": self.fejl,
+                "tabte": self.tabte,
+                "tabte_samples": self.tabte_samples,
+                "flush_ms_gns": self.flush_ms_total / self.flushes if self.flushes else 0.0,
+                "flush_ms_max": self.flush_ms_max,
+                "flush_ms_seneste": self.flush_ms_seneste,
+                "kødybde": self.kø.qsize(),
+                "ventende_samples": self.ventende_samples,
+            }
+
+
+class RingBuffer():
+    # Initialiserer en ringbuffer med plads til kapacitet samples. Datahandler skriver og GUI'en læser.
+    # sekvens tæller alle samples der nogensinde er skrevet, så læseren kan spørge efter "alt efter nr. x"
+    def __init__(self, kapacitet=5000):
+        self.kapacitet = kapacitet
+        self.værdier = np.zeros(kapacitet, dtype=np.float64) #EKG værdier
+        self.tider = np.zeros(kapacitet, dtype=np.int64) #Tidsstempler i epoch-ns
+        self.sekvens = 0 #Antal samples skrevet i alt
+        self.puls = None #Seneste puls beregnet af Datahandler
+        self.ankomst_ns = None #time.monotonic_ns() da de nyeste samples blev læst fra porten (ende-til-ende latens)
+        self.fs = None #Effektiv samplerate estimeret af Datahandler ud fra enhedens tæller
+        self._lås = threading.Lock()
+
+    # Skriver én sample til bufferen
+    def skriv(self, værdi, tid_ns, puls=None):
+        with self._lås:
+            i = self.sekvens % self.kapacitet
+            self.værdier[i] = værdi
+            self.tider[i] = tid_ns
+            if puls is not None:
+                self.puls = puls
+            self.sekvens += 1
+
+    # Skriver mange samples på én gang (værdier og tider som arrays)
+    def skriv_mange(self, værdier, tider_ns):
+        værdier = np.asarray(værdier, dtype=np.float64)[-self.kapacitet:]
+        tider_ns = np.asarray(tider_ns, dtype=np.int64)[-self.kapacitet:]
+        n = len(værdier)
+        if n == 0:
+            return
+        with self._lås:
+            #Positionerne i bufferen kan gå hen over enden, så der skrives med et indeks-array
+            positioner = (self.sekvens + np.arange(n)) % self.kapacitet
+            self.værdier[positioner] = værdier
+            self.tider[positioner] = tider_ns
+            self.sekvens += n
+
+    # Kopierer samples med sekvensnummer fra start til slut (slut ikke inkluderet) ud af bufferen
+    def _kopier(self, start, slut):
+        a = start % self.kapacitet
+        b = slut % self.kapacitet
+        if slut - start == 0:
+            return self.værdier[:0].copy(), self.tider[:0].copy()
+        if a < b:
+            return self.værdier[a:b].copy(), self.tider[a:b].copy()
+        #Området går hen over bufferens ende
+        return (np.concatenate((self.værdier[a:], self.værdier[:b])),
+                np.concatenate((self.tider[a:], self.tider[:b])))
+
+    # Returnerer (ny sekvens, værdier, tider) for alle samples skrevet efter sekvens.
+    # Er læseren kommet for langt bagud returneres kun de samples der stadig ligger i bufferen
+    def læs_siden(self, sekvens):
+        with self._lås:
+            start = max(sekvens, self.sekvens - self.kapacitet)
+            værdier, tider = self._kopier(start, self.sekvens)
+            return self.sekvens, værdier, tider
+
+    # Returnerer de seneste n samples (værdier, tider)
+    def seneste(self, n):
+        with self._lås:
+            n = min(n, self.sekvens, self.kapacitet)
+            return self._kopier(self.sekvens - n, self.sekvens)
+
+
+# Belastningstest: simulerer et antal patienter ved en given samplingsfrekvens og udskriver statistik
+def belastningstest(db_sti, patienter=4, fs=1000, sekunder=5):
+    from ekg_database import opret_schema
+
+    conn = åbn_forbindelse(db_sti)
+    opret_schema(conn) #Samme tabeller og indekser som programmet
+    conn.close()
+
+    writer = IngestWriter(db_sti).start()
+    start = time.monotonic()
+    sendt = 0
+    #Lægger målinger i køen i samme tempo som patienterne ville levere dem
+    while time.monotonic() - start < sekunder:
+        mål = int((time.monotonic() - start) * fs)
+        while sendt < mål:
+            for patient_id in range(1, patienter + 1):
+                writer.tilføj((patient_id, 512.0, "2024-01-01T00:00:00.000000", None))
+            sendt += 1
+        stat = writer.statistik()
+        if stat["kødybde"] > fs * patienter:
+            print("Skriveren følger ikke med, kødybde:", stat["kødybde"])
+        time.sleep(0.01)
+    writer.stop()
+
+    stat = writer.statistik()
+    print(f"{patienter} patienter ved {fs} Hz i {sekunder} s: "
+          f"{stat['rækker_pr_s']:.0f} rækker/s (krævet {patienter * fs}), "
+          f"flush gns {stat['flush_ms_gns']:.2f} ms, max {stat['flush_ms_max']:.2f} ms")
+    return stat
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+
+    #Kør f.eks. "python ekg_ingest.py 4 1000" for 4 patienter ved 1 kHz
+    patienter = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    fs = int(sys.argv[2]) if len(sys.argv) > 2 else 250
+    with tempfile.TemporaryDirectory() as mappe:
+        belastningstest(os.path.join(mappe, "belastning.db"), patienter, fs)
@@ -0,0 +1,73 @@
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+
+#En patient fra Brugerdata
+Patient = namedtuple("Patient", ["id", "navn", "efternavn", "alder", "køn"])
+
+
+class PatientKatalog():
+    # Fælles cache over alle patienter, så siderne ikke spørger Brugerdata ved hvert klik. Listen er
+    # sorteret efter Id, så indeks i en liste altid passer til samme patient på alle sider.
+    # Kaldes ugyldiggør (f.eks. når en patient oprettes) hentes listen igen ved næste opslag
+    def __init__(self, db):
+        self.db = db #Database fra ekg_database
+        self._lås = threading.Lock()
+        self._patienter = None #Liste af Patient sorteret efter Id (None = skal hentes)
+        self._efter_id = {}
+        self._nøgler = [] #Sorteret liste af (søgetekst, indeks) til præfikssøgning
+        self.indlæsninger = 0 #Antal gange listen er hentet fra databasen
+
+    # Henter listen fra databasen hvis den ikke allerede er i hukommelsen
+    def _hent(self):
+        with self._lås:
+            if self._patienter is not None:
+                return self._patienter
+            patienter = [Patient(*række) for række in self.db.patient_katalog()]
+            nøgler = []
+            for i, p in enumerate(patienter):
+                navn = (p.navn or "").lower()
+                efternavn = (p.efternavn or "").lower()
+                #Der kan søges på fornavn, efternavn og fulde navn
+                nøgler += [(navn, i), (efternavn, i), (f"{navn} {efternavn}", i)]
+            nøgler.sort()
+            self._efter_id = {p.id: p for p in patienter}
+            self._nøgler = nøgler
+            self._patienter = patienter
+            self.indlæsninger += 1
+            return patienter
+
+    # Glemmer listen, så næste opslag henter den igen
+    def ugyldiggør(self):
+        with self._lås:
+            self._patienter = None
+
+    # Alle patienter sorteret efter Id
+    def alle(self):
+        return list(self._hent())
+
+    # Patienten med Id (eller None)
+    def hent(self, patient_id):
+        self._hent()
+        return self._efter_id.get(patient_id)
+
+    # Fornavnet på patienten (eller None)
+    def navn(self, patient_id):
+        patient = self.hent(patient_id)
+        return patient.navn if patient else None
+
+    # Patienter hvis fornavn, efternavn eller fulde navn starter med tekst (uden forskel på store og små
+    # bogstaver), sorteret efter Id. Opslaget er binær søgning i de sorterede navne
+    def søg(self, tekst, maks=None):
+        patienter = self._hent()
+        tekst = tekst.strip().lower()
+        if not tekst:
+            return patienter[:maks] if maks else list(patienter)
+        nøgler = self._nøgler
+        fundne = set()
+        i = bisect_left(nøgler, (tekst, -1))
+        while i < len(nøgler) and nøgler[i][0].startswith(tekst):
+            fundne.add(nøgler[i][1])
+            i += 1
+        resultat = [patienter[j] for j in sorted(fundne)]
+        return resultat[:maks] if maks else resultat
@@ -0,0 +1,472 @@
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from ekg_session import opret_session_tabel, ny_session, opsummer_blokke
+
+#Længden af en blok i sekunder. Ved 250 Hz fylder en blok 500 bytes mod ca. 60-80 bytes pr. række i Ekgdata
+BLOK_SEKUNDER = 1
+
+#Samples gemmes som little-endian int16 (ADC værdier)
+SAMPLE_TYPE = np.dtype("<i2")
+
+INSERT_BLOK = """
+    INSERT INTO EkgBlokke (PatientID, SessionID, StartNs, SlutNs, Samplerate, Antal, Puls, Data)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_SENESTE_BLOKKE = """
+    SELECT StartNs, Samplerate, Antal, Puls, Data
+    FROM EkgBlokke
+    WHERE PatientID = ?
+    ORDER BY Id DESC
+"""
+
+#Blokke der overlapper et tidsrum. Indekset afgrænses nedadtil af blokken der indeholder fra (den seneste
+#der starter før), så opslaget ikke gennemløber hele historikken før tidsrummet
+SQL_BLOK_INTERVAL = """
+    SELECT StartNs, Samplerate, Antal, Puls, Data
+    FROM EkgBlokke
+    WHERE PatientID = ? AND StartNs <= ? AND SlutNs >= ?
+      AND StartNs >= COALESCE((SELECT StartNs FROM EkgBlokke WHERE PatientID = ? AND StartNs <= ?
+                               ORDER BY StartNs DESC LIMIT 1), ?)
+    ORDER BY StartNs
+"""
+
+#Keyset pagination: blokke ældre end en given blok (nyeste først), og blokken der indeholder et tidspunkt
+SQL_BLOK_SIDE = """
+    SELECT Id, StartNs, Samplerate, Antal, Puls, Data
+    FROM EkgBlokke
+    WHERE PatientID = ? AND Id < ?
+    ORDER BY Id DESC
+"""
+
+#Alle blokke fra én session i rækkefølge (afspilning i simulatoren og eksport)
+SQL_SESSION_BLOKKE = """
+    SELECT Data
+    FROM EkgBlokke
+    WHERE SessionID = ?
+    ORDER BY Id
+"""
+
+#Eksport: sessioner med antal samples for en patient, og en patients blokke fra én session i bidder
+SQL_EKSPORT_BLOK_SESSIONER = """
+    SELECT SessionID, SUM(Antal)
+    FROM EkgBlokke
+    WHERE SessionID IN (SELECT Id FROM Sessions WHERE PatientID = ?)
+    GROUP BY SessionID
+"""
+
+SQL_EKSPORT_BLOKKE = """
+    SELECT Id, StartNs, Samplerate, Antal, Data
+    FROM EkgBlokke
+    WHERE PatientID = ? AND SessionID IS ? AND Id > ?
+    ORDER BY Id
+    LIMIT ?
+"""
+
+#Reanalyse: blokkenes Id og antal samples for en session (til at finde hver bloks sidste sample), og ny puls
+SQL_REANALYSE_BLOKKE = """
+    SELECT Id, Antal
+    FROM EkgBlokke
+    WHERE SessionID = ?
+    ORDER BY Id
+"""
+
+SQL_REANALYSE_BLOK_PULS = "UPDATE EkgBlokke SET Puls = ? WHERE Id = ?"
+
+#Retention: blokkene fra én session slettes i bidder, når de er flyttet til EkgArkiv
+SQL_SLET_BLOKKE = "DELETE FROM EkgBlokke WHERE SessionID = ? AND Id <= ?"
+
+#Arkiverede sessioner: rå samples fra sessioner ældre end retention-grænsen (se ekg_retention.py).
+#Hver række er en bid af en session gemt som delta + zlib (tabsfrit)
+INSERT_ARKIV = """
+    INSERT INTO EkgArkiv (PatientID, SessionID, StartNs, SlutNs, Antal, Data, Tider)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_SESSION_ARKIV = """
+    SELECT Data, Tider
+    FROM EkgArkiv
+    WHERE SessionID = ?
+    ORDER BY Id
+"""
+
+SQL_EKSPORT_ARKIV_SESSIONER = """
+    SELECT SessionID, SUM(Antal)
+    FROM EkgArkiv
+    WHERE SessionID IN (SELECT Id FROM Sessions WHERE PatientID = ?)
+    GROUP BY SessionID
+"""
+
+SQL_EKSPORT_ARKIV = """
+    SELECT Id, Data, Tider
+    FROM EkgArkiv
+    WHERE SessionID = ? AND Id > ?
+    ORDER BY Id
+    LIMIT ?
+"""
+
+#Samples pr. række i EkgArkiv (ca. 20 s ved 250 Hz). Én række skrives og de tilsvarende rå samples slettes
+#i samme korte transaktion
+ARKIV_STYKKE = 5000
+
+SQL_HENT_META = "SELECT Værdi FROM Meta WHERE Nøgle = ?"
+SQL_SÆT_META = "INSERT OR REPLACE INTO Meta (Nøgle, Værdi) VALUES (?, ?)"
+
+#migrer_ekgdata: en patients rækker efter det Id migreringen er nået til, tidspunktet for en række (når en
+#afbrudt migrering fortsætter) og sletning af de migrerede rækker
+SQL_MIGRER_PATIENTER = "SELECT DISTINCT PatientID FROM Ekgdata ORDER BY PatientID"
+SQL_MIGRER_EKGDATA = """
+    SELECT Id, Tidspunkt, Data, Puls
+    FROM Ekgdata
+    WHERE PatientID = ? AND Id > ?
+    ORDER BY Id
+"""
+SQL_MIGRER_TIDSPUNKT = "SELECT Tidspunkt FROM Ekgdata WHERE Id = ?"
+SQL_SLET_MIGREREDE = "DELETE FROM Ekgdata WHERE PatientID = ? AND Id <= ?"
+
+#zlib niveau for arkivet. Højere niveauer giver kun lidt mindre data for EKG, men koster meget mere tid
+ARKIV_NIVEAU = 6
+
+SQL_BLOK_ID_VED_TID = """
+    SELECT Id
+    FROM EkgBlokke
+    WHERE PatientID = ? AND StartNs <= ?
+    ORDER BY StartNs DESC
+    LIMIT 1
+"""
+
+
+# Opretter tabellen til blokvis lagring hvis den ikke findes.
+# StartNs og SlutNs er epoch-nanosekunder. Tiden for sample i er StartNs + i * 1e9 / Samplerate
+def opret_blok_tabel(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS EkgBlokke (
+        Id INTEGER PRIMARY KEY AUTOINCREMENT,
+        PatientID INTEGER,
+        SessionID INTEGER,
+        StartNs INTEGER,
+        SlutNs INTEGER,
+        Samplerate REAL,
+        Antal INTEGER,
+        Puls INTEGER,
+        Data BLOB,
+        FOREIGN KEY (PatientID) REFERENCES Brugerdata(Id)
+    )""")
+
+
+# Opretter tabellen med arkiverede sessioner hvis den ikke findes
+def opret_arkiv_tabel(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS EkgArkiv (
+        Id INTEGER PRIMARY KEY AUTOINCREMENT,
+        PatientID INTEGER,
+        SessionID INTEGER,
+        StartNs INTEGER,
+        SlutNs INTEGER,
+        Antal INTEGER,
+        Data BLOB,
+        Tider BLOB,
+        FOREIGN KEY (PatientID) REFERENCES Brugerdata(Id),
+        FOREIGN KEY (SessionID) REFERENCES Sessions(Id)
+    )""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ekgarkiv_session ON EkgArkiv (SessionID)")
+
+
+# Opretter tabellen med små værdier programmet skal huske mellem kørsler (f.eks. hvor langt
+# migrer_ekgdata er nået)
+def opret_meta_tabel(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS Meta (Nøgle TEXT PRIMARY KEY, Værdi)")
+
+
+# Pakker en række ADC værdier til bytes (int16). Værdier uden for int16 klippes
+def pak_samples(værdier):
+    return np.clip(np.rint(np.asarray(værdier, dtype=np.float64)), -32768, 32767).astype(SAMPLE_TYPE).tobytes()
+
+
+# Pakker bytes ud til et int16 array
+def udpak_samples(data):
+    return np.frombuffer(data, dtype=SAMPLE_TYPE)
+
+
+# Pakker samples og tider (epoch-ns) til arkivet. Forskellen mellem nabosamples er lille og tiderne
+# stiger næsten med samme skridt, så deltaerne komprimeres langt bedre end værdierne selv.
+# int16 deltaerne må gerne løbe over, da de lægges sammen igen med samme overløb
+def pak_arkiv(værdier, tider_ns):
+    værdier = np.asarray(værdier, dtype=SAMPLE_TYPE)
+    tider_ns = np.asarray(tider_ns, dtype=np.int64)
+    deltaer = np.diff(værdier, prepend=np.zeros(1, SAMPLE_TYPE)).astype(SAMPLE_TYPE)
+    tid_deltaer = np.diff(tider_ns, prepend=np.zeros(1, np.int64)).astype("<i8")
+    return zlib.compress(deltaer.tobytes(), ARKIV_NIVEAU), zlib.compress(tid_deltaer.tobytes(), ARKIV_NIVEAU)
+
+
+# Pakker en arkivrække ud igen til (int16 samples, int64 tider)
+def udpak_arkiv(data, tider):
+    værdier = np.cumsum(np.frombuffer(zlib.decompress(data), dtype=SAMPLE_TYPE), dtype=SAMPLE_TYPE)
+    return værdier, np.cumsum(np.frombuffer(zlib.decompress(tider), dtype="<i8"), dtype=np.int64)
+
+
+# Alle arkiverede samples og tider fra en session
+def hent_arkiv(cursor, session_id):
+    cursor.execute(SQL_SESSION_ARKIV, (session_id,))
+    rækker = [udpak_arkiv(data, tider) for data, tider in cursor.fetchall()]
+    if not rækker:
+        return np.empty(0, SAMPLE_TYPE), np.empty(0, np.int64)
+    return np.concatenate([v for v, _ in rækker]), np.concatenate([t for _, t in rækker])
+
+
+# Udleder tidsstempler (epoch-ns) for hver sample i en blok ud fra starttid og samplerate
+def sample_tider(start_ns, samplerate, antal):
+    return start_ns + np.rint(np.arange(antal) * (1e9 / samplerate)).astype(np.int64)
+
+
+class BlokWriter():
+    # Initialiserer blokskriveren for en patient og session. Fulde blokke lægges i writer'ens kø
+    def __init__(self, writer, patient_id, session_id, samplerate=250):
+        self.writer = writer #IngestWriter der skriver blokkene til databasen
+        self.patient_id = patient_id
+        self.session_id = session_id
+        self.samplerate = samplerate
+        self.blok_størrelse = max(1, int(round(samplerate * BLOK_SEKUNDER))) #Antal samples pr. blok
+        self.værdier = []
+        self.start_ns = None
+        self.puls = None
+
+    # Tilføjer én sample. Når blokken er fuld sendes den til databasen
+    def tilføj(self, værdi, tid_ns, puls=None):
+        if self.start_ns is None:
+            self.start_ns = tid_ns #Første sample i blokken giver blokkens starttid
+        self.værdier.append(værdi)
+        if puls is not None:
+            self.puls = puls
+        if len(self.værdier) >= self.blok_størrelse:
+            self.flush()
+
+    # Sender den nuværende (evt. ufuldstændige) blok til databasen
+    def flush(self):
+        if not self.værdier:
+            return
+        antal = len(self.værdier)
+        slut_ns = self.start_ns + int(round(antal * 1e9 / self.samplerate))
+        self.writer.tilføj((self.patient_id, self.session_id, self.start_ns, slut_ns, self.samplerate,
+                            antal, self.puls, pak_samples(self.værdier)), sql=INSERT_BLOK, samples=antal)
+        self.værdier = []
+        self.start_ns = None
+
+
+# Pakker en liste af blokrækker (StartNs, Samplerate, Antal, Puls, Data) ud til sammenhængende arrays
+def _afkod_blokke(blokke):
+    if not blokke:
+        return np.empty(0, SAMPLE_TYPE), np.empty(0, np.int64), np.empty(0, object)
+    værdier = np.concatenate([udpak_samples(data) for _, _, _, _, data in blokke])
+    tider = np.concatenate([sample_tider(start, fs, antal) for start, fs, antal, _, _ in blokke])
+    pulser = np.repeat(np.array([puls for _, _, _, puls, _ in blokke], dtype=object),
+                       [antal for _, _, antal, _, _ in blokke])
+    return værdier, tider, pulser
+
+
+# Henter de seneste n samples for en patient. Returnerer (værdier, tider i epoch-ns, puls pr. sample)
+def hent_seneste(cursor, patient_id, n):
+    cursor.execute(SQL_SENESTE_BLOKKE, (patient_id,))
+    blokke = []
+    samlet = 0
+    #Der hentes kun blokke indtil der er nok samples
+    for række in cursor:
+        blokke.append(række)
+        samlet += række[2]
+        if samlet >= n:
+            break
+    værdier, tider, pulser = _afkod_blokke(blokke[::-1])
+    return værdier[-n:], tider[-n:], pulser[-n:]
+
+
+# Henter alle samples for en patient mellem fra_ns og til_ns (epoch-ns, inklusive)
+def hent_interval(cursor, patient_id, fra_ns, til_ns):
+    cursor.execute(SQL_BLOK_INTERVAL, (patient_id, til_ns, fra_ns, patient_id, fra_ns, fra_ns))
+    værdier, tider, pulser = _afkod_blokke(cursor.fetchall())
+    maske = (tider >= fra_ns) & (tider <= til_ns)
+    return værdier[maske], tider[maske], pulser[maske]
+
+
+# Henter mindst n samples fra blokke med Id mindre end før_id (keyset pagination, hele blokke).
+# Returnerer (værdier, tider i epoch-ns, puls pr. sample, Id for ældste hentede blok eller None)
+def hent_side(cursor, patient_id, før_id, n):
+    cursor.execute(SQL_BLOK_SIDE, (patient_id, før_id))
+    blokke = []
+    samlet = 0
+    for række in cursor:
+        blokke.append(række)
+        samlet += række[3]
+        if samlet >= n:
+            break
+    ældste_id = blokke[-1][0] if blokke else None
+    værdier, tider, pulser = _afkod_blokke([række[1:] for række in blokke[::-1]])
+    return værdier, tider, pulser, ældste_id
+
+
+# Omregner et ISO tidspunkt fra Ekgdata til epoch-ns
+def iso_til_ns(tidspunkt):
+    return int(round(datetime.fromisoformat(tidspunkt).timestamp() * 1e9))
+
+
+#Forskydningen mellem lokal tid og UTC findes pr. kvarter. Alle tidszoner skifter (sommertid) på et helt kvarter
+_SPAND_S = 900
+
+#Ligger alle tider inden for så mange sekunder og har første og sidste samme forskydning, er der intet skift imellem
+_ET_SKIFT_S = 7 * 86400
+
+_EPOKE = datetime(1970, 1, 1)
+
+
+# Forskydning i ns der lægges til en naiv lokal tid (sekunder siden 1970 som om den var UTC) for at få epoch
+def _til_utc(lokal_s):
+    return (int((_EPOKE + timedelta(seconds=lokal_s)).timestamp()) - lokal_s) * 10 ** 9
+
+
+# Forskydning i ns der lægges til en epoch-tid i sekunder for at få den naive lokale tid
+def _til_lokal(utc_s):
+    return ((datetime.fromtimestamp(utc_s) - _EPOKE) // timedelta(seconds=1) - utc_s) * 10 ** 9
+
+
+# Forskydningen (funktionen ovenfor) for hver tid i ns. Normalt er den ens for alle, og så beregnes den kun én
+# gang. Krydser tiderne et skift til eller fra sommertid, beregnes den for hvert kvarter der forekommer
+def _forskydninger(tider_ns, forskydning):
+    spand_ns = _SPAND_S * 10 ** 9
+    lav, høj = int(tider_ns.min()), int(tider_ns.max())
+    første = forskydning(lav // spand_ns * _SPAND_S)
+    if høj - lav < _ET_SKIFT_S * 10 ** 9 and forskydning(høj // spand_ns * _SPAND_S) == første:
+        return første
+    spande, indeks = np.unique(tider_ns // spand_ns, return_inverse=True)
+    return np.array([forskydning(int(spand) * _SPAND_S) for spand in spande], dtype=np.int64)[indeks]
+
+
+# Omregner mange ISO tidspunkter til epoch-ns på én gang. Numpy parser strengene som UTC, og
+# forskydningen til lokal tid lægges på hvert tidspunkt (den skifter ved sommertid)
+def iso_til_ns_array(tidspunkter):
+    if not len(tidspunkter):
+        return np.empty(0, dtype=np.int64)
+    naive = np.array(tidspunkter, dtype="datetime64[ns]").astype(np.int64)
+    return naive + _forskydninger(naive, _til_utc)
+
+
+# Omregner epoch-ns til ISO tidspunkter i lokal tid som Datahandler skriver dem i Ekgdata
+# (den modsatte vej af iso_til_ns_array)
+def ns_til_iso_array(tider_ns):
+    tider_ns = np.asarray(tider_ns, dtype=np.int64)
+    if not len(tider_ns):
+        return np.empty(0, dtype="<U26")
+    return np.datetime_as_string((tider_ns + _forskydninger(tider_ns, _til_lokal)).astype("datetime64[ns]"), unit="us")
+
+
+# Konverterer eksisterende rækker i Ekgdata til blokke. En ny session startes når der er mere end
+# max_pause sekunder mellem to målinger. Sampleraten for hver blok estimeres ud fra tidsstemplerne.
+# Hver session får en række i Sessions med en opsummering ud fra blokkene.
+# For hver patient gemmes Id for den sidste række der er skrevet i en blok og den session der er i gang
+# i Meta, i samme transaktion som blokkene. En afbrudt eller gentaget migrering fortsætter derfra, så
+# intet migreres to gange, og slet_gamle sletter kun rækker til og med det gemte Id
+def migrer_ekgdata(conn, max_pause=1.0, standard_fs=250, slet_gamle=False, chunk=50000):
+    cursor = conn.cursor()
+    opret_blok_tabel(cursor)
+    opret_session_tabel(cursor)
+    opret_meta_tabel(cursor)
+    blokke = 0
+
+    cursor.execute(SQL_MIGRER_PATIENTER)
+    for (patient_id,) in cursor.fetchall():
+        nøgle_id, nøgle_session = f"migrer_ekgdata:{patient_id}:id", f"migrer_ekgdata:{patient_id}:session"
+        migreret_id = (conn.execute(SQL_HENT_META, (nøgle_id,)).fetchone() or (0,))[0]
+        session_id = (conn.execute(SQL_HENT_META, (nøgle_session,)).fetchone() or (None,))[0] #Sessionen oprettes når dens første blok skrives
+        forrige_ns = None
+        if session_id is not None: #Sessionen fortsætter hvis den næste række kommer inden for max_pause
+            forrige = conn.execute(SQL_MIGRER_TIDSPUNKT, (migreret_id,)).fetchone()
+            try:
+                forrige_ns = iso_til_ns(forrige[0])
+            except (TypeError, ValueError):
+                forrige_ns = None
+        læser = conn.cursor()
+        læser.execute(SQL_MIGRER_EKGDATA, (patient_id, migreret_id))
+        buffer = [] #(tid_ns, værdi, puls) for den blok der bygges
+        blok_størrelse = int(standard_fs * BLOK_SEKUNDER)
+        sidste_id = migreret_id #Id for den seneste læste række
+
+        # Skriver den opsamlede blok med samplerate estimeret fra første og sidste tidsstempel
+        def skriv_blok():
+            nonlocal blokke, session_id, migreret_id
+            if not buffer:
+                return
+            if session_id is None:
+                session_id = ny_session(cursor, patient_id)
+            start_ns = buffer[0][0]
+            if len(buffer) > 1 and buffer[-1][0] > start_ns:
+                fs = (len(buffer) - 1) * 1e9 / (buffer[-1][0] - start_ns)
+            else:
+                fs = standard_fs
+            pulser = [p for _, _, p in buffer if p is not None]
+            antal = len(buffer)
+            conn.execute(INSERT_BLOK, (patient_id, session_id, start_ns,
+                                       start_ns + int(round(antal * 1e9 / fs)), fs, antal,
+                                       pulser[-1] if pulser else None,
+                                       pak_samples([v for _, v, _ in buffer])))
+            blokke += 1
+            buffer.clear()
+            migreret_id = sidste_id
+
+        # Skriver sessionens opsummering. Næste blok starter en ny session
+        def afslut_session():
+            nonlocal session_id
+            if session_id is not None:
+                opsummer_blokke(cursor, session_id)
+            session_id = None
+
+        # Gemmer hvor langt migreringen er nået og committer sammen med blokkene
+        def gem():
+            conn.execute(SQL_SÆT_META, (nøgle_id, migreret_id))
+            conn.execute(SQL_SÆT_META, (nøgle_session, session_id))
+            conn.commit()
+
+        while True:
+            rækker = læser.fetchmany(chunk)
+            if not rækker:
+                break
+            for række_id, tidspunkt, data, puls in rækker:
+                try:
+                    tid_ns = iso_til_ns(tidspunkt)
+                except (TypeError, ValueError):
+                    continue
+                #Lang pause betyder at en ny måling er startet
+                if forrige_ns is not None and (tid_ns - forrige_ns) > max_pause * 1e9:
+                    skriv_blok()
+                    afslut_session()
+                buffer.append((tid_ns, data, puls))
+                forrige_ns = tid_ns
+                sidste_id = række_id
+                if len(buffer) >= blok_størrelse:
+                    skriv_blok()
+            gem()
+        skriv_blok()
+        afslut_session()
+        gem()
+
+        if slet_gamle:
+            conn.execute(SQL_SLET_MIGREREDE, (patient_id, migreret_id))
+            conn.commit()
+    return blokke
+
+
+if __name__ == "__main__":
+    import sys
+    from ekg_database import opret_schema, åbn_forbindelse
+
+    #Kør "python ekg_lagring.py migrer [database] [--slet]" for at konvertere Ekgdata til blokke
+    if len(sys.argv) < 2 or sys.argv[1] != "migrer":
+        print("Brug: python ekg_lagring.py migrer [EKGDATABASE.db] [--slet]")
+        sys.exit(1)
+    argumenter = [a for a in sys.argv[2:] if not a.startswith("--")]
+    db_sti = argumenter[0] if argumenter else "EKGDATABASE.db"
+    forbindelse = åbn_forbindelse(db_sti)
+    opret_schema(forbindelse)
+    antal = migrer_ekgdata(forbindelse, slet_gamle="--slet" in sys.argv)
+    forbindelse.close()
+    print(f"Migrerede Ekgdata til {antal} blokke i {db_sti}")
@@ -0,0 +1,199 @@
+import json
+import threading
+import time
+
+#Histogrammernes spande i mikrosekunder: spand i dækker [2^(i-1), 2^i) µs, spand 0 er under 1 µs.
+#Den sidste spand (2^31 µs, ca. 36 min) tager alt der er længere
+SPANDE = 32
+
+#Sekunder mellem to linjer i metrikfilen
+EKSPORT_INTERVAL = 5.0
+
+
+class _Stadie():
+    # Latens for ét stadie: antal, sum, maks, seneste og et histogram med faste log2 spande
+    def __init__(self):
+        self.antal = 0
+        self.sum_ns = 0
+        self.maks_ns = 0
+        self.seneste_ns = 0
+        self.spande = [0] * SPANDE
+
+    def registrer(self, ns):
+        self.antal += 1
+        self.sum_ns += ns
+        self.seneste_ns = ns
+        if ns > self.maks_ns:
+            self.maks_ns = ns
+        self.spande[min(SPANDE - 1, (ns // 1000).bit_length())] += 1
+
+    # Øvre grænse for en percentil ud fra histogrammet (højst den målte maks)
+    def percentil_ms(self, p):
+        if not self.antal:
+            return 0.0
+        grænse = p / 100 * self.antal
+        samlet = 0
+        for i, antal in enumerate(self.spande):
+            samlet += antal
+            if samlet >= grænse:
+                return min(2 ** i / 1000, self.maks_ns / 1e6)
+        return self.maks_ns / 1e6
+
+    def som_dict(self):
+        return {"antal": self.antal, "gns_ms": self.sum_ns / self.antal / 1e6 if self.antal else 0.0,
+                "seneste_ms": self.seneste_ns / 1e6, "maks_ms": self.maks_ns / 1e6,
+                "p50_ms": self.percentil_ms(50), "p95_ms": self.percentil_ms(95), "p99_ms": self.percentil_ms(99),
+                "spande": list(self.spande)}
+
+
+class _Span():
+    # Kontekst til "with metrik.span(navn):" uden for de varmeste løkker
+    def __init__(self, metrik, navn):
+        self.metrik = metrik
+        self.navn = navn
+        self.t0 = 0
+
+    def __enter__(self):
+        self.t0 = self.metrik.start()
+        return self
+
+    def __exit__(self, *_):
+        self.metrik.slut(self.navn, self.t0)
+
+
+class Metrik():
+    # Latens pr. stadie og tællere for hele programmet. Slået fra koster et kald kun et opslag af self.aktiv,
+    # og der læses ikke noget ur. Tider måles med time.monotonic_ns, så de ikke påvirkes af ændringer
+    # i systemets ur. Der måles pr. læsning/flush/billede, ikke pr. sample
+    def __init__(self):
+        self.aktiv = False
+        self._lås = threading.Lock()
+        self._stadier = {}
+        self._tællere = {}
+        self._start = time.monotonic()
+
+    # Slår målingerne til eller fra
+    def slå_til(self, aktiv=True):
+        self.aktiv = aktiv
+        return self
+
+    # Starttid for et span (0 når målingerne er slået fra)
+    def start(self):
+        if not self.aktiv:
+            return 0
+        return time.monotonic_ns()
+
+    # Afslutter et span startet med start()
+    def slut(self, navn, t0):
+        if not self.aktiv or not t0:
+            return
+        self.registrer(navn, time.monotonic_ns() - t0)
+
+    # Registrerer en varighed i ns der er målt et andet sted (f.eks. ende-til-ende latens)
+    def registrer(self, navn, ns):
+        if not self.aktiv:
+            return
+        with self._lås:
+            stadie = self._stadier.get(navn)
+            if stadie is None:
+                stadie = self._stadier[navn] = _Stadie()
+            stadie.registrer(max(0, int(ns)))
+
+    # Lægger n til en tæller
+    def tæl(self, navn, n=1):
+        if not self.aktiv:
+            return
+        with self._lås:
+            self._tællere[navn] = self._tællere.get(navn, 0) + n
+
+    def span(self, navn):
+        return _Span(self, navn)
+
+    # Et stadies tal som dict (eller None hvis det ikke er målt endnu)
+    def stadie(self, navn):
+        with self._lås:
+            stadie = self._stadier.get(navn)
+            return stadie.som_dict() if stadie else None
+
+    # Alle stadier og tællere som dict (JSON)
+    def øjebliksbillede(self):
+        with self._lås:
+            return {"tid": time.time(), "sekunder": time.monotonic() - self._start,
+                    "stadier": {navn: s.som_dict() for navn, s in self._stadier.items()},
+                    "tællere": dict(self._tællere)}
+
+    # Sletter alle målinger
+    def nulstil(self):
+        with self._lås:
+            self._stadier = {}
+            self._tællere = {}
+            self._start = time.monotonic()
+
+
+#Programmets fælles målinger. Modulerne registrerer her, og GUI'en/dæmonen slår dem til
+metrik = Metrik()
+
+
+class MetrikEksport():
+    # Skriver et øjebliksbillede som én JSON linje i filen hvert interval sekund (og ved stop)
+    def __init__(self, fil, interval=EKSPORT_INTERVAL, kilde=metrik):
+        self.fil = fil
+        self.interval = interval
+        self.kilde = kilde
+        self._stop = threading.Event()
+        self._tråd = None
+
+    def start(self):
+        self.kilde.slå_til()
+        self._tråd = threading.Thread(target=self._kør, daemon=True)
+        self._tråd.start()
+        return self
+
+    def stop(self):
+        if self._tråd is None:
+            return
+        self._stop.set()
+        self._tråd.join()
+        self._tråd = None
+
+    # Tilføjer én linje til filen
+    def skriv(self):
+        try:
+            with open(self.fil, "a", encoding="utf-8") as fil:
+                fil.write(json.dumps(self.kilde.øjebliksbillede(), ensure_ascii=False) + "\n")
+        except OSError as e:
+            print("Fejl ved skrivning af metrik:", e)
+
+    def _kør(self):
+        while not self._stop.wait(self.interval):
+            self.skriv()
+        self.skriv()
+
+
+# Tekst med latens pr. stadie og tællerne fra et øjebliksbillede
+def rapport(billede):
+    linjer = [f"{'stadie':<16}{'antal':>9}{'gns':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'maks':>9}  (ms)"]
+    for navn, s in sorted(billede["stadier"].items()):
+        linjer.append(f"{navn:<16}{s['antal']:>9}{s['gns_ms']:>9.2f}{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}"
+                      f"{s['p99_ms']:>9.2f}{s['maks_ms']:>9.2f}")
+    for navn, antal in sorted(billede["tællere"].items()):
+        linjer.append(f"{navn:<16}{antal:>9}")
+    return "\n".join(linjer)
+
+
+if __name__ == "__main__":
+    import sys
+
+    #Kør "python ekg_metrik.py metrik.jsonl" for at se den seneste linje fra GUI'en eller dæmonen
+    if len(sys.argv) < 2:
+        print("Brug: python ekg_metrik.py metrik.jsonl")
+        sys.exit(1)
+    with open(sys.argv[1], encoding="utf-8") as fil:
+        sidste = None
+        for linje in fil:
+            if linje.strip():
+                sidste = linje
+    if sidste is None:
+        print("Ingen målinger i", sys.argv[1])
+        sys.exit(1)
+    print(rapport(json.loads(sidste)))
@@ -0,0 +1,156 @@
+import threading
+import time
+
+from ekg_ingest import IngestWriter, RingBuffer
+
+
+# Finder de serielle porte der er tilsluttet (standardporten kommer altid først)
+def find_porte(standard=None):
+    porte = [standard] if standard else []
+    try:
+        from serial.tools import list_ports
+        porte += [p.device for p in list_ports.comports() if p.device != standard]
+    except ImportError:
+        pass
+    return porte
+
+
+class Helbred():
+    # Sundhedstal for én enhed. Skrives af Datahandler's tråd og læses af GUI'en
+    def __init__(self, port=None, patient_id=None):
+        self.port = port
+        self.patient_id = patient_id
+        self.status = "starter" #starter, forbundet, afbrudt eller stoppet
+        self.samples = 0
+        self.samples_pr_s = 0.0
+        self.genforbindelser = 0 #Antal gange porten er åbnet igen efter en fejl
+        self.session_id = None #Sessionen (i Sessions) som Datahandler skriver målingen til
+        self.hrv = None #HRV for hele målingen (ekg_hrv), sat af Datahandler når sessionen lukkes
+        self.sidste_sample = None #Tidspunkt (monotonic) for seneste sample
+        self._læser = None #Nuværende protokol-læser (tekst eller binær)
+        self._tidligere = {} #Fejl talt af læsere fra tidligere forbindelser
+        self._vindue_start = time.monotonic()
+        self._vindue_samples = 0
+
+    # Tæller modtagne samples. Raten beregnes over vinduer af ca. et sekund
+    def tæl(self, antal):
+        if not antal:
+            return
+        nu = time.monotonic()
+        self.samples += antal
+        self.sidste_sample = nu
+        self._vindue_samples += antal
+        if nu - self._vindue_start >= 1.0:
+            self.samples_pr_s = self._vindue_samples / (nu - self._vindue_start)
+            self._vindue_start = nu
+            self._vindue_samples = 0
+
+    # Skifter til en ny læser efter (gen)forbindelse. Den gamle læsers fejl lægges til
+    def sæt_læser(self, læser):
+        if self._læser is not None:
+            for nøgle, værdi in self._læser.statistik().items():
+                self._tidligere[nøgle] = self._tidligere.get(nøgle, 0) + værdi
+        self._læser = læser
+
+    # Summerer en tæller fra nuværende og tidligere læsere
+    def _fejl(self, nøgle):
+        nu = self._læser.statistik().get(nøgle, 0) if self._læser is not None else 0
+        return self._tidligere.get(nøgle, 0) + nu
+
+    # Returnerer tallene som en dict. Kommer der ikke længere data er raten 0
+    def statistik(self):
+        stille = self.sidste_sample is None or time.monotonic() - self.sidste_sample > 2.0
+        return {
+            "port": self.port,
+            "patient_id": self.patient_id,
+            "session_id": self.session_id,
+            "status": self.status,
+            "samples": self.samples,
+            "samples_pr_s": 0.0 if stille else self.samples_pr_s,
+            "parse_fejl": self._fejl("parse_fejl") + self._fejl("checksum_fejl"),
+            "tabte_frames": self._fejl("tabte_frames"),
+            "genforbindelser": self.genforbindelser,
+        }
+
+
+class Enhed():
+    # En igangværende måling: én port, én patient, én ringbuffer og én Datahandler-tråd
+    def __init__(self, port, patient_id, kapacitet=5000):
+        self.port = port
+        self.patient_id = patient_id
+        self.ringbuffer = RingBuffer(kapacitet) #GUI'en læser live data herfra
+        self.helbred = Helbred(port, patient_id)
+        self.stop_event = threading.Event()
+        self.tråd = None
+
+
+class Opsamling():
+    # Styrer flere samtidige målinger. Hver port får sin egen Datahandler-tråd, og alle deler én
+    # IngestWriter med en begrænset kø ind i databasen. lav_datahandler kaldes som
+    # lav_datahandler(patient_id, stop_event, ringbuffer, writer=..., helbred=...)
+    def __init__(self, db_sti, lav_datahandler, maks_kø=100000, kapacitet=5000):
+        self.db_sti = db_sti
+        self.lav_datahandler = lav_datahandler
+        self.maks_kø = maks_kø #Maks antal rækker der må vente på at blive skrevet
+        self.kapacitet = kapacitet #Ringbufferens størrelse pr. enhed
+        self.writer = None #Startes ved første måling
+        self.enheder = {} #port -> Enhed
+        self._lås = threading.Lock()
+
+    # Starter en måling på porten. Kører der allerede en måling på porten stoppes den først
+    def start(self, port, patient_id):
+        self.stop(port)
+        with self._lås:
+            if self.writer is None:
+                self.writer = IngestWriter(self.db_sti, maks_kø=self.maks_kø).start()
+            enhed = Enhed(port, patient_id, self.kapacitet)
+            handler = self.lav_datahandler(patient_id, enhed.stop_event, enhed.ringbuffer,
+                                           writer=self.writer, helbred=enhed.helbred)
+            enhed.tråd = threading.Thread(target=handler.serialdata, args=(port,), daemon=True)
+            self.enheder[port] = enhed
+        print(f"Starter måling for patient {patient_id} på {port}")
+        enhed.tråd.start()
+        return enhed
+
+    # Stopper målingen på porten og returnerer enheden (None hvis der ingen måling var)
+    def stop(self, port):
+        with self._lås:
+            enhed = self.enheder.pop(port, None)
+        if enhed is None:
+            return None
+        enhed.stop_event.set()
+        if enhed.tråd is not None:
+            enhed.tråd.join()
+        enhed.helbred.status = "stoppet"
+        return enhed
+
+    # Stopper alle målinger på en patient
+    def stop_patient(self, patient_id):
+        return [self.stop(enhed.port) for enhed in self.aktive() if enhed.patient_id == patient_id]
+
+    # Stopper alle målinger og skriver resten af køen til databasen
+    def stop_alle(self):
+        for enhed in self.aktive():
+            self.stop(enhed.port)
+        with self._lås:
+            writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.stop()
+
+    # Returnerer de igangværende målinger
+    def aktive(self):
+        with self._lås:
+            return list(self.enheder.values())
+
+    # Returnerer første igangværende måling på patienten (eller None)
+    def for_patient(self, patient_id):
+        for enhed in self.aktive():
+            if enhed.patient_id == patient_id:
+                return enhed
+        return None
+
+    # Sundhedstal for alle enheder og den fælles skriver
+    def statistik(self):
+        writer = self.writer
+        return {"enheder": [enhed.helbred.statistik() for enhed in self.aktive()],
+                "writer": writer.statistik() if writer is not None else None}
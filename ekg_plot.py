@@ -0,0 +1,177 @@
+import time
+
+import numpy as np
+
+from ekg_metrik import metrik
+
+#matplotlib importeres først når et diagram oprettes, så programmet starter uden at vente på den
+
+
+class EkgPlot():
+    # Opretter figur, akser og EKG-kurven én gang. Ved opdatering ændres kun kurvens data og kun
+    # kurveområdet tegnes igen (blitting). master er Tkinter rammen; uden master tegnes i hukommelsen
+    def __init__(self, master=None, antal=150, ylim=(-100, 4500), max_fps=30, blit=True,
+                 figsize=(6, 4.5), titel="EKG diagram"):
+        self.antal = antal #Antal målepunkter i vinduet
+        self.blit = blit #False tegner hele figuren hver gang (til sammenligning)
+        self.min_interval = 1 / max_fps if max_fps else 0.0 #Mindste tid mellem to billeder
+
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.fig = Figure(figsize=figsize, dpi=100, facecolor='lightblue')
+        self.ax = self.fig.add_subplot(111)
+        if master is not None:
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            self.canvas = FigureCanvasTkAgg(self.fig, master=master)
+            self.canvas.get_tk_widget().pack(expand=True, fill="both")
+        else:
+            self.canvas = FigureCanvasAgg(self.fig)
+
+        # Akser, gitter og aksemærkninger sættes kun op én gang
+        self.ax.set_facecolor('white')
+        self.ax.grid(True, which='both', linestyle='--', linewidth=0.5, color='gray', alpha=0.7)
+        self.ax.set_xlabel("Tid (målepunkt #)")
+        self.ax.set_ylabel("Amplitude (AD værdi)")
+        step = max(1, antal // 10)
+        self.ax.set_xticks(range(0, antal, step))
+        self.ax.set_xticklabels([str(i) for i in range(0, antal, step)], rotation=45)
+        self.ax.set_title(titel)
+        self.ax.set_ylim(*ylim)
+        self.ax.set_xlim(0, antal - 1)
+        self.ax.tick_params(axis='both', labelsize=8)
+
+        # Forudallokeret array til kurven. NaN punkter tegnes ikke
+        self.ydata = np.full(antal, np.nan)
+        (self.linje,) = self.ax.plot(np.arange(antal), self.ydata, color='black', animated=blit)
+
+        # Baggrunden (akser og gitter) gemmes hver gang hele figuren tegnes
+        self.baggrund = None
+        self.canvas.mpl_connect("draw_event", self._gem_baggrund)
+
+        # Måling af billeder pr. sekund
+        self.sidste_billede = 0.0
+        self.billeder = 0
+        self.fps = 0.0
+        self._fps_start = time.perf_counter()
+        self.billede_ms = 0.0 #Tid brugt på seneste billede
+
+        self.canvas.draw()
+
+    # Gemmer baggrunden efter en fuld tegning og tegner kurven ovenpå
+    def _gem_baggrund(self, event):
+        if not self.blit:
+            return
+        self.baggrund = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.linje)
+
+    # Opdaterer kurven med de nyeste målinger. Returnerer False hvis billedet springes over pga. fps-loftet
+    def opdater(self, data, tving=False):
+        nu = time.perf_counter()
+        if not tving and nu - self.sidste_billede < self.min_interval:
+            return False
+        self.sidste_billede = nu
+
+        data = np.asarray(data, dtype=np.float64)[-self.antal:]
+        n = len(data)
+        self.ydata[:n] = data
+        self.ydata[n:] = np.nan
+        self.linje.set_ydata(self.ydata)
+
+        if not self.blit or self.baggrund is None:
+            self.canvas.draw() #Fuld tegning (første gang eller uden blitting)
+        else:
+            self.canvas.restore_region(self.baggrund) #Kun kurveområdet tegnes igen
+            self.ax.draw_artist(self.linje)
+            self.canvas.blit(self.ax.bbox)
+
+        self.billede_ms = (time.perf_counter() - nu) * 1000
+        metrik.registrer("plot_tegn", self.billede_ms * 1e6)
+        metrik.tæl("billeder_tegnet")
+        self._tæl_billede()
+        return True
+
+    # Tæller billeder og opdaterer fps én gang i sekundet
+    def _tæl_billede(self):
+        self.billeder += 1
+        nu = time.perf_counter()
+        if nu - self._fps_start >= 1.0:
+            self.fps = self.billeder / (nu - self._fps_start)
+            self.billeder = 0
+            self._fps_start = nu
+
+
+#Et mellemrum på mere end så mange spande mellem to spande er et hul i målingen (f.eks. mellem to sessioner)
+HUL_FAKTOR = 1.5
+
+
+# Indsætter NaN efter hver spand der følges af et hul, så hverken båndet eller kurven trækkes hen over hullet.
+# spand er spandenes bredde i samme enhed som x. Uden spand bruges det typiske mellemrum mellem spandene.
+# Tegnes spandene som trin, får den sidste spand før et hul (og den allersidste) sin bredde, så den ikke
+# tegnes med bredden nul. Rå samples (trin=False) er punkter, og kurven stopper blot ved hullet
+def bryd_ved_huller(x, mins, maxs, spand=None, trin=True):
+    if len(x) < 2:
+        return x, mins, maxs
+    mellemrum = np.diff(x)
+    spand = float(np.median(mellemrum)) if spand is None else spand
+    if spand <= 0:
+        return x, mins, maxs
+    huller = np.flatnonzero(mellemrum > HUL_FAKTOR * spand) + 1
+    x = np.insert(x, huller, x[huller - 1] + spand)
+    mins = np.insert(mins, huller, np.nan)
+    maxs = np.insert(maxs, huller, np.nan)
+    if not trin:
+        return x, mins, maxs
+    return np.append(x, x[-1] + spand), np.append(mins, mins[-1]), np.append(maxs, maxs[-1])
+
+
+class OversigtPlot():
+    # Tegner min/max spande fra pyramiden som et udfyldt bånd (historikken). Hver spand fylder
+    # mindst en halv pixel, så antallet af tegnede punkter afhænger af bredden og ikke af tidsrummet
+    def __init__(self, master=None, figsize=(8.6, 4.2), ylim=(-100, 4500)):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.fig = Figure(figsize=figsize, dpi=100, facecolor='lightblue')
+        self.ax = self.fig.add_subplot(111)
+        if master is not None:
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            self.canvas = FigureCanvasTkAgg(self.fig, master=master)
+            self.canvas.get_tk_widget().pack(expand=True, fill="both")
+        else:
+            self.canvas = FigureCanvasAgg(self.fig)
+
+        self.ax.set_facecolor('white')
+        self.ax.grid(True, which='both', linestyle='--', linewidth=0.5, color='gray', alpha=0.7)
+        self.ax.set_xlabel("Tid (s)")
+        self.ax.set_ylabel("Amplitude (AD værdi)")
+        self.ax.set_ylim(*ylim)
+        self.ax.tick_params(axis='both', labelsize=8)
+        self.bånd = None
+        (self.linje,) = self.ax.plot([], [], color='black', linewidth=0.8)
+        self.canvas.draw()
+
+    # Diagrammets bredde i pixels (antal spande der giver mening at hente er 2 * bredde)
+    def bredde(self):
+        return max(1, int(self.ax.bbox.width))
+
+    # Tegner spandene. Er min og max ens (rå samples) tegnes kun en kurve. Huller i målingen (se
+    # bryd_ved_huller) efterlades tomme. spand er spandenes bredde i samme enhed som x, hvis den kendes
+    def tegn(self, x, mins, maxs, xlim=None, spand=None):
+        x = np.asarray(x, dtype=np.float64)
+        mins = np.asarray(mins, dtype=np.float64)
+        maxs = np.asarray(maxs, dtype=np.float64)
+        if self.bånd is not None:
+            self.bånd.remove()
+            self.bånd = None
+        rå = np.array_equal(mins, maxs)
+        x, mins, maxs = bryd_ved_huller(x, mins, maxs, spand, trin=not rå)
+        if len(x) and rå:
+            self.linje.set_data(x, mins)
+        else:
+            self.linje.set_data([], [])
+            if len(x):
+                self.bånd = self.ax.fill_between(x, mins, maxs, color='black', linewidth=0.5, step='post')
+        if xlim is not None and xlim[1] > xlim[0]:
+            self.ax.set_xlim(*xlim)
+        self.canvas.draw()
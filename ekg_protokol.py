@@ -0,0 +1,267 @@
+import time
+
+import numpy as np
+
+from ekg_metrik import metrik
+
+#Tekstprotokol (skal matche Arduino_kode.ino): "tæller,værdi" pr. linje. Ældre firmware sender kun "værdi"
+#og med BAUD_ÆLDRE, så den kræver at baud rate vælges (baud i GUI filen eller --baud til ekg_daemon.py)
+#Binær protokol (skal matche Arduino_kode.ino):
+#  sync (0xA5 0x5A) | sekvens uint16 | antal uint8 | antal x int16 samples | fletcher-16 uint16
+#Alle tal er little-endian. Checksummen beregnes over bytes fra sekvens til og med sidste sample.
+#Enheden sampler på et timerinterrupt, så sample nr. i i frame med sekvens s har tælleren s * antal + i
+SYNC = b"\xa5\x5a"
+FRAME_SAMPLES = 10
+BAUD_TEKST = 115200 #38400 er for langsomt når tælleren får 7 cifre (se Arduino_kode.ino)
+BAUD_BINÆR = 115200
+BAUD_ÆLDRE = 38400 #Ældre firmware der kun sender "værdi" pr. linje
+TÆLLER_MODULO = 2 ** 32 #Sampletælleren i tekstprotokollen er en unsigned long på Arduino
+
+
+# Returnerer numpy typen for en frame med et givent antal samples (pakket uden udfyldning)
+def frame_type(samples=FRAME_SAMPLES):
+    return np.dtype([("sync", "<u2"), ("sekvens", "<u2"), ("antal", "u1"),
+                     ("samples", "<i2", (samples,)), ("checksum", "<u2")])
+
+
+# Fletcher-16 for hver række i et (frames x bytes) uint8 array. sum2 er en vægtet sum af bytes
+def fletcher16(data):
+    data = np.atleast_2d(np.asarray(data, dtype=np.uint8)).astype(np.int64)
+    vægte = np.arange(data.shape[1], 0, -1, dtype=np.int64)
+    sum1 = data.sum(axis=1) % 255
+    sum2 = (data * vægte).sum(axis=1) % 255
+    return (sum2 << 8) | sum1
+
+
+# Pakker samples til én frame (benyttes af simulatoren og i tests)
+def pak_frame(sekvens, samples):
+    samples = np.asarray(samples, dtype="<i2")
+    krop = np.uint16(sekvens & 0xFFFF).astype("<u2").tobytes() + bytes([len(samples)]) + samples.tobytes()
+    checksum = int(fletcher16(np.frombuffer(krop, dtype=np.uint8))[0])
+    return SYNC + krop + checksum.to_bytes(2, "little")
+
+
+class SampleUr():
+    # Genskaber sampletider ud fra enhedens sampletæller i stedet for hvornår data nåede frem til PC'en.
+    # Tiden er en ret linje tid = a + b * tæller, hvor hældningen (1 / effektiv samplerate) estimeres
+    # løbende med lineær regression af modtagetid mod tæller. Regressionen er Welford-opdateret (O(1))
+    def __init__(self, fs=250, modulo=TÆLLER_MODULO, min_sekunder=2.0):
+        self.fs_nominel = fs #Den rate enheden er sat til (SAMPLE_RATE i Arduino koden)
+        self.modulo = modulo #Tælleren løber rundt ved modulo
+        self.min_sekunder = min_sekunder #Så længe skal der måles før estimatet benyttes
+        self.nulstillinger = 0 #Antal gange enheden er genstartet undervejs
+        self._forrige = None #Seneste rå tæller
+        self._base = 0 #Seneste fortløbende tæller
+        self._nulstil()
+
+    # Starter regressionen forfra, f.eks. når enheden genstarter og tælleren springer tilbage
+    def _nulstil(self):
+        self._n = 0
+        self._første_x = None #Første og seneste tæller i regressionen
+        self._sidste_x = None
+        self._mx = 0.0
+        self._my = 0.0
+        self._cxx = 0.0
+        self._cxy = 0.0
+        self._start_ns = None
+        self._sidste_tid = None
+
+    # Omregner rå tællere (der kan løbe rundt) til en fortløbende tæller fra målingens start
+    def udpak(self, tællere):
+        tællere = np.asarray(tællere, dtype=np.int64)
+        if self._forrige is None:
+            spring = np.concatenate(([0], np.diff(tællere) % self.modulo))
+        else:
+            spring = np.diff(np.concatenate(([self._forrige], tællere))) % self.modulo
+        baglæns = spring > self.modulo // 2
+        if np.any(baglæns): #Tælleren er gået baglæns: enheden er genstartet, så tidsestimatet startes forfra
+            spring[baglæns] = 1
+            self.nulstillinger += 1
+            self._nulstil()
+        fortløbende = self._base + np.cumsum(spring)
+        self._base = int(fortløbende[-1])
+        self._forrige = int(tællere[-1])
+        return fortløbende
+
+    # Returnerer tider i epoch-ns for en række tællere modtaget på tidspunktet modtaget_ns
+    def tider(self, tællere, modtaget_ns):
+        tællere = self.udpak(tællere)
+        if self._start_ns is None:
+            self._start_ns = modtaget_ns
+
+        #Ét regressionspunkt pr. læsning: sidste tæller mod modtagetiden
+        x = float(tællere[-1])
+        y = float(modtaget_ns - self._start_ns)
+        if self._første_x is None:
+            self._første_x = x
+        self._sidste_x = x
+        self._n += 1
+        dx = x - self._mx
+        self._mx += dx / self._n
+        self._my += (y - self._my) / self._n
+        self._cxx += dx * (x - self._mx)
+        self._cxy += dx * (y - self._my)
+
+        b = 1e9 / self.fs
+        tider = self._start_ns + np.rint(self._my + b * (tællere - self._mx)).astype(np.int64)
+        #Tiderne må ikke gå baglæns når estimatet justeres
+        if self._sidste_tid is not None and tider[0] <= self._sidste_tid:
+            tider += self._sidste_tid + 1 - tider[0]
+        self._sidste_tid = int(tider[-1])
+        return tider
+
+    # Effektiv samplerate. Den nominelle rate benyttes indtil der er målt længe nok
+    @property
+    def fs(self):
+        if self._n < 3 or self._cxy <= 0 or self._sidste_x - self._første_x < self.min_sekunder * self.fs_nominel:
+            return self.fs_nominel
+        fs = 1e9 * self._cxx / self._cxy
+        if not 0.25 * self.fs_nominel < fs < 4 * self.fs_nominel: #Urimeligt estimat ignoreres
+            return self.fs_nominel
+        return fs
+
+
+class BinærLæser():
+    # Læser binære frames fra den serielle port med store ser.read kald og afkoder hele frames på én gang
+    def __init__(self, ser, fs=250, samples=FRAME_SAMPLES):
+        self.ser = ser
+        self.ur = SampleUr(fs, modulo=65536 * samples) #Sampletider ud fra sekvensnumrene
+        self.type = frame_type(samples)
+        self.frame_længde = self.type.itemsize
+        self.samples = samples
+        self.buffer = bytearray()
+        self.næste_sekvens = None
+
+        #Statistik
+        self.frames = 0
+        self.tabte_frames = 0
+        self.checksum_fejl = 0
+        self.kasserede_bytes = 0
+
+    # Læser det der er klar på porten og returnerer (samples, tider i epoch-ns, enhedens sampletællere)
+    def læs(self):
+        antal = max(getattr(self.ser, "in_waiting", 0), self.frame_længde)
+        data = self.ser.read(antal)
+        nu = time.time_ns()
+        if data:
+            self.buffer += data
+        sekvenser, samples = self._afkod()
+        if not len(samples):
+            return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        #Enheden sampler på et timerinterrupt, så hver sample har en fast plads ud fra framens sekvens
+        tællere = (sekvenser[:, None] * self.samples + np.arange(self.samples)).reshape(-1)
+        return samples.astype(np.float64), self.ur.tider(tællere, nu), tællere
+
+    # Finder og afkoder alle hele frames i bufferen. Ugyldige bytes springes over indtil næste sync
+    def _afkod(self):
+        sekvenser = []
+        samples = []
+        while True:
+            start = self.buffer.find(SYNC)
+            if start < 0:
+                #Intet sync: behold kun sidste byte (kan være første halvdel af et sync)
+                self.kasserede_bytes += max(0, len(self.buffer) - 1)
+                del self.buffer[:-1]
+                break
+            if start > 0:
+                self.kasserede_bytes += start
+                del self.buffer[:start]
+
+            hele = len(self.buffer) // self.frame_længde
+            if hele == 0:
+                break
+
+            #Alle hele frames tolkes på én gang, og det længste gyldige stykke i starten tages
+            frames = np.frombuffer(bytes(self.buffer[:hele * self.frame_længde]), dtype=self.type)
+            rå = np.frombuffer(bytes(self.buffer[:hele * self.frame_længde]), dtype=np.uint8)
+            rå = rå.reshape(hele, self.frame_længde)[:, 2:-2]
+            gyldige = ((frames["sync"] == 0x5AA5) & (frames["antal"] == self.samples)
+                       & (frames["checksum"] == fletcher16(rå)))
+            ugyldige = np.flatnonzero(~gyldige)
+            ok = ugyldige[0] if len(ugyldige) else hele
+
+            if ok:
+                sekvenser.append(frames["sekvens"][:ok].astype(np.int64))
+                samples.append(frames["samples"][:ok].reshape(-1))
+                del self.buffer[:ok * self.frame_længde]
+            if ok < hele:
+                #Frame med fejl: ét byte kasseres og der søges efter næste sync
+                if frames["sync"][ok] == 0x5AA5:
+                    self.checksum_fejl += 1
+                    metrik.tæl("checksum_fejl")
+                self.kasserede_bytes += 1
+                del self.buffer[:1]
+            else:
+                break
+
+        if not sekvenser:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype="<i2")
+        sekvenser = np.concatenate(sekvenser)
+        self._tæl_tabte(sekvenser)
+        return sekvenser, np.concatenate(samples)
+
+    # Tæller tabte frames ud fra huller i sekvensnumrene (uint16 der løber rundt)
+    def _tæl_tabte(self, sekvenser):
+        self.frames += len(sekvenser)
+        forrige = np.concatenate(([self.næste_sekvens - 1 if self.næste_sekvens is not None else sekvenser[0] - 1],
+                                  sekvenser[:-1]))
+        spring = (sekvenser - forrige) % 65536
+        tabte = int(np.sum(spring - 1))
+        self.tabte_frames += tabte
+        if tabte:
+            metrik.tæl("tabte_frames", tabte)
+        self.næste_sekvens = int(sekvenser[-1] + 1) % 65536
+
+    # Statistik over modtagne og tabte frames
+    def statistik(self):
+        return {"frames": self.frames, "tabte_frames": self.tabte_frames,
+                "checksum_fejl": self.checksum_fejl, "kasserede_bytes": self.kasserede_bytes}
+
+
+class TekstLæser():
+    # Læser tekstprotokollen: "tæller,værdi" pr. linje. Linjer med kun en værdi (ældre firmware, der
+    # kræver at porten åbnes med BAUD_ÆLDRE) får PC'ens tid, ligesom før. Bytes gemmes på tværs af kald, så en linje der kommer i flere
+    # bidder (f.eks. når porten får timeout midt i den) først afkodes når hele linjen er der
+    def __init__(self, ser, fs=250):
+        self.ser = ser
+        self.ur = SampleUr(fs) #Sampletider ud fra enhedens tæller
+        self.buffer = bytearray() #Modtagne bytes efter seneste hele linje
+        self.linjer = 0
+        self.parse_fejl = 0
+
+    # Læser én linje og returnerer (samples, tider i epoch-ns, enhedens sampletællere) som den binære læser.
+    # Er der ingen hel linje inden portens timeout, returneres intet og resten gemmes til næste kald
+    def læs(self):
+        tom = np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        slut = self.buffer.find(b"\n")
+        while slut < 0:
+            data = self.ser.read(max(getattr(self.ser, "in_waiting", 64), 1))
+            if not data:
+                return tom
+            self.buffer += data
+            slut = self.buffer.find(b"\n")
+        linje = bytes(self.buffer[:slut])
+        del self.buffer[:slut + 1]
+        data = linje.decode("utf-8", errors="replace").strip() #Fjerne whitespaces fra serialdata
+        nu = time.time_ns()
+        if not data:
+            return tom
+        try:
+            felter = data.split(",")
+            værdi = float(felter[-1]) #Gør værdien til en float
+            tæller = int(felter[0]) if len(felter) == 2 else None
+        except ValueError as e:
+            self.parse_fejl += 1
+            metrik.tæl("parse_fejl")
+            print("Fejl ved læsning:", e)
+            return tom
+        self.linjer += 1
+        if tæller is None:
+            return np.array([værdi]), np.array([nu], dtype=np.int64), tom[2]
+        tællere = np.array([tæller], dtype=np.int64)
+        return np.array([værdi]), self.ur.tider(tællere, nu), tællere
+
+    # Statistik over læste linjer
+    def statistik(self):
+        return {"linjer": self.linjer, "parse_fejl": self.parse_fejl}
@@ -0,0 +1,247 @@
+import numpy as np
+
+from ekg_lagring import SAMPLE_TYPE, pak_samples, udpak_samples, sample_tider, iso_til_ns_array
+
+#Niveauer i pyramiden: hvert niveau har min og max over så mange samples (1:10, 1:100, ...)
+NIVEAUER = (10, 100, 1000, 10000)
+
+#Antal spande (min/max par) pr. række i EkgPyramide
+CHUNK = 256
+
+INSERT_PYRAMIDE = """
+    INSERT INTO EkgPyramide (PatientID, Niveau, StartNs, SlutNs, Antal, Tider, Min, Max)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+#Rækker på et niveau der overlapper et tidsrum. Indekset afgrænses nedadtil af rækken der indeholder fra,
+#så prisen ikke afhænger af hvor lang historikken før tidsrummet er
+SQL_PYRAMIDE_INTERVAL = """
+    SELECT Tider, Min, Max
+    FROM EkgPyramide
+    WHERE PatientID = ? AND Niveau = ? AND StartNs <= ? AND SlutNs >= ?
+      AND StartNs >= COALESCE((SELECT StartNs FROM EkgPyramide WHERE PatientID = ? AND Niveau = ? AND StartNs <= ?
+                               ORDER BY StartNs DESC LIMIT 1), ?)
+    ORDER BY StartNs
+"""
+
+#Antal spande på et niveau der starter i et tidsrum (retention tjekker at en session er dækket helt
+#før de rå samples arkiveres), og sletning af dem når pyramiden for tidsrummet bygges om
+SQL_PYRAMIDE_DÆKNING = """
+    SELECT COALESCE(SUM(Antal), 0)
+    FROM EkgPyramide
+    WHERE PatientID = ? AND Niveau = ? AND StartNs BETWEEN ? AND ?
+"""
+
+SQL_SLET_PYRAMIDE = "DELETE FROM EkgPyramide WHERE PatientID = ? AND Niveau = ? AND StartNs BETWEEN ? AND ?"
+
+SQL_PYRAMIDE_OMFANG = """
+    SELECT MIN(StartNs), MAX(SlutNs)
+    FROM EkgPyramide
+    WHERE PatientID = ? AND Niveau = ?
+"""
+
+
+# Opretter tabellen til min/max pyramiden hvis den ikke findes. Hver række er op til CHUNK spande
+# på ét niveau: starttid for hver spand (int64) samt min og max (int16) som BLOBs
+def opret_pyramide_tabel(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS EkgPyramide (
+        Id INTEGER PRIMARY KEY AUTOINCREMENT,
+        PatientID INTEGER,
+        Niveau INTEGER,
+        StartNs INTEGER,
+        SlutNs INTEGER,
+        Antal INTEGER,
+        Tider BLOB,
+        Min BLOB,
+        Max BLOB,
+        FOREIGN KEY (PatientID) REFERENCES Brugerdata(Id)
+    )""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ekgpyramide_interval ON EkgPyramide (PatientID, Niveau, StartNs)")
+
+
+class _Niveau():
+    # Ét niveau i pyramiden. Samler faktor spande fra niveauet under til én spand
+    def __init__(self, niveau, faktor):
+        self.niveau = niveau
+        self.faktor = faktor
+        #Spande fra niveauet under der endnu ikke udgør en hel gruppe
+        self.ind = (np.empty(0, np.float64), np.empty(0, np.float64), np.empty(0, np.int64))
+        #Færdige spande der endnu ikke er skrevet
+        self.ud_min, self.ud_max, self.ud_tid = [], [], []
+        self.ud_antal = 0
+
+    # Tilføjer spande fra niveauet under og returnerer de nye spande på dette niveau
+    def tilføj(self, mins, maxs, tider, rest=False):
+        mins = np.concatenate((self.ind[0], mins))
+        maxs = np.concatenate((self.ind[1], maxs))
+        tider = np.concatenate((self.ind[2], tider))
+        hele = len(mins) // self.faktor * self.faktor
+        nye_min = mins[:hele].reshape(-1, self.faktor).min(axis=1)
+        nye_max = maxs[:hele].reshape(-1, self.faktor).max(axis=1)
+        nye_tid = tider[:hele:self.faktor]
+        self.ind = (mins[hele:], maxs[hele:], tider[hele:])
+        if rest and len(self.ind[0]): #Ved stop bliver den ufuldstændige gruppe også til en spand
+            nye_min = np.append(nye_min, self.ind[0].min())
+            nye_max = np.append(nye_max, self.ind[1].max())
+            nye_tid = np.append(nye_tid, self.ind[2][0])
+            self.ind = (mins[:0], maxs[:0], tider[:0])
+        if len(nye_min):
+            self.ud_min.append(nye_min)
+            self.ud_max.append(nye_max)
+            self.ud_tid.append(nye_tid)
+            self.ud_antal += len(nye_min)
+        return nye_min, nye_max, nye_tid
+
+    # Returnerer rækker til EkgPyramide for hver fuld chunk (eller alt ved rest)
+    def rækker(self, patient_id, slut_ns, rest=False):
+        if self.ud_antal < CHUNK and not (rest and self.ud_antal):
+            return []
+        mins = np.concatenate(self.ud_min)
+        maxs = np.concatenate(self.ud_max)
+        tider = np.concatenate(self.ud_tid)
+        hele = len(mins) if rest else len(mins) // CHUNK * CHUNK
+        rækker = []
+        for a in range(0, hele, CHUNK):
+            b = min(a + CHUNK, hele)
+            #Spanden slutter hvor den næste starter. Den sidste slutter ved seneste kendte sample
+            slut = tider[b] if b < len(tider) else slut_ns
+            rækker.append((patient_id, self.niveau, int(tider[a]), int(slut), b - a,
+                           tider[a:b].astype(np.int64).tobytes(), pak_samples(mins[a:b]), pak_samples(maxs[a:b])))
+        self.ud_min, self.ud_max, self.ud_tid = [mins[hele:]], [maxs[hele:]], [tider[hele:]]
+        self.ud_antal = len(mins) - hele
+        return rækker
+
+
+class PyramideBygger():
+    # Bygger min/max pyramiden løbende mens der måles. Hvert niveau bygges af niveauet under, og
+    # færdige chunks lægges i writer'ens kø (IngestWriter) ligesom blokkene
+    def __init__(self, writer, patient_id, niveauer=NIVEAUER):
+        self.writer = writer
+        self.patient_id = patient_id
+        faktorer = [niveauer[0]] + [b // a for a, b in zip(niveauer, niveauer[1:])]
+        self.niveauer = [_Niveau(n, f) for n, f in zip(niveauer, faktorer)]
+        self.sidste_ns = None
+
+    # Tilføjer samples (værdier og tider i epoch-ns som arrays)
+    def tilføj_mange(self, værdier, tider_ns, rest=False):
+        værdier = np.asarray(værdier, dtype=np.float64)
+        tider_ns = np.asarray(tider_ns, dtype=np.int64)
+        if len(tider_ns):
+            self.sidste_ns = int(tider_ns[-1])
+        mins, maxs, tider = værdier, værdier, tider_ns
+        for niveau in self.niveauer:
+            mins, maxs, tider = niveau.tilføj(mins, maxs, tider, rest)
+            for række in niveau.rækker(self.patient_id, self.sidste_ns, rest):
+                self.writer.tilføj(række, sql=INSERT_PYRAMIDE, samples=0)
+
+    # Skriver alt der mangler, også ufuldstændige spande (kaldes når målingen stopper)
+    def flush(self):
+        if self.sidste_ns is not None:
+            self.tilføj_mange([], [], rest=True)
+
+
+# Vælger det groveste niveau der stadig giver mindst to spande pr. pixel. 1 betyder rå samples
+def vælg_niveau(antal_samples, bredde, niveauer=NIVEAUER):
+    valgt = 1
+    for niveau in niveauer:
+        if antal_samples / niveau >= 2 * bredde:
+            valgt = niveau
+    return valgt
+
+
+# Henter spande på et niveau mellem fra_ns og til_ns. Returnerer (tider, min, max)
+def hent_niveau(cursor, patient_id, niveau, fra_ns, til_ns):
+    cursor.execute(SQL_PYRAMIDE_INTERVAL, (patient_id, niveau, til_ns, fra_ns, patient_id, niveau, fra_ns, fra_ns))
+    rækker = cursor.fetchall()
+    if not rækker:
+        return np.empty(0, np.int64), np.empty(0, SAMPLE_TYPE), np.empty(0, SAMPLE_TYPE)
+    tider = np.concatenate([np.frombuffer(t, dtype=np.int64) for t, _, _ in rækker])
+    mins = np.concatenate([udpak_samples(m) for _, m, _ in rækker])
+    maxs = np.concatenate([udpak_samples(m) for _, _, m in rækker])
+    maske = (tider >= fra_ns) & (tider <= til_ns)
+    return tider[maske], mins[maske], maxs[maske]
+
+
+# Samler spande yderligere så der højst er maks spande (min af min og max af max)
+def reducer(tider, mins, maxs, maks):
+    if len(tider) <= maks:
+        return tider, mins, maxs
+    faktor = -(-len(tider) // maks)
+    hele = len(tider) // faktor * faktor
+    rest = len(tider) - hele
+    nye = (tider[:hele:faktor], mins[:hele].reshape(-1, faktor).min(axis=1), maxs[:hele].reshape(-1, faktor).max(axis=1))
+    if rest:
+        nye = (np.append(nye[0], tider[hele]), np.append(nye[1], mins[hele:].min()), np.append(nye[2], maxs[hele:].max()))
+    return nye
+
+
+class _SamletWriter():
+    # Samler rækker fra PyramideBygger og skriver dem med executemany (benyttes uden IngestWriter)
+    def __init__(self, conn):
+        self.conn = conn
+        self.rækker = []
+
+    def tilføj(self, række, sql=INSERT_PYRAMIDE, samples=0):
+        self.rækker.append(række)
+
+    def skriv(self):
+        with self.conn:
+            self.conn.executemany(INSERT_PYRAMIDE, self.rækker)
+        antal = len(self.rækker)
+        self.rækker = []
+        return antal
+
+
+# Bidder af (værdier, tider i epoch-ns) fra Ekgdata for en patient, i Id-rækkefølge
+def _bidder_fra_ekgdata(conn, patient_id, chunk=50000):
+    sidste_id = 0
+    while True:
+        rækker = conn.execute("SELECT Id, Tidspunkt, Data FROM Ekgdata WHERE PatientID = ? AND Id > ? "
+                              "ORDER BY Id LIMIT ?", (patient_id, sidste_id, chunk)).fetchall()
+        if not rækker:
+            return
+        sidste_id = rækker[-1][0]
+        yield (np.array([data for _, _, data in rækker], dtype=np.float64),
+               iso_til_ns_array([tid for _, tid, _ in rækker]))
+
+
+# Bidder af (værdier, tider i epoch-ns) fra EkgBlokke for en patient, én blok ad gangen
+def _bidder_fra_blokke(conn, patient_id):
+    for start, fs, antal, data in conn.execute("SELECT StartNs, Samplerate, Antal, Data FROM EkgBlokke "
+                                               "WHERE PatientID = ? ORDER BY Id", (patient_id,)):
+        yield udpak_samples(data).astype(np.float64), sample_tider(start, fs, antal)
+
+
+# Bygger pyramiden for målinger der er gemt før pyramiden fandtes. Patienter der allerede
+# har en pyramide springes over. Returnerer antal skrevne rækker
+def byg_eksisterende(conn):
+    færdige = {pid for (pid,) in conn.execute("SELECT DISTINCT PatientID FROM EkgPyramide")}
+    skrevet = 0
+    for tabel, bidder in (("Ekgdata", _bidder_fra_ekgdata), ("EkgBlokke", _bidder_fra_blokke)):
+        for (patient_id,) in conn.execute(f"SELECT DISTINCT PatientID FROM {tabel}").fetchall():
+            if patient_id in færdige:
+                continue
+            writer = _SamletWriter(conn)
+            bygger = PyramideBygger(writer, patient_id)
+            for værdier, tider in bidder(conn, patient_id):
+                bygger.tilføj_mange(værdier, tider)
+            bygger.flush()
+            skrevet += writer.skriv()
+            færdige.add(patient_id)
+            print(f"Pyramide bygget for patient {patient_id} ({tabel})")
+    return skrevet
+
+
+if __name__ == "__main__":
+    import sys
+    from ekg_database import opret_schema, åbn_forbindelse
+
+    #Kør "python ekg_pyramide.py byg [database]" for at bygge pyramiden for gamle målinger
+    if len(sys.argv) < 2 or sys.argv[1] != "byg":
+        print("Brug: python ekg_pyramide.py byg [EKGDATABASE.db]")
+        sys.exit(1)
+    forbindelse = åbn_forbindelse(sys.argv[2] if len(sys.argv) > 2 else "EKGDATABASE.db")
+    opret_schema(forbindelse)
+    print(f"{byg_eksisterende(forbindelse)} rækker skrevet til EkgPyramide")
+    forbindelse.close()
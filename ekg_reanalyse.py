@@ -0,0 +1,249 @@
+import os
+import time
+
+import numpy as np
+
+from ekg_database import SQL_EKSPORT_EKG, SQL_REANALYSE_EKG_PULS, Database, åbn_forbindelse
+from ekg_eksport import bidder
+from ekg_lagring import SQL_REANALYSE_BLOKKE, SQL_REANALYSE_BLOK_PULS, iso_til_ns_array
+from ekg_session import SQL_ANALYSE_VERSION, SQL_REANALYSE_SESSION, SQL_REANALYSE_SESSIONER, SessionStatistik
+from ekg_signal import BidQRS, rr_og_puls
+
+#Analysens version. Gemmes i Sessions.Analyse når en session er færdig, så en afbrudt kørsel fortsætter
+#hvor den slap. Kør med en ny version for at analysere alle sessioner igen (f.eks. efter en ændring i BidQRS)
+VERSION = "bidqrs-1"
+
+#Samples der læses og analyseres ad gangen i hver proces (ca. 17 min ved 250 Hz, 2 MB pr. array)
+STYKKE = 1 << 18
+
+#UPDATE sætninger pr. transaktion, så GUI'ens og Datahandler's skrivninger kommer til imellem
+SKRIV_STYKKE = 5000
+
+
+# Bidder af (Id, værdier, tider i epoch-ns) fra en sessions rækker i Ekgdata. Som ekg_eksport.bidder,
+# men med hver rækkes Id, så pulsen kan skrives tilbage til de rigtige rækker
+def _rækker(conn, patient_id, session_id, stykke):
+    sidste_id = 0
+    while True:
+        rækker = conn.execute(SQL_EKSPORT_EKG, (patient_id, session_id, sidste_id, stykke)).fetchall()
+        if not rækker:
+            return
+        sidste_id = rækker[-1][0]
+        yield (np.array([i for i, _, _ in rækker], dtype=np.int64),
+               np.array([data for _, data, _ in rækker], dtype=np.float64),
+               iso_til_ns_array([tid for _, _, tid in rækker]))
+
+
+# Effektiv samplerate ud fra en bids tider (None hvis den ikke kan bestemmes)
+def _samplerate(tider_ns):
+    if len(tider_ns) < 2 or tider_ns[-1] <= tider_ns[0]:
+        return None
+    return (len(tider_ns) - 1) * 1e9 / (int(tider_ns[-1]) - int(tider_ns[0]))
+
+
+# Puls som hele BPM til databasen (None før det første gyldige RR-interval), som Datahandler.beregn_puls
+def _hel_puls(puls):
+    return None if np.isnan(puls) else int(puls)
+
+
+# Finder sessionens slag i én kilde ("rækker", "blokke" eller "arkiv"). Returnerer None hvis sessionen
+# ikke har samples i kilden. Kun de sidste samples gemmes mellem bidderne (BidQRS's hale)
+def _find_slag(conn, patient_id, session_id, kilde, stykke, standard_fs):
+    if kilde == "rækker":
+        kilde_bidder = _rækker(conn, patient_id, session_id, stykke)
+    else:
+        kilde_bidder = ((None, værdier, tider) for værdier, tider in bidder(conn, patient_id, session_id, kilde, stykke))
+
+    detektor = None
+    antal = 0
+    rater = []
+    r_indeks, r_tider, r_id = [], [], []
+    første_id = sidste_id = None
+    #Tider og Id for detektorens hale plus den nye bid. buffer_start er indekset for deres første sample
+    buffer_tider = np.empty(0, dtype=np.int64)
+    buffer_id = np.empty(0, dtype=np.int64)
+    buffer_start = 0
+
+    # Gemmer indeks, tid og Id for nyfundne R-takker
+    def gem(r):
+        if len(r):
+            r_indeks.append(r)
+            r_tider.append(buffer_tider[r - buffer_start])
+            if første_id is not None:
+                r_id.append(buffer_id[r - buffer_start])
+
+    for ids, værdier, tider in kilde_bidder:
+        fs = _samplerate(tider)
+        if fs:
+            rater.append(fs)
+        if detektor is None:
+            #Den hardkodede 250 Hz passer ikke altid: detektoren indstilles efter de gemte tider
+            detektor = BidQRS(fs=fs or standard_fs)
+            første_id = None if ids is None else int(ids[0])
+        if ids is not None:
+            buffer_id = np.concatenate((buffer_id, ids))
+            sidste_id = int(ids[-1])
+        buffer_tider = np.concatenate((buffer_tider, tider))
+        antal += len(værdier)
+        gem(detektor.tilføj(værdier))
+        fra = detektor.hale_start - buffer_start
+        buffer_tider, buffer_id, buffer_start = buffer_tider[fra:], buffer_id[fra:], detektor.hale_start
+    if detektor is None:
+        return None
+    gem(detektor.tilføj(np.empty(0), slut=True))
+
+    tom = np.empty(0, dtype=np.int64)
+    return {"antal": antal, "samplerate": float(np.median(rater)) if rater else None,
+            "r_indeks": np.concatenate(r_indeks) if r_indeks else tom,
+            "r_tider": np.concatenate(r_tider) if r_tider else tom,
+            "r_id": np.concatenate(r_id) if r_id else tom, "første_id": første_id, "sidste_id": sidste_id}
+
+
+# Analyserer én session i en arbejdsproces. Samples læses i bidder fra rækker, blokke eller arkiv i én
+# læsetransaktion, og resultatet sendes tilbage til hovedprocessen, der er den eneste der skriver:
+#   opsummering: parametre til SQL_REANALYSE_SESSION (uden version og Id)
+#   puls:        parametre til SQL_REANALYSE_EKG_PULS (stykker af rækker med samme puls) eller
+#                SQL_REANALYSE_BLOK_PULS (puls ved hver bloks sidste sample). Tom for arkiverede sessioner
+def analyser_session(db_sti, patient_id, session_id, stykke=STYKKE, standard_fs=250):
+    conn = åbn_forbindelse(db_sti)
+    try:
+        conn.execute("BEGIN")
+        for kilde in ("rækker", "blokke", "arkiv"):
+            slag = _find_slag(conn, patient_id, session_id, kilde, stykke, standard_fs)
+            if slag is not None:
+                break
+        else:
+            return {"session": session_id, "patient": patient_id, "kilde": None, "antal": 0, "slag": 0,
+                    "opsummering": None, "puls": []}
+
+        rr, puls = rr_og_puls(slag["r_tider"])
+        statistik = SessionStatistik(session_id, slag["samplerate"])
+        statistik.slag_fundet_mange(rr)
+        opsummering = statistik.række()
+
+        if kilde == "rækker":
+            pulsrækker = _puls_stykker(puls, slag["r_id"], slag["første_id"], slag["sidste_id"], session_id)
+        elif kilde == "blokke":
+            blokke = conn.execute(SQL_REANALYSE_BLOKKE, (session_id,)).fetchall()
+            slut = np.cumsum([antal for _, antal in blokke]) - 1 #Indeks for hver bloks sidste sample
+            før = np.searchsorted(slag["r_indeks"], slut, side="right") #Antal slag til og med blokkens slutning
+            pulsrækker = [(_hel_puls(puls[n - 1]) if n else None, blok_id) for n, (blok_id, _) in zip(før.tolist(), blokke)]
+        else:
+            pulsrækker = []
+        conn.rollback()
+    finally:
+        conn.close()
+    #Samme rækkefølge som SQL_AFSLUT_SESSION: Samplerate, Slag, PulsMin, PulsMaks, PulsGns, RRGns, RRStd
+    return {"session": session_id, "patient": patient_id, "kilde": kilde, "antal": slag["antal"],
+            "slag": len(slag["r_tider"]), "opsummering": (opsummering[2],) + tuple(opsummering[4:10]),
+            "puls": pulsrækker}
+
+
+# Stykker af rækker med samme puls: [(puls, fra_id, til_id, session_id)]. Pulsen gælder fra rækken med
+# et slag til rækken før det næste slag. Rækkerne før det første gyldige RR-interval får None
+def _puls_stykker(puls, r_id, første_id, sidste_id, session_id):
+    værdier = [None] + [_hel_puls(p) for p in puls.tolist()]
+    fra = [første_id] + r_id.tolist()
+    stykker = []
+    for værdi, fra_id in zip(værdier, fra):
+        if stykker and stykker[-1][0] == værdi:
+            continue
+        stykker.append([værdi, fra_id, None, session_id])
+    for i in range(len(stykker) - 1):
+        stykker[i][2] = stykker[i + 1][1] - 1
+    if stykker:
+        stykker[-1][2] = sidste_id
+    return [tuple(s) for s in stykker if s[2] >= s[1]]
+
+
+# Skriver en sessions resultat: ny puls i bidder af korte transaktioner og til sidst opsummeringen sammen
+# med analysens version. Et afbrudt job har derfor enten ikke skrevet versionen (og sessionen tages igen)
+# eller skrevet alt
+def skriv_resultat(conn, resultat, version=VERSION):
+    sql = SQL_REANALYSE_EKG_PULS if resultat["kilde"] == "rækker" else SQL_REANALYSE_BLOK_PULS
+    rækker = resultat["puls"]
+    for i in range(0, len(rækker), SKRIV_STYKKE):
+        with conn:
+            conn.executemany(sql, rækker[i:i + SKRIV_STYKKE])
+    with conn:
+        if resultat["opsummering"] is None:
+            conn.execute(SQL_ANALYSE_VERSION, (version, resultat["session"]))
+        else:
+            conn.execute(SQL_REANALYSE_SESSION, resultat["opsummering"] + (version, resultat["session"]))
+
+
+# Udskriver hvor langt kørslen er nået
+def vis_fremskridt(færdige, antal, samples, i_alt, sekunder):
+    hastighed = samples / sekunder if sekunder > 0 else 0.0
+    rest = (i_alt - samples) / hastighed if hastighed and i_alt > samples else 0.0
+    print(f"{færdige}/{antal} sessioner, {samples} samples, {hastighed / 1e6:.2f} M samples/s, ca. {rest:.0f} s tilbage")
+
+
+# Analyserer alle afsluttede og arkiverede sessioner (evt. kun én patients) der ikke allerede er analyseret
+# med version. Sessionerne fordeles på arbejdere processer (standard: alle kerner), de største først.
+# Kun få sessioner er undervejs ad gangen, så hukommelsen ikke afhænger af antallet af sessioner
+def reanalyser(db_sti, arbejdere=None, patient_id=None, version=VERSION, stykke=STYKKE, fremskridt=vis_fremskridt):
+    import multiprocessing
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    Database(db_sti).luk() #Sikrer at schemaet er migreret
+    conn = åbn_forbindelse(db_sti)
+    statistik = {"sessioner": 0, "samples": 0, "slag": 0, "fejl": 0}
+    start = time.perf_counter()
+    try:
+        sessioner = [(s, p, n or 0) for s, p, n in conn.execute(SQL_REANALYSE_SESSIONER, (version,))
+                     if patient_id is None or p == patient_id]
+        sessioner.sort(key=lambda s: -s[2])
+        i_alt = sum(n for _, _, n in sessioner)
+        arbejdere = max(1, arbejdere or os.cpu_count() or 1)
+        kø = iter(sessioner)
+        #spawn undgår fork af en proces med tråde (Tkinter, Datahandler)
+        with ProcessPoolExecutor(arbejdere, mp_context=multiprocessing.get_context("spawn")) as pool:
+            undervejs = {}
+            while True:
+                while len(undervejs) < 2 * arbejdere:
+                    session = next(kø, None)
+                    if session is None:
+                        break
+                    undervejs[pool.submit(analyser_session, db_sti, session[1], session[0], stykke)] = session
+                if not undervejs:
+                    break
+                færdige, _ = wait(undervejs, return_when=FIRST_COMPLETED)
+                for fremtid in færdige:
+                    session_id = undervejs.pop(fremtid)[0]
+                    try:
+                        resultat = fremtid.result()
+                        skriv_resultat(conn, resultat, version)
+                    except Exception as e:
+                        print("Fejl ved reanalyse af session", session_id, e)
+                        statistik["fejl"] += 1
+                        continue
+                    statistik["sessioner"] += 1
+                    statistik["samples"] += resultat["antal"]
+                    statistik["slag"] += resultat["slag"]
+                    if fremskridt:
+                        fremskridt(statistik["sessioner"] + statistik["fejl"], len(sessioner), statistik["samples"],
+                                   i_alt, time.perf_counter() - start)
+    finally:
+        conn.close()
+    statistik["sekunder"] = time.perf_counter() - start
+    return statistik
+
+
+if __name__ == "__main__":
+    import argparse
+
+    #Kør "python ekg_reanalyse.py" for at regne puls, RR og opsummering om for alle gemte målinger.
+    #Kan afbrydes og startes igen, og kan køre mens der måles (aktive sessioner springes over)
+    parser = argparse.ArgumentParser(description="Reanalyse af gemte EKG målinger på alle kerner")
+    parser.add_argument("--db", default="EKGDATABASE.db")
+    parser.add_argument("--arbejdere", type=int, default=None, help="antal processer (standard: alle kerner)")
+    parser.add_argument("--patient", type=int, default=None, help="kun denne patient")
+    parser.add_argument("--version", default=VERSION, help="en ny version analyserer alle sessioner igen")
+    parser.add_argument("--stykke", type=int, default=STYKKE, help="samples pr. læsning")
+    argumenter = parser.parse_args()
+
+    statistik = reanalyser(argumenter.db, argumenter.arbejdere, argumenter.patient, argumenter.version,
+                           argumenter.stykke)
+    print(f"{statistik['sessioner']} sessioner analyseret ({statistik['samples']} samples, {statistik['slag']} slag, "
+          f"{statistik['fejl']} fejl) på {statistik['sekunder']:.1f} s")
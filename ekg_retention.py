@@ -0,0 +1,297 @@
+import os
+import sqlite3
+import threading
+import time
+
+from ekg_database import (SQL_SESSION_SAMPLES_ANTAL, SQL_SLET_EKGDATA, SQL_TILDEL_SESSION, SQL_UDEN_SESSION,
+                          SQL_UDEN_SESSION_PATIENTER, Database, åbn_forbindelse)
+from ekg_eksport import bidder
+from ekg_lagring import ARKIV_STYKKE, INSERT_ARKIV, SQL_SLET_BLOKKE, iso_til_ns, pak_arkiv
+from ekg_pyramide import NIVEAUER, SQL_PYRAMIDE_DÆKNING, SQL_SLET_PYRAMIDE, PyramideBygger, _SamletWriter
+from ekg_session import (SQL_ARKIVER_SESSION, SQL_GAMLE_SESSIONER, SQL_SAML_SESSION, SQL_SAMLES_SESSION,
+                         SQL_SAMLET_SESSION, ny_session)
+
+#Rå samples beholdes så mange dage efter at målingen sluttede. Derefter findes sessionen som opsummering
+#(Sessions), min/max pyramide (historikken) og tabsfrit komprimeret i EkgArkiv
+RÅ_DAGE = 30
+
+#Pause i sekunder efter hver transaktion, så Datahandler's skriver og GUI'en altid kommer til
+PAUSE = 0.02
+
+#Sider der gives tilbage til filsystemet pr. PRAGMA incremental_vacuum (1 MB med 4 KB sider)
+VACUUM_SIDER = 256
+
+#Sekunder mellem kørslerne i baggrunden
+INTERVAL = 3600
+
+#Rækker uden session deles i sessioner hvor der er mere end så mange sekunder mellem to samples (som migrer_ekgdata)
+MAX_PAUSE = 1.0
+
+
+# Grænsen i epoch-ns: sessioner der sluttede før den arkiveres
+def grænse_ns(rå_dage, nu_ns=None):
+    return (time.time_ns() if nu_ns is None else nu_ns) - int(rå_dage * 86400 * 10 ** 9)
+
+
+# Finder rækkerne uden session for en patient og deler dem i grupper ved pauser på mere end max_pause.
+# Kun grupper der sluttede før grænsen (epoch-ns) tages med, så en måling der stadig skrives rækker uden
+# session ikke deles. Hver gruppe er en dict med første og sidste Id, tider, antal og Id for hver
+# stykke'te række, så rækkerne kan få SessionID i korte transaktioner
+def _grupper_uden_session(conn, patient_id, grænse, max_pause, stykke):
+    grupper = []
+    gruppe = None
+    sidste_id = 0
+    while True:
+        rækker = conn.execute(SQL_UDEN_SESSION, (patient_id, sidste_id, stykke)).fetchall()
+        if not rækker:
+            break
+        sidste_id = rækker[-1][0]
+        for række_id, tidspunkt in rækker:
+            try:
+                tid_ns = iso_til_ns(tidspunkt)
+            except (TypeError, ValueError):
+                tid_ns = None #Rækken kommer med i gruppen den ligger i, men ændrer ikke tiderne
+            if tid_ns is not None and gruppe is not None and tid_ns - gruppe["slut_ns"] > max_pause * 1e9:
+                grupper.append(gruppe)
+                gruppe = None
+            if tid_ns is not None and tid_ns >= grænse:
+                return grupper #Gruppen der måles i nu (eller for nylig) er ikke gammel nok endnu
+            if gruppe is None:
+                gruppe = {"første_id": række_id, "start_ns": tid_ns, "slut_ns": tid_ns, "antal": 0, "stykker": []}
+            gruppe["start_ns"] = gruppe["start_ns"] if gruppe["start_ns"] is not None else tid_ns
+            gruppe["slut_ns"] = tid_ns if tid_ns is not None else gruppe["slut_ns"]
+            gruppe["sidste_id"] = række_id
+            gruppe["antal"] += 1
+            if gruppe["antal"] % stykke == 0:
+                gruppe["stykker"].append(række_id)
+    if gruppe is not None:
+        grupper.append(gruppe)
+    return grupper
+
+
+# Samler rækker i Ekgdata uden session (fra før Sessions fandtes) i sessioner, så de også bliver arkiveret.
+# Rækkerne deles ved pauser som i migrer_ekgdata, og hver gruppe der sluttede før grænsen får en afsluttet
+# session med tider, antal og samplerate (pulsen kan findes med ekg_reanalyse.py). Rækkerne får SessionID
+# i bidder, og et afbrudt job fortsætter med den samme session (status 'samles'). Returnerer antal sessioner
+def saml_uden_session(conn, grænse, max_pause=MAX_PAUSE, stykke=ARKIV_STYKKE, pause=PAUSE, stop=None):
+    stop = stop or threading.Event()
+    sessioner = 0
+    for (patient_id,) in conn.execute(SQL_UDEN_SESSION_PATIENTER).fetchall():
+        samles = conn.execute(SQL_SAMLES_SESSION, (patient_id,)).fetchone()
+        if stop.is_set():
+            break
+        for gruppe in _grupper_uden_session(conn, patient_id, grænse, max_pause, stykke):
+            start_ns, slut_ns, antal = gruppe["start_ns"], gruppe["slut_ns"], gruppe["antal"]
+            if start_ns is None:
+                continue #Ingen brugbare tidspunkter i gruppen
+            #Resten af en gruppe fra en afbrudt kørsel hører til den session der blev startet
+            if samles is not None and start_ns <= samles[1]:
+                session_id = samles[0]
+            else:
+                fs = (antal - 1) * 1e9 / (slut_ns - start_ns) if slut_ns > start_ns else None
+                with conn:
+                    session_id = ny_session(conn.cursor(), patient_id, start_ns=start_ns, samplerate=fs)
+                    conn.execute(SQL_SAML_SESSION, (slut_ns, antal, session_id))
+            samles = None
+            fra = gruppe["første_id"]
+            for til in gruppe["stykker"] + [gruppe["sidste_id"]]:
+                with conn:
+                    conn.execute(SQL_TILDEL_SESSION, (session_id, patient_id, fra, til))
+                fra = til + 1
+                if stop.wait(pause):
+                    return sessioner
+            with conn:
+                conn.execute(SQL_SAMLET_SESSION, (session_id,))
+            sessioner += 1
+    return sessioner
+
+
+# Om pyramidens nederste niveau dækker alle sessionens samples. Hver spand er NIVEAUER[0] samples (den
+# sidste evt. færre), så spandene skal kunne rumme antal samples. Det er ikke nok at der findes spande:
+# en måling der blev afbrudt kan have skrevet pyramiden for en del af sessionen og ikke resten
+def pyramide_dækket(conn, patient_id, start_ns, slut_ns, antal):
+    spande = conn.execute(SQL_PYRAMIDE_DÆKNING, (patient_id, NIVEAUER[0], start_ns, slut_ns)).fetchone()[0]
+    return spande * NIVEAUER[0] >= antal
+
+
+# Bygger min/max pyramiden for en session der ikke er dækket af den (målinger fra før pyramiden fandtes,
+# eller hvor den kun blev skrevet delvist), så historikken stadig kan vises når de rå samples er væk.
+# antal er Sessions.Antal. Mangler det, tælles sessionens samples. En delvis pyramide for sessionen
+# slettes og bygges forfra af rækkerne, blokkene og det der allerede er arkiveret, så intet tælles dobbelt.
+# Den bygges færdig før der slettes noget
+def sikr_pyramide(conn, patient_id, session_id, start_ns, slut_ns, antal=None, stykke=ARKIV_STYKKE):
+    start_ns = slut_ns if start_ns is None else start_ns
+    if antal is None:
+        antal = conn.execute(SQL_SESSION_SAMPLES_ANTAL, (patient_id, session_id, session_id, session_id)).fetchone()[0]
+    if pyramide_dækket(conn, patient_id, start_ns, slut_ns, antal):
+        return False
+    with conn:
+        conn.executemany(SQL_SLET_PYRAMIDE, [(patient_id, niveau, start_ns, slut_ns) for niveau in NIVEAUER])
+    writer = _SamletWriter(conn)
+    bygger = PyramideBygger(writer, patient_id)
+    for kilde in ("arkiv", "rækker", "blokke"):
+        for værdier, tider_ns in bidder(conn, patient_id, session_id, kilde, stykke):
+            bygger.tilføj_mange(værdier, tider_ns)
+            writer.skriv()
+    bygger.flush()
+    writer.skriv()
+    return True
+
+
+# Flytter en sessions rå samples fra Ekgdata eller EkgBlokke til EkgArkiv. Hver bid skrives til arkivet
+# og slettes i samme korte transaktion, så et afbrudt job hverken mister eller fordobler noget og bare
+# fortsætter ved næste kørsel. Returnerer antal flyttede samples, eller None hvis der blev stoppet
+def arkiver_session(conn, patient_id, session_id, stykke=ARKIV_STYKKE, pause=PAUSE, stop=None):
+    stop = stop or threading.Event()
+    antal = 0
+    for kilde in ("rækker", "blokke"):
+        for sidste_id, værdier, tider_ns in bidder(conn, patient_id, session_id, kilde, stykke, med_id=True):
+            data, tider = pak_arkiv(værdier, tider_ns)
+            with conn:
+                conn.execute(INSERT_ARKIV, (patient_id, session_id, int(tider_ns[0]), int(tider_ns[-1]),
+                                            len(værdier), data, tider))
+                if kilde == "rækker":
+                    conn.execute(SQL_SLET_EKGDATA, (patient_id, session_id, sidste_id))
+                else:
+                    conn.execute(SQL_SLET_BLOKKE, (session_id, sidste_id))
+            antal += len(værdier)
+            if stop.wait(pause):
+                return None
+    with conn:
+        conn.execute(SQL_ARKIVER_SESSION, (session_id,))
+    return antal
+
+
+# Giver frie sider tilbage til filsystemet lidt ad gangen i stedet for en VACUUM, der låser databasen
+# mens hele filen skrives om. Kræver auto_vacuum = INCREMENTAL (se omstil). Uden den genbruger SQLite
+# blot de frie sider til nye målinger, så filen holder op med at vokse. Returnerer antal frigivne sider
+def frigiv_plads(conn, sider=VACUUM_SIDER, pause=PAUSE, stop=None):
+    stop = stop or threading.Event()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    frigivet = 0
+    frie = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    while frie and not stop.is_set():
+        #execute tager kun ét trin (én side). executescript kører pragmaen til ende
+        conn.executescript(f"PRAGMA incremental_vacuum({int(sider)})")
+        tilbage = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if tilbage >= frie:
+            break
+        frigivet += frie - tilbage
+        frie = tilbage
+        stop.wait(pause)
+    return frigivet
+
+
+# Én kørsel af retention: arkiverer alle afsluttede sessioner der sluttede for mere end rå_dage siden
+# og frigiver pladsen efter hver session. Rækker uden session (fra før Sessions fandtes) samles først
+# i sessioner, så de arkiveres på samme måde. Returnerer statistik for kørslen
+def komprimer(conn, rå_dage=RÅ_DAGE, stykke=ARKIV_STYKKE, pause=PAUSE, stop=None, nu_ns=None):
+    stop = stop or threading.Event()
+    statistik = {"sessioner": 0, "samples": 0, "pyramider": 0, "sider_frigivet": 0, "samlet": 0}
+    grænse = grænse_ns(rå_dage, nu_ns)
+    statistik["samlet"] = saml_uden_session(conn, grænse, stykke=stykke, pause=pause, stop=stop)
+    gamle = conn.execute(SQL_GAMLE_SESSIONER, (grænse,)).fetchall()
+    for session_id, patient_id, start_ns, slut_ns, antal in gamle:
+        if stop.is_set():
+            break
+        statistik["pyramider"] += sikr_pyramide(conn, patient_id, session_id, start_ns, slut_ns, antal, stykke)
+        antal = arkiver_session(conn, patient_id, session_id, stykke, pause, stop)
+        if antal is None:
+            break
+        statistik["sessioner"] += 1
+        statistik["samples"] += antal
+        statistik["sider_frigivet"] += frigiv_plads(conn, pause=pause, stop=stop)
+    return statistik
+
+
+# Slår incremental auto_vacuum til på en database oprettet før den var standard. Det kræver én fuld
+# VACUUM, der låser databasen imens, så den køres manuelt når der ikke måles
+def omstil(db_sti):
+    conn = åbn_forbindelse(db_sti) #Sætter auto_vacuum = INCREMENTAL, som VACUUM så tager i brug
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    finally:
+        conn.close()
+
+
+class Komprimering():
+    # Kører retention i baggrunden: ved start og derefter hvert interval sekund. Arbejdet sker i små
+    # transaktioner med pauser imellem, så målingerne og GUI'en ikke venter på det
+    def __init__(self, db_sti, rå_dage=RÅ_DAGE, interval=INTERVAL, stykke=ARKIV_STYKKE, pause=PAUSE):
+        self.db_sti = db_sti
+        self.rå_dage = rå_dage
+        self.interval = interval
+        self.stykke = stykke
+        self.pause = pause
+        self.stop_event = threading.Event()
+        self._tråd = None
+
+        #Statistik over kørslerne
+        self.kørsler = 0
+        self.fejl = 0
+        self.seneste = None #Statistik fra den seneste kørsel
+
+    # Starter baggrundstråden
+    def start(self):
+        self.stop_event.clear()
+        self._tråd = threading.Thread(target=self.kør, daemon=True)
+        self._tråd.start()
+        return self
+
+    # Stopper tråden efter den igangværende transaktion. Resten tages ved næste start
+    def stop(self):
+        if self._tråd is None:
+            return
+        self.stop_event.set()
+        self._tråd.join()
+        self._tråd = None
+
+    # Trådens løkke. Tråden har sin egen forbindelse (WAL)
+    def kør(self):
+        conn = åbn_forbindelse(self.db_sti)
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.seneste = komprimer(conn, self.rå_dage, self.stykke, self.pause, self.stop_event)
+                    self.kørsler += 1
+                except sqlite3.Error as e:
+                    self.fejl += 1
+                    print("Fejl ved komprimering af databasen:", e)
+                self.stop_event.wait(self.interval)
+        finally:
+            conn.close()
+
+
+# Databasefilens størrelse i bytes (inkl. WAL filen)
+def fil_størrelse(db_sti):
+    return sum(os.path.getsize(sti) for sti in (db_sti, db_sti + "-wal") if os.path.exists(sti))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    #Kør "python ekg_retention.py kør --dage 30" for at arkivere gamle sessioner én gang (kan køre mens der
+    #måles). "python ekg_retention.py omstil" slår incremental vacuum til på en ældre database (kun én gang,
+    #og mens der ikke måles)
+    parser = argparse.ArgumentParser(description="Retention og komprimering af gamle EKG målinger")
+    parser.add_argument("handling", choices=("kør", "omstil"))
+    parser.add_argument("--db", default="EKGDATABASE.db")
+    parser.add_argument("--dage", type=float, default=RÅ_DAGE, help="dage rå samples beholdes")
+    argumenter = parser.parse_args()
+
+    Database(argumenter.db).luk() #Sikrer at schemaet er migreret
+    før = fil_størrelse(argumenter.db)
+    start = time.perf_counter()
+    if argumenter.handling == "omstil":
+        print("Incremental vacuum slået til" if omstil(argumenter.db) else "Kunne ikke slå incremental vacuum til")
+    else:
+        forbindelse = åbn_forbindelse(argumenter.db)
+        statistik = komprimer(forbindelse, argumenter.dage)
+        forbindelse.close()
+        print(f"{statistik['samlet']} sessioner samlet af rækker uden session, "
+              f"{statistik['sessioner']} sessioner arkiveret ({statistik['samples']} samples), "
+              f"{statistik['pyramider']} pyramider bygget, {statistik['sider_frigivet']} sider frigivet")
+    print(f"{før / 1e6:.1f} MB -> {fil_størrelse(argumenter.db) / 1e6:.1f} MB på {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,190 @@
+import math
+
+import numpy as np
+
+#En session er én måling: fra start til stop på én port. Opsummeringen skrives når sessionen lukkes,
+#så lister over målinger og deres puls ikke skal læse selve samples igen
+INSERT_SESSION = """
+    INSERT INTO Sessions (PatientID, Port, StartNs, Samplerate, Status)
+    VALUES (?, ?, ?, ?, 'aktiv')
+"""
+
+SQL_AFSLUT_SESSION = """
+    UPDATE Sessions
+    SET StartNs = COALESCE(?, StartNs), SlutNs = ?, Samplerate = COALESCE(?, Samplerate), Antal = ?, Slag = ?,
+        PulsMin = ?, PulsMaks = ?, PulsGns = ?, RRGns = ?, RRStd = ?, Status = 'afsluttet'
+    WHERE Id = ?
+"""
+
+#Kolonnerne der vises i oversigter over sessioner
+SESSION_KOLONNER = "Id, PatientID, Port, StartNs, SlutNs, Samplerate, Antal, Slag, PulsMin, PulsMaks, PulsGns, RRGns, RRStd, Status"
+
+SQL_SESSIONER = f"""
+    SELECT {SESSION_KOLONNER}
+    FROM Sessions
+    WHERE PatientID = ?
+    ORDER BY Id DESC
+    LIMIT ?
+"""
+
+SQL_SESSION = f"SELECT {SESSION_KOLONNER} FROM Sessions WHERE Id = ?"
+
+#Opsummering af en session der kun findes som blokke (gamle målinger og migrer_ekgdata). Slag og RR kendes ikke
+SQL_OPSUMMER_BLOKKE = """
+    INSERT OR REPLACE INTO Sessions (Id, PatientID, StartNs, SlutNs, Samplerate, Antal, PulsMin, PulsMaks, PulsGns, Status)
+    SELECT SessionID, MIN(PatientID), MIN(StartNs), MAX(SlutNs), SUM(Samplerate * Antal) / SUM(Antal), SUM(Antal),
+           MIN(Puls), MAX(Puls), AVG(Puls), 'afsluttet'
+    FROM EkgBlokke
+    WHERE SessionID = ?
+"""
+
+#Retention: afsluttede sessioner der sluttede før en grænse (epoch-ns). Når de rå samples er flyttet til
+#EkgArkiv får sessionen status 'arkiveret', så den ikke behandles igen
+SQL_GAMLE_SESSIONER = """
+    SELECT Id, PatientID, StartNs, SlutNs, Antal
+    FROM Sessions
+    WHERE Status = 'afsluttet' AND SlutNs < ?
+    ORDER BY Id
+"""
+
+SQL_ARKIVER_SESSION = "UPDATE Sessions SET Status = 'arkiveret' WHERE Id = ?"
+
+#Retention: rækker fra før sessionerne samles i sessioner. Mens rækkerne får SessionID har sessionen
+#status 'samles', så et afbrudt job kan fortsætte med den samme session
+SQL_SAML_SESSION = "UPDATE Sessions SET SlutNs = ?, Antal = ?, Status = 'samles' WHERE Id = ?"
+SQL_SAMLES_SESSION = "SELECT Id, SlutNs FROM Sessions WHERE PatientID = ? AND Status = 'samles'"
+SQL_SAMLET_SESSION = "UPDATE Sessions SET Status = 'afsluttet' WHERE Id = ?"
+
+#Reanalyse (ekg_reanalyse.py): sessioner der ikke er analyseret med den nuværende version, og deres nye
+#opsummering. Status røres ikke, så arkiverede sessioner forbliver arkiverede
+SQL_REANALYSE_SESSIONER = """
+    SELECT Id, PatientID, Antal
+    FROM Sessions
+    WHERE Status IN ('afsluttet', 'arkiveret') AND Analyse IS NOT ?
+    ORDER BY Id
+"""
+
+SQL_REANALYSE_SESSION = """
+    UPDATE Sessions
+    SET Samplerate = ?, Slag = ?, PulsMin = ?, PulsMaks = ?, PulsGns = ?, RRGns = ?, RRStd = ?, Analyse = ?
+    WHERE Id = ?
+"""
+
+SQL_ANALYSE_VERSION = "UPDATE Sessions SET Analyse = ? WHERE Id = ?"
+
+
+# Opretter tabellen med sessioner hvis den ikke findes. Tider er epoch-ns
+def opret_session_tabel(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS Sessions (
+        Id INTEGER PRIMARY KEY AUTOINCREMENT,
+        PatientID INTEGER,
+        Port TEXT,
+        StartNs INTEGER,
+        SlutNs INTEGER,
+        Samplerate REAL,
+        Antal INTEGER,
+        Slag INTEGER,
+        PulsMin REAL,
+        PulsMaks REAL,
+        PulsGns REAL,
+        RRGns REAL,
+        RRStd REAL,
+        Status TEXT,
+        FOREIGN KEY (PatientID) REFERENCES Brugerdata(Id)
+    )""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_patient_id ON Sessions (PatientID, Id)")
+
+
+# Version 8: hvilken version af analysen sessionens opsummering og puls er regnet med (ekg_reanalyse.py)
+def opret_analyse_kolonne(cursor):
+    kolonner = [række[1] for række in cursor.execute("PRAGMA table_info(Sessions)")]
+    if "Analyse" not in kolonner:
+        cursor.execute("ALTER TABLE Sessions ADD COLUMN Analyse TEXT")
+
+
+# Opretter en ny session og returnerer dens Id (erstatter MAX(SessionID) + 1)
+def ny_session(cursor, patient_id, port=None, start_ns=None, samplerate=None):
+    cursor.execute(INSERT_SESSION, (patient_id, port, start_ns, samplerate))
+    return cursor.lastrowid
+
+
+# Skriver opsummeringen for en session ud fra dens blokke
+def opsummer_blokke(cursor, session_id):
+    cursor.execute(SQL_OPSUMMER_BLOKKE, (session_id,))
+
+
+# Gør en række fra SQL_SESSIONER/SQL_SESSION til en dict med kolonnenavnene
+def session_dict(række):
+    return dict(zip([k.strip() for k in SESSION_KOLONNER.split(",")], række)) if række else None
+
+
+class SessionStatistik():
+    # Løbende summer for en igangværende session. Datahandler fodrer den med samples og fundne slag,
+    # og når sessionen stopper skrives opsummeringen med én UPDATE
+    def __init__(self, session_id, samplerate=None):
+        self.session_id = session_id
+        self.samplerate = samplerate
+        self.start_ns = None
+        self.slut_ns = None
+        self.antal = 0 #Antal samples
+        self.slag = 0 #Antal fundne R-takker
+        self.rr_antal = 0 #Antal gyldige RR-intervaller
+        self.rr_sum = 0.0
+        self.rr_kvadratsum = 0.0
+        self.puls_sum = 0.0 #Sum af puls for hvert RR-interval (60 / RR)
+        self.puls_min = None
+        self.puls_maks = None
+
+    # Tæller samples (tider i epoch-ns, første og sidste giver sessionens start og slut)
+    def tilføj(self, tider_ns):
+        if not len(tider_ns):
+            return
+        if self.start_ns is None:
+            self.start_ns = int(tider_ns[0])
+        self.slut_ns = int(tider_ns[-1])
+        self.antal += len(tider_ns)
+
+    # Registrerer et slag. rr er intervallet til forrige slag i sekunder hvis det var gyldigt
+    def slag_fundet(self, rr=None):
+        self.slag += 1
+        if not rr:
+            return
+        puls = 60 / rr
+        self.rr_antal += 1
+        self.rr_sum += rr
+        self.rr_kvadratsum += rr * rr
+        self.puls_sum += puls
+        self.puls_min = puls if self.puls_min is None else min(self.puls_min, puls)
+        self.puls_maks = puls if self.puls_maks is None else max(self.puls_maks, puls)
+
+    # Registrerer mange slag på én gang (reanalyse). rr er intervallerne i sekunder, NaN hvor de ikke var gyldige
+    def slag_fundet_mange(self, rr):
+        rr = np.asarray(rr, dtype=np.float64)
+        self.slag += len(rr)
+        rr = rr[~np.isnan(rr)]
+        if not len(rr):
+            return
+        puls = 60 / rr
+        self.rr_antal += len(rr)
+        self.rr_sum += float(rr.sum())
+        self.rr_kvadratsum += float((rr * rr).sum())
+        self.puls_sum += float(puls.sum())
+        self.puls_min = float(puls.min()) if self.puls_min is None else min(self.puls_min, float(puls.min()))
+        self.puls_maks = float(puls.max()) if self.puls_maks is None else max(self.puls_maks, float(puls.max()))
+
+    # Opsummeringen som dict (samme nøgler som session_dict)
+    def opsummering(self):
+        n = self.rr_antal
+        rr_gns = self.rr_sum / n if n else None
+        rr_std = math.sqrt(max(0.0, (self.rr_kvadratsum - n * rr_gns * rr_gns) / (n - 1))) if n > 1 else None
+        return {"Id": self.session_id, "StartNs": self.start_ns, "SlutNs": self.slut_ns,
+                "Samplerate": self.samplerate, "Antal": self.antal, "Slag": self.slag,
+                "PulsMin": self.puls_min, "PulsMaks": self.puls_maks,
+                "PulsGns": self.puls_sum / n if n else None, "RRGns": rr_gns, "RRStd": rr_std}
+
+    # Parametre til SQL_AFSLUT_SESSION
+    def række(self):
+        o = self.opsummering()
+        return (o["StartNs"], o["SlutNs"], o["Samplerate"], o["Antal"], o["Slag"], o["PulsMin"], o["PulsMaks"],
+                o["PulsGns"], o["RRGns"], o["RRStd"], self.session_id)
@@ -0,0 +1,362 @@
+from collections import deque
+
+import numpy as np
+
+#SciPy importeres først i de funktioner der bruger den. Den tager omkring et sekund at importere,
+#og den løbende detektor (StreamingQRS) har ikke brug for den
+
+
+class LøbendeSum():
+    # Sum over de seneste længde værdier. Opdateres i O(1) og genberegnes med jævne mellemrum,
+    # så afrundingsfejl i den løbende sum ikke hober sig op
+    def __init__(self, længde):
+        self.længde = længde
+        self.værdier = deque(maxlen=længde)
+        self.sum = 0.0
+        self._siden_genberegning = 0
+
+    # Tilføjer en værdi og returnerer den nye sum
+    def tilføj(self, værdi):
+        if len(self.værdier) == self.længde:
+            self.sum -= self.værdier[0]
+        self.værdier.append(værdi)
+        self.sum += værdi
+        self._siden_genberegning += 1
+        if self._siden_genberegning >= self.længde: #O(længde) hver længde'te gang = O(1) amortiseret
+            self.sum = float(sum(self.værdier))
+            self._siden_genberegning = 0
+        return self.sum
+
+    # Gennemsnit af værdierne i vinduet
+    def gennemsnit(self):
+        return self.sum / len(self.værdier) if self.værdier else 0.0
+
+
+class StreamingQRS():
+    # Initialiserer en QRS-detektor i stil med Pan-Tompkins der tager én sample ad gangen.
+    # Trin: lavpas (glidende gns) -> fjernelse af baseline -> differentiering -> kvadrering
+    # -> glidende integration -> adaptiv tærskel. Alle trin er O(1) pr. sample.
+    # hrv (ekg_hrv.RullendeHRV) får hvert fundet slag, så HRV-vinduerne følger med uden genberegning
+    def __init__(self, fs=250, min_rr=0.3, max_rr=3.5, rr_antal=5, lære_sek=2.0, hrv=None):
+        self.fs = fs
+        self.min_rr = min_rr #Korteste gyldige RR-interval i sekunder (200 BPM)
+        self.max_rr = max_rr #Længste gyldige RR-interval i sekunder
+        self.refraktær = max(1, int(0.2 * fs)) #Ingen ny QRS inden for 200 ms
+
+        self._lavpas = LøbendeSum(5) #Samme glatning som uniform_filter1d(size=5)
+        self._baseline = LøbendeSum(max(1, int(0.6 * fs))) #Langsom middelværdi der trækkes fra
+        self._integration = LøbendeSum(max(1, int(0.15 * fs))) #Integrationsvindue på 150 ms
+        self._forrige = deque([0.0, 0.0], maxlen=2) #De to forrige filtrerede værdier til differentiering
+
+        #Adaptive niveauer for signal- og støjtoppe (SPKI og NPKI i Pan-Tompkins)
+        self._lære_antal = max(1, int(lære_sek * fs))
+        self._lære_max = 0.0
+        self._lære_sum = 0.0
+        self.spki = 0.0
+        self.npki = 0.0
+        self.tærskel = None #Sættes når læringsfasen er slut
+
+        #Tilstand for det område hvor det integrerede signal er over tærsklen
+        self._over = False
+        self._top_mwi = 0.0
+        self._top_værdi = -np.inf
+        self._top_indeks = None
+        self._top_tid = None
+
+        self.indeks = -1 #Indeks for seneste sample
+        self.sidste_r = None #Indeks for seneste R-tak
+        self._sidste_r_tid = None
+        self.rr = None #Seneste gyldige RR-interval i sekunder
+        self.nyt_rr = None #RR-intervallet for det seneste slag hvis det var gyldigt, ellers None
+        self._rr = LøbendeSum(rr_antal) #Løbende RR-estimat over de seneste rr_antal intervaller
+        self.antal_slag = 0
+        self.hrv = hrv
+
+    # Tilføjer én sample (og evt. tidsstempel i epoch-ns). Returnerer indeks for R-takken hvis en QRS
+    # netop er afsluttet, ellers None. R-takken er det sted hvor det filtrerede signal var højest
+    def tilføj(self, værdi, tid_ns=None):
+        self.indeks += 1
+        glat = self._lavpas.tilføj(værdi) / len(self._lavpas.værdier)
+        filtreret = glat - self._baseline.tilføj(glat) / len(self._baseline.værdier)
+
+        afledt = filtreret - self._forrige[0]
+        self._forrige.append(filtreret)
+        mwi = self._integration.tilføj(afledt * afledt) / self._integration.længde
+
+        #Læringsfase: tærsklerne startes ud fra de første sekunder
+        if self.tærskel is None:
+            self._lære_max = max(self._lære_max, mwi)
+            self._lære_sum += mwi
+            if self.indeks + 1 >= self._lære_antal:
+                self.spki = 0.5 * self._lære_max
+                self.npki = 0.5 * self._lære_sum / self._lære_antal
+                self._opdater_tærskel()
+            return None
+
+        if mwi > self.tærskel:
+            #Inden for et QRS-kandidatområde: top i integreret og filtreret signal følges
+            if not self._over:
+                self._over = True
+                self._top_mwi = 0.0
+                self._top_værdi = -np.inf
+            self._top_mwi = max(self._top_mwi, mwi)
+            if filtreret > self._top_værdi:
+                self._top_værdi = filtreret
+                self._top_indeks = self.indeks
+                self._top_tid = tid_ns
+            return None
+
+        if not self._over:
+            return None
+
+        #Området er slut: afgør om det var en QRS eller støj
+        self._over = False
+        if self.sidste_r is not None and self._top_indeks - self.sidste_r < self.refraktær:
+            self.npki = 0.125 * self._top_mwi + 0.875 * self.npki
+            self._opdater_tærskel()
+            return None
+
+        self.spki = 0.125 * self._top_mwi + 0.875 * self.spki
+        self._opdater_tærskel()
+        self._registrer_slag(self._top_indeks, self._top_tid)
+        return self._top_indeks
+
+    # Tilføjer mange samples og returnerer listen af fundne R-tak indeks
+    def tilføj_mange(self, værdier, tider_ns=None):
+        tak = []
+        for i, værdi in enumerate(værdier):
+            r = self.tilføj(værdi, None if tider_ns is None else tider_ns[i])
+            if r is not None:
+                tak.append(r)
+        return tak
+
+    # Gemmer et R-tak og opdaterer RR-estimatet hvis intervallet er fysiologisk muligt
+    def _registrer_slag(self, indeks, tid_ns):
+        self.antal_slag += 1
+        self.nyt_rr = None
+        if self.sidste_r is not None:
+            if tid_ns is not None and self._sidste_r_tid is not None:
+                rr = (tid_ns - self._sidste_r_tid) / 1e9
+            else:
+                rr = (indeks - self.sidste_r) / self.fs
+            if self.min_rr < rr < self.max_rr:
+                self.rr = rr
+                self.nyt_rr = rr
+                self._rr.tilføj(rr)
+        self.sidste_r = indeks
+        self._sidste_r_tid = tid_ns
+        if self.hrv is not None:
+            self.hrv.slag_fundet(tid_ns if tid_ns is not None else int(indeks * 1e9 / self.fs), self.nyt_rr)
+
+    # Tærsklen ligger en fjerdedel af vejen fra støjniveau til signalniveau
+    def _opdater_tærskel(self):
+        self.tærskel = max(self.npki + 0.25 * (self.spki - self.npki), 1e-9)
+
+    # Løbende RR-estimat i sekunder (gennemsnit af de seneste intervaller)
+    def rr_gennemsnit(self):
+        return self._rr.gennemsnit() if self._rr.værdier else None
+
+    # Puls i BPM ud fra RR-estimatet, eller None hvis der endnu ikke er gyldige intervaller
+    def puls(self):
+        rr = self.rr_gennemsnit()
+        return 60 / rr if rr else None
+
+
+# Kausalt glidende gennemsnit over k samples. De første k-1 deler med antallet der er set (som LøbendeSum)
+def _glidende(x, k, fast=False):
+    summer = np.cumsum(np.concatenate(([0.0], x)))
+    i = np.arange(1, len(x) + 1)
+    fra = np.maximum(0, i - k)
+    return (summer[i] - summer[fra]) / (k if fast else i - fra)
+
+
+class BidQRS():
+    # Vektoriseret udgave af StreamingQRS til lagrede målinger, der læses i store bidder. Samme trin
+    # (lavpas, baseline, differentiering, kvadrering, integration), men tærsklen sættes for hver bid ud fra
+    # toppene i det integrerede signal. De sidste samples i en bid gemmes og analyseres igen med den næste,
+    # så slag ved grænsen mellem to bidder hverken mistes eller tælles to gange
+    def __init__(self, fs=250, min_rr=0.3, max_rr=3.5):
+        self.fs = fs
+        self.min_rr = min_rr
+        self.max_rr = max_rr
+        self.refraktær = max(1, int(0.2 * fs)) #Ingen ny QRS inden for 200 ms
+        self._integration = max(1, int(0.15 * fs))
+        self._opvarmning = int(0.6 * fs) + self._integration #Filtrene har brug for så mange samples
+        self._vagt = int(0.5 * fs) #Toppe så tæt på biddens ende venter til næste bid
+        self._mindst = int(10 * fs) #Tærsklen sættes ud fra mindst 10 s, mindre bidder gemmes til næste gang
+        self._hale = np.empty(0, dtype=np.float64)
+        self.hale_start = 0 #Indeks (i hele målingen) for første sample i halen. Tidligere samples bruges ikke igen
+        self.sidste_r = None
+
+    # Filtrerer et stykke signal. Returnerer (filtreret, integreret) som StreamingQRS
+    def _filtrer(self, x):
+        glat = _glidende(x, 5)
+        filtreret = glat - _glidende(glat, max(1, int(0.6 * self.fs)))
+        afledt = filtreret - np.concatenate((np.zeros(min(2, len(x))), filtreret[:-2]))
+        return filtreret, _glidende(afledt * afledt, self._integration, fast=True)
+
+    # Tilføjer en bid samples og returnerer indeks (i hele målingen) for de R-takker der nu ligger fast.
+    # slut=True ved sidste bid, så toppe helt ude ved enden også tages med
+    def tilføj(self, værdier, slut=False):
+        from scipy.signal import find_peaks
+
+        x = np.concatenate((self._hale, np.asarray(værdier, dtype=np.float64)))
+        start = self.hale_start
+        fra = self._opvarmning if start > 0 else 0
+        if not slut and len(x) - fra < self._mindst:
+            self._hale = x
+            return np.empty(0, dtype=np.int64)
+        til = len(x) if slut else max(fra, len(x) - self._vagt)
+        #Halen til næste bid: det der ikke er afgjort endnu plus filtrenes opvarmning
+        hale_fra = max(0, til - self._opvarmning)
+        self._hale = x[hale_fra:]
+        self.hale_start = start + hale_fra
+        if til - fra < 2:
+            return np.empty(0, dtype=np.int64)
+
+        filtreret, mwi = self._filtrer(x)
+        toppe, egenskaber = find_peaks(mwi, distance=self.refraktær, height=0)
+        if not len(toppe):
+            return np.empty(0, dtype=np.int64)
+        #Tærsklen ligger en fjerdedel af vejen fra støjniveau til signalniveau (som SPKI/NPKI)
+        signal = np.percentile(egenskaber["peak_heights"], 90)
+        støj = np.median(mwi[fra:til])
+        tærskel = støj + 0.25 * (signal - støj)
+        toppe = toppe[(toppe >= fra) & (toppe < til) & (egenskaber["peak_heights"] > tærskel)]
+        if not len(toppe):
+            return np.empty(0, dtype=np.int64)
+
+        #R-takken er det højeste filtrerede punkt i integrationsvinduet op til toppen
+        bredde = self._integration + max(1, int(0.05 * self.fs))
+        polstret = np.concatenate((np.full(bredde, -np.inf), filtreret))
+        vinduer = np.lib.stride_tricks.sliding_window_view(polstret, bredde + 1)[toppe]
+        r_tak = toppe - bredde + np.argmax(vinduer, axis=1) + start
+
+        #Slag der allerede er fundet i forrige bid (eller ligger inden for refraktærperioden) springes over
+        if self.sidste_r is not None:
+            r_tak = r_tak[r_tak > self.sidste_r + self.refraktær]
+        if len(r_tak):
+            self.sidste_r = int(r_tak[-1])
+        return r_tak.astype(np.int64)
+
+
+# Gyldige RR-intervaller og pulsen efter hvert slag som Datahandler regner den (gennemsnit af de seneste
+# rr_antal gyldige intervaller). r_tider er R-takkernes tider i epoch-ns. RR er NaN når intervallet ikke
+# er fysiologisk muligt, og puls er NaN før det første gyldige interval
+def rr_og_puls(r_tider, min_rr=0.3, max_rr=3.5, rr_antal=5):
+    rr = np.diff(np.asarray(r_tider, dtype=np.int64)) / 1e9
+    rr = np.concatenate(([np.nan], rr))
+    gyldig = (rr > min_rr) & (rr < max_rr)
+    rr[~gyldig] = np.nan
+    summer = np.concatenate(([0.0], np.cumsum(np.where(gyldig, rr, 0.0)[gyldig])))
+    antal = np.cumsum(gyldig) #Antal gyldige intervaller til og med hvert slag
+    med = np.minimum(antal, rr_antal)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        gennemsnit = (summer[antal] - summer[antal - med]) / med
+        puls = np.where(antal > 0, 60 / gennemsnit, np.nan)
+    return rr, puls
+
+
+# Den oprindelige pulsberegning fra Datahandler: find_peaks over hele bufferen (benyttes til sammenligning)
+def puls_find_peaks(buffer, fs=250):
+    from scipy.signal import find_peaks
+    peaks, _ = find_peaks(buffer, height=1000, distance=40, prominence=200) #finder signaltoppe vha scipy
+    if len(peaks) < 2: #Mindst to peaks skal haves for at regne distance mellem dem
+        return None
+    rr_intervaller = np.diff(peaks) #Afstanden mellem peaks findes (R til R peak)
+    sek_per_peak = np.mean(rr_intervaller) / fs
+    return int(60 / sek_per_peak) if sek_per_peak > 0 else None # Konverterer sek/beat til BPM
+
+
+# Gyldige RR-intervaller (sekunder) i en buffer: lavpasfilter, find_peaks og RR ud fra tiden i sekunder
+def rr_fra_buffer(signal, sekunder):
+    from scipy.ndimage import uniform_filter1d
+    from scipy.signal import find_peaks
+
+    # Lavpasfilter
+    signal = uniform_filter1d(signal, size=5)
+
+    # Finder peaks
+    peaks, _ = find_peaks(signal, height=1000, distance=200, prominence=300)
+    if len(peaks) < 2: # Der skal bruges minimum 2 peaks for at kunne regne puls
+        return np.empty(0)
+
+    # RR-interval (sekunder)
+    rr_intervaller = np.diff(sekunder[peaks]) #Beregner tid i sek mellem peaks
+    return rr_intervaller[(rr_intervaller > 0.3) & (rr_intervaller < 3.5)]  # Mellem 30–210 BPM
+
+
+# PageOne's pulsberegning over hele bufferen ud fra RR-intervallerne
+def puls_fra_buffer(signal, sekunder):
+    rr_intervaller = rr_fra_buffer(signal, sekunder)
+
+    #Der skal haves gyldige intervaller
+    if len(rr_intervaller) == 0:
+        return None
+
+    rr_mean = np.mean(rr_intervaller[-5:]) #Gennemsnit fra sidste 5 intervaller
+    return 60 / rr_mean if rr_mean > 0 else None #konverterer til BPM fra sek/Beat
+
+
+# Pulsberegning ud fra tidsstempler i epoch-ns (int64 array) i stedet for datetime objekter
+def puls_fra_ns(signal, tider_ns):
+    if len(signal) < 10: #Venter på minimum 10 målinger for at undgå fejlmålinger
+        return None
+    sekunder = (np.asarray(tider_ns, dtype=np.int64) - tider_ns[0]) / 1e9 #Tid i sek ifht 1. måling
+    return puls_fra_buffer(np.asarray(signal, dtype=np.float64), sekunder)
+
+
+# Omregner en liste af datetime objekter til epoch-ns (int64). Kun forskelle mellem tiderne benyttes
+def datetimes_til_ns(tider):
+    return np.array(tider, dtype="datetime64[ns]").astype(np.int64)
+
+
+# PageOne's pulsberegning ud fra EKG værdier og datetime tidsstempler. None ved for lidt eller ugyldig data
+def beregn_puls(data, tider):
+    if data is None or tider is None or len(data) < 10: #Venter på minimum 10 målinger for at undgå fejlmålinger
+        return None
+    if len(data) != len(tider): #Hver værdi skal have sit tidsstempel
+        return None
+    try:
+        #datetime objekterne omregnes samlet til epoch-ns og beregningen sker på numpy arrays
+        return puls_fra_ns(np.asarray(data, dtype=np.float64), datetimes_til_ns(tider))
+    #Går noget galt returneres fejlmedling
+    except Exception as e:
+        print("Pulsfejl:", e)
+        return None
+
+
+# Genererer et syntetisk EKG signal (ADC værdier) med en given puls, støj og samplingsfrekvens.
+# Hvert slag består af P-bølge, QRS-kompleks og T-bølge modelleret som gaussiske pulser.
+# ekstraslag er sandsynligheden for at et slag efterfølges af en ekstrasystole (arytmi)
+def syntetisk_ekg(fs=250, sekunder=10, puls=72, støj=20, baseline=500, amplitude=2500, variation=0.0, seed=0,
+                  ekstraslag=0.0):
+    rng = np.random.default_rng(seed)
+    n = int(fs * sekunder)
+    t = np.arange(n) / fs
+    signal = np.full(n, float(baseline))
+
+    #Tidspunkter for R-takker, evt. med variation i RR-intervallet
+    r_tider = []
+    tid = 0.5
+    while tid < sekunder:
+        r_tider.append(tid)
+        rr = (60 / puls) * (1 + variation * rng.standard_normal())
+        if ekstraslag and rng.random() < ekstraslag:
+            #Ekstrasystolen kommer for tidligt og efterfølges af en kompenserende pause
+            if tid + 0.6 * rr < sekunder:
+                r_tider.append(tid + 0.6 * rr)
+            rr *= 2
+        tid += rr
+
+    #Bølgerne lægges på omkring hver R-tak: (forskydning i s, bredde i s, relativ højde)
+    bølger = ((-0.2, 0.025, 0.12), (-0.025, 0.008, -0.1), (0.0, 0.01, 1.0), (0.03, 0.01, -0.2), (0.25, 0.04, 0.25))
+    for r in r_tider:
+        for forskydning, bredde, højde in bølger:
+            centrum = r + forskydning
+            a = max(0, int((centrum - 5 * bredde) * fs))
+            b = min(n, int((centrum + 5 * bredde) * fs) + 1)
+            signal[a:b] += amplitude * højde * np.exp(-0.5 * ((t[a:b] - centrum) / bredde) ** 2)
+
+    signal += støj * rng.standard_normal(n)
+    return signal, np.array(r_tider)
@@ -0,0 +1,317 @@
+import io
+import socketserver
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from ekg_protokol import FRAME_SAMPLES, TÆLLER_MODULO, fletcher16, frame_type
+from ekg_signal import syntetisk_ekg
+
+#Standardindstillinger for simulatoren (kan ændres i sim:// adressen, se åbn_simulator)
+SAMPLERATE = 250
+PULS = 72
+STØJ = 20
+LØKKE_SEKUNDER = 60 #Længden af det syntetiske signal der afspilles i ring
+
+
+# Pakker samples som tekstprotokollen: "tæller,værdi" pr. linje
+def pak_tekst(tællere, værdier):
+    return "".join(f"{t},{v}\n" for t, v in zip((tællere % TÆLLER_MODULO).tolist(), værdier.tolist())).encode()
+
+
+# Pakker samples som binære frames (samme format som pak_frame i ekg_protokol, men alle frames på én gang).
+# sekvenser har én værdi pr. frame og værdier samples gange så mange
+def pak_frames(sekvenser, værdier, samples=FRAME_SAMPLES):
+    frames = np.zeros(len(sekvenser), dtype=frame_type(samples))
+    frames["sync"] = 0x5AA5
+    frames["sekvens"] = np.asarray(sekvenser) % 65536
+    frames["antal"] = samples
+    frames["samples"] = np.asarray(værdier).reshape(len(sekvenser), samples)
+    rå = frames.view(np.uint8).reshape(len(sekvenser), frames.dtype.itemsize)
+    frames["checksum"] = fletcher16(rå[:, 2:-2])
+    return frames.tobytes()
+
+
+# Syntetisk EKG til afspilning i ring. Signalet skæres ét normalt RR-interval efter et slag (minus de 0,5 s
+# signalet starter med), så overgangen fra slutningen til starten ligner et almindeligt slag
+def syntetisk_kilde(fs=SAMPLERATE, puls=PULS, støj=STØJ, variation=0.0, ekstraslag=0.0, seed=0,
+                    sekunder=LØKKE_SEKUNDER):
+    signal, r_tider = syntetisk_ekg(fs=fs, sekunder=sekunder, puls=puls, støj=støj, variation=variation,
+                                    seed=seed, ekstraslag=ekstraslag)
+    slut = [r + 60 / puls - 0.5 for r in r_tider if r + 60 / puls - 0.5 <= sekunder]
+    return signal[:int(slut[-1] * fs)] if slut else signal
+
+
+# Optaget måling til afspilning: en session fra databasen eller en fil. Filer er .npy eller tekst
+# med én værdi eller "tæller,værdi" pr. linje
+def optaget_kilde(fil=None, db=None, session=None):
+    if fil is not None:
+        if fil.endswith(".npy"):
+            return np.load(fil).astype(np.float64)
+        return np.loadtxt(fil, delimiter=",", ndmin=2)[:, -1]
+    from ekg_database import Database
+    database = Database(db)
+    try:
+        return database.session_samples(session)
+    finally:
+        database.luk()
+
+
+class SimuleretPort(io.RawIOBase):
+    # Opfører sig som serial.Serial (read, readinto, in_waiting, timeout, close), men data kommer fra et
+    # signal der afspilles i ring i tekst- eller binærprotokollen. Samples frigives i takt med samplerate
+    # ganget med hastighed (0 = så hurtigt som der læses). udfald og byger er (hvert, varighed) i sekunder:
+    # ved udfald tabes samples i varighed (enhedens tæller løber videre), ved byger holdes data tilbage i
+    # varighed og sendes samlet. afbryd_efter giver en SerialException som når kablet trækkes ud
+    def __init__(self, signal, fs=SAMPLERATE, protokol="tekst", hastighed=1.0, udfald=None, byger=None,
+                 afbryd_efter=None, timeout=0.001, port="sim://"):
+        super().__init__()
+        self.signal = np.clip(np.rint(np.asarray(signal, dtype=np.float64)), -32768, 32767).astype(np.int64)
+        if not len(self.signal):
+            raise ValueError("Simulatoren har intet signal at afspille")
+        self.fs = fs
+        self.protokol = protokol
+        self.hastighed = hastighed
+        self.udfald = udfald
+        self.byger = byger
+        self.afbryd_efter = afbryd_efter
+        self.timeout = timeout
+        self.port = port
+        self.baudrate = None
+        self.enhed = FRAME_SAMPLES if protokol == "binær" else 1 #Binære samples sendes i hele frames
+        self._buffer = bytearray()
+        self._næste = 0 #Tælleren for næste sample der frigives
+        self._start = time.monotonic()
+        self.start_ns = time.time_ns() #Tiden hvor sample 0 blev målt
+
+        #Statistik
+        self.sendte_samples = 0
+        self.tabte_samples = 0
+        self.sendte_bytes = 0
+
+    def readable(self):
+        return True
+
+    # Det enheden har sendt, men der endnu ikke er læst
+    @property
+    def in_waiting(self):
+        self._tjek_forbindelse()
+        self._fyld(1)
+        return len(self._buffer)
+
+    @property
+    def is_open(self):
+        return not self.closed
+
+    def reset_input_buffer(self):
+        self._buffer.clear()
+
+    # Data til enheden ignoreres (Arduinoen læser ikke fra porten)
+    def write(self, data):
+        return len(data)
+
+    # Tidspunktet (epoch-ns) hvor samples med de givne tællere blev målt. Benyttes til at måle latens
+    def planlagt_ns(self, tællere):
+        tempo = self.fs * (self.hastighed or 1.0)
+        return self.start_ns + np.rint(np.asarray(tællere, dtype=np.float64) * (1e9 / tempo)).astype(np.int64)
+
+    # Kaster SerialException når porten skal "trækkes ud". pyserial importeres først her
+    def _tjek_forbindelse(self):
+        if self.closed:
+            raise ValueError("Porten er lukket")
+        if self.afbryd_efter is not None and time.monotonic() - self._start >= self.afbryd_efter:
+            import serial
+            raise serial.SerialException(f"{self.port}: simuleret afbrydelse")
+
+    # Tælleren som enheden er nået til. Under en byge holdes alt fra bygens start tilbage
+    def _frigivet(self):
+        t = (time.monotonic() - self._start) * self.hastighed
+        if self.byger:
+            hvert, varighed = self.byger
+            fase = t % hvert
+            if fase >= hvert - varighed:
+                t -= fase - (hvert - varighed)
+        return int(t * self.fs) // self.enhed * self.enhed
+
+    # Frigiver de samples der er nået til og pakker dem i bufferen. Med hastighed 0 frigives et sekund
+    # ad gangen indtil der er mindst ønsket bytes
+    def _fyld(self, ønsket):
+        while True:
+            if self.hastighed:
+                slut = self._frigivet()
+            else:
+                if len(self._buffer) >= ønsket:
+                    return
+                slut = self._næste + max(self.enhed, int(self.fs) // self.enhed * self.enhed)
+            if slut <= self._næste:
+                return
+            self._pak(np.arange(self._næste, slut, dtype=np.int64))
+            self._næste = slut
+            if self.hastighed:
+                return
+
+    # Pakker samples med tællere i bufferen. Samples i et udfald tabes (hele frames i binærprotokollen)
+    def _pak(self, tællere):
+        if self.udfald:
+            periode, længde = (round(sekunder * self.fs) for sekunder in self.udfald) #I samples
+            behold = tællere[::self.enhed] % periode < periode - længde
+            tabte = int(np.count_nonzero(~behold)) * self.enhed
+            if tabte:
+                self.tabte_samples += tabte
+                tællere = tællere.reshape(-1, self.enhed)[behold].reshape(-1)
+        if not len(tællere):
+            return
+        værdier = self.signal[tællere % len(self.signal)]
+        if self.protokol == "binær":
+            data = pak_frames(tællere[::self.enhed] // self.enhed, værdier, self.enhed)
+        else:
+            data = pak_tekst(tællere, værdier)
+        self._buffer += data
+        self.sendte_samples += len(tællere)
+        self.sendte_bytes += len(data)
+
+    # Læser som serial.Serial: venter op til timeout på data og returnerer det der er kommet (evt. 0 bytes)
+    def readinto(self, b):
+        self._tjek_forbindelse()
+        frist = None if self.timeout is None else time.monotonic() + self.timeout
+        self._fyld(len(b))
+        while not self._buffer:
+            tilbage = None if frist is None else frist - time.monotonic()
+            if tilbage is not None and tilbage <= 0:
+                break
+            time.sleep(min(0.001, tilbage) if tilbage is not None else 0.001)
+            self._tjek_forbindelse()
+            self._fyld(len(b))
+        antal = min(len(b), len(self._buffer))
+        b[:antal] = self._buffer[:antal]
+        del self._buffer[:antal]
+        return antal
+
+    # Statistik over det simulatoren har sendt og tabt
+    def statistik(self):
+        return {"sendte_samples": self.sendte_samples, "tabte_samples": self.tabte_samples,
+                "sendte_bytes": self.sendte_bytes}
+
+
+# Læser et (hvert, varighed) par som "10,0.5"
+def _periode(tekst):
+    hvert, varighed = (float(x) for x in tekst.split(","))
+    if not 0 <= varighed < hvert:
+        raise ValueError(f"Ugyldig periode {tekst!r}: varigheden skal være mindre end perioden")
+    return hvert, varighed
+
+
+# Åbner en simuleret port ud fra en adresse, f.eks.
+#   sim://?puls=80&støj=40&ekstraslag=0.1            syntetisk EKG
+#   sim://?session=12&db=EKGDATABASE.db                afspilning af en gemt session
+#   sim://?fil=optagelse.npy&hastighed=10&udfald=10,0.5&byger=5,0.2
+# Mulige felter: fs, puls, støj, variation, ekstraslag, seed, fil, db, session, protokol, hastighed,
+# udfald, byger og afbryd. protokol er standardprotokollen hvis adressen ikke angiver en
+def åbn_simulator(url, protokol="tekst", timeout=0.001):
+    dele = urlsplit(url)
+    if dele.scheme != "sim":
+        raise ValueError(f"Ikke en simulatoradresse: {url}")
+    felter = {navn: værdier[-1] for navn, værdier in parse_qs(dele.query).items()}
+    ukendte = set(felter) - {"fs", "puls", "støj", "variation", "ekstraslag", "seed", "fil", "db", "session",
+                             "protokol", "hastighed", "udfald", "byger", "afbryd"}
+    if ukendte:
+        raise ValueError(f"Ukendte felter i {url}: {', '.join(sorted(ukendte))}")
+
+    fs = float(felter.get("fs", SAMPLERATE))
+    if "fil" in felter or "session" in felter:
+        signal = optaget_kilde(felter.get("fil"), felter.get("db", "EKGDATABASE.db"),
+                               int(felter["session"]) if "session" in felter else None)
+    else:
+        signal = syntetisk_kilde(fs, float(felter.get("puls", PULS)), float(felter.get("støj", STØJ)),
+                                 float(felter.get("variation", 0.0)), float(felter.get("ekstraslag", 0.0)),
+                                 int(felter.get("seed", 0)))
+    protokol = felter.get("protokol", protokol)
+    if protokol not in ("tekst", "binær"):
+        raise ValueError(f"Ukendt protokol: {protokol}")
+    return SimuleretPort(signal, fs, protokol, hastighed=float(felter.get("hastighed", 1.0)),
+                         udfald=_periode(felter["udfald"]) if "udfald" in felter else None,
+                         byger=_periode(felter["byger"]) if "byger" in felter else None,
+                         afbryd_efter=float(felter["afbryd"]) if "afbryd" in felter else None,
+                         timeout=timeout, port=url)
+
+
+# Læser fra en simuleret port i et antal sekunder med samme læser som Datahandler og returnerer
+# gennemløb og latens fra en sample blev målt til den var læst (kun meningsfuldt for målinger under
+# en time, før binærprotokollens sekvensnumre løber rundt)
+def mål(url, sekunder=5.0, protokol="tekst"):
+    from ekg_protokol import BinærLæser, TekstLæser
+    port = åbn_simulator(url, protokol)
+    læser = BinærLæser(port, port.fs) if port.protokol == "binær" else TekstLæser(port, port.fs)
+    latens = []
+    samples = 0
+    start = time.perf_counter()
+    try:
+        while time.perf_counter() - start < sekunder:
+            værdier, _, tællere = læser.læs()
+            if len(tællere):
+                latens.append((time.time_ns() - port.planlagt_ns(tællere)) / 1e6)
+            samples += len(værdier)
+    finally:
+        port.close()
+    varighed = time.perf_counter() - start
+    latens = np.concatenate(latens) if latens else np.zeros(1)
+    resultat = {"samples": samples, "samples_pr_s": samples / varighed,
+                "latens_ms_median": float(np.median(latens)), "latens_ms_p99": float(np.percentile(latens, 99)),
+                "latens_ms_max": float(latens.max())}
+    resultat.update(port.statistik())
+    resultat.update(læser.statistik())
+    return resultat
+
+
+class _SimHandler(socketserver.BaseRequestHandler):
+    # Hver forbindelse får sin egen simulerede enhed, der sender indtil forbindelsen lukkes
+    def handle(self):
+        port = åbn_simulator(self.server.url, self.server.protokol, timeout=0.05)
+        try:
+            while True:
+                data = port.read(65536)
+                if data:
+                    self.request.sendall(data)
+        except OSError: #Klienten har lukket forbindelsen
+            pass
+        finally:
+            port.close()
+
+
+class SimServer(socketserver.ThreadingTCPServer):
+    # Sender simulatorens data over TCP, så programmer uden for Python (eller dæmonen med
+    # "socket://127.0.0.1:port") kan læse fra den som fra en netværksseriel port
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, url, protokol="tekst", vært="127.0.0.1", port=0):
+        åbn_simulator(url, protokol).close() #Fejl i adressen vises med det samme
+        self.url = url
+        self.protokol = protokol
+        super().__init__((vært, port), _SimHandler)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    #Kør f.eks. "python ekg_simulator.py 'sim://?puls=90&hastighed=20' --mål 5" for at måle gennemløb og
+    #latens, eller "python ekg_simulator.py 'sim://?puls=90' --tcp 7000" og start dæmonen med
+    #"--enhed socket://127.0.0.1:7000=1". Dæmonen og GUI'en kan også åbne sim:// adresser direkte
+    parser = argparse.ArgumentParser(description="Simuleret EKG enhed til test og belastningsmålinger")
+    parser.add_argument("url", nargs="?", default="sim://", help="simulatoradresse, f.eks. sim://?puls=80")
+    parser.add_argument("--protokol", choices=("tekst", "binær"), default="tekst")
+    parser.add_argument("--mål", type=float, metavar="SEKUNDER", help="mål gennemløb og latens")
+    parser.add_argument("--tcp", type=int, metavar="PORT", help="send data til TCP klienter på denne port")
+    argumenter = parser.parse_args()
+
+    if argumenter.tcp is not None:
+        server = SimServer(argumenter.url, argumenter.protokol, port=argumenter.tcp)
+        print(f"Simulator på socket://127.0.0.1:{server.server_address[1]}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+    else:
+        print(json.dumps(mål(argumenter.url, argumenter.mål or 5.0, argumenter.protokol), indent=2))
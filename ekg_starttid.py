@@ -0,0 +1,96 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+#GUI filen der måles på (ligger ved siden af denne fil)
+GUI_FIL = os.path.join(os.path.abspath(os.path.dirname(__file__)), "GUI final 2.1 + dokumentation.py")
+
+#Budget for at importere GUI modulet (inkl. åbning af databasen) før vinduet kan vises
+BUDGET_MS = 600
+
+#Moduler der først må importeres når de skal bruges (diagrammer, pulsanalyse, seriel port)
+FORBUDTE = ("matplotlib", "scipy", "serial", "six")
+
+#Importerer GUI filen og kører start() uden at oprette App og udskriver tiden det tog.
+#luk() stopper bagefter alt hvad start() har startet
+_KODE = """
+import importlib.util, sys, time
+sys.path.insert(0, {mappe!r})
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("gui", {fil!r})
+modul = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(modul)
+modul.start()
+print("SAMLET_MS", (time.perf_counter() - start) * 1000)
+modul.luk()
+"""
+
+
+# Fortolker linjerne fra "python -X importtime". Returnerer (modul, egen tid, samlet tid, dybde) i mikrosekunder
+def fortolk_importtime(tekst):
+    målinger = []
+    for linje in tekst.splitlines():
+        if not linje.startswith("import time:"):
+            continue
+        felter = linje[len("import time:"):].split("|")
+        if len(felter) != 3 or not felter[0].strip().isdigit():
+            continue #Overskriften
+        navn = felter[2].rstrip()
+        dybde = (len(navn) - len(navn.lstrip())) // 2
+        målinger.append((navn.strip(), int(felter[0]), int(felter[1]), dybde))
+    return målinger
+
+
+# Importerer GUI modulet i en ny proces (i en tom mappe, så der oprettes en ny database) og
+# returnerer (samlet tid i ms, målinger fra -X importtime)
+def mål_starttid(fil=GUI_FIL):
+    kode = _KODE.format(mappe=os.path.dirname(fil), fil=fil)
+    with tempfile.TemporaryDirectory() as mappe:
+        kørsel = subprocess.run([sys.executable, "-X", "importtime", "-c", kode], cwd=mappe,
+                                capture_output=True, text=True, encoding="utf-8")
+    if kørsel.returncode != 0:
+        raise RuntimeError("GUI modulet kunne ikke importeres:\n" + kørsel.stderr[-2000:])
+    samlet = None
+    for linje in kørsel.stdout.splitlines():
+        if linje.startswith("SAMLET_MS"):
+            samlet = float(linje.split()[1])
+    return samlet, fortolk_importtime(kørsel.stderr)
+
+
+# Finder overskridelser: samlet tid over budget og forbudte moduler der blev importeret
+def tjek(samlet_ms, målinger, budget_ms=BUDGET_MS, forbudte=FORBUDTE):
+    problemer = []
+    if samlet_ms is not None and samlet_ms > budget_ms:
+        problemer.append(f"Starttid {samlet_ms:.0f} ms er over budgettet på {budget_ms} ms")
+    importeret = {navn.split(".")[0] for navn, _, _, _ in målinger}
+    for modul in forbudte:
+        if modul in importeret:
+            problemer.append(f"{modul} importeres ved start")
+    return problemer
+
+
+# Tekst med de moduler på øverste niveau der tog længst tid
+def rapport(samlet_ms, målinger, top=15):
+    linjer = [f"Import af GUI: {samlet_ms:.0f} ms" if samlet_ms is not None else "Import af GUI: ukendt"]
+    øverste = sorted((m for m in målinger if m[3] == 0), key=lambda m: m[2], reverse=True)[:top]
+    for navn, _, samlet, _ in øverste:
+        linjer.append(f"  {samlet / 1000:8.1f} ms  {navn}")
+    return "\n".join(linjer)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    #Kør "python ekg_starttid.py" for at måle starttiden. Afslutter med kode 1 hvis budgettet overskrides
+    parser = argparse.ArgumentParser(description="Måler hvor lang tid GUI'en er om at starte")
+    parser.add_argument("--budget", type=float, default=BUDGET_MS, help="Budget i ms")
+    parser.add_argument("--top", type=int, default=15, help="Antal moduler i rapporten")
+    argumenter = parser.parse_args()
+
+    samlet_ms, målinger = mål_starttid()
+    print(rapport(samlet_ms, målinger, argumenter.top))
+    problemer = tjek(samlet_ms, målinger, argumenter.budget)
+    for problem in problemer:
+        print("FEJL:", problem)
+    sys.exit(1 if problemer else 0)
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+#Største mulige Id, så første side starter ved den nyeste række
+MAKS_ID = 2 ** 63 - 1
+
+
+class EkgSider():
+    # Henter målinger til PageTwo's tabel én side ad gangen med keyset pagination på (PatientID, Id),
+    # nyeste først. Hver side er en indekseret forespørgsel fra der hvor forrige side sluttede, så
+    # prisen pr. side er den samme uanset hvor lang optagelsen er
+    def __init__(self, db, patient_id, blokke=False, side_størrelse=200):
+        self.db = db #Database fra ekg_database
+        self.patient_id = patient_id
+        self.blokke = blokke #True ved blokvis lagring (EkgBlokke), ellers en række pr. måling (Ekgdata)
+        self.side_størrelse = side_størrelse
+        self.før_id = MAKS_ID #Næste side hentes fra rækker/blokke med mindre Id end dette
+        self.slut = False #Der er ikke flere ældre målinger
+        self._maks_ns = None #Ved hop til et tidspunkt: seneste tid der må vises på første side
+
+    # Starter forfra ved de nyeste målinger og returnerer første side
+    def første_side(self):
+        self.før_id = MAKS_ID
+        self.slut = False
+        self._maks_ns = None
+        return self.næste_side()
+
+    # Returnerer næste side (ældre målinger) som (tidspunkt, puls, data) rækker
+    def næste_side(self):
+        if self.slut:
+            return []
+        if self.blokke:
+            return self._blok_side()
+
+        rækker = self.db.ekg_side(self.patient_id, self.før_id, self.side_størrelse)
+        if len(rækker) < self.side_størrelse:
+            self.slut = True
+        if rækker:
+            self.før_id = rækker[-1][0]
+        return [række[1:] for række in rækker]
+
+    # Blokvis lagring: hele blokke pakkes ud, og samples vises nyeste først
+    def _blok_side(self):
+        værdier, tider, pulser, ældste_id = self.db.blok_side(self.patient_id, self.før_id, self.side_størrelse)
+        if ældste_id is None:
+            self.slut = True
+            return []
+        self.før_id = ældste_id
+        if self._maks_ns is not None: #Samples efter tidspunktet der hoppes til udelades
+            maske = tider <= self._maks_ns
+            værdier, tider, pulser = værdier[maske], tider[maske], pulser[maske]
+            self._maks_ns = None
+        return [(datetime.fromtimestamp(t / 1e9).strftime('%Y-%m-%d %H:%M:%S'), p, v)
+                for t, p, v in zip(tider[::-1].tolist(), pulser[::-1].tolist(), værdier[::-1].tolist())]
+
+    # Hopper til et tidspunkt (datetime) og returnerer siden der starter ved seneste måling
+    # på eller før tidspunktet. Derefter fortsætter næste_side bagud fra dér
+    def hop_til(self, tidspunkt):
+        self.slut = False
+        if self.blokke:
+            tid_ns = int(round(tidspunkt.timestamp() * 1e9))
+            blok_id = self.db.blok_id_ved_tid(self.patient_id, tid_ns)
+            if blok_id is None:
+                self.slut = True
+                return []
+            self.før_id = blok_id + 1
+            self._maks_ns = tid_ns
+        else:
+            række_id = self.db.ekg_id_ved_tid(self.patient_id, tidspunkt.isoformat(timespec='microseconds'))
+            if række_id is None:
+                self.slut = True
+                return []
+            self.før_id = række_id + 1
+        return self.næste_side()